@@ -34,10 +34,11 @@ from __future__ import print_function
 
 import imp
 import random
+import re
 import sys
 
 from rucio.common import exception
-from rucio.common.config import config_get
+from rucio.common.config import config_get, config_get_bool
 from rucio.common.exception import (CannotAuthenticate, ClientProtocolNotSupported,
                                     NoAuthInformation, MissingClientParameter,
                                     MissingModuleException, ServerConnectionException)
@@ -58,8 +59,10 @@ except ImportError:
     from configparser import NoOptionError, NoSectionError
 from dogpile.cache import make_region
 from requests import session
+from requests.models import Response
 from requests.status_codes import codes, _codes
 from requests.exceptions import ConnectionError
+from requests.structures import CaseInsensitiveDict
 from requests.packages.urllib3 import disable_warnings  # pylint: disable=import-error
 disable_warnings()
 
@@ -89,6 +92,14 @@ REGION = make_region(function_key_generator=my_key_generator).configure(
 )
 
 
+# Idempotent GET endpoints which can be cached by the client, with their default time-to-live in seconds.
+# The time-to-live can be changed in the client section of the configuration, e.g. http_cache_ttl_whoami = 600
+HTTP_CACHE_ENDPOINTS = {'rse': (re.compile(r'/rses/[^/]+/?$'), 300),
+                        'rse_attributes': (re.compile(r'/rses/[^/]+/attr/?$'), 300),
+                        'rse_protocols': (re.compile(r'/rses/[^/]+/protocols(/[^/]+)*/?$'), 300),
+                        'whoami': (re.compile(r'/accounts/whoami/?$'), 3600)}
+
+
 @REGION.cache_on_arguments(namespace='host_to_choose')
 def choice(hosts):
     """
@@ -226,6 +237,11 @@ class BaseClient(object):
         self.token_file = token_path + '/' + self.TOKEN_PREFIX + self.account
         self.__authenticate()
 
+        self.http_cache = None
+        self.http_cache_keys = set()
+        if config_get_bool('client', 'http_cache', raise_exception=False, default=False):
+            self.enable_http_cache()
+
         try:
             self.request_retries = int(config_get('client', 'request_retries'))
         except NoOptionError:
@@ -294,6 +310,28 @@ class BaseClient(object):
         if headers is not None:
             hds.update(headers)
 
+        if self.http_cache is not None:
+            if type == 'GET':
+                ttl = self.__get_http_cache_ttl(url)
+                if ttl:
+                    return self.__send_cached_request(url, hds, params, ttl)
+            else:
+                # the cached responses may be outdated by the modification
+                self.invalidate_http_cache()
+
+        return self.__send_request(url, hds, type, data, params, stream)
+
+    def __send_request(self, url, hds, type='GET', data=None, params=None, stream=False):
+        """
+        Sends a request to the rucio server. Gets a new token and retries if an unauthorized error is returned.
+
+        :param url: the http url to use.
+        :param hds: the http headers to send.
+        :param type: the http request type to use.
+        :param data: post data.
+        :param params: (optional) Dictionary or bytes to be sent in the url query string.
+        :return: the HTTP return body.
+        """
         result = None
         for retry in range(self.AUTH_RETRIES + 1):
             try:
@@ -325,6 +363,89 @@ class BaseClient(object):
             raise ServerConnectionException
         return result
 
+    def enable_http_cache(self, cache_dir=None):
+        """
+        Caches the responses of the idempotent GET endpoints listed in HTTP_CACHE_ENDPOINTS until their
+        time-to-live expires. The cache is stored on disk, under RUCIO_HOME by default, and is shared by the
+        processes of the user. Identical concurrent requests of the threads of a process are sent only once.
+        The responses cached by this client are dropped when it modifies anything, the other processes see
+        the modifications once the time-to-live expires.
+
+        :param cache_dir: the directory of the cache file, if None it is read from the config file.
+        """
+        if cache_dir is None:
+            cache_dir = config_get('client', 'http_cache_dir', raise_exception=False,
+                                   default=path.join(environ.get('RUCIO_HOME', '/opt/rucio'), 'cache'))
+        try:
+            if not path.isdir(cache_dir):
+                makedirs(cache_dir)
+            self.http_cache = make_region().configure('dogpile.cache.dbm',
+                                                      arguments={'filename': path.join(cache_dir, 'http_cache_%d.dbm' % geteuid()),
+                                                                 'dogpile_lockfile': False})
+        except (IOError, OSError) as error:
+            LOG.warning('Cannot store the http cache in %s, keeping it in memory: %s' % (cache_dir, str(error)))
+            self.http_cache = make_region().configure('dogpile.cache.memory')
+
+    def invalidate_http_cache(self):
+        """
+        Drops the responses cached by this client.
+        """
+        if self.http_cache is not None:
+            for key in self.http_cache_keys:
+                self.http_cache.delete(key)
+            self.http_cache_keys = set()
+
+    def __get_http_cache_ttl(self, url):
+        """
+        Returns the time-to-live of the cached responses of an url.
+
+        :param url: the http url.
+        :return: the time-to-live in seconds, 0 if the url is not cached.
+        """
+        url_path = urlparse(url).path
+        for name, (pattern, ttl) in HTTP_CACHE_ENDPOINTS.items():
+            if pattern.search(url_path):
+                try:
+                    return int(config_get('client', 'http_cache_ttl_%s' % name, raise_exception=False, default=ttl))
+                except ValueError:
+                    LOG.debug('http_cache_ttl_%s must be an integer. Taking default.' % name)
+                    return ttl
+        return 0
+
+    def __send_cached_request(self, url, hds, params, ttl):
+        """
+        Returns the cached response of a GET request, or sends the request if the response is missing or expired.
+        While a thread sends the request, the other threads asking for the same response wait for it.
+
+        :param url: the http url to use.
+        :param hds: the http headers to send.
+        :param params: (optional) Dictionary or bytes to be sent in the url query string.
+        :param ttl: the time-to-live of the response in seconds.
+        :return: the HTTP return body.
+        """
+        key = '%s %s %s' % (self.account, url, sorted(params.items()) if isinstance(params, dict) else params)
+
+        def creator():
+            result = self.__send_request(url, hds, 'GET', params=params)
+            return {'status_code': result.status_code,
+                    'headers': dict(result.headers),
+                    'content': result.content,
+                    'encoding': result.encoding,
+                    'url': result.url}
+
+        # only the successful responses are kept
+        cached = self.http_cache.get_or_create(key, creator, expiration_time=ttl,
+                                               should_cache_fn=lambda cached: cached['status_code'] == codes.ok)  # pylint: disable-msg=E1101
+        self.http_cache_keys.add(key)
+
+        result = Response()
+        result.status_code = cached['status_code']
+        result.headers = CaseInsensitiveDict(cached['headers'])
+        result._content = cached['content']
+        result.encoding = cached['encoding']
+        result.url = cached['url']
+        return result
+
     def __get_token_userpass(self):
         """
         Sends a request to get an auth token from the server and stores it as a class attribute. Uses username/password.
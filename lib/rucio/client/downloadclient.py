@@ -25,6 +25,7 @@
 from __future__ import division
 
 import copy
+import hashlib
 import logging
 import os
 import os.path
@@ -32,14 +33,18 @@ import random
 import shutil
 import signal
 import time
+import zlib
 
 try:
     from Queue import Queue, Empty, deque
 except ImportError:
     from queue import Queue, Empty, deque
-from threading import Thread
+from threading import Event, Lock, Thread
+
+from six.moves.urllib.parse import urlparse
 
 from rucio.client.client import Client
+from rucio.common.config import config_get
 from rucio.common.exception import (InputValidationError, NoFilesDownloaded, NotAllFilesDownloaded, RSENotFound, RucioException)
 from rucio.common.pcache import Pcache
 from rucio.common.utils import adler32, md5, detect_client_location, generate_uuid, parse_replicas_from_string, send_trace, sizefmt, execute, parse_replicas_from_file
@@ -112,15 +117,160 @@ class BaseExtractionTool:
         return False
 
 
+class ProtocolPool:
+
+    def __init__(self, logger):
+        """
+        Keeps the connected protocol objects of finished downloads to reuse them for
+        the next downloads from the same RSE, scheme and hostname.
+        A protocol object is used by one download at a time.
+
+        :param logger: logging.Logger object
+        """
+        self.logger = logger
+        self.idle = {}
+        self.lock = Lock()
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, rse_settings, pfn):
+        """
+        Returns a connected protocol for the PFN, reusing an idle one if possible.
+
+        :param rse_settings: the RSE settings as returned by rsemanager.get_rse_info
+        :param pfn: the PFN to download
+
+        :returns: tuple of the pool key and the protocol object
+        """
+        parsed_pfn = urlparse(pfn)
+        key = (rse_settings['rse'], parsed_pfn.scheme, parsed_pfn.hostname)
+        with self.lock:
+            if self.idle.get(key):
+                self.reused += 1
+                return key, self.idle[key].pop()
+        protocol = rsemgr.create_protocol(rse_settings, operation='read', scheme=parsed_pfn.scheme)
+        protocol.connect()
+        with self.lock:
+            self.created += 1
+        return key, protocol
+
+    def release(self, key, protocol, reusable=True):
+        """
+        Gives back a protocol after a download.
+
+        :param key: the pool key returned by acquire
+        :param protocol: the protocol object
+        :param reusable: if False, e.g. after a failed transfer, the protocol is closed instead of kept
+        """
+        if not reusable:
+            self._close(protocol)
+            return
+        with self.lock:
+            self.idle.setdefault(key, []).append(protocol)
+
+    def close(self):
+        """
+        Closes all the idle protocols.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for protocols in idle.values():
+            for protocol in protocols:
+                self._close(protocol)
+        self.logger.debug('Created %d protocol connection(s), reused %d time(s)' % (self.created, self.reused))
+
+    def _close(self, protocol):
+        try:
+            protocol.close()
+        except Exception as error:
+            self.logger.debug('Failed to close protocol: %s' % error)
+
+
+class StreamingChecksum(Thread):
+
+    def __init__(self, file_path, algorithm, chunk_size=1048576, poll_interval=0.05):
+        """
+        Computes the checksum of a file while it is being downloaded, by following
+        its growth. The data is read while it is still in the page cache, instead of
+        reading the whole file again after the download.
+
+        :param file_path: the path of the file being written
+        :param algorithm: adler32 or md5
+        :param chunk_size: maximum number of bytes per read
+        :param poll_interval: seconds to wait for new data
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.file_path = file_path
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.done = Event()
+        self.adler = 1
+        self.md5 = hashlib.md5()
+        self.offset = 0
+        self.inode = None
+        self.error = None
+
+    def run(self):
+        try:
+            file_obj = None
+            while file_obj is None:
+                try:
+                    file_obj = open(self.file_path, 'rb')
+                except (IOError, OSError):
+                    if self.done.is_set():
+                        return
+                    self.done.wait(self.poll_interval)
+            with file_obj:
+                self.inode = os.fstat(file_obj.fileno()).st_ino
+                while True:
+                    finished = self.done.is_set()
+                    data = file_obj.read(self.chunk_size)
+                    if data:
+                        if self.algorithm == 'adler32':
+                            self.adler = zlib.adler32(data, self.adler)
+                        else:
+                            self.md5.update(data)
+                        self.offset += len(data)
+                    elif finished:
+                        return
+                    else:
+                        self.done.wait(self.poll_interval)
+        except Exception as error:
+            self.error = error
+
+    def finish(self):
+        """
+        Reads the rest of the file once the download ended.
+
+        :returns: the checksum, or None if the followed data is not the final file, e.g. if the protocol replaced it
+        """
+        self.done.set()
+        self.join()
+        if self.error or self.inode is None:
+            return None
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return None
+        if stat.st_ino != self.inode or stat.st_size != self.offset:
+            return None
+        if self.algorithm == 'adler32':
+            return str('%08x' % (self.adler & 0xffffffff))
+        return self.md5.hexdigest()
+
+
 class DownloadClient:
 
-    def __init__(self, client=None, logger=None, tracing=True, check_admin=False, check_pcache=False):
+    def __init__(self, client=None, logger=None, tracing=True, check_admin=False, check_pcache=False, max_threads=None):
         """
         Initialises the basic settings for an DownloadClient object
 
         :param client: Optional: rucio.client.client.Client object. If None, a new object will be created.
         :param external_traces: Optional: reference to a list where traces can be added
         :param logger: Optional: logging.Logger object to use for downloads. If None nothing will be logged.
+        :param max_threads: Optional: maximum number of download threads. If None, download_max_threads of the client configuration is used. (Default: 5)
         """
         if not logger:
             logger = logging.getLogger('%s.null' % __name__)
@@ -155,6 +305,10 @@ class DownloadClient:
         self.trace_tpl['eventType'] = 'download'
         self.trace_tpl['eventVersion'] = 'api_%s' % version.RUCIO_VERSION[0]
 
+        if max_threads is None:
+            max_threads = config_get('client', 'download_max_threads', raise_exception=False, default=5)
+        self.max_threads = max(1, int(max_threads))
+
         self.use_cea_threshold = 10
         self.extraction_tools = []
 
@@ -347,17 +501,20 @@ class DownloadClient:
         logger = self.logger
 
         num_files = len(input_items)
-        nlimit = 5
         num_threads = max(1, num_threads)
-        num_threads = min(num_files, num_threads, nlimit)
+        num_threads = min(num_files, num_threads, self.max_threads)
 
         input_queue = Queue()
         output_queue = Queue()
         input_queue.queue = deque(input_items)
+        protocol_pool = ProtocolPool(logger)
 
         if num_threads < 2:
             logger.info('Using main thread to download %d file(s)' % num_files)
-            self._download_worker(input_queue, output_queue, trace_custom_fields, traces_copy_out, '')
+            try:
+                self._download_worker(input_queue, output_queue, trace_custom_fields, traces_copy_out, '', protocol_pool)
+            finally:
+                protocol_pool.close()
             return list(output_queue.queue)
 
         logger.info('Using %d threads to download %d files' % (num_threads, num_files))
@@ -368,7 +525,8 @@ class DownloadClient:
                       'output_queue': output_queue,
                       'trace_custom_fields': trace_custom_fields,
                       'traces_copy_out': traces_copy_out,
-                      'log_prefix': log_prefix}
+                      'log_prefix': log_prefix,
+                      'protocol_pool': protocol_pool}
             try:
                 thread = Thread(target=self._download_worker, kwargs=kwargs)
                 thread.start()
@@ -385,9 +543,11 @@ class DownloadClient:
             logger.warning('You pressed Ctrl+C! Exiting gracefully')
             for thread in threads:
                 thread.kill_received = True
+        finally:
+            protocol_pool.close()
         return list(output_queue.queue)
 
-    def _download_worker(self, input_queue, output_queue, trace_custom_fields, traces_copy_out, log_prefix):
+    def _download_worker(self, input_queue, output_queue, trace_custom_fields, traces_copy_out, log_prefix, protocol_pool=None):
         """
         This function runs as long as there are items in the input queue,
         downloads them and stores the output in the output queue.
@@ -398,6 +558,7 @@ class DownloadClient:
         :param trace_custom_fields: Custom key value pairs to send with the traces
         :param traces_copy_out: reference to an external list, where the traces should be uploaded
         :param log_prefix: string that will be put at the beginning of every log message
+        :param protocol_pool: Optional: ProtocolPool sharing the protocol connections between the workers
         """
         logger = self.logger
 
@@ -410,7 +571,7 @@ class DownloadClient:
             try:
                 trace = copy.deepcopy(self.trace_tpl)
                 trace.update(trace_custom_fields)
-                download_result = self._download_item(item, trace, traces_copy_out, log_prefix)
+                download_result = self._download_item(item, trace, traces_copy_out, log_prefix, protocol_pool)
                 output_queue.put(download_result)
             except KeyboardInterrupt:
                 logger.warning('You pressed Ctrl+C! Exiting gracefully')
@@ -420,7 +581,7 @@ class DownloadClient:
                 logger.error('%sFailed to download item' % log_prefix)
                 logger.debug(error)
 
-    def _download_item(self, item, trace, traces_copy_out, log_prefix=''):
+    def _download_item(self, item, trace, traces_copy_out, log_prefix='', protocol_pool=None):
         """
         Downloads the given item and sends traces for success/failure.
         (This function is meant to be used as class internal only)
@@ -429,8 +590,10 @@ class DownloadClient:
         :param trace: dictionary representing a pattern of trace that will be send
         :param traces_copy_out: reference to an external list, where the traces should be uploaded
         :param log_prefix: string that will be put at the beginning of every log message
+        :param protocol_pool: Optional: ProtocolPool to reuse the protocol connections from
 
-        :returns: dictionary with all attributes from the input item and a clientState attribute
+        :returns: dictionary with all attributes from the input item, a clientState attribute and
+                  a source_stats attribute listing the attempts, bytes, duration and throughput of each tried source
         """
         logger = self.logger
         pcache = Pcache() if self.check_pcache and len(item.get('archive_items', [])) == 0 else None
@@ -515,6 +678,9 @@ class DownloadClient:
 
         # try different PFNs until one succeeded
         temp_file_path = item['temp_file_path']
+        ignore_checksum = item.get('merged_options', {}).get('ignore_checksum', False)
+        checksum_name = 'adler32' if item.get('adler32') is not None else ('md5' if item.get('md5') is not None else None)
+        source_stats = item['source_stats'] = []
         success = False
         i = 0
         while not success and i < len(sources):
@@ -537,24 +703,36 @@ class DownloadClient:
             logger.info('%sTrying to download with %s from %s: %s ' % (log_prefix, scheme, rse_name, did_str))
 
             try:
-                protocol = rsemgr.create_protocol(rse, operation='read', scheme=scheme)
-                protocol.connect()
+                if protocol_pool:
+                    protocol_key, protocol = protocol_pool.acquire(rse, pfn)
+                else:
+                    protocol = rsemgr.create_protocol(rse, operation='read', scheme=scheme)
+                    protocol.connect()
             except Exception as error:
                 logger.warning('%sFailed to create protocol for PFN: %s' % (log_prefix, pfn))
                 logger.debug('scheme: %s, exception: %s' % (scheme, error))
                 continue
 
+            stats = {'rse': rse_name, 'pfn': pfn, 'scheme': scheme, 'attempts': 0, 'bytes': 0, 'duration': 0.0, 'throughput': None}
+            source_stats.append(stats)
             attempt = 0
             retries = 2
             # do some retries with the same PFN if the download fails
             while not success and attempt < retries:
                 attempt += 1
                 item['attemptnr'] = attempt
+                stats['attempts'] = attempt
 
                 if os.path.isfile(temp_file_path):
                     logger.debug('%sDeleting existing temporary file: %s' % (log_prefix, temp_file_path))
                     os.unlink(temp_file_path)
 
+                # the checksum is computed while the file is downloaded
+                streaming_checksum = None
+                if not ignore_checksum and checksum_name:
+                    streaming_checksum = StreamingChecksum(temp_file_path, checksum_name)
+                    streaming_checksum.start()
+
                 start_time = time.time()
 
                 try:
@@ -565,18 +743,16 @@ class DownloadClient:
                     trace['clientState'] = str(type(error).__name__)
 
                 end_time = time.time()
+                local_checksum = streaming_checksum.finish() if streaming_checksum else None
+                stats['duration'] += end_time - start_time
 
-                if success and not item.get('merged_options', {}).get('ignore_checksum', False):
-                    rucio_checksum = item.get('adler32')
-                    local_checksum = None
+                if success and not ignore_checksum:
+                    rucio_checksum = item.get(checksum_name) if checksum_name else None
                     if rucio_checksum is None:
-                        rucio_checksum = item.get('md5')
-                        if rucio_checksum is None:
-                            logger.warning('%sNo remote checksum available. Skipping validation.' % log_prefix)
-                        else:
-                            local_checksum = md5(temp_file_path)
-                    else:
-                        local_checksum = adler32(temp_file_path)
+                        logger.warning('%sNo remote checksum available. Skipping validation.' % log_prefix)
+                    elif local_checksum != rucio_checksum:
+                        # the followed data may not be the final file, confirm with a full read
+                        local_checksum = adler32(temp_file_path) if checksum_name == 'adler32' else md5(temp_file_path)
 
                     if rucio_checksum != local_checksum:
                         success = False
@@ -588,7 +764,15 @@ class DownloadClient:
                     logger.warning('%sDownload attempt failed. Try %s/%s' % (log_prefix, attempt, retries))
                     self._send_trace(trace)
 
-            protocol.close()
+            if success:
+                stats['bytes'] = os.path.getsize(temp_file_path)
+                if stats['duration']:
+                    stats['throughput'] = stats['bytes'] / stats['duration']
+
+            if protocol_pool:
+                protocol_pool.release(protocol_key, protocol, reusable=success)
+            else:
+                protocol.close()
 
         if not success:
             logger.error('%sFailed to download file %s' % (log_prefix, did_str))
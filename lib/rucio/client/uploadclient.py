@@ -36,7 +36,7 @@ from rucio.client.client import Client
 from rucio.common.exception import (RucioException, RSEBlacklisted, DataIdentifierAlreadyExists,
                                     DataIdentifierNotFound, NoFilesUploaded, NotAllFilesUploaded,
                                     ResourceTemporaryUnavailable, ServiceUnavailable, InputValidationError)
-from rucio.common.utils import adler32, execute, generate_uuid, md5, send_trace
+from rucio.common.utils import bulk_file_checksums, chunks, execute, file_checksums, generate_uuid, run_concurrently, send_trace
 from rucio.rse import rsemanager as rsemgr
 from rucio import version
 
@@ -102,30 +102,8 @@ class UploadClient:
 
         # check if RSE of every file is available for writing
         # and cache rse settings
-        registered_dataset_dids = set()
-        registered_file_dids = set()
-
-        for file in files:
-            rse = file['rse']
-            if not self.rses.get(rse):
-                rse_settings = self.rses.setdefault(rse, rsemgr.get_rse_info(rse))
-                if rse_settings['availability_write'] != 1:
-                    raise RSEBlacklisted('%s is blacklisted for writing. No actions have been taken' % rse)
-
-            dataset_scope = file.get('dataset_scope')
-            dataset_name = file.get('dataset_name')
-            if dataset_scope and dataset_name:
-                dataset_did_str = ('%s:%s' % (dataset_scope, dataset_name))
-                file['dataset_did_str'] = dataset_did_str
-                registered_dataset_dids.add(dataset_did_str)
+        self._check_files(files)
 
-            registered_file_dids.add('%s:%s' % (file['did_scope'], file['did_name']))
-
-        wrong_dids = registered_file_dids.intersection(registered_dataset_dids)
-        if len(wrong_dids):
-            raise InputValidationError('DIDs used to address both files and datasets: %s' % str(wrong_dids))
-
-        # clear this set again to ensure that we only try to register datasets once
         registered_dataset_dids = set()
         num_succeeded = 0
         summary = []
@@ -137,13 +115,12 @@ class UploadClient:
             no_register = file.get('no_register')
             register_after_upload = file.get('register_after_upload') and not no_register
             pfn = file.get('pfn')
-            force_scheme = file.get('force_scheme')
             delete_existing = False
 
             self.trace['scope'] = file['did_scope']
             self.trace['datasetScope'] = file.get('dataset_scope', '')
             self.trace['dataset'] = file.get('dataset_name', '')
-            self.trace['remoteSite'] = rse
+            self.trace['remoteSite'] = file['rse']
             self.trace['filesize'] = file['bytes']
 
             file_did = {'scope': file['did_scope'], 'name': file['did_name']}
@@ -151,7 +128,6 @@ class UploadClient:
 
             rse = file['rse']
             rse_settings = self.rses[rse]
-            rse_sign_service = rse_settings.get('sign_url', None)
             is_deterministic = rse_settings.get('deterministic', True)
             if not is_deterministic and not pfn:
                 logger.error('PFN has to be defined for NON-DETERMINISTIC RSE.')
@@ -185,42 +161,7 @@ class UploadClient:
                 if rsemgr.exists(rse_settings, pfn if pfn else file_did):
                     logger.info('File already exists on RSE. Skipping upload')
                     continue
-            protocols = rsemgr.get_protocols_ordered(rse_settings=rse_settings, operation='write', scheme=force_scheme)
-            protocols.reverse()
-            success = False
-            state_reason = ''
-            while not success and len(protocols):
-                protocol = protocols.pop()
-                cur_scheme = protocol['scheme']
-                logger.info('Trying upload with %s to %s' % (cur_scheme, rse))
-                lfn = {}
-                lfn['filename'] = basename
-                lfn['scope'] = file['did_scope']
-                lfn['name'] = file['did_name']
-                lfn['adler32'] = file['adler32']
-                lfn['filesize'] = file['bytes']
-
-                sign_service = None
-                if cur_scheme == 'https':
-                    sign_service = rse_sign_service
-
-                self.trace['protocol'] = cur_scheme
-                self.trace['transferStart'] = time.time()
-                try:
-                    state = rsemgr.upload(rse_settings=rse_settings,
-                                          lfns=lfn,
-                                          source_dir=file['dirname'],
-                                          force_scheme=cur_scheme,
-                                          force_pfn=pfn,
-                                          transfer_timeout=file.get('transfer_timeout'),
-                                          delete_existing=delete_existing,
-                                          sign_service=sign_service)
-                    success = state['success']
-                    file['upload_result'] = state
-                except (ServiceUnavailable, ResourceTemporaryUnavailable) as error:
-                    logger.warning('Upload attempt failed')
-                    logger.debug('Exception: %s' % str(error))
-                    state_reason = str(error)
+            success, state_reason = self._upload_file(file, rse_settings, self.trace, delete_existing)
 
             if success:
                 num_succeeded += 1
@@ -254,21 +195,7 @@ class UploadClient:
                 logger.error('Failed to upload file %s' % basename)
 
         if summary_file_path:
-            final_summary = {}
-            for file in summary:
-                file_scope = file['did_scope']
-                file_name = file['did_name']
-                file_did_str = '%s:%s' % (file_scope, file_name)
-                final_summary[file_did_str] = {'scope': file_scope,
-                                               'name': file_name,
-                                               'bytes': file['bytes'],
-                                               'rse': file['rse'],
-                                               'pfn': file['upload_result'].get('pfn', ''),
-                                               'guid': file['meta']['guid'],
-                                               'adler32': file['adler32'],
-                                               'md5': file['md5']}
-            with open(summary_file_path, 'wb') as summary_file:
-                json.dump(final_summary, summary_file, sort_keys=True, indent=1)
+            self._write_summary(summary, summary_file_path)
 
         if num_succeeded == 0:
             raise NoFilesUploaded()
@@ -276,6 +203,285 @@ class UploadClient:
             raise NotAllFilesUploaded()
         return 0
 
+    def bulk_upload(self, items, summary_file_path=None, num_threads=4):
+        """
+        Uploads the files concurrently, then registers all of them at once: one add_replicas call
+        per RSE, one add_replication_rule call per RSE and lifetime for the files without dataset,
+        and one attach_dids_to_dids call per dataset. The files are always registered after the upload.
+
+        :param items: List of dictionaries. Each dictionary describing a file to upload, with the keys of upload.
+                      register_after_upload is implied.
+        :param summary_file_path: Optional: a path where a summary in form of a json file will be stored
+        :param num_threads: Optional: number of concurrent uploads
+
+        :returns: the list of dictionaries describing the files, with their status in the keys
+                  clientState (DONE, ALREADY_DONE or FAILED) and stateReason
+
+        :raises InputValidationError: if any input arguments are in a wrong format
+        :raises RSEBlacklisted: if a given RSE is not available for writing
+        """
+        logger = self.logger
+
+        self.trace['uuid'] = generate_uuid()
+
+        # check given sources, resolve dirs into files, and collect meta infos
+        files = self._collect_and_validate_file_info(items)
+        self._check_files(files)
+
+        # find the file DIDs which are already registered, and their replicas
+        replicas = {}
+        dids = [{'scope': file['did_scope'], 'name': file['did_name']} for file in files if not file.get('no_register')]
+        for chunk in chunks(dids, 500):
+            for replica in self.client.list_replicas(chunk, all_states=True):
+                replicas['%s:%s' % (replica['scope'], replica['name'])] = replica
+
+        calls = [(self._bulk_upload_file, {'file': file, 'replica': replicas.get('%s:%s' % (file['did_scope'], file['did_name']))}) for file in files]
+        for file, result in zip(files, run_concurrently(calls, max_workers=num_threads)):
+            if isinstance(result, Exception):
+                logger.error('Failed to upload file %s' % file['basename'])
+                logger.debug(result)
+                file['clientState'], file['stateReason'] = 'FAILED', str(result)
+
+        uploaded = [file for file in files if file['clientState'] == 'DONE' and not file.get('no_register')]
+
+        registered_dataset_dids = set()
+        for file in uploaded:
+            dataset_did_str = file.get('dataset_did_str')
+            if dataset_did_str and dataset_did_str not in registered_dataset_dids:
+                registered_dataset_dids.add(dataset_did_str)
+                try:
+                    self._register_dataset(file)
+                except Exception as error:
+                    logger.error('Failed to create dataset %s' % dataset_did_str)
+                    logger.debug(error)
+                    for dataset_file in uploaded:
+                        if dataset_file.get('dataset_did_str') == dataset_did_str:
+                            dataset_file['clientState'], dataset_file['stateReason'] = 'FAILED', 'Failed to create the dataset: %s' % error
+
+        files_per_rse = {}
+        for file in uploaded:
+            if file['clientState'] == 'DONE':
+                files_per_rse.setdefault(file['rse'], []).append(file)
+        for rse, rse_files in files_per_rse.items():
+            self._bulk_register_replicas(rse, rse_files)
+
+        # only the new file DIDs without dataset need a rule
+        rules = {}
+        for file in uploaded:
+            if file['clientState'] == 'DONE' and not file.get('dataset_did_str') and '%s:%s' % (file['did_scope'], file['did_name']) not in replicas:
+                rules.setdefault((file['rse'], file.get('lifetime')), []).append(file)
+        for (rse, lifetime), rule_files in rules.items():
+            try:
+                self.client.add_replication_rule([{'scope': file['did_scope'], 'name': file['did_name']} for file in rule_files],
+                                                 copies=1, rse_expression=rse, lifetime=lifetime)
+                logger.info('Successfully added replication rules for %s files at %s' % (len(rule_files), rse))
+            except Exception as error:
+                logger.error('Failed to add replication rules at %s' % rse)
+                logger.debug(error)
+                for file in rule_files:
+                    file['clientState'], file['stateReason'] = 'FAILED', 'Failed to add the replication rule: %s' % error
+
+        datasets = {}
+        for file in uploaded:
+            if file['clientState'] == 'DONE' and file.get('dataset_did_str'):
+                datasets.setdefault(file['dataset_did_str'], []).append(file)
+        for dataset_did_str, dataset_files in datasets.items():
+            try:
+                self.client.attach_dids_to_dids(attachments=[{'scope': dataset_files[0]['dataset_scope'],
+                                                              'name': dataset_files[0]['dataset_name'],
+                                                              'dids': [{'scope': file['did_scope'], 'name': file['did_name']} for file in dataset_files]}],
+                                                ignore_duplicate=True)
+                logger.info('Successfully attached %s files to the dataset %s' % (len(dataset_files), dataset_did_str))
+            except Exception as error:
+                logger.warning('Failed to attach files to the dataset %s' % dataset_did_str)
+                logger.debug(error)
+                for file in dataset_files:
+                    file['stateReason'] = 'Failed to attach the file to the dataset: %s' % error
+
+        if summary_file_path:
+            self._write_summary([file for file in files if file['clientState'] == 'DONE'], summary_file_path)
+
+        logger.info('%s files uploaded, %s already done, %s failed' % (len([file for file in files if file['clientState'] == 'DONE']),
+                                                                       len([file for file in files if file['clientState'] == 'ALREADY_DONE']),
+                                                                       len([file for file in files if file['clientState'] == 'FAILED'])))
+        return files
+
+    def _bulk_upload_file(self, file, replica=None):
+        """
+        Uploads one file of a bulk upload, unless it is already registered at its RSE
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file, its clientState and stateReason are set
+        :param replica: the replicas of the file DID as returned by list_replicas, if it is already registered
+        """
+        logger = self.logger
+        rse = file['rse']
+        rse_settings = self.rses[rse]
+        pfn = file.get('pfn')
+        file_did = {'scope': file['did_scope'], 'name': file['did_name']}
+        file['stateReason'] = ''
+
+        is_deterministic = rse_settings.get('deterministic', True)
+        if not is_deterministic and not pfn:
+            file['clientState'], file['stateReason'] = 'FAILED', 'PFN has to be defined for NON-DETERMINISTIC RSE.'
+            return
+        if pfn and is_deterministic:
+            file['no_register'] = True
+
+        if replica and not file.get('no_register'):
+            if replica['adler32'] != file['adler32']:
+                file['clientState'] = 'FAILED'
+                file['stateReason'] = 'Local checksum %s does not match remote checksum %s' % (file['adler32'], replica['adler32'])
+                return
+            if rse in replica['rses']:
+                logger.info('File %s already registered at %s. Skipping upload.' % (file['basename'], rse))
+                file['clientState'] = 'ALREADY_DONE'
+                return
+
+        # the file is not registered yet, so previous left overs are overwritten
+        delete_existing = False
+        if rsemgr.exists(rse_settings, pfn if pfn else file_did):
+            if file.get('no_register'):
+                logger.info('File %s already exists on RSE. Skipping upload' % file['basename'])
+                file['clientState'] = 'ALREADY_DONE'
+                return
+            logger.info('File %s already exists on RSE. Previous left overs will be overwritten.' % file['basename'])
+            delete_existing = True
+
+        # the trace of the client is shared by the upload threads
+        trace = copy.deepcopy(self.trace)
+        trace['scope'] = file['did_scope']
+        trace['datasetScope'] = file.get('dataset_scope', '')
+        trace['dataset'] = file.get('dataset_name', '')
+        trace['remoteSite'] = rse
+        trace['filesize'] = file['bytes']
+
+        success, state_reason = self._upload_file(file, rse_settings, trace, delete_existing)
+        if success:
+            trace['transferEnd'] = time.time()
+            trace['clientState'] = 'DONE'
+            file['state'] = 'A'
+            file['clientState'] = 'DONE'
+            logger.info('Successfully uploaded file %s' % file['basename'])
+        else:
+            trace['clientState'] = 'FAILED'
+            trace['stateReason'] = state_reason
+            file['clientState'], file['stateReason'] = 'FAILED', state_reason
+            logger.error('Failed to upload file %s' % file['basename'])
+        self._send_trace(trace)
+
+    def _bulk_register_replicas(self, rse, files):
+        """
+        Registers the replicas of the uploaded files at an RSE with a single call, or one by one
+        if the bulk registration fails, so that a faulty file does not fail the others
+        (This function is meant to be used as class internal only)
+
+        :param rse: the RSE name
+        :param files: list of dictionaries describing the uploaded files, the clientState of the failed ones is set
+        """
+        logger = self.logger
+        try:
+            self.client.add_replicas(rse=rse, files=[self._convert_file_for_api(file) for file in files])
+            logger.info('Successfully added %s replicas in Rucio catalogue at %s' % (len(files), rse))
+            return
+        except Exception as error:
+            logger.warning('Failed to add %s replicas at %s at once, adding them one by one' % (len(files), rse))
+            logger.debug(error)
+        for file in files:
+            try:
+                self.client.add_replicas(rse=rse, files=[self._convert_file_for_api(file)])
+            except Exception as error:
+                logger.error('Failed to add replica of file %s at %s' % (file['basename'], rse))
+                logger.debug(error)
+                file['clientState'], file['stateReason'] = 'FAILED', 'Failed to register the replica: %s' % error
+
+    def _check_files(self, files):
+        """
+        Checks that the RSE of every file is available for writing, caching the RSE settings,
+        and that no DID is used for both a file and a dataset
+        (This function is meant to be used as class internal only)
+
+        :param files: list of dictionaries describing the files, their dataset_did_str is set
+
+        :raises RSEBlacklisted: if a given RSE is not available for writing
+        :raises InputValidationError: if a DID is used for both a file and a dataset
+        """
+        registered_dataset_dids = set()
+        registered_file_dids = set()
+
+        for file in files:
+            rse = file['rse']
+            if not self.rses.get(rse):
+                rse_settings = self.rses.setdefault(rse, rsemgr.get_rse_info(rse))
+                if rse_settings['availability_write'] != 1:
+                    raise RSEBlacklisted('%s is blacklisted for writing. No actions have been taken' % rse)
+
+            dataset_scope = file.get('dataset_scope')
+            dataset_name = file.get('dataset_name')
+            if dataset_scope and dataset_name:
+                dataset_did_str = ('%s:%s' % (dataset_scope, dataset_name))
+                file['dataset_did_str'] = dataset_did_str
+                registered_dataset_dids.add(dataset_did_str)
+
+            registered_file_dids.add('%s:%s' % (file['did_scope'], file['did_name']))
+
+        wrong_dids = registered_file_dids.intersection(registered_dataset_dids)
+        if len(wrong_dids):
+            raise InputValidationError('DIDs used to address both files and datasets: %s' % str(wrong_dids))
+
+    def _upload_file(self, file, rse_settings, trace, delete_existing=False):
+        """
+        Uploads the file, trying the write protocols of the RSE in order
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file, its upload_result is set
+        :param rse_settings: the RSE settings
+        :param trace: the trace of the upload, updated with the protocol in use
+        :param delete_existing: if True, previous left overs of the file are overwritten
+
+        :returns: a tuple with True if the upload succeeded, and the reason of the last failure
+        """
+        logger = self.logger
+        rse = file['rse']
+        rse_sign_service = rse_settings.get('sign_url', None)
+        protocols = rsemgr.get_protocols_ordered(rse_settings=rse_settings, operation='write', scheme=file.get('force_scheme'))
+        protocols.reverse()
+        success = False
+        state_reason = ''
+        while not success and len(protocols):
+            protocol = protocols.pop()
+            cur_scheme = protocol['scheme']
+            logger.info('Trying upload with %s to %s' % (cur_scheme, rse))
+            lfn = {}
+            lfn['filename'] = file['basename']
+            lfn['scope'] = file['did_scope']
+            lfn['name'] = file['did_name']
+            lfn['adler32'] = file['adler32']
+            lfn['filesize'] = file['bytes']
+
+            sign_service = None
+            if cur_scheme == 'https':
+                sign_service = rse_sign_service
+
+            trace['protocol'] = cur_scheme
+            trace['transferStart'] = time.time()
+            try:
+                state = rsemgr.upload(rse_settings=rse_settings,
+                                      lfns=lfn,
+                                      source_dir=file['dirname'],
+                                      force_scheme=cur_scheme,
+                                      force_pfn=file.get('pfn'),
+                                      transfer_timeout=file.get('transfer_timeout'),
+                                      delete_existing=delete_existing,
+                                      sign_service=sign_service)
+                success = state['success']
+                file['upload_result'] = state
+            except (ServiceUnavailable, ResourceTemporaryUnavailable) as error:
+                logger.warning('Upload attempt failed')
+                logger.debug('Exception: %s' % str(error))
+                state_reason = str(error)
+        return success, state_reason
+
     def _register_file(self, file, registered_dataset_dids):
         """
         Registers the given file in Rucio. Creates a dataset if
@@ -295,18 +501,7 @@ class UploadClient:
         # register a dataset if we need to
         if dataset_did_str and dataset_did_str not in registered_dataset_dids:
             registered_dataset_dids.add(dataset_did_str)
-            try:
-                logger.debug('Trying to create dataset: %s' % dataset_did_str)
-                self.client.add_dataset(scope=file['dataset_scope'],
-                                        name=file['dataset_name'],
-                                        rules=[{'account': self.client.account,
-                                                'copies': 1,
-                                                'rse_expression': rse,
-                                                'grouping': 'DATASET',
-                                                'lifetime': file.get('lifetime')}])
-                logger.info('Successfully created dataset %s' % dataset_did_str)
-            except DataIdentifierAlreadyExists:
-                logger.debug('Dataset %s already exists' % dataset_did_str)
+            self._register_dataset(file)
         else:
             logger.debug('Skipping dataset registration')
 
@@ -339,6 +534,29 @@ class UploadClient:
                 self.client.add_replication_rule([file_did], copies=1, rse_expression=rse, lifetime=file.get('lifetime'))
                 logger.info('Successfully added replication rule at %s' % rse)
 
+    def _register_dataset(self, file):
+        """
+        Creates the dataset of the given file, with a replication rule at the RSE of the file,
+        unless the dataset already exists
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file
+        """
+        logger = self.logger
+        dataset_did_str = file['dataset_did_str']
+        try:
+            logger.debug('Trying to create dataset: %s' % dataset_did_str)
+            self.client.add_dataset(scope=file['dataset_scope'],
+                                    name=file['dataset_name'],
+                                    rules=[{'account': self.client.account,
+                                            'copies': 1,
+                                            'rse_expression': file['rse'],
+                                            'grouping': 'DATASET',
+                                            'lifetime': file.get('lifetime')}])
+            logger.info('Successfully created dataset %s' % dataset_did_str)
+        except DataIdentifierAlreadyExists:
+            logger.debug('Dataset %s already exists' % dataset_did_str)
+
     def _get_file_guid(self, file):
         """
         Get the guid of a file, trying different strategies
@@ -365,7 +583,7 @@ class UploadClient:
             guid = generate_uuid()
         return guid
 
-    def _collect_file_info(self, filepath, item):
+    def _collect_file_info(self, filepath, item, checksums=None):
         """
         Collects infos (e.g. size, checksums, etc.) about the file and
         returns them as a dictionary
@@ -373,6 +591,7 @@ class UploadClient:
 
         :param filepath: path where the file is stored
         :param item: input options for the given file
+        :param checksums: Optional: dictionary with the already computed adler32 and md5 of the file
 
         :returns: a dictionary containing all collected info and the input options
         """
@@ -382,8 +601,10 @@ class UploadClient:
         new_item['basename'] = os.path.basename(filepath)
 
         new_item['bytes'] = os.stat(filepath).st_size
-        new_item['adler32'] = adler32(filepath)
-        new_item['md5'] = md5(filepath)
+        if not checksums:
+            checksums = file_checksums(filepath)
+        new_item['adler32'] = checksums['adler32']
+        new_item['md5'] = checksums['md5']
         new_item['meta'] = {'guid': self._get_file_guid(new_item)}
         new_item['state'] = 'C'
         if not new_item.get('did_scope'):
@@ -406,7 +627,7 @@ class UploadClient:
         :raises InputValidationError: if an input option has a wrong format
         """
         logger = self.logger
-        files = []
+        paths_and_items = []
         for item in items:
             path = item.get('path')
             pfn = item.get('pfn')
@@ -422,18 +643,20 @@ class UploadClient:
             if os.path.isdir(path):
                 dname, subdirs, fnames = next(os.walk(path))
                 for fname in fnames:
-                    file = self._collect_file_info(os.path.join(dname, fname), item)
-                    files.append(file)
+                    paths_and_items.append((os.path.join(dname, fname), item))
                 if not len(fnames) and not len(subdirs):
                     logger.warning('Skipping %s because it is empty.' % dname)
                 elif not len(fnames):
                     logger.warning('Skipping %s because it has no files in it. Subdirectories are not supported.' % dname)
             elif os.path.isfile(path):
-                file = self._collect_file_info(path, item)
-                files.append(file)
+                paths_and_items.append((path, item))
             else:
                 logger.warning('No such file or directory: %s' % path)
 
+        # hash all the files in parallel, each of them with a single read
+        checksums = bulk_file_checksums([path for path, _ in paths_and_items])
+        files = [self._collect_file_info(path, item, checksums[path]) for path, item in paths_and_items]
+
         if not len(files):
             raise InputValidationError('No valid input files given')
 
@@ -462,6 +685,30 @@ class UploadClient:
             replica['pfn'] = pfn
         return replica
 
+    def _write_summary(self, files, summary_file_path):
+        """
+        Stores a json summary of the uploaded files
+        (This function is meant to be used as class internal only)
+
+        :param files: list of dictionaries describing the uploaded files
+        :param summary_file_path: the path of the summary file
+        """
+        final_summary = {}
+        for file in files:
+            file_scope = file['did_scope']
+            file_name = file['did_name']
+            file_did_str = '%s:%s' % (file_scope, file_name)
+            final_summary[file_did_str] = {'scope': file_scope,
+                                           'name': file_name,
+                                           'bytes': file['bytes'],
+                                           'rse': file['rse'],
+                                           'pfn': file['upload_result'].get('pfn', ''),
+                                           'guid': file['meta']['guid'],
+                                           'adler32': file['adler32'],
+                                           'md5': file['md5']}
+        with open(summary_file_path, 'w') as summary_file:
+            json.dump(final_summary, summary_file, sort_keys=True, indent=1)
+
     def _send_trace(self, trace):
         """
         Checks if sending trace is allowed and send the trace.
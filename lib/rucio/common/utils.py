@@ -65,6 +65,12 @@ try:
 except ImportError:
     # Python 3
     from urllib.parse import urlencode, quote
+try:
+    # Python 2
+    from Queue import Queue, Empty
+except ImportError:
+    # Python 3
+    from queue import Queue, Empty
 try:
     # Python 2
     from StringIO import StringIO
@@ -179,29 +185,59 @@ def clean_headers(msg):
     return msg
 
 
-def adler32(file):
-    """
-    An Adler-32 checksum is obtained by calculating two 16-bit checksums A and B and concatenating their bits into a 32-bit integer. A is the sum of all bytes in the stream plus one, and B is the sum of the individual values of A from each step.
+# Size of the buffers the checksums are computed over
+CHECKSUM_BUFFER_SIZE = 4 * 1024 * 1024
 
-    :returns: Hexified string, padded to 8 values.
+CHECKSUM_ALGORITHMS = ('adler32', 'md5')
+
+
+def _file_digests(file, algorithms=CHECKSUM_ALGORITHMS, buffer_size=CHECKSUM_BUFFER_SIZE):
     """
+    Computes several checksums of a file in a single pass, reading it into one reused fixed-size buffer.
 
+    :param file: file name
+    :param algorithms: names of the checksums to compute, adler32 and/or md5
+    :param buffer_size: size of the read buffer in bytes
+    :returns: dictionary {algorithm: hexadecimal checksum}
+    """
     # adler starting value is _not_ 0
     adler = 1
+    hash_md5 = hashlib.md5() if 'md5' in algorithms else None
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    with open(file, 'rb') as openFile:
+        while True:
+            size = openFile.readinto(buf)
+            if not size:
+                break
+            chunk = view[:size]
+            if 'adler32' in algorithms:
+                adler = zlib.adler32(chunk, adler)
+            if hash_md5:
+                hash_md5.update(chunk)
+
+    checksums = {}
+    if 'adler32' in algorithms:
+        # backflip on 32bit
+        if adler < 0:
+            adler = adler + 2 ** 32
+        checksums['adler32'] = str('%08x' % adler)
+    if hash_md5:
+        checksums['md5'] = hash_md5.hexdigest()
+    return checksums
+
+
+def adler32(file):
+    """
+    An Adler-32 checksum is obtained by calculating two 16-bit checksums A and B and concatenating their bits into a 32-bit integer. A is the sum of all bytes in the stream plus one, and B is the sum of the individual values of A from each step.
 
+    :returns: Hexified string, padded to 8 values.
+    """
     try:
-        with open(file, 'rb') as openFile:
-            for line in openFile:
-                adler = zlib.adler32(line, adler)
+        return _file_digests(file, algorithms=('adler32',))['adler32']
     except Exception as e:
         raise Exception('FATAL - could not get Adler32 checksum of file %s - %s' % (file, e))
 
-    # backflip on 32bit
-    if adler < 0:
-        adler = adler + 2 ** 32
-
-    return str('%08x' % adler)
-
 
 def md5(file):
     """
@@ -210,14 +246,43 @@ def md5(file):
     :param string: file name
     :returns: string of 32 hexadecimal digits
     """
-    hash_md5 = hashlib.md5()
     try:
-        with open(file, "rb") as f:
-            list(map(hash_md5.update, iter(lambda: f.read(4096), b"")))
+        return _file_digests(file, algorithms=('md5',))['md5']
     except Exception as e:
         raise Exception('FATAL - could not get MD5 checksum of file %s - %s' % (file, e))
 
-    return hash_md5.hexdigest()
+
+def file_checksums(file, algorithms=CHECKSUM_ALGORITHMS):
+    """
+    Computes the adler32 and md5 checksums of a file with a single read of the file.
+
+    :param file: file name
+    :param algorithms: names of the checksums to compute
+    :returns: dictionary {algorithm: hexadecimal checksum}
+    """
+    try:
+        return _file_digests(file, algorithms=algorithms)
+    except Exception as e:
+        raise Exception('FATAL - could not get checksums of file %s - %s' % (file, e))
+
+
+def bulk_file_checksums(files, algorithms=CHECKSUM_ALGORITHMS, max_workers=4):
+    """
+    Computes the checksums of many files on a pool of threads. The checksum functions release
+    the GIL on large buffers, so the files are hashed in parallel.
+
+    :param files: list of file names
+    :param algorithms: names of the checksums to compute
+    :param max_workers: maximum number of threads
+    :returns: dictionary {file name: {algorithm: hexadecimal checksum}}
+    :raises Exception: the error of the first file which could not be read
+    """
+    files = list(set(files))
+    results = run_concurrently([(file_checksums, {'file': file, 'algorithms': algorithms}) for file in files], max_workers=max_workers)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return dict(zip(files, results))
 
 
 def str_to_date(string):
@@ -394,6 +459,38 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
+def run_concurrently(calls, max_workers=10):
+    """
+    Run callables on a bounded pool of threads.
+
+    :param calls:        List of (callable, kwargs).
+    :param max_workers:  Maximum number of threads.
+    :returns:            List of the results, or of the raised exceptions, in the order of the calls.
+    """
+    results = [None] * len(calls)
+    pending = Queue()
+    for idx, call in enumerate(calls):
+        pending.put((idx, call))
+
+    def worker():
+        while True:
+            try:
+                idx, (function, kwargs) = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                results[idx] = function(**kwargs)
+            except Exception as error:
+                results[idx] = error
+
+    threads = [threading.Thread(target=worker) for _ in range(min(max_workers, len(calls)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
 def my_key_generator(namespace, fn, **kw):
     """
     Customyzed key generator for dogpile
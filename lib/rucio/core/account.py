@@ -30,6 +30,7 @@ import rucio.core.account_counter
 import rucio.core.rse
 
 from rucio.common import exception
+from rucio.common.utils import chunks
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import AccountStatus, AccountType
 from rucio.db.sqla.enum import EnumSymbol
@@ -292,6 +293,25 @@ def get_usage(rse_id, account, session=None):
         return {'bytes': 0, 'files': 0, 'updated_at': None}
 
 
+@read_session
+def get_usages(account, rse_ids, session=None):
+    """
+    Returns current values of the counters of an account on a list of RSEs.
+
+    :param account:          The account name.
+    :param rse_ids:          List of RSE ids.
+    :param session:          The database session in use.
+    :returns:                A dictionary rse_id -> dictionary with bytes, files and updated_at. Missing counters are reported as 0.
+    """
+    usages = dict((rse_id, {'bytes': 0, 'files': 0, 'updated_at': None}) for rse_id in rse_ids)
+    for rse_ids_chunk in chunks(list(rse_ids), 1000):
+        query = session.query(models.AccountUsage).filter(models.AccountUsage.account == account,
+                                                          models.AccountUsage.rse_id.in_(rse_ids_chunk))
+        for counter in query:
+            usages[counter.rse_id] = {'bytes': counter.bytes, 'files': counter.files, 'updated_at': counter.updated_at}
+    return usages
+
+
 @read_session
 def get_usage_history(rse_id, account, session=None):
     """
@@ -14,10 +14,14 @@
 #
 # PY3K COMPATIBLE
 
+from datetime import datetime
+
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.sql.expression import bindparam, text
+from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import and_, bindparam, case, or_, text
 
-from rucio.common.exception import CounterNotFound
+from rucio.common.exception import CounterNotFound, DatabaseException
+from rucio.common.utils import chunks
 import rucio.core.account
 import rucio.core.rse
 
@@ -109,19 +113,16 @@ def del_counter(rse_id, account, session=None):
     session.query(models.AccountUsage).filter_by(rse_id=rse_id, account=account).delete(synchronize_session=False)
 
 
-@read_session
-def get_updated_account_counters(total_workers, worker_number, session=None):
+def __filter_worker(query, total_workers, worker_number, session):
     """
-    Get updated rse_counters.
+    Restrict a query on the updated_account_counters to the account/RSE pairs of a worker.
 
+    :param query:              The query.
     :param total_workers:      Number of total workers.
     :param worker_number:      id of the executing worker.
     :param session:            Database session in use.
-    :returns:                  List of rse_ids whose rse_counters need to be updated.
+    :returns:                  The filtered query.
     """
-    query = session.query(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id).\
-        distinct(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id)
-
     if total_workers > 0:
         if session.bind.dialect.name == 'oracle':
             bindparams = [bindparam('worker_number', worker_number),
@@ -131,10 +132,82 @@ def get_updated_account_counters(total_workers, worker_number, session=None):
             query = query.filter(text('mod(md5(concat(account, rse_id)), %s) = %s' % (total_workers + 1, worker_number)))
         elif session.bind.dialect.name == 'postgresql':
             query = query.filter(text('mod(abs((\'x\'||md5(concat(account, rse_id)))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number)))
+    return query
+
+
+@read_session
+def get_updated_account_counters(total_workers, worker_number, session=None):
+    """
+    Get updated rse_counters.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param session:            Database session in use.
+    :returns:                  List of rse_ids whose rse_counters need to be updated.
+    """
+    query = session.query(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id).\
+        distinct(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id)
+    query = __filter_worker(query, total_workers, worker_number, session)
 
     return query.all()
 
 
+@transactional_session
+def fold_updated_account_counters(total_workers, worker_number, session=None):
+    """
+    Fold the updated_account_counters of all the account/RSE pairs of a worker into the account_counters,
+    with one aggregate query, one deletion of the folded rows and one update per 100 pairs.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param session:            Database session in use.
+    :returns:                  Dictionary with the number of folded counters and rows, and the creation date of the oldest folded row.
+    :raises DatabaseException: If the folded rows changed meanwhile. Nothing is folded then.
+    """
+    # The rows are folded by creation date, as their ids are not ordered
+    folded_until = datetime.utcnow()
+    query = session.query(models.UpdatedAccountCounter.account,
+                          models.UpdatedAccountCounter.rse_id,
+                          func.sum(models.UpdatedAccountCounter.files),
+                          func.sum(models.UpdatedAccountCounter.bytes),
+                          func.count(models.UpdatedAccountCounter.id),
+                          func.min(models.UpdatedAccountCounter.created_at)).\
+        filter(models.UpdatedAccountCounter.created_at <= folded_until).\
+        group_by(models.UpdatedAccountCounter.account, models.UpdatedAccountCounter.rse_id)
+    query = __filter_worker(query, total_workers, worker_number, session)
+
+    deltas, nb_rows, oldest = {}, 0, None
+    for account, rse_id, files, bytes, count, created_at in query:
+        deltas[(account, rse_id)] = {'files': int(files or 0), 'bytes': int(bytes or 0)}
+        nb_rows += count
+        oldest = created_at if oldest is None else min(oldest, created_at)
+    if not deltas:
+        return {'counters': 0, 'rows': 0, 'oldest': None}
+
+    # A row committed after the aggregation, or deleted by another worker, would make the counters wrong
+    query = session.query(models.UpdatedAccountCounter).filter(models.UpdatedAccountCounter.created_at <= folded_until)
+    rowcount = __filter_worker(query, total_workers, worker_number, session).delete(synchronize_session=False)
+    if rowcount != nb_rows:
+        raise DatabaseException('%s updated account counters were aggregated but %s were deleted' % (nb_rows, rowcount))
+
+    for keys in chunks(list(deltas), 100):
+        clauses = [and_(models.AccountUsage.account == account, models.AccountUsage.rse_id == rse_id) for account, rse_id in keys]
+        existing_keys = [(account, rse_id) for account, rse_id in session.query(models.AccountUsage.account, models.AccountUsage.rse_id).filter(or_(*clauses))]
+        if existing_keys:
+            clauses = [and_(models.AccountUsage.account == account, models.AccountUsage.rse_id == rse_id) for account, rse_id in existing_keys]
+            session.query(models.AccountUsage).\
+                filter(or_(*clauses)).\
+                update({'bytes': models.AccountUsage.bytes + case([(clause, deltas[key]['bytes']) for clause, key in zip(clauses, existing_keys)]),
+                        'files': models.AccountUsage.files + case([(clause, deltas[key]['files']) for clause, key in zip(clauses, existing_keys)])},
+                       synchronize_session=False)
+        for account, rse_id in set(keys) - set(existing_keys):
+            models.AccountUsage(rse_id=rse_id,
+                                account=account,
+                                files=deltas[(account, rse_id)]['files'],
+                                bytes=deltas[(account, rse_id)]['bytes']).save(session=session, flush=False)
+    return {'counters': len(deltas), 'rows': nb_rows, 'oldest': oldest}
+
+
 @transactional_session
 def update_account_counter(account, rse_id, session=None):
     """
@@ -22,8 +22,9 @@
 # PY3K COMPATIBLE
 
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.sql.expression import and_, or_
+from sqlalchemy.sql.expression import and_
 
+from rucio.common.utils import chunks
 from rucio.db.sqla import models
 from rucio.db.sqla.session import read_session, transactional_session
 from rucio.core.rse import get_rse_name
@@ -82,12 +83,9 @@ def get_account_limits(account, rse_ids=None, session=None):
 
     account_limits = {}
     if rse_ids:
-        rse_id_clauses = []
-        for rse_id in rse_ids:
-            rse_id_clauses.append(and_(models.AccountLimit.rse_id == rse_id, models.AccountLimit.account == account))
-        rse_id_clause_chunks = [rse_id_clauses[x:x + 10] for x in range(0, len(rse_id_clauses), 10)]
-        for rse_id_chunk in rse_id_clause_chunks:
-            tmp_limits = session.query(models.AccountLimit).filter(or_(*rse_id_chunk)).all()
+        for rse_id_chunk in chunks(list(rse_ids), 1000):
+            tmp_limits = session.query(models.AccountLimit).filter(models.AccountLimit.account == account,
+                                                                   models.AccountLimit.rse_id.in_(rse_id_chunk)).all()
             for limit in tmp_limits:
                 if limit.bytes == -1:
                     account_limits[limit.rse_id] = float("inf")
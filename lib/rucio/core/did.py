@@ -38,7 +38,7 @@ from hashlib import md5
 from re import match
 from six import string_types, iteritems
 
-from sqlalchemy import and_, or_, exists, String, cast, type_coerce, JSON
+from sqlalchemy import and_, or_, exists, update, String, cast, type_coerce, JSON
 from sqlalchemy.exc import DatabaseError, IntegrityError, CompileError, InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import not_, func
@@ -555,11 +555,33 @@ def attach_dids_to_dids(attachments, account, ignore_duplicate=False, session=No
         session.bulk_insert_mappings(models.UpdatedDID, parent_dids)
 
 
+def __did_clauses(dids, scope_column, name_column, chunk_size=500):
+    """
+    Build the clauses selecting a list of dids, one per scope and chunk of names.
+
+    :param dids:         The list of dids.
+    :param scope_column: The scope column to filter.
+    :param name_column:  The name column to filter.
+    :param chunk_size:   The maximum number of names per clause.
+    :returns:            List of clauses.
+    """
+    names_per_scope = {}
+    for did in dids:
+        names_per_scope.setdefault(did['scope'], set()).add(did['name'])
+    clauses = []
+    for scope, names in iteritems(names_per_scope):
+        for names_chunk in chunks(list(names), chunk_size):
+            clauses.append(and_(scope_column == scope, name_column.in_(names_chunk)))
+    return clauses
+
+
 @transactional_session
 def delete_dids(dids, account, expire_rules=False, session=None):
     """
     Delete data identifiers
 
+    The statements are issued per scope and chunk of names, so that thousands of dids can be deleted in one transaction.
+
     :param dids:          The list of dids to delete.
     :param account:       The account.
     :param expire_rules:  Expire large rules instead of deleting them right away. This should only be used in Undertaker mode, as it can be that
@@ -567,20 +589,10 @@ def delete_dids(dids, account, expire_rules=False, session=None):
                           expired did.
     :param session:       The database session in use.
     """
-    rule_id_clause, content_clause = [], []
-    parent_content_clause, did_clause = [], []
-    collection_replica_clause, file_clause = [], []
-    not_purge_replicas = []
+    not_purge_replicas = set()
 
     for did in dids:
         logging.info('Removing did %(scope)s:%(name)s (%(did_type)s)' % did)
-        if did['did_type'] == DIDType.FILE:
-            file_clause.append(and_(models.DataIdentifier.scope == did['scope'], models.DataIdentifier.name == did['name']))
-        else:
-            did_clause.append(and_(models.DataIdentifier.scope == did['scope'], models.DataIdentifier.name == did['name']))
-            content_clause.append(and_(models.DataIdentifierAssociation.scope == did['scope'], models.DataIdentifierAssociation.name == did['name']))
-            collection_replica_clause.append(and_(models.CollectionReplica.scope == did['scope'],
-                                                  models.CollectionReplica.name == did['name']))
 
         # ATLAS LOCALGROUPDISK Archive policy
         if did['did_type'] == DIDType.DATASET and did['scope'].external != 'archive':
@@ -590,54 +602,19 @@ def delete_dids(dids, account, expire_rules=False, session=None):
                 pass
 
         if did['purge_replicas'] is False:
-            not_purge_replicas.append((did['scope'], did['name']))
+            not_purge_replicas.add((did['scope'], did['name']))
 
-            # Archive content
-            # Disable for postgres
-            if session.bind.dialect.name != 'postgresql':
-                q = session.query(models.DataIdentifierAssociation.scope,
-                                  models.DataIdentifierAssociation.name,
-                                  models.DataIdentifierAssociation.child_scope,
-                                  models.DataIdentifierAssociation.child_name,
-                                  models.DataIdentifierAssociation.did_type,
-                                  models.DataIdentifierAssociation.child_type,
-                                  models.DataIdentifierAssociation.bytes,
-                                  models.DataIdentifierAssociation.adler32,
-                                  models.DataIdentifierAssociation.md5,
-                                  models.DataIdentifierAssociation.guid,
-                                  models.DataIdentifierAssociation.events,
-                                  models.DataIdentifierAssociation.rule_evaluation,
-                                  bindparam("did_created_at", did.get('created_at')),
-                                  models.DataIdentifierAssociation.created_at,
-                                  models.DataIdentifierAssociation.updated_at,
-                                  bindparam('deleted_at', datetime.utcnow())).\
-                    filter(and_(models.DataIdentifierAssociation.scope == did['scope'],
-                                models.DataIdentifierAssociation.name == did['name']))
-                ins = Insert(table=models.DataIdentifierAssociationHistory, inline=True).\
-                    from_select(('scope', 'name', 'child_scope', 'child_name', 'did_type',
-                                 'child_type', 'bytes', 'adler32', 'md5', 'guid', 'events',
-                                 'rule_evaluation', 'did_created_at', 'created_at', 'updated_at',
-                                 'deleted_at'), q)
-                session.execute(ins)
-        parent_content_clause.append(and_(models.DataIdentifierAssociation.child_scope == did['scope'], models.DataIdentifierAssociation.child_name == did['name']))
-        rule_id_clause.append(and_(models.ReplicationRule.scope == did['scope'], models.ReplicationRule.name == did['name']))
-
-        # Send message
-        add_message('ERASE', {'account': account.external,
-                              'scope': did['scope'].external,
-                              'name': did['name']},
-                    session=session)
     # Delete rules on did
-    skip_deletion = False  # Skip deletion in case of expiration of a rule
-    if rule_id_clause:
-        with record_timer_block('undertaker.rules'):
+    skipped_dids = set()  # Skip deletion in case of expiration of a rule
+    with record_timer_block('undertaker.rules'):
+        for rule_clause in __did_clauses(dids, models.ReplicationRule.scope, models.ReplicationRule.name):
             for (rule_id, scope, name, rse_expression, locks_ok_cnt, locks_replicating_cnt, locks_stuck_cnt) in session.query(models.ReplicationRule.id,
                                                                                                                               models.ReplicationRule.scope,
                                                                                                                               models.ReplicationRule.name,
                                                                                                                               models.ReplicationRule.rse_expression,
                                                                                                                               models.ReplicationRule.locks_ok_cnt,
                                                                                                                               models.ReplicationRule.locks_replicating_cnt,
-                                                                                                                              models.ReplicationRule.locks_stuck_cnt).filter(or_(*rule_id_clause)):
+                                                                                                                              models.ReplicationRule.locks_stuck_cnt).filter(rule_clause).all():
                 logging.debug('Removing rule %s for did %s:%s on RSE-Expression %s' % (str(rule_id), scope, name, rse_expression))
 
                 # Propagate purge_replicas from did to rules
@@ -650,48 +627,90 @@ def delete_dids(dids, account, expire_rules=False, session=None):
                     rucio.core.rule.delete_rule(rule_id=rule_id, purge_replicas=purge_replicas, soft=True, delete_parent=True, nowait=True, session=session)
                     # Update expiration of did
                     set_metadata(scope=scope, name=name, key='lifetime', value=3600 * 24, session=session)
-                    skip_deletion = True
+                    skipped_dids.add((scope, name))
                 else:
                     rucio.core.rule.delete_rule(rule_id=rule_id, purge_replicas=purge_replicas, delete_parent=True, nowait=True, session=session)
 
-    if skip_deletion:
-        return
+    # The dids with an expired rule are deleted once the rule is gone
+    dids = [did for did in dids if (did['scope'], did['name']) not in skipped_dids]
+    collections = [did for did in dids if did['did_type'] != DIDType.FILE]
+    files = [did for did in dids if did['did_type'] == DIDType.FILE]
+
+    # Archive content
+    # Disable for postgres
+    archived_collections = [did for did in collections if (did['scope'], did['name']) in not_purge_replicas]
+    if archived_collections and session.bind.dialect.name != 'postgresql':
+        deleted_at = datetime.utcnow()
+        for content_clause in __did_clauses(archived_collections, models.DataIdentifierAssociation.scope, models.DataIdentifierAssociation.name):
+            q = session.query(models.DataIdentifierAssociation.scope,
+                              models.DataIdentifierAssociation.name,
+                              models.DataIdentifierAssociation.child_scope,
+                              models.DataIdentifierAssociation.child_name,
+                              models.DataIdentifierAssociation.did_type,
+                              models.DataIdentifierAssociation.child_type,
+                              models.DataIdentifierAssociation.bytes,
+                              models.DataIdentifierAssociation.adler32,
+                              models.DataIdentifierAssociation.md5,
+                              models.DataIdentifierAssociation.guid,
+                              models.DataIdentifierAssociation.events,
+                              models.DataIdentifierAssociation.rule_evaluation,
+                              models.DataIdentifier.created_at,
+                              models.DataIdentifierAssociation.created_at,
+                              models.DataIdentifierAssociation.updated_at,
+                              bindparam('deleted_at', deleted_at)).\
+                join(models.DataIdentifier, and_(models.DataIdentifierAssociation.scope == models.DataIdentifier.scope,
+                                                 models.DataIdentifierAssociation.name == models.DataIdentifier.name)).\
+                filter(content_clause)
+            ins = Insert(table=models.DataIdentifierAssociationHistory, inline=True).\
+                from_select(('scope', 'name', 'child_scope', 'child_name', 'did_type',
+                             'child_type', 'bytes', 'adler32', 'md5', 'guid', 'events',
+                             'rule_evaluation', 'did_created_at', 'created_at', 'updated_at',
+                             'deleted_at'), q)
+            session.execute(ins)
+
+    # Send message
+    for did in dids:
+        add_message('ERASE', {'account': account.external,
+                              'scope': did['scope'].external,
+                              'name': did['name']},
+                    session=session)
 
     # Detach from parent dids:
-    existing_parent_dids = False
-    if parent_content_clause:
-        with record_timer_block('undertaker.parent_content'):
-            for parent_did in session.query(models.DataIdentifierAssociation).filter(or_(*parent_content_clause)):
-                existing_parent_dids = True
+    detached_dids = set()
+    with record_timer_block('undertaker.parent_content'):
+        for parent_content_clause in __did_clauses(dids, models.DataIdentifierAssociation.child_scope, models.DataIdentifierAssociation.child_name):
+            for parent_did in session.query(models.DataIdentifierAssociation).filter(parent_content_clause).all():
+                detached_dids.add((parent_did.child_scope, parent_did.child_name))
                 detach_dids(scope=parent_did.scope, name=parent_did.name, dids=[{'scope': parent_did.child_scope, 'name': parent_did.child_name}], session=session)
 
     # Remove content
-    if content_clause:
-        with record_timer_block('undertaker.content'):
-            rowcount = session.query(models.DataIdentifierAssociation).filter(or_(*content_clause)).\
+    with record_timer_block('undertaker.content'):
+        for content_clause in __did_clauses(collections, models.DataIdentifierAssociation.scope, models.DataIdentifierAssociation.name):
+            rowcount = session.query(models.DataIdentifierAssociation).filter(content_clause).\
                 delete(synchronize_session=False)
-        record_counter(counters='undertaker.content.rowcount', delta=rowcount)
+            record_counter(counters='undertaker.content.rowcount', delta=rowcount)
 
     # Remove CollectionReplica
-    if collection_replica_clause:
-        with record_timer_block('undertaker.dids'):
-            rowcount = session.query(models.CollectionReplica).filter(or_(*collection_replica_clause)).\
+    with record_timer_block('undertaker.dids'):
+        for collection_replica_clause in __did_clauses(collections, models.CollectionReplica.scope, models.CollectionReplica.name):
+            session.query(models.CollectionReplica).filter(collection_replica_clause).\
                 delete(synchronize_session=False)
 
     # remove data identifier
-    if existing_parent_dids:
-        # Exit method early to give Judge time to remove locks (Otherwise, due to foreign keys, did removal does not work
-        logging.debug('Leaving delete_dids early for Judge-Evaluator checks')
-        return
-
-    if did_clause:
-        with record_timer_block('undertaker.dids'):
-            rowcount = session.query(models.DataIdentifier).filter(or_(*did_clause)).\
+    # The dids detached from a parent are removed at the next pass, to give Judge time to remove locks (Otherwise, due to foreign keys, did removal does not work)
+    if detached_dids:
+        logging.debug('Leaving %s dids for Judge-Evaluator checks' % len(detached_dids))
+        collections = [did for did in collections if (did['scope'], did['name']) not in detached_dids]
+        files = [did for did in files if (did['scope'], did['name']) not in detached_dids]
+
+    with record_timer_block('undertaker.dids'):
+        for did_clause in __did_clauses(collections, models.DataIdentifier.scope, models.DataIdentifier.name):
+            session.query(models.DataIdentifier).filter(did_clause).\
                 filter(or_(models.DataIdentifier.did_type == DIDType.CONTAINER, models.DataIdentifier.did_type == DIDType.DATASET)).\
                 delete(synchronize_session=False)
 
-    if file_clause:
-        rowcount = session.query(models.DataIdentifier).filter(or_(*file_clause)).\
+    for file_clause in __did_clauses(files, models.DataIdentifier.scope, models.DataIdentifier.name):
+        session.query(models.DataIdentifier).filter(file_clause).\
             filter(models.DataIdentifier.did_type == DIDType.FILE).\
             update({'expired_at': None}, synchronize_session=False)
 
@@ -844,16 +863,25 @@ def set_new_dids(dids, new_flag, session=None):
     """
     if session.bind.dialect.name == 'postgresql':
         new_flag = bool(new_flag)
+    names_per_scope = {}
     for did in dids:
-        try:
-
-            rowcount = session.query(models.DataIdentifier).\
-                filter_by(scope=did['scope'], name=did['name']).\
-                update({'is_new': new_flag}, synchronize_session=False)
-            if not rowcount:
-                raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (did['scope'], did['name']))
-        except DatabaseError as error:
-            raise exception.DatabaseException('%s : Cannot update %s:%s' % (error.args[0], did['scope'], did['name']))
+        names_per_scope.setdefault(did['scope'], []).append(did['name'])
+    for scope, names in iteritems(names_per_scope):
+        for names_chunk in chunks(list(set(names)), 500):
+            try:
+                rowcount = session.query(models.DataIdentifier).\
+                    filter(models.DataIdentifier.scope == scope,
+                           models.DataIdentifier.name.in_(names_chunk)).\
+                    update({'is_new': new_flag}, synchronize_session=False)
+            except DatabaseError as error:
+                raise exception.DatabaseException('%s : Cannot update %s:%s' % (error.args[0], scope, names_chunk[0]))
+            if rowcount < len(names_chunk):
+                found = [row.name for row in session.query(models.DataIdentifier.name).
+                         filter(models.DataIdentifier.scope == scope, models.DataIdentifier.name.in_(names_chunk))]
+                missing = [name for name in names_chunk if name not in found]
+                # MySQL only counts the rows whose flag changed
+                if missing:
+                    raise exception.DataIdentifierNotFound("Data identifier '%s:%s' not found" % (scope, missing[0]))
     try:
         session.flush()
     except IntegrityError as error:
@@ -950,6 +978,84 @@ def list_all_parent_dids(scope, name, session=None):
             yield {'scope': pdid['scope'], 'name': pdid['name'], 'type': pdid['type']}
 
 
+@read_session
+def list_parent_dids_bulk(dids, session=None):
+    """
+    List the direct parent datasets and containers of many dids,
+    with one IN query per scope and chunk of names.
+
+    :param dids:      List of dictionaries with scope and name.
+    :param session:   The database session.
+    :returns:         Dictionary (scope, name) -> list of direct parent dids.
+    """
+    parents = {}
+    names_per_scope = {}
+    for did in dids:
+        parents[(did['scope'], did['name'])] = []
+        names_per_scope.setdefault(did['scope'], set()).add(did['name'])
+
+    for scope, names in iteritems(names_per_scope):
+        for names_chunk in chunks(list(names), 500):
+            query = session.query(models.DataIdentifierAssociation.child_scope,
+                                  models.DataIdentifierAssociation.child_name,
+                                  models.DataIdentifierAssociation.scope,
+                                  models.DataIdentifierAssociation.name,
+                                  models.DataIdentifierAssociation.did_type).\
+                with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_CHILD_SCOPE_NAME_IDX)", 'oracle').\
+                filter(models.DataIdentifierAssociation.child_scope == scope,
+                       models.DataIdentifierAssociation.child_name.in_(names_chunk))
+            for child_scope, child_name, parent_scope, parent_name, did_type in query:
+                parents[(child_scope, child_name)].append({'scope': parent_scope, 'name': parent_name, 'type': did_type})
+    return parents
+
+
+def __fetch_parent_dids(dids, parents, session):
+    """
+    Fetch the direct parents of a set of dids, and of their parents, level by level.
+    Every level is resolved with list_parent_dids_bulk.
+
+    :param dids:      Set of (scope, name) tuples.
+    :param parents:   Dictionary (scope, name) -> list of direct parents, extended in place.
+    :param session:   The database session.
+    """
+    pending = set(did for did in dids if did not in parents)
+    while pending:
+        level = list_parent_dids_bulk([{'scope': scope, 'name': name} for scope, name in pending], session=session)
+        parents.update(level)
+        pending = set((parent['scope'], parent['name']) for level_parents in level.values() for parent in level_parents
+                      if (parent['scope'], parent['name']) not in parents)
+
+
+@read_session
+def list_all_parent_dids_bulk(dids, cache=None, session=None):
+    """
+    List all parent datasets and containers of many dids, no matter on what level.
+    Same result per did as list_all_parent_dids, but the graph is walked for all dids
+    together with O(depth) queries, and shared parents are only resolved once.
+
+    :param dids:      List of dictionaries with scope and name.
+    :param cache:     Optional dictionary memoising the resolved parents, to be reused across calls.
+    :param session:   The database session.
+    :returns:         Dictionary (scope, name) -> list of parent dids.
+    """
+    cache = {} if cache is None else cache
+    parents = cache.setdefault('parents', {})
+    ancestors = cache.setdefault('ancestors', {})
+
+    __fetch_parent_dids(set((did['scope'], did['name']) for did in dids), parents, session)
+
+    def _ancestors(did):
+        if did not in ancestors:
+            result = []
+            for parent in parents[did]:
+                result.append(parent)
+                result.extend(_ancestors((parent['scope'], parent['name'])))
+            ancestors[did] = result
+        return ancestors[did]
+
+    return dict(((did['scope'], did['name']), _ancestors((did['scope'], did['name']))) for did in dids)
+
+
 @transactional_session
 def list_child_datasets(scope, name, session=None):
     """
@@ -1317,6 +1423,31 @@ def get_metadata(scope, name, session=None):
         raise exception.DataIdentifierNotFound("Data identifier '%(scope)s:%(name)s' not found" % locals())
 
 
+@stream_session
+def get_metadata_bulk(dids, session=None):
+    """
+    Get the metadata of a list of data identifiers, with one query per scope and chunk of names.
+
+    :param dids: A list of dictionaries {'scope', 'name'}.
+    :param session: The database session in use.
+    :returns: Generator of the metadata dictionaries, in no particular order. The unknown data identifiers are skipped.
+    """
+    names_per_scope = {}
+    for did in dids:
+        names_per_scope.setdefault(did['scope'], []).append(did['name'])
+    for scope, names in iteritems(names_per_scope):
+        for names_chunk in chunks(list(set(names)), 500):
+            query = session.query(models.DataIdentifier).\
+                with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
+                filter(models.DataIdentifier.scope == scope,
+                       models.DataIdentifier.name.in_(names_chunk))
+            for row in query.yield_per(500):
+                d = {}
+                for column in row.__table__.columns:
+                    d[column.name] = getattr(row, column.name)
+                yield d
+
+
 @read_session
 def get_did_meta(scope, name, session=None):
     """
@@ -1682,7 +1813,7 @@ def touch_dids(dids, session=None):
     """
     Update the accessed_at timestamp and the access_cnt of the given dids.
 
-    :param replicas: the list of dids.
+    :param dids: the list of dids.
     :param session: The database session in use.
 
     :returns: True, if successful, False otherwise.
@@ -1690,14 +1821,22 @@ def touch_dids(dids, session=None):
 
     now = datetime.utcnow()
     none_value = None
+    dids = list(dids)
+    if not dids:
+        return True
     try:
-        for did in dids:
-            session.query(models.DataIdentifier).\
-                filter_by(scope=did['scope'], name=did['name'], did_type=did['type']).\
-                update({'accessed_at': did.get('accessed_at') or now,
-                        'access_cnt': case([(models.DataIdentifier.access_cnt == none_value, 1)],
-                                           else_=(models.DataIdentifier.access_cnt + 1))},
-                       synchronize_session=False)
+        # One statement executed for all the dids
+        stmt = update(models.DataIdentifier).\
+            where(and_(models.DataIdentifier.scope == bindparam('b_scope'),
+                       models.DataIdentifier.name == bindparam('b_name'),
+                       models.DataIdentifier.did_type == bindparam('b_did_type'))).\
+            values(accessed_at=bindparam('b_accessed_at'),
+                   access_cnt=case([(models.DataIdentifier.access_cnt == none_value, 1)],
+                                   else_=(models.DataIdentifier.access_cnt + 1)))
+        session.execute(stmt, [{'b_scope': did['scope'],
+                                'b_name': did['name'],
+                                'b_did_type': did['type'],
+                                'b_accessed_at': did.get('accessed_at') or now} for did in dids])
     except DatabaseError:
         return False
 
@@ -15,16 +15,36 @@
 
 import datetime
 import hashlib
+import threading
+import time
 
-from sqlalchemy import func
-from sqlalchemy.sql import distinct
+from sqlalchemy import event, func
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.sql import and_, distinct, or_
 
 from rucio.db.sqla.models import Heartbeats
 from rucio.db.sqla.session import read_session, transactional_session
+from rucio.common.config import config_get
 from rucio.common.exception import DatabaseException
 from rucio.common.utils import pid_exists
 
 
+# Maximum number of seconds a thread assignment is reused without checking the membership
+ASSIGNMENT_LEASE = int(config_get('heartbeat', 'assignment_lease', False, 60))
+# Maximum number of seconds between two refreshes of the heartbeats of a process
+BEAT_INTERVAL = int(config_get('heartbeat', 'beat_interval', False, 30))
+
+# In-process state shared by the threads: the heartbeats registered by the process, refreshed
+# together with a single update, the thread assignments with their lease, and a generation per
+# executable, increased whenever the process adds or removes a heartbeat of the executable.
+# A heartbeat is only refreshed by the other threads while its own thread keeps calling live.
+# The state is only updated once the transaction writing the heartbeats is committed.
+__HEARTBEATS = {}
+__ASSIGNMENTS = {}
+__GENERATIONS = {}
+__LOCK = threading.Lock()
+
+
 @transactional_session
 def sanity_check(executable, hostname, hash_executable=None, pid=None, thread=None,
                  session=None):
@@ -65,10 +85,12 @@ def _sanity_check(executable, hostname, hash_executable=None, session=None):
         for pid, in session.query(distinct(Heartbeats.pid)).filter_by(executable=hash_executable, hostname=hostname):
             if not pid_exists(pid):
                 session.query(Heartbeats).filter_by(executable=hash_executable, hostname=hostname, pid=pid).delete()
+                __increase_generation(hash_executable)
     else:
         for pid, in session.query(distinct(Heartbeats.pid)).filter_by(hostname=hostname):
             if not pid_exists(pid):
                 session.query(Heartbeats).filter_by(hostname=hostname, pid=pid).delete()
+                __increase_generation()
 
 
 @transactional_session
@@ -94,26 +116,54 @@ def live(executable, hostname, pid, thread, older_than=600, hash_executable=None
     if not hash_executable:
         hash_executable = calc_hash(executable)
 
-    # upsert the heartbeat
-    rowcount = session.query(Heartbeats)\
-        .filter_by(executable=hash_executable,
-                   hostname=hostname,
-                   pid=pid,
-                   thread_id=thread.ident)\
-        .update({'updated_at': datetime.datetime.utcnow(), 'payload': payload})
-    if not rowcount:
-        Heartbeats(executable=hash_executable,
-                   readable=executable,
-                   hostname=hostname,
-                   pid=pid,
-                   thread_id=thread.ident,
-                   thread_name=thread.name,
-                   payload=payload).save(session=session)
+    key = (hash_executable, hostname, pid, thread.ident)
+    now = time.time()
+    with __LOCK:
+        heartbeat = __HEARTBEATS.get(key)
+        if heartbeat is not None:
+            heartbeat['lived_at'] = now
+            heartbeat['older_than'] = older_than
+
+    # the heartbeats of the process are refreshed together, at most every beat interval
+    if heartbeat is not None and heartbeat['payload'] == payload:
+        if now - heartbeat['updated_at'] >= min(BEAT_INTERVAL, older_than / 10.0) and not __beat(key, now, session=session):
+            heartbeat = None
+
+    if heartbeat is None or heartbeat['payload'] != payload:
+        # upsert the heartbeat
+        rowcount = session.query(Heartbeats)\
+            .filter_by(executable=hash_executable,
+                       hostname=hostname,
+                       pid=pid,
+                       thread_id=thread.ident)\
+            .update({'updated_at': datetime.datetime.utcnow(), 'payload': payload})
+        if not rowcount:
+            Heartbeats(executable=hash_executable,
+                       readable=executable,
+                       hostname=hostname,
+                       pid=pid,
+                       thread_id=thread.ident,
+                       thread_name=thread.name,
+                       payload=payload).save(session=session)
+            __increase_generation(hash_executable)
+        __set_heartbeat(key, {'thread': thread, 'payload': payload, 'updated_at': now, 'lived_at': now, 'older_than': older_than}, session=session)
+
+    # reuse the assignment while its lease is valid, or while the membership does not change
+    with __LOCK:
+        assignment = __ASSIGNMENTS.get(key + (older_than, ))
+        generation = __GENERATIONS.get(hash_executable, 0)
+    if assignment is not None and assignment['generation'] == generation:
+        if now - assignment['checked_at'] < min(ASSIGNMENT_LEASE, older_than):
+            return dict(assignment['heartbeats'])
+        if __get_membership(hash_executable, older_than, session=session) == assignment['membership']:
+            __on_commit(session, lambda: assignment.update(checked_at=now))
+            return dict(assignment['heartbeats'])
 
     # assign thread identifier
     query = session.query(Heartbeats.hostname,
                           Heartbeats.pid,
-                          Heartbeats.thread_id)\
+                          Heartbeats.thread_id,
+                          func.max(Heartbeats.created_at))\
                    .with_hint(Heartbeats, "index(HEARTBEATS HEARTBEATS_PK)", 'oracle')\
                    .filter(Heartbeats.executable == hash_executable)\
                    .filter(Heartbeats.updated_at >= datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than))\
@@ -133,8 +183,161 @@ def live(executable, hostname, pid, thread, older_than=600, hash_executable=None
             assign_thread = r
             break
 
-    return {'assign_thread': assign_thread,
-            'nr_threads': len(result)}
+    heartbeats = {'assign_thread': assign_thread,
+                  'nr_threads': len(result)}
+    assignment = {'heartbeats': heartbeats,
+                  'generation': generation,
+                  'membership': (len(result), max([r[3] for r in result]) if result else None),
+                  'checked_at': now}
+
+    def set_assignment():
+        with __LOCK:
+            __ASSIGNMENTS[key + (older_than, )] = assignment
+    __on_commit(session, set_assignment)
+    return dict(heartbeats)
+
+
+def __beat(key, now, session=None):
+    """
+    Refresh with a single update the heartbeats of all the live threads registered by the process
+    which called live themselves within their older_than. The other heartbeats are forgotten, so a
+    stuck thread is not kept alive by the other threads.
+
+    :param key: Key of the heartbeat of the calling thread, refreshed even if the thread is not alive anymore.
+    :param now: Current time in seconds since the epoch.
+    :param session: The database session in use.
+
+    :returns: False if some heartbeats were removed meanwhile, they are forgotten and have to be registered again.
+    """
+    with __LOCK:
+        for other_key, heartbeat in list(__HEARTBEATS.items()):
+            if other_key != key and (not heartbeat['thread'].is_alive() or now - heartbeat['lived_at'] >= heartbeat['older_than']):
+                del __HEARTBEATS[other_key]
+        keys = list(__HEARTBEATS)
+
+    rowcount = session.query(Heartbeats)\
+        .filter(or_(*[and_(Heartbeats.executable == hash_executable,
+                           Heartbeats.hostname == hostname,
+                           Heartbeats.pid == pid,
+                           Heartbeats.thread_id == thread_id) for hash_executable, hostname, pid, thread_id in keys]))\
+        .update({'updated_at': datetime.datetime.utcnow()}, synchronize_session=False)
+
+    if rowcount != len(keys):
+        with __LOCK:
+            for other_key in keys:
+                __HEARTBEATS.pop(other_key, None)
+        return False
+
+    def set_updated_at():
+        with __LOCK:
+            for other_key in keys:
+                if other_key in __HEARTBEATS:
+                    __HEARTBEATS[other_key]['updated_at'] = now
+    __on_commit(session, set_updated_at)
+    return True
+
+
+def __set_heartbeat(key, heartbeat, session=None):
+    """
+    Register a heartbeat of the process once the transaction is committed.
+
+    :param key: Key of the heartbeat.
+    :param heartbeat: Dictionary with the thread, payload, updated_at, lived_at and older_than of the heartbeat.
+    :param session: The database session in use.
+    """
+    def set_heartbeat():
+        with __LOCK:
+            __HEARTBEATS[key] = heartbeat
+    __on_commit(session, set_heartbeat)
+
+
+def __on_commit(session, callback):
+    """
+    Call a function once the transaction of a session is committed, never if it is rolled back.
+
+    :param session: The database session in use.
+    :param callback: Function without arguments.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    state = {'done': False}
+
+    def after_commit(session):
+        if not state['done']:
+            state['done'] = True
+            callback()
+
+    def after_rollback(session):
+        state['done'] = True
+
+    event.listen(session, 'after_commit', after_commit, once=True)
+    event.listen(session, 'after_rollback', after_rollback, once=True)
+
+
+def __get_membership(hash_executable, older_than, session=None):
+    """
+    Return a cheap summary of the live heartbeats of an executable, which changes when a thread joins or leaves.
+
+    :param hash_executable: Hash of the executable.
+    :param older_than: Ignore specified heartbeats older than specified nr of seconds.
+    :param session: The database session in use.
+
+    :returns: Tuple (number of heartbeats, creation date of the newest one)
+    """
+    count, newest = session.query(func.count(Heartbeats.thread_id),
+                                  func.max(Heartbeats.created_at))\
+                           .filter(Heartbeats.executable == hash_executable)\
+                           .filter(Heartbeats.updated_at >= datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than))\
+                           .one()
+    return (count, newest)
+
+
+def __increase_generation(hash_executable=None):
+    """
+    Increase the in-process generation of an executable, or forget all the assignments.
+
+    :param hash_executable: Hash of the executable, None for all of them.
+    """
+    with __LOCK:
+        if hash_executable is None:
+            __ASSIGNMENTS.clear()
+        else:
+            __GENERATIONS[hash_executable] = __GENERATIONS.get(hash_executable, 0) + 1
+
+
+@transactional_session
+def update_payload(executable, hostname, pid, thread, payload=None, hash_executable=None, session=None):
+    """
+    Refresh the heartbeat of a process/thread and set its payload with a single update.
+    Contrary to live, the thread assignment is not computed. If the heartbeat does not exist
+    anymore, it is registered again through live.
+
+    :param executable: Executable name as a string, e.g., conveyor-submitter.
+    :param hostname: Hostname as a string, e.g., rucio-daemon-prod-01.cern.ch.
+    :param pid: UNIX Process ID as a number, e.g., 1234.
+    :param thread: Python Thread Object.
+    :param payload: Payload identifier which can be further used to identify the work a certain thread is executing.
+    :param hash_executable: Hash of the executable.
+    :param session: The database session in use.
+    """
+    if not hash_executable:
+        hash_executable = calc_hash(executable)
+
+    rowcount = session.query(Heartbeats)\
+        .filter_by(executable=hash_executable,
+                   hostname=hostname,
+                   pid=pid,
+                   thread_id=thread.ident)\
+        .update({'updated_at': datetime.datetime.utcnow(), 'payload': payload})
+    if not rowcount:
+        live(executable=executable, hostname=hostname, pid=pid, thread=thread,
+             hash_executable=hash_executable, payload=payload, session=session)
+    else:
+        key = (hash_executable, hostname, pid, thread.ident)
+        now = time.time()
+        with __LOCK:
+            older_than = __HEARTBEATS[key]['older_than'] if key in __HEARTBEATS else 600
+        __set_heartbeat(key, {'thread': thread, 'payload': payload, 'updated_at': now, 'lived_at': now, 'older_than': older_than}, session=session)
 
 
 @transactional_session
@@ -163,7 +366,10 @@ def die(executable, hostname, pid, thread, older_than=None, hash_executable=None
     if older_than:
         query = query.filter(Heartbeats.updated_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than))
 
-    query.delete()
+    if query.delete():
+        with __LOCK:
+            __HEARTBEATS.pop((hash_executable, hostname, pid, thread.ident), None)
+        __increase_generation(hash_executable)
 
 
 @transactional_session
@@ -182,6 +388,10 @@ def cardiac_arrest(older_than=None, session=None):
 
     query.delete()
 
+    with __LOCK:
+        __HEARTBEATS.clear()
+    __increase_generation()
+
 
 @read_session
 def list_heartbeats(session=None):
@@ -19,8 +19,9 @@ import sys
 
 from datetime import datetime
 
+from sqlalchemy import update
 from sqlalchemy.exc import DatabaseError
-from sqlalchemy.sql.expression import and_, or_
+from sqlalchemy.sql.expression import and_, or_, bindparam
 
 import rucio.core.rule
 import rucio.core.did
@@ -409,27 +410,41 @@ def touch_dataset_locks(dataset_locks, session=None):
     """
     Update the accessed_at timestamp of the given dataset locks + eol_at.
 
-    :param replicas: the list of dataset locks.
+    :param dataset_locks: the list of dataset locks.
     :param session: The database session in use.
 
     :returns: True, if successful, False otherwise.
     """
 
     now = datetime.utcnow()
+    locks = []
     for dataset_lock in dataset_locks:
         try:
             if 'rse_id' not in dataset_lock:
                 dataset_lock['rse_id'] = get_rse_id(rse=dataset_lock['rse'], session=session)
         except RSENotFound:
             continue
-
-        eol_at = define_eol(dataset_lock['scope'], dataset_lock['name'], rses=[{'id': dataset_lock['rse_id']}], session=session)
-        try:
-            session.query(models.DatasetLock).filter_by(scope=dataset_lock['scope'], name=dataset_lock['name'], rse_id=dataset_lock['rse_id']).\
-                update({'accessed_at': dataset_lock.get('accessed_at') or now}, synchronize_session=False)
+        locks.append(dataset_lock)
+    if not locks:
+        return True
+
+    try:
+        # One statement executed for all the dataset locks
+        stmt = update(models.DatasetLock).\
+            where(and_(models.DatasetLock.scope == bindparam('b_scope'),
+                       models.DatasetLock.name == bindparam('b_name'),
+                       models.DatasetLock.rse_id == bindparam('b_rse_id'))).\
+            values(accessed_at=bindparam('b_accessed_at'))
+        session.execute(stmt, [{'b_scope': dataset_lock['scope'],
+                                'b_name': dataset_lock['name'],
+                                'b_rse_id': dataset_lock['rse_id'],
+                                'b_accessed_at': dataset_lock.get('accessed_at') or now} for dataset_lock in locks])
+
+        for dataset_lock in locks:
+            eol_at = define_eol(dataset_lock['scope'], dataset_lock['name'], rses=[{'id': dataset_lock['rse_id']}], session=session)
             for res in session.query(models.DatasetLock.rule_id).filter_by(scope=dataset_lock['scope'], name=dataset_lock['name'], rse_id=dataset_lock['rse_id']):
                 session.query(models.ReplicationRule).filter_by(id=res[0]).update({'eol_at': eol_at}, synchronize_session=False)
-        except DatabaseError:
-            return False
+    except DatabaseError:
+        return False
 
     return True
@@ -23,12 +23,12 @@
 
 import json
 
-from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql.expression import bindparam, text
 
 
 from rucio.common.exception import InvalidObject, RucioException
+from rucio.common.utils import chunks
 from rucio.db.sqla.models import Message, MessageHistory
 from rucio.db.sqla.session import transactional_session
 
@@ -113,20 +113,24 @@ def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=Non
 
         # Step 3:
         # Assemble message object
+        nolimit = {}
         for id, created_at, event_type, payload in query:
             message = {'id': id,
                        'created_at': created_at,
                        'event_type': event_type}
 
-            # Only switch SQL context when necessary
+            # Only switch SQL context when necessary, once for all the large payloads
             if payload == 'nolimit':
-                nolimit_query = session.query(Message.payload_nolimit).filter(Message.id == id).one()[0]
-                message['payload'] = json.loads(str(nolimit_query))
+                nolimit[id] = message
             else:
                 message['payload'] = json.loads(str(payload))
 
             messages.append(message)
 
+        for chunk in chunks(list(nolimit), 1000):
+            for id, payload_nolimit in session.query(Message.id, Message.payload_nolimit).filter(Message.id.in_(chunk)):
+                nolimit[id]['payload'] = json.loads(str(payload_nolimit))
+
         return messages
 
     except IntegrityError as e:
@@ -134,25 +138,41 @@ def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=Non
 
 
 @transactional_session
-def delete_messages(messages, session=None):
+def delete_messages(messages, archive=True, session=None):
     """
     Delete all messages with the given IDs, and archive them to the history.
 
     :param messages: The messages to delete as a list of dictionaries.
+    :param archive: If False, the messages are not archived, e.g. when the caller archives them asynchronously.
+    :param session: The database session to use.
     """
-    message_condition = []
-    for message in messages:
-        message_condition.append(Message.id == message['id'])
-        if len(message['payload']) > 4000:
-            message['payload_nolimit'] = message.pop('payload')
-
     try:
-        if message_condition:
+        for chunk in chunks([message['id'] for message in messages], 1000):
             session.query(Message).\
                 with_hint(Message, "index(messages MESSAGES_ID_PK)", 'oracle').\
-                filter(or_(*message_condition)).\
+                filter(Message.id.in_(chunk)).\
                 delete(synchronize_session=False)
+    except IntegrityError as e:
+        raise RucioException(e.args)
+
+    if archive:
+        archive_messages(messages, session=session)
+
 
+@transactional_session
+def archive_messages(messages, session=None):
+    """
+    Archive delivered messages to the history.
+
+    :param messages: The messages to archive as a list of dictionaries.
+    :param session: The database session to use.
+    """
+    for message in messages:
+        if len(message['payload']) > 4000:
+            message['payload_nolimit'] = message.pop('payload')
+
+    try:
+        if messages:
             session.bulk_insert_mappings(MessageHistory, messages)
     except IntegrityError as e:
         raise RucioException(e.args)
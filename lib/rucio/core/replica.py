@@ -754,6 +754,272 @@ def _list_replicas_for_files(file_clause, state_clause, files, rse_clause, sessi
             {'scope': scope, 'name': name} in files and files.remove({'scope': scope, 'name': name})
 
 
+def _iter_replica_batches(replicas, batch_size):
+    """
+    Group a stream of replica rows into lists of at most batch_size rows.
+
+    :param replicas: Iterable of replica rows.
+    :param batch_size: The maximum number of rows per batch.
+    """
+    batch = []
+    for replica in replicas:
+        batch.append(replica)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _get_rse_pfn_context(rse_id, schemes, domain, local_rses, client_location, sign_urls, session):
+    """
+    Resolve everything needed to build the PFNs of one RSE: protocols, priorities,
+    site attribute and URL signing service. Done once per RSE and list_replicas call.
+
+    :param rse_id: The RSE id.
+    :param schemes: A list of schemes to filter the protocols.
+    :param domain: The network domain selected by the user (None, 'wan', 'lan' or 'all').
+    :param local_rses: List of RSE ids local to the client.
+    :param client_location: Client location dictionary for PFN modification {'ip', 'fqdn', 'site'}
+    :param sign_urls: If set, the URL signing service of the RSE is resolved.
+    :param session: The database session in use.
+
+    :returns: Dictionary with the PFN context of the RSE.
+    """
+    rse_info = rsemgr.get_rse_info(rse=get_rse_name(rse_id=rse_id, session=session), session=session)
+
+    # assign scheme priorities, and don't forget to exclude disabled protocols
+    # 0 in RSE protocol definition = disabled, 1 = highest priority
+    rse_info['priority_wan'] = {p['scheme']: p['domains']['wan']['read'] for p in rse_info['protocols'] if p['domains']['wan']['read'] > 0}
+    rse_info['priority_lan'] = {p['scheme']: p['domains']['lan']['read'] for p in rse_info['protocols'] if p['domains']['lan']['read'] > 0}
+
+    # select the lan door in autoselect mode, otherwise use the wan door
+    if domain is None:
+        domain = 'wan'
+        if local_rses and rse_id in local_rses:
+            domain = 'lan'
+
+    rse_schemes = schemes or []
+    if not rse_schemes:
+        try:
+            if domain == 'all':
+                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info,
+                                                          operation='read',
+                                                          domain='wan')['scheme'])
+                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info,
+                                                          operation='read',
+                                                          domain='lan')['scheme'])
+            else:
+                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info,
+                                                          operation='read',
+                                                          domain=domain)['scheme'])
+        except exception.RSEProtocolNotSupported:
+            pass  # no need to be verbose
+        except Exception:
+            print(format_exc())
+
+    protocols = []
+    for s in rse_schemes:
+        try:
+            if domain == 'all':
+                protocols.append(('lan', rsemgr.create_protocol(rse_settings=rse_info,
+                                                                operation='read',
+                                                                scheme=s,
+                                                                domain='lan'),
+                                  rse_info['priority_lan'][s]))
+                protocols.append(('wan', rsemgr.create_protocol(rse_settings=rse_info,
+                                                                operation='read',
+                                                                scheme=s,
+                                                                domain='wan'),
+                                  rse_info['priority_wan'][s]))
+            else:
+                protocols.append((domain, rsemgr.create_protocol(rse_settings=rse_info,
+                                                                 operation='read',
+                                                                 scheme=s,
+                                                                 domain=domain),
+                                  rse_info['priority_%s' % domain][s]))
+        except exception.RSEProtocolNotSupported:
+            pass  # no need to be verbose
+        except Exception:
+            print(format_exc())
+
+    context = {'domain': domain, 'protocols': protocols, 'site': None, 'sign_service': None}
+
+    # the site attribute is only needed for the server side root proxy handling
+    schemes_in_use = [protocol.attributes['scheme'] for _, protocol, _ in protocols]
+    if domain == 'wan' and 'root' in schemes_in_use and client_location and client_location.get('site'):
+        rse_site_attr = get_rse_attribute('site', rse_id, session=session)
+        context['site'] = ['']
+        if isinstance(rse_site_attr, list) and rse_site_attr:
+            context['site'] = rse_site_attr[0]
+
+    if sign_urls and 'https' in schemes_in_use:
+        service = get_rse_attribute('sign_url', rse_id=rse_id, session=session)
+        if service and isinstance(service, list):
+            context['sign_service'] = service[0]
+
+    for _, protocol, _ in protocols:
+        if protocol.attributes['scheme'] == 'srm':
+            try:
+                context['space_token'] = protocol.attributes['extended_attributes']['space_token']
+            except KeyError:
+                context['space_token'] = None
+
+    return context
+
+
+def _lfns2pfns_batch(protocol, lfns):
+    """
+    Compute the PFNs of a list of LFNs with a single lfns2pfns call on the protocol.
+    Falls back to one call per LFN if the protocol does not return a PFN for every LFN.
+
+    :param protocol: The protocol object.
+    :param lfns: List of dictionaries with scope, name and path.
+
+    :returns: List of PFNs, in the same order as the LFNs.
+    """
+    pfns = protocol.lfns2pfns(lfns=lfns)
+    keys = ['%s:%s' % (lfn['scope'], lfn['name']) for lfn in lfns]
+    if isinstance(pfns, dict) and all(key in pfns for key in keys):
+        return [pfns[key] for key in keys]
+    return [list(protocol.lfns2pfns(lfns=lfn).values())[0] for lfn in lfns]
+
+
+def _resolve_pfns_for_batch(replicas, pfn_context, schemes, domain, local_rses, client_location,
+                            sign_urls, signature_lifetime, session):
+    """
+    Compute the PFNs for a batch of replica rows. Rows are grouped by RSE, the RSE
+    context is resolved once per RSE and call, and the PFNs are computed with one
+    lfns2pfns call per RSE and protocol.
+
+    :param replicas: List of replica rows as returned by _list_replicas_for_datasets/_list_replicas_for_files.
+    :param pfn_context: Per-call dictionary caching the RSE contexts, the deterministic paths and the root proxy.
+    :param schemes: A list of schemes to filter the replicas.
+    :param domain: The network domain selected by the user.
+    :param local_rses: List of RSE ids local to the client.
+    :param client_location: Client location dictionary for PFN modification {'ip', 'fqdn', 'site'}
+    :param sign_urls: If set, will sign the PFNs if necessary.
+    :param signature_lifetime: If supported, in seconds, restrict the lifetime of the signed PFN.
+    :param session: The database session in use.
+
+    :returns: List of (pfns, rse context) tuples aligned with the rows, pfns being ('pfn', 'domain', 'priority', 'client_extract') tuples.
+    """
+    results = [([], None)] * len(replicas)
+
+    rows_per_rse = defaultdict(list)
+    for index, replica in enumerate(replicas):
+        if replica[7]:
+            rows_per_rse[replica[7]].append(index)
+
+    for rse_id, indexes in rows_per_rse.items():
+        if rse_id not in pfn_context['rses']:
+            pfn_context['rses'][rse_id] = _get_rse_pfn_context(rse_id=rse_id, schemes=schemes, domain=domain,
+                                                               local_rses=local_rses, client_location=client_location,
+                                                               sign_urls=sign_urls, session=session)
+        context = pfn_context['rses'][rse_id]
+        rse_pfns = dict((index, []) for index in indexes)
+
+        for tmp_domain, protocol, priority in context['protocols']:
+            lfns = []
+            for index in indexes:
+                scope, name, path = replicas[index][0], replicas[index][1], replicas[index][5]
+                if 'determinism_type' in protocol.attributes:  # PFN is cachable
+                    path_key = '%s:%s:%s' % (protocol.attributes['determinism_type'], scope.internal, name)
+                    try:
+                        path = pfn_context['paths'][path_key]
+                    except KeyError:  # No cache entry scope:name found for this protocol
+                        path = protocol._get_path(scope, name)
+                        pfn_context['paths'][path_key] = path
+                lfns.append({'scope': scope, 'name': name, 'path': path})
+
+            try:
+                pfns = _lfns2pfns_batch(protocol, lfns)
+            except Exception:
+                # never end up here
+                print(format_exc())
+                continue
+
+            # server side root proxy handling if location is set.
+            # cannot be pushed into protocols because we need to lookup rse attributes.
+            # ultra-conservative implementation.
+            root_proxy_internal = None
+            if context['domain'] == 'wan' and protocol.attributes['scheme'] == 'root' and client_location:
+                # does the RSE site match with the client? if not, it's an outgoing connection
+                # therefore the internal proxy must be prepended
+                if 'site' in client_location and client_location['site'] and client_location['site'] != context['site']:
+                    if 'root_proxy_internal' not in pfn_context:
+                        pfn_context['root_proxy_internal'] = config_get('root-proxy-internal',    # section
+                                                                        client_location['site'],  # option
+                                                                        default='',               # empty string to circumvent exception
+                                                                        session=session)
+                    root_proxy_internal = pfn_context['root_proxy_internal']
+
+            # do we need to sign the URLs?
+            sign_service = None
+            if sign_urls and protocol.attributes['scheme'] == 'https':
+                sign_service = context['sign_service']
+
+            for index, pfn in zip(indexes, pfns):
+                try:
+                    if root_proxy_internal:
+                        pfn = 'root://' + root_proxy_internal + '//' + pfn
+                    if sign_service:
+                        pfn = get_signed_url(service=sign_service, operation='read', url=pfn, lifetime=signature_lifetime)
+                    # PFNs don't have concepts, therefore quickly encapsulate in a tuple
+                    # ('pfn', 'domain', 'priority', 'client_extract')
+                    rse_pfns[index].append((pfn, tmp_domain, priority, False))
+                except Exception:
+                    # never end up here
+                    print(format_exc())
+
+        for index in indexes:
+            results[index] = (rse_pfns[index], context)
+
+    return results
+
+
+def _resolve_parents(scope, name, parents_cache, session):
+    """
+    Return all the parent datasets and containers of a file, using the per-call parents cache.
+
+    :param scope: The scope of the file.
+    :param name: The name of the file.
+    :param parents_cache: Per-call dictionary memoising the resolved parents.
+    :param session: The database session in use.
+
+    :returns: List of 'scope:name' strings.
+    """
+    parents = rucio.core.did.list_all_parent_dids_bulk(dids=[{'scope': scope, 'name': name}], cache=parents_cache, session=session)
+    return ['%s:%s' % (parent['scope'].internal, parent['name']) for parent in parents[(scope, name)]]
+
+
+def _iter_replicas_with_pfns(replicas, show_pfns, pfn_context, schemes, domain, local_rses, client_location,
+                             sign_urls, signature_lifetime, session, parents_cache=None, batch_size=1000):
+    """
+    Stream replica rows extended with their PFNs and RSE context, resolving the PFNs batch by batch.
+
+    :param replicas: Iterable of replica rows.
+    :param show_pfns: If not set, no PFNs are resolved.
+    :param pfn_context: Per-call dictionary caching the RSE contexts, the deterministic paths and the root proxy.
+    :param parents_cache: If set, the parents of the files of every batch are resolved together into this dictionary.
+    :param batch_size: The number of rows resolved together.
+
+    :returns: Replica rows extended with the list of PFN tuples and the RSE context.
+    """
+    for batch in _iter_replica_batches(replicas, batch_size):
+        if parents_cache is not None:
+            rucio.core.did.list_all_parent_dids_bulk(dids=[{'scope': replica[0], 'name': replica[1]} for replica in batch],
+                                                     cache=parents_cache, session=session)
+        if show_pfns:
+            resolved = _resolve_pfns_for_batch(replicas=batch, pfn_context=pfn_context, schemes=schemes, domain=domain,
+                                               local_rses=local_rses, client_location=client_location, sign_urls=sign_urls,
+                                               signature_lifetime=signature_lifetime, session=session)
+        else:
+            resolved = [([], None)] * len(batch)
+        for replica, (rse_pfns, rse_context) in zip(batch, resolved):
+            yield tuple(replica) + (rse_pfns, rse_context)
+
+
 def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                    schemes, files, rse_clause, rse_expression, client_location, domain,
                    sign_urls, signature_lifetime, constituents, resolve_parents,
@@ -775,16 +1041,21 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
             except Exception:
                 pass  # do not hard fail if site cannot be resolved or is empty
 
-    file, tmp_protocols, rse_info, pfns_cache = {}, {}, {}, {}
+    file, pfn_context = {}, {'rses': {}, 'paths': {}}
+
+    # parents are resolved per batch of replicas and shared between the files of the call
+    parents_cache = {} if resolve_parents else None
 
     for replicas in filter(None, files):
-        for scope, name, bytes, md5, adler32, path, state, rse_id, rse, rse_type, volatile in replicas:
+        replicas = _iter_replicas_with_pfns(replicas=replicas, show_pfns=show_pfns, pfn_context=pfn_context,
+                                            schemes=schemes, domain=original_domain, local_rses=local_rses,
+                                            client_location=client_location, sign_urls=sign_urls,
+                                            signature_lifetime=signature_lifetime, session=session,
+                                            parents_cache=parents_cache)
+        for scope, name, bytes, md5, adler32, path, state, rse_id, rse, rse_type, volatile, rse_pfns, rse_context in replicas:
 
             pfns = []
 
-            # reset the domain selection to original user's choice (as this could get overwritten each iteration)
-            domain = deepcopy(original_domain)
-
             # if the file is a constituent, find the available archives and add them to the list of possible PFNs
             # taking into account the original rse_expression
             if '%s:%s' % (scope.internal, name) in constituents:
@@ -792,15 +1063,14 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                 # special protocol handling for constituents
                 # force the use of root if client didn't specify
                 if not schemes:
-                    schemes = ['root']
+                    archive_schemes = ['root']
                 else:
                     # always add root for archives
-                    schemes.append('root')
-                    schemes = list(set(schemes))
+                    archive_schemes = list(set(list(schemes) + ['root']))
 
                 archive_result = list_replicas(dids=constituents['%s:%s' % (scope.internal, name)],
-                                               schemes=schemes, client_location=client_location,
-                                               domain=domain, sign_urls=sign_urls,
+                                               schemes=archive_schemes, client_location=client_location,
+                                               domain=original_domain, sign_urls=sign_urls,
                                                rse_expression=rse_expression,
                                                signature_lifetime=signature_lifetime,
                                                session=session)
@@ -873,127 +1143,11 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                         pfns.append((pfn, 'zip', priority, client_extract, archive[archive_pfn]))
 
             if show_pfns and rse_id:
-                if rse_id not in rse_info:
-                    rse_info[rse_id] = rsemgr.get_rse_info(rse=get_rse_name(rse_id=rse_id, session=session), session=session)
-
-                # assign scheme priorities, and don't forget to exclude disabled protocols
-                # 0 in RSE protocol definition = disabled, 1 = highest priority
-                rse_info[rse_id]['priority_wan'] = {p['scheme']: p['domains']['wan']['read'] for p in rse_info[rse_id]['protocols'] if p['domains']['wan']['read'] > 0}
-                rse_info[rse_id]['priority_lan'] = {p['scheme']: p['domains']['lan']['read'] for p in rse_info[rse_id]['protocols'] if p['domains']['lan']['read'] > 0}
-
-                # select the lan door in autoselect mode, otherwise use the wan door
-                if domain is None:
-                    domain = 'wan'
-                    if local_rses and rse_id in local_rses:
-                        domain = 'lan'
-
-                if rse_id not in tmp_protocols:
-
-                    rse_schemes = schemes or []
-                    if not rse_schemes:
-                        try:
-                            if domain == 'all':
-                                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info[rse_id],
-                                                                          operation='read',
-                                                                          domain='wan')['scheme'])
-                                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info[rse_id],
-                                                                          operation='read',
-                                                                          domain='lan')['scheme'])
-                            else:
-                                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info[rse_id],
-                                                                          operation='read',
-                                                                          domain=domain)['scheme'])
-                        except exception.RSEProtocolNotSupported:
-                            pass  # no need to be verbose
-                        except Exception:
-                            print(format_exc())
-
-                    protocols = []
-                    for s in rse_schemes:
-                        try:
-                            if domain == 'all':
-                                protocols.append(('lan', rsemgr.create_protocol(rse_settings=rse_info[rse_id],
-                                                                                operation='read',
-                                                                                scheme=s,
-                                                                                domain='lan'),
-                                                  rse_info[rse_id]['priority_lan'][s]))
-                                protocols.append(('wan', rsemgr.create_protocol(rse_settings=rse_info[rse_id],
-                                                                                operation='read',
-                                                                                scheme=s,
-                                                                                domain='wan'),
-                                                  rse_info[rse_id]['priority_wan'][s]))
-                            else:
-                                protocols.append((domain, rsemgr.create_protocol(rse_settings=rse_info[rse_id],
-                                                                                 operation='read',
-                                                                                 scheme=s,
-                                                                                 domain=domain),
-                                                  rse_info[rse_id]['priority_%s' % domain][s]))
-                        except exception.RSEProtocolNotSupported:
-                            pass  # no need to be verbose
-                        except Exception:
-                            print(format_exc())
-
-                    tmp_protocols[rse_id] = protocols
-
-                # get pfns
-                for tmp_protocol in tmp_protocols[rse_id]:
-                    protocol = tmp_protocol[1]
-                    if 'determinism_type' in protocol.attributes:  # PFN is cachable
-                        try:
-                            path = pfns_cache['%s:%s:%s' % (protocol.attributes['determinism_type'], scope.internal, name)]
-                        except KeyError:  # No cache entry scope:name found for this protocol
-                            path = protocol._get_path(scope, name)
-                            pfns_cache['%s:%s:%s' % (protocol.attributes['determinism_type'], scope.internal, name)] = path
+                # the PFNs of the replica were computed for the whole batch
+                pfns.extend(rse_pfns)
 
-                    try:
-                        pfn = protocol.lfns2pfns(lfns={'scope': scope,
-                                                       'name': name,
-                                                       'path': path}).\
-                            values()[0]
-
-                        # server side root proxy handling if location is set.
-                        # cannot be pushed into protocols because we need to lookup rse attributes.
-                        # ultra-conservative implementation.
-                        if domain == 'wan' and protocol.attributes['scheme'] == 'root' and client_location:
-
-                            if 'site' in client_location and client_location['site']:
-
-                                # is the RSE site-configured?
-                                rse_site_attr = get_rse_attribute('site', rse_id, session=session)
-                                replica_site = ['']
-                                if isinstance(rse_site_attr, list) and rse_site_attr:
-                                    replica_site = rse_site_attr[0]
-
-                                # does it match with the client? if not, it's an outgoing connection
-                                # therefore the internal proxy must be prepended
-                                if client_location['site'] != replica_site:
-                                    root_proxy_internal = config_get('root-proxy-internal',    # section
-                                                                     client_location['site'],  # option
-                                                                     default='',               # empty string to circumvent exception
-                                                                     session=session)
-                                    if root_proxy_internal:
-                                        pfn = 'root://' + root_proxy_internal + '//' + pfn
-
-                        # do we need to sign the URLs?
-                        if sign_urls and protocol.attributes['scheme'] == 'https':
-                            service = get_rse_attribute('sign_url',
-                                                        rse_id=rse_id,
-                                                        session=session)
-                            if service and isinstance(service, list):
-                                pfn = get_signed_url(service=service[0], operation='read', url=pfn, lifetime=signature_lifetime)
-
-                        # PFNs don't have concepts, therefore quickly encapsulate in a tuple
-                        # ('pfn', 'domain', 'priority', 'client_extract')
-                        pfns.append((pfn, tmp_protocol[0], tmp_protocol[2], False))
-                    except Exception:
-                        # never end up here
-                        print(format_exc())
-
-                    if protocol.attributes['scheme'] == 'srm':
-                        try:
-                            file['space_token'] = protocol.attributes['extended_attributes']['space_token']
-                        except KeyError:
-                            file['space_token'] = None
+                if rse_context and 'space_token' in rse_context:
+                    file['space_token'] = rse_context['space_token']
 
             if 'scope' in file and 'name' in file:
                 if file['scope'] == scope and file['name'] == name:
@@ -1002,8 +1156,7 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                     file['states'][rse_id] = str(state)
 
                     if resolve_parents:
-                        file['parents'] = ['%s:%s' % (parent['scope'].internal, parent['name'])
-                                           for parent in rucio.core.did.list_all_parent_dids(scope, name, session=session)]
+                        file['parents'] = _resolve_parents(scope, name, parents_cache=parents_cache, session=session)
 
                     for tmp_pfn in pfns:
                         file['pfns'][tmp_pfn[0]] = {'rse_id': tmp_pfn[4]['rse_id'] if tmp_pfn[1] == 'zip' else rse_id,
@@ -1015,8 +1168,7 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                                                     'client_extract': tmp_pfn[3]}
                 else:
                     if resolve_parents:
-                        file['parents'] = ['%s:%s' % (parent['scope'].internal, parent['name'])
-                                           for parent in rucio.core.did.list_all_parent_dids(file['scope'], file['name'], session=session)]
+                        file['parents'] = _resolve_parents(file['scope'], file['name'], parents_cache=parents_cache, session=session)
 
                     # quick exit, but don't forget to set the total order for the priority
                     # --> exploit that L(AN) comes before W(AN) before Z(IP) alphabetically
@@ -1048,8 +1200,7 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                 file['states'] = {rse_id: str(state)}
 
                 if resolve_parents:
-                    file['parents'] = ['%s:%s' % (parent['scope'].internal, parent['name'])
-                                       for parent in rucio.core.did.list_all_parent_dids(scope, name, session=session)]
+                    file['parents'] = _resolve_parents(scope, name, parents_cache=parents_cache, session=session)
 
                 if rse_id:
                     # extract properly the pfn from the tuple
@@ -1086,8 +1237,7 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
 
         # don't forget to resolve parents for the last replica
         if resolve_parents:
-            file['parents'] = ['%s:%s' % (parent['scope'].internal, parent['name'])
-                               for parent in rucio.core.did.list_all_parent_dids(file['scope'], file['name'], session=session)]
+            file['parents'] = _resolve_parents(file['scope'], file['name'], parents_cache=parents_cache, session=session)
 
         # also sort the pfns inside the rse structure
         rse_pfns = []
@@ -1846,6 +1996,76 @@ def touch_replica(replica, session=None):
     return True
 
 
+@transactional_session
+def touch_replicas(replicas, session=None):
+    """
+    Update the accessed_at timestamp of many file replicas and of their dids in bulk, but don't wait if a row is locked.
+    All the rows are row-locked with NOWAIT first, then updated with one statement per table executed for all the replicas.
+
+    :param replicas: list of dictionaries with scope, name, rse_id and accessed_at, at most one per replica.
+    :param session: The database session in use.
+
+    :returns: True, if successful, False otherwise.
+    """
+    if not replicas:
+        return True
+
+    now, none_value = datetime.utcnow(), None
+    replica_clauses, did_clauses, dids = [], [], {}
+    for replica in replicas:
+        accessed_at = replica.get('accessed_at') or now
+        replica_clauses.append(and_(models.RSEFileAssociation.scope == replica['scope'],
+                                    models.RSEFileAssociation.name == replica['name'],
+                                    models.RSEFileAssociation.rse_id == replica['rse_id']))
+        did = (replica['scope'], replica['name'])
+        if did not in dids:
+            did_clauses.append(and_(models.DataIdentifier.scope == replica['scope'],
+                                    models.DataIdentifier.name == replica['name']))
+            dids[did] = accessed_at
+        else:
+            dids[did] = max(dids[did], accessed_at)
+
+    try:
+        session.query(models.RSEFileAssociation.scope).\
+            with_hint(models.RSEFileAssociation, "index(REPLICAS REPLICAS_PK)", 'oracle').\
+            filter(or_(*replica_clauses)).\
+            with_for_update(nowait=True).all()
+
+        session.query(models.DataIdentifier.scope).\
+            with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
+            filter(or_(*did_clauses)).\
+            filter(models.DataIdentifier.did_type == DIDType.FILE).\
+            with_for_update(nowait=True).all()
+
+        stmt = update(models.RSEFileAssociation).\
+            where(and_(models.RSEFileAssociation.scope == bindparam('b_scope'),
+                       models.RSEFileAssociation.name == bindparam('b_name'),
+                       models.RSEFileAssociation.rse_id == bindparam('b_rse_id'))).\
+            values(accessed_at=bindparam('b_accessed_at'),
+                   tombstone=case([(and_(models.RSEFileAssociation.tombstone != none_value,
+                                         models.RSEFileAssociation.tombstone != OBSOLETE),
+                                    bindparam('b_accessed_at'))],
+                                  else_=models.RSEFileAssociation.tombstone))
+        session.execute(stmt, [{'b_scope': replica['scope'],
+                                'b_name': replica['name'],
+                                'b_rse_id': replica['rse_id'],
+                                'b_accessed_at': replica.get('accessed_at') or now} for replica in replicas])
+
+        stmt = update(models.DataIdentifier).\
+            where(and_(models.DataIdentifier.scope == bindparam('b_scope'),
+                       models.DataIdentifier.name == bindparam('b_name'),
+                       models.DataIdentifier.did_type == DIDType.FILE)).\
+            values(accessed_at=bindparam('b_accessed_at'))
+        session.execute(stmt, [{'b_scope': scope,
+                                'b_name': name,
+                                'b_accessed_at': accessed_at} for (scope, name), accessed_at in dids.items()])
+
+    except DatabaseError:
+        return False
+
+    return True
+
+
 @transactional_session
 def update_replica_state(rse_id, scope, name, state, session=None):
     """
@@ -2173,12 +2393,22 @@ def touch_collection_replicas(collection_replicas, session=None):
     """
 
     now = datetime.utcnow()
-    for collection_replica in collection_replicas:
-        try:
-            session.query(models.CollectionReplica).filter_by(scope=collection_replica['scope'], name=collection_replica['name'], rse_id=collection_replica['rse_id']).\
-                update({'accessed_at': collection_replica.get('accessed_at') or now}, synchronize_session=False)
-        except DatabaseError:
-            return False
+    collection_replicas = list(collection_replicas)
+    if not collection_replicas:
+        return True
+    try:
+        # One statement executed for all the collection replicas
+        stmt = update(models.CollectionReplica).\
+            where(and_(models.CollectionReplica.scope == bindparam('b_scope'),
+                       models.CollectionReplica.name == bindparam('b_name'),
+                       models.CollectionReplica.rse_id == bindparam('b_rse_id'))).\
+            values(accessed_at=bindparam('b_accessed_at'))
+        session.execute(stmt, [{'b_scope': collection_replica['scope'],
+                                'b_name': collection_replica['name'],
+                                'b_rse_id': collection_replica['rse_id'],
+                                'b_accessed_at': collection_replica.get('accessed_at') or now} for collection_replica in collection_replicas])
+    except DatabaseError:
+        return False
 
     return True
 
@@ -72,20 +72,52 @@ def should_retry_request(req, retry_protocol_mismatches):
 def requeue_and_archive(request, retry_protocol_mismatches=False, session=None):
     """
     Requeue and archive a failed request.
-    TODO: Multiple requeue.
 
     :param request:     Original request.
     :param session:     Database session to use.
     """
 
-    record_counter('core.request.requeue_request')
-    # Probably not needed anymore
-    request_id = request['request_id']
-    new_req = get_request(request_id, session=session)
+    new_reqs = requeue_and_archive_bulk([request], retry_protocol_mismatches=retry_protocol_mismatches, session=session)
+    if request['request_id'] not in new_reqs:
+        raise RequestNotFound
+    return new_reqs[request['request_id']]
 
-    if new_req:
-        new_req['sources'] = get_sources(request_id, session=session)
-        archive_request(request_id, session=session)
+
+@transactional_session
+def requeue_and_archive_bulk(requests, retry_protocol_mismatches=False, session=None):
+    """
+    Requeue and archive failed requests, with one query per 500 requests to read
+    and delete them and their sources, and multi-row inserts into the history and requests tables.
+
+    :param requests:                     List of original requests.
+    :param retry_protocol_mismatches:    Boolean to retry the transfer in case of protocol mismatch.
+    :param session:                      Database session to use.
+    :returns:                            Dictionary with the new request of every requeued request id, or None if it is not retried anymore.
+                                         The requests which cannot be found are missing.
+    """
+
+    record_counter('core.request.requeue_request', len(requests))
+    reqs, sources = {}, {}
+    for request_ids in chunks([request['request_id'] for request in requests], 500):
+        for req in session.query(models.Request).filter(models.Request.id.in_(request_ids)):
+            req = dict(req)
+            req.pop('_sa_instance_state')
+            reqs[req['id']] = req
+        for source in session.query(models.Source).filter(models.Source.request_id.in_(request_ids)):
+            source = dict(source)
+            source.pop('_sa_instance_state')
+            sources.setdefault(source['request_id'], []).append(source)
+
+    __archive_requests(list(reqs.values()), session=session)
+
+    new_reqs, requeued = {}, []
+    for request in requests:
+        request_id = request['request_id']
+        if request_id not in reqs:
+            continue
+        new_req = reqs[request_id]
+        new_req['sources'] = sources.get(request_id)
+        new_reqs[request_id] = None
 
         if should_retry_request(new_req, retry_protocol_mismatches):
             new_req['request_id'] = generate_uuid()
@@ -103,11 +135,12 @@ def requeue_and_archive(request, retry_protocol_mismatches=False, session=None):
                         else:
                             new_req['sources'][i]['ranking'] -= 1
                         new_req['sources'][i]['is_using'] = False
-            queue_requests([new_req], session=session)
-            return new_req
-    else:
-        raise RequestNotFound
-    return None
+            new_reqs[request_id] = new_req
+            requeued.append(new_req)
+
+    if requeued:
+        queue_requests(requeued, session=session)
+    return new_reqs
 
 
 @transactional_session
@@ -617,34 +650,7 @@ def archive_request(request_id, session=None):
     req = get_request(request_id=request_id, session=session)
 
     if req:
-        hist_request = models.Request.__history_mapper__.class_(id=req['id'],
-                                                                created_at=req['created_at'],
-                                                                request_type=req['request_type'],
-                                                                scope=req['scope'],
-                                                                name=req['name'],
-                                                                dest_rse_id=req['dest_rse_id'],
-                                                                source_rse_id=req['source_rse_id'],
-                                                                attributes=req['attributes'],
-                                                                state=req['state'],
-                                                                account=req['account'],
-                                                                external_id=req['external_id'],
-                                                                retry_count=req['retry_count'],
-                                                                err_msg=req['err_msg'],
-                                                                previous_attempt_id=req['previous_attempt_id'],
-                                                                external_host=req['external_host'],
-                                                                rule_id=req['rule_id'],
-                                                                activity=req['activity'],
-                                                                bytes=req['bytes'],
-                                                                md5=req['md5'],
-                                                                adler32=req['adler32'],
-                                                                dest_url=req['dest_url'],
-                                                                requested_at=req['requested_at'],
-                                                                submitted_at=req['submitted_at'],
-                                                                started_at=req['started_at'],
-                                                                estimated_started_at=req['estimated_started_at'],
-                                                                estimated_at=req['estimated_at'],
-                                                                transferred_at=req['transferred_at'],
-                                                                estimated_transferred_at=req['estimated_transferred_at'])
+        hist_request = models.Request.__history_mapper__.class_(**__get_history_request(req))
         hist_request.save(session=session)
         try:
             time_diff = req['updated_at'] - req['created_at']
@@ -1402,3 +1408,67 @@ def __get_source_rse(request_id, src_url, session=None):
     except Exception:
         logging.error('Cannot get correct RSE for source url: %s(%s)' % (src_url, traceback.format_exc()))
         return None, None
+
+
+def __get_history_request(req):
+    """
+    Map a request to the columns of its history entry.
+
+    :param req:  Request as a dictionary.
+    :returns:    Dictionary of the history columns.
+    """
+
+    return {'id': req['id'],
+            'created_at': req['created_at'],
+            'request_type': req['request_type'],
+            'scope': req['scope'],
+            'name': req['name'],
+            'dest_rse_id': req['dest_rse_id'],
+            'source_rse_id': req['source_rse_id'],
+            'attributes': req['attributes'],
+            'state': req['state'],
+            'account': req['account'],
+            'external_id': req['external_id'],
+            'retry_count': req['retry_count'],
+            'err_msg': req['err_msg'],
+            'previous_attempt_id': req['previous_attempt_id'],
+            'external_host': req['external_host'],
+            'rule_id': req['rule_id'],
+            'activity': req['activity'],
+            'bytes': req['bytes'],
+            'md5': req['md5'],
+            'adler32': req['adler32'],
+            'dest_url': req['dest_url'],
+            'requested_at': req['requested_at'],
+            'submitted_at': req['submitted_at'],
+            'started_at': req['started_at'],
+            'estimated_started_at': req['estimated_started_at'],
+            'estimated_at': req['estimated_at'],
+            'transferred_at': req['transferred_at'],
+            'estimated_transferred_at': req['estimated_transferred_at']}
+
+
+@transactional_session
+def __archive_requests(reqs, session=None):
+    """
+    Move requests to the history table, with multi-row inserts and one deletion per 500 requests.
+
+    :param reqs:     List of requests as dictionaries.
+    :param session:  Database session to use.
+    """
+
+    record_counter('core.request.archive', len(reqs))
+    for reqs_chunk in chunks(reqs, 1000):
+        session.bulk_insert_mappings(models.Request.__history_mapper__.class_, [__get_history_request(req) for req in reqs_chunk])
+
+    for req in reqs:
+        time_diff = req['updated_at'] - req['created_at']
+        time_diff_s = time_diff.seconds + time_diff.days * 24 * 3600
+        record_timer('core.request.archive_request.%s' % req['activity'].replace(' ', '_'), time_diff_s)
+
+    try:
+        for request_ids in chunks([req['id'] for req in reqs], 500):
+            session.query(models.Source).filter(models.Source.request_id.in_(request_ids)).delete(synchronize_session=False)
+            session.query(models.Request).filter(models.Request.id.in_(request_ids)).delete(synchronize_session=False)
+    except IntegrityError as error:
+        raise RucioException(error.args)
@@ -65,6 +65,26 @@ REGION = make_region().configure('dogpile.cache.memcached',
                                  arguments={'url': "127.0.0.1:11211",
                                             'distributed_lock': True})
 
+# Generation of the RSE definitions in this process, increased whenever an RSE or one
+# of its attributes or protocols is changed. Used to invalidate in-process caches of RSE definitions.
+__RSE_GENERATION = [0]
+
+
+def get_rse_generation():
+    """
+    Return the in-process generation of the RSE definitions.
+
+    :returns: Integer increased whenever an RSE, an RSE attribute or an RSE protocol is changed by this process.
+    """
+    return __RSE_GENERATION[0]
+
+
+def _increase_rse_generation():
+    """
+    Increase the in-process generation of the RSE definitions.
+    """
+    __RSE_GENERATION[0] += 1
+
 
 @transactional_session
 def add_rse(rse, deterministic=True, volatile=False, city=None, region_code=None, country_name=None, continent=None, time_zone=None,
@@ -176,6 +196,7 @@ def del_rse(rse_id, session=None):
         raise exception.RSENotFound('RSE with id \'%s\' cannot be found' % rse_id)
     rse = old_rse.rse
     old_rse.delete(session=session)
+    _increase_rse_generation()
     try:
         del_rse_attribute(rse_id=rse_id, key=rse, session=session)
     except exception.RSEAttributeNotFound:
@@ -374,6 +395,7 @@ def add_rse_attribute(rse_id, key, value, session=None):
     except IntegrityError:
         rse = get_rse_name(rse_id=rse_id, session=session)
         raise exception.Duplicate("RSE attribute '%(key)s-%(value)s\' for RSE '%(rse)s' already exists!" % locals())
+    _increase_rse_generation()
     return True
 
 
@@ -395,6 +417,7 @@ def del_rse_attribute(rse_id, key, session=None):
     except sqlalchemy.orm.exc.NoResultFound:
         raise exception.RSEAttributeNotFound('RSE attribute \'%s\' cannot be found' % key)
     rse_attr.delete(session=session)
+    _increase_rse_generation()
     return True
 
 
@@ -416,6 +439,33 @@ def list_rse_attributes(rse_id, session=None):
     return rse_attrs
 
 
+@read_session
+def list_all_rse_attributes(rse_ids=None, session=None):
+    """
+    List the attributes of all active RSEs, or of a list of RSEs.
+
+    :param rse_ids: Optional list of RSE ids to restrict the listing to.
+    :param session: The database session in use.
+
+    :returns: A dictionary rse_id -> dictionary with the RSE attributes.
+    """
+    rse_attrs = {}
+
+    query = session.query(models.RSEAttrAssociation.rse_id,
+                          models.RSEAttrAssociation.key,
+                          models.RSEAttrAssociation.value).\
+        join(models.RSE, models.RSE.id == models.RSEAttrAssociation.rse_id).\
+        filter(models.RSE.deleted == false())
+    if rse_ids is None:
+        for rse_id, key, value in query:
+            rse_attrs.setdefault(rse_id, {})[key] = value
+    else:
+        for rse_ids_chunk in utils.chunks(list(rse_ids), 1000):
+            for rse_id, key, value in query.filter(models.RSEAttrAssociation.rse_id.in_(rse_ids_chunk)):
+                rse_attrs.setdefault(rse_id, {})[key] = value
+    return rse_attrs
+
+
 @read_session
 def has_rse_attribute(rse_id, key, session=None):
     """
@@ -639,6 +689,26 @@ def get_rse_limits(rse_id, name=None, session=None):
     return limits
 
 
+@read_session
+def list_rse_limits(rse_ids, name=None, session=None):
+    """
+    Get the limits of a list of RSEs.
+
+    :param rse_ids: List of RSE ids.
+    :param name: A Limit name.
+
+    :returns: A dictionary rse_id -> dictionary with the limits {'limit.name': limit.value}.
+    """
+    limits = {}
+    for rse_ids_chunk in utils.chunks(list(rse_ids), 1000):
+        query = session.query(models.RSELimit).filter(models.RSELimit.rse_id.in_(rse_ids_chunk))
+        if name:
+            query = query.filter_by(name=name)
+        for limit in query:
+            limits.setdefault(limit.rse_id, {})[limit.name] = limit.value
+    return limits
+
+
 @transactional_session
 def delete_rse_limit(rse_id, name=None, session=None):
     """
@@ -822,6 +892,7 @@ def add_protocol(rse_id, parameter, session=None):
              or match('.*OperationalError.*cannot be null.*', error.args[0]):
             raise exception.InvalidObject('Missing values!')
         raise error
+    _increase_rse_generation()
     return new_protocol
 
 
@@ -1034,6 +1105,7 @@ def update_protocols(rse_id, scheme, data, hostname, port, session=None):
                         val += 1
 
         up.update(data, flush=True, session=session)
+        _increase_rse_generation()
     except (IntegrityError, OperationalError) as error:
         if 'UNIQUE'.lower() in error.args[0].lower() or 'Duplicate' in error.args[0]:  # Covers SQLite, Oracle and MySQL error
             raise exception.Duplicate('Protocol \'%s\' on port %s already registered for  \'%s\' with hostname \'%s\'.' % (scheme, port, rse, hostname))
@@ -1095,6 +1167,7 @@ def del_protocols(rse_id, scheme, hostname=None, port=None, session=None):
                 for p in prots:
                     p.update({op_name: i})
                     i += 1
+    _increase_rse_generation()
 
 
 @transactional_session
@@ -1131,6 +1204,7 @@ def update_rse(rse_id, parameters, session=None):
             param[key] = parameters[key]
     param['availability'] = availability
     query.update(param)
+    _increase_rse_generation()
     if 'name' in parameters:
         add_rse_attribute(rse_id=rse_id, key=parameters['name'], value=1, session=session)
         query = session.query(models.RSEAttrAssociation).filter_by(rse_id=rse_id).filter(models.RSEAttrAssociation.key == rse)
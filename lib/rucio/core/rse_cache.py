@@ -0,0 +1,119 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+In-process cache of the RSE names, settings, attributes and protocols used by the conveyor daemons
+"""
+
+import threading
+import time
+
+from rucio.common.config import config_get
+from rucio.core.rse import get_rse_name, get_rse_generation, get_rse_protocols, list_rse_attributes
+from rucio.rse import rsemanager as rsemgr
+
+
+class RSEMetadataCache(object):
+    """
+    Process-wide cache of the RSE metadata, shared by the threads of the submitter, stager and finisher.
+
+    The entries expire after a time-to-live. All the entries are dropped as soon as an RSE, an RSE
+    attribute or an RSE protocol is changed by this process, or explicitly with invalidate.
+    """
+
+    def __init__(self, ttl=300):
+        """
+        Create an empty cache.
+
+        :param ttl:           Lifetime of the entries in seconds.
+        """
+        self.ttl = ttl
+        self.entries = {}
+        self.generation = get_rse_generation()
+        self.lock = threading.Lock()
+
+    def __get(self, key, loader):
+        """
+        Return a cached entry, loading it if it is missing, expired or outdated.
+
+        :param key:           Key of the entry, the RSE id is its second element.
+        :param loader:        Function returning the value of the entry.
+        :returns:             The value.
+        """
+        now = time.time()
+        with self.lock:
+            if self.generation != get_rse_generation():
+                self.entries, self.generation = {}, get_rse_generation()
+            entry = self.entries.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        value = loader()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, rse_id=None):
+        """
+        Drop the entries of an RSE, or all the entries.
+
+        :param rse_id:        The RSE id, None to drop all the entries.
+        """
+        with self.lock:
+            if rse_id is None:
+                self.entries = {}
+            else:
+                self.entries = dict((key, entry) for key, entry in self.entries.items() if key[1] != rse_id)
+
+    def get_rse_name(self, rse_id, session=None):
+        """
+        Return the name of an RSE.
+
+        :param rse_id:        The RSE id.
+        :param session:       The database session in use.
+        :returns:             The RSE name.
+        """
+        return self.__get(('name', rse_id), lambda: get_rse_name(rse_id=rse_id, session=session))
+
+    def get_rse_info(self, rse_id, session=None):
+        """
+        Return the protocol related settings of an RSE, as returned by rsemanager.get_rse_info.
+
+        :param rse_id:        The RSE id.
+        :param session:       The database session in use.
+        :returns:             Dictionary of the RSE settings.
+        """
+        return self.__get(('info', rse_id), lambda: get_rse_protocols(rse_id=rse_id, session=session))
+
+    def get_rse_attributes(self, rse_id, session=None):
+        """
+        Return the attributes of an RSE.
+
+        :param rse_id:        The RSE id.
+        :param session:       The database session in use.
+        :returns:             Dictionary of the RSE attributes.
+        """
+        return self.__get(('attributes', rse_id), lambda: list_rse_attributes(rse_id=rse_id, session=session))
+
+    def get_protocol(self, rse_id, operation, scheme=None, domain='wan', session=None):
+        """
+        Return a protocol instance of an RSE, shared by all the users of the cache.
+
+        :param rse_id:        The RSE id.
+        :param operation:     Intended operation for this protocol.
+        :param scheme:        Optional scheme or list of schemes.
+        :param domain:        Optional specification of the domain.
+        :param session:       The database session in use.
+        :returns:             An instance of the requested protocol.
+        :raises RSEProtocolNotSupported: If no protocol matches, the failure is not cached.
+        """
+        key = ('protocol', rse_id, operation, ','.join(scheme) if isinstance(scheme, list) else scheme, domain)
+        return self.__get(key, lambda: rsemgr.create_protocol(self.get_rse_info(rse_id, session=session), operation, scheme, domain=domain))
+
+
+RSE_CACHE = RSEMetadataCache(ttl=int(config_get('conveyor', 'rse_cache_ttl', False, 300)))
@@ -11,10 +11,14 @@
 # - Martin Barisits, <martin.barisits@cern.ch>, 2014
 # - Hannes Hansen, <hannes.jakob.hansen@cern.ch>, 2018-2019
 
+from datetime import datetime
+
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.sql.expression import bindparam, text
+from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import bindparam, case, text
 
-from rucio.common.exception import CounterNotFound
+from rucio.common.exception import CounterNotFound, DatabaseException
+from rucio.common.utils import chunks
 from rucio.db.sqla import models
 from rucio.db.sqla.session import read_session, transactional_session
 
@@ -94,18 +98,35 @@ def get_counter(rse_id, session=None):
 
 
 @read_session
-def get_updated_rse_counters(total_workers, worker_number, session=None):
+def get_counters(rse_ids, session=None):
     """
-    Get updated rse_counters.
+    Returns current values of the counters of a list of RSEs.
+
+    :param rse_ids:          List of RSE ids.
+    :param session:          The database session in use.
+    :returns:                A dictionary rse_id -> dictionary with bytes, files and updated_at. RSEs without counter are omitted.
+    """
+    counters = {}
+    for rse_ids_chunk in chunks(list(rse_ids), 1000):
+        query = session.query(models.RSEUsage).filter(models.RSEUsage.rse_id.in_(rse_ids_chunk),
+                                                      models.RSEUsage.source == 'rucio')
+        for counter in query:
+            counters[counter.rse_id] = {'bytes': counter.used,
+                                        'files': counter.files,
+                                        'updated_at': counter.updated_at}
+    return counters
+
+
+def __filter_worker(query, total_workers, worker_number, session):
+    """
+    Restrict a query on the updated_rse_counters to the RSEs of a worker.
 
+    :param query:              The query.
     :param total_workers:      Number of total workers.
     :param worker_number:      id of the executing worker.
     :param session:            Database session in use.
-    :returns:                  List of rse_ids whose rse_counters need to be updated.
+    :returns:                  The filtered query.
     """
-    query = session.query(models.UpdatedRSECounter.rse_id).\
-        distinct(models.UpdatedRSECounter.rse_id)
-
     if total_workers > 0:
         if session.bind.dialect.name == 'oracle':
             bindparams = [bindparam('worker_number', worker_number),
@@ -115,11 +136,81 @@ def get_updated_rse_counters(total_workers, worker_number, session=None):
             query = query.filter(text('mod(md5(rse_id), %s) = %s' % (total_workers + 1, worker_number)))
         elif session.bind.dialect.name == 'postgresql':
             query = query.filter(text('mod(abs((\'x\'||md5(rse_id::text))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number)))
+    return query
+
+
+@read_session
+def get_updated_rse_counters(total_workers, worker_number, session=None):
+    """
+    Get updated rse_counters.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param session:            Database session in use.
+    :returns:                  List of rse_ids whose rse_counters need to be updated.
+    """
+    query = session.query(models.UpdatedRSECounter.rse_id).\
+        distinct(models.UpdatedRSECounter.rse_id)
+    query = __filter_worker(query, total_workers, worker_number, session)
 
     results = query.all()
     return [result.rse_id for result in results]
 
 
+@transactional_session
+def fold_updated_rse_counters(total_workers, worker_number, session=None):
+    """
+    Fold the updated_rse_counters of all the RSEs of a worker into the rse_counters, with one aggregate
+    query, one deletion of the folded rows and one update per 100 RSEs.
+
+    :param total_workers:      Number of total workers.
+    :param worker_number:      id of the executing worker.
+    :param session:            Database session in use.
+    :returns:                  Dictionary with the number of folded rses and rows, and the creation date of the oldest folded row.
+    :raises DatabaseException: If the folded rows changed meanwhile. Nothing is folded then.
+    """
+    # The rows are folded by creation date, as their ids are not ordered
+    folded_until = datetime.utcnow()
+    query = session.query(models.UpdatedRSECounter.rse_id,
+                          func.sum(models.UpdatedRSECounter.files),
+                          func.sum(models.UpdatedRSECounter.bytes),
+                          func.count(models.UpdatedRSECounter.id),
+                          func.min(models.UpdatedRSECounter.created_at)).\
+        filter(models.UpdatedRSECounter.created_at <= folded_until).\
+        group_by(models.UpdatedRSECounter.rse_id)
+    query = __filter_worker(query, total_workers, worker_number, session)
+
+    deltas, nb_rows, oldest = {}, 0, None
+    for rse_id, files, bytes, count, created_at in query:
+        deltas[rse_id] = {'files': int(files or 0), 'bytes': int(bytes or 0)}
+        nb_rows += count
+        oldest = created_at if oldest is None else min(oldest, created_at)
+    if not deltas:
+        return {'rses': 0, 'rows': 0, 'oldest': None}
+
+    # A row committed after the aggregation, or deleted by another worker, would make the counters wrong
+    query = session.query(models.UpdatedRSECounter).filter(models.UpdatedRSECounter.created_at <= folded_until)
+    rowcount = __filter_worker(query, total_workers, worker_number, session).delete(synchronize_session=False)
+    if rowcount != nb_rows:
+        raise DatabaseException('%s updated rse counters were aggregated but %s were deleted' % (nb_rows, rowcount))
+
+    for rse_ids in chunks(list(deltas), 100):
+        query = session.query(models.RSEUsage.rse_id).filter(models.RSEUsage.rse_id.in_(rse_ids), models.RSEUsage.source == 'rucio')
+        existing_rse_ids = [rse_id for rse_id, in query]
+        if existing_rse_ids:
+            session.query(models.RSEUsage).\
+                filter(models.RSEUsage.rse_id.in_(existing_rse_ids), models.RSEUsage.source == 'rucio').\
+                update({'used': models.RSEUsage.used + case([(models.RSEUsage.rse_id == rse_id, deltas[rse_id]['bytes']) for rse_id in existing_rse_ids]),
+                        'files': models.RSEUsage.files + case([(models.RSEUsage.rse_id == rse_id, deltas[rse_id]['files']) for rse_id in existing_rse_ids])},
+                       synchronize_session=False)
+        for rse_id in set(rse_ids) - set(existing_rse_ids):
+            models.RSEUsage(rse_id=rse_id,
+                            used=deltas[rse_id]['bytes'],
+                            files=deltas[rse_id]['files'],
+                            source='rucio').save(session=session, flush=False)
+    return {'rses': len(deltas), 'rows': nb_rows, 'oldest': oldest}
+
+
 @transactional_session
 def update_rse_counter(rse_id, session=None):
     """
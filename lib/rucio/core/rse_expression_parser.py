@@ -17,15 +17,21 @@
 
 import abc
 import re
+import threading
+import time
 
 from dogpile.cache import make_region
 from dogpile.cache.api import NoValue
 from hashlib import sha256
-from six import add_metaclass
+from six import add_metaclass, string_types
 
 from rucio.common import schema
+from rucio.common.config import config_get, config_get_bool
 from rucio.common.exception import InvalidRSEExpression, RSEBlacklisted
-from rucio.core.rse import list_rses, get_rses_with_attribute, get_rse_attribute
+from rucio.core.rse import (list_rses, get_rses_with_attribute, get_rse_attribute, list_all_rse_attributes,
+                            get_rse_generation)
+from rucio.db.sqla import models
+from rucio.db.sqla.enum import EnumSymbol
 from rucio.db.sqla.session import transactional_session
 
 
@@ -44,6 +50,13 @@ REGION = make_region().configure('dogpile.cache.memcached',
                                  arguments={'url': "127.0.0.1:11211", 'distributed_lock': True})
 
 
+# Compiled expressions and attribute index of the in-process evaluation
+__COMPILED_EXPRESSIONS = {}
+__MAX_COMPILED_EXPRESSIONS = 10000
+__INDEX = [None]
+__INDEX_LOCK = threading.Lock()
+
+
 @transactional_session
 def parse_expression(expression, filter=None, session=None):
     """
@@ -55,29 +68,13 @@ def parse_expression(expression, filter=None, session=None):
     :returns:             A list of rse dictionaries.
     :raises:              InvalidRSEExpression, RSENotFound, RSEBlacklisted
     """
-    result = REGION.get(sha256(expression).hexdigest())
+    if config_get_bool('rse_expression', 'use_index', raise_exception=False, default=False):
+        index = get_rse_expression_index(session=session)
+        result = index.rses_from_bitset(compile_expression(expression).evaluate(index))
+    else:
+        result = REGION.get(sha256(expression).hexdigest())
     if type(result) is NoValue:
-        # Evaluate the correctness of the parentheses
-        parantheses_open_count = 0
-        parantheses_close_count = 0
-        for char in expression:
-            if (char == '('):
-                parantheses_open_count += 1
-            elif (char == ')'):
-                parantheses_close_count += 1
-            if (parantheses_close_count > parantheses_open_count):
-                raise InvalidRSEExpression('Problem with parantheses.')
-        if (parantheses_open_count != parantheses_close_count):
-            raise InvalidRSEExpression('Problem with parantheses.')
-
-        # Check the expression pattern
-        match = re.match(PATTERN, expression)
-        if match is None:
-            raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
-        else:
-            if match.group() != expression:
-                raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
-        result_tuple = __resolve_term_expression(expression)[0].resolve_elements(session=session)
+        result_tuple = compile_expression(expression).resolve_elements(session=session)
         # result_tuple = ([rse_ids], {rse_id: {rse_info}})
         result = []
         for rse in list(result_tuple[0]):
@@ -103,6 +100,199 @@ def parse_expression(expression, filter=None, session=None):
     return final_result
 
 
+def compile_expression(expression):
+    """
+    Validate a RSE expression and compile it into a tree of BaseExpressionElement.
+    Compiled expressions are cached in-process.
+
+    :param expression:    RSE expression, e.g: 'CERN|BNL'.
+    :returns:             The root BaseExpressionElement of the expression.
+    :raises:              InvalidRSEExpression
+    """
+    compiled = __COMPILED_EXPRESSIONS.get(expression)
+    if compiled is not None:
+        return compiled
+
+    # Evaluate the correctness of the parentheses
+    parantheses_open_count = 0
+    parantheses_close_count = 0
+    for char in expression:
+        if (char == '('):
+            parantheses_open_count += 1
+        elif (char == ')'):
+            parantheses_close_count += 1
+        if (parantheses_close_count > parantheses_open_count):
+            raise InvalidRSEExpression('Problem with parantheses.')
+    if (parantheses_open_count != parantheses_close_count):
+        raise InvalidRSEExpression('Problem with parantheses.')
+
+    # Check the expression pattern
+    match = re.match(PATTERN, expression)
+    if match is None:
+        raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
+    else:
+        if match.group() != expression:
+            raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
+
+    compiled = __resolve_term_expression(expression)[0]
+    if len(__COMPILED_EXPRESSIONS) >= __MAX_COMPILED_EXPRESSIONS:
+        __COMPILED_EXPRESSIONS.clear()
+    __COMPILED_EXPRESSIONS[expression] = compiled
+    return compiled
+
+
+def get_rse_expression_index(session=None):
+    """
+    Return the in-process RSE attribute index, (re)loading it if it is missing, expired,
+    or if RSEs or RSE attributes were changed by this process since it was loaded.
+    The lifetime is configured with the index_ttl option of the rse_expression section.
+
+    :param session:       Database session in use.
+    :returns:             The RSEAttributeIndex.
+    """
+    index = __INDEX[0]
+    if index is None or not index.is_valid():
+        with __INDEX_LOCK:
+            index = __INDEX[0]
+            if index is None or not index.is_valid():
+                ttl = int(config_get('rse_expression', 'index_ttl', raise_exception=False, default=300))
+                index = RSEAttributeIndex(ttl=ttl)
+                index.load(session=session)
+                __INDEX[0] = index
+    return index
+
+
+def invalidate_rse_expression_index():
+    """
+    Drop the in-process RSE attribute index, forcing a reload at the next evaluation.
+    """
+    __INDEX[0] = None
+
+
+def _normalize_attribute_value(value):
+    """
+    Normalize an attribute value the same way as it is stored in the database.
+
+    :param value:         The attribute value.
+    :returns:             The string representation of the value.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, EnumSymbol):
+        return value.description.upper()
+    if isinstance(value, string_types) and value.lower() in ('true', 'false'):
+        return value.lower()
+    return str(value)
+
+
+class RSEAttributeIndex(object):
+    """
+    In-process inverted index of the RSEs: attribute -> value -> bitset of RSEs.
+    The bit position of an RSE is its position in the name-ordered list of active RSEs.
+    """
+
+    # Availability keys evaluated on the availability bitmask, as in list_rses
+    AVAILABILITY_MAPPING = {'availability_read': 4, 'availability_write': 2, 'availability_delete': 1}
+
+    def __init__(self, ttl=300):
+        """
+        Create an empty index.
+
+        :param ttl:           Lifetime of the index in seconds.
+        """
+        self.ttl = ttl
+        self.rses = []
+        self.everything = 0
+        self.attributes = {}
+        self.columns = {}
+        self.loaded_at = None
+        self.generation = None
+
+    def load(self, session=None):
+        """
+        Load all active RSEs and their attributes with two queries.
+
+        :param session:       Database session in use.
+        """
+        self.generation = get_rse_generation()
+        self.rses = list_rses(session=session)
+        rse_attributes = list_all_rse_attributes(session=session)
+        column_names = [column.name for column in models.RSE.__table__.columns]
+        self.everything = (1 << len(self.rses)) - 1
+        self.attributes, self.columns = {}, {}
+        for position, rse in enumerate(self.rses):
+            bit = 1 << position
+            for key, value in rse_attributes.get(rse['id'], {}).items():
+                values = self.attributes.setdefault(key, {})
+                value = _normalize_attribute_value(value)
+                values[value] = values.get(value, 0) | bit
+            for key in column_names:
+                values = self.columns.setdefault(key, {})
+                value = _normalize_attribute_value(rse[key])
+                values[value] = values.get(value, 0) | bit
+            for key, mask in self.AVAILABILITY_MAPPING.items():
+                if rse['availability'] & mask:
+                    self.columns.setdefault(key, {True: 0})[True] |= bit
+        self.loaded_at = time.time()
+
+    def is_valid(self):
+        """
+        Check that the index is neither expired nor outdated by a change in this process.
+
+        :returns:             True if the index can be used.
+        """
+        return self.generation == get_rse_generation() and time.time() - self.loaded_at < self.ttl
+
+    def equal(self, key, value):
+        """
+        Return the bitset of RSEs for which the key equals the value.
+
+        :param key:           Attribute or RSE column name.
+        :param value:         The value.
+        :returns:             Bitset of RSEs.
+        """
+        if key in self.AVAILABILITY_MAPPING:
+            return self.columns.get(key, {}).get(True, 0)
+        if key in self.columns:
+            if key == 'rse_type':
+                return self.columns[key].get(str(value).upper(), 0)
+            return self.columns[key].get(_normalize_attribute_value(value), 0)
+        return self.attributes.get(key, {}).get(_normalize_attribute_value(value), 0)
+
+    def compare(self, key, value, smaller):
+        """
+        Return the bitset of RSEs for which the numeric attribute value is smaller or larger than the value.
+
+        :param key:           Attribute name.
+        :param value:         The value to compare with.
+        :param smaller:       True for a smaller check, False for a larger check.
+        :returns:             Bitset of RSEs.
+        """
+        bitset = 0
+        for attribute_value, rses in self.attributes.get(key, {}).items():
+            try:
+                attribute_value = {'true': 1.0, 'false': 0.0}.get(attribute_value, attribute_value)
+                if (float(attribute_value) < float(value)) if smaller else (float(attribute_value) > float(value)):
+                    bitset |= rses
+            except ValueError:
+                continue
+        return bitset
+
+    def rses_from_bitset(self, bitset):
+        """
+        Return the RSE dictionaries of a bitset.
+
+        :param bitset:        Bitset of RSEs.
+        :returns:             List of RSE dictionaries.
+        """
+        result = []
+        while bitset:
+            lowest = bitset & -bitset
+            result.append(self.rses[lowest.bit_length() - 1])
+            bitset ^= lowest
+        return result
+
+
 def __resolve_term_expression(expression):
     """
     Resolves a Term Expression and returns an object of type BaseExpressionElement
@@ -214,6 +404,17 @@ class BaseExpressionElement:
         """
         pass
 
+    @abc.abstractmethod
+    def evaluate(self, index):
+        """
+        Evaluate the ExpressionElement on the in-process RSE attribute index, without database access
+
+        :param index:    RSEAttributeIndex
+        :returns:        Bitset of RSEs
+        :rtype:          Integer
+        """
+        pass
+
 
 class RSEAll(BaseExpressionElement):
     """
@@ -232,6 +433,12 @@ class RSEAll(BaseExpressionElement):
             rse_dict[rse['id']] = rse
         return (set([rse['id'] for rse in output]), rse_dict)
 
+    def evaluate(self, index):
+        """
+        Inherited from :py:func:`BaseExpressionElement.evaluate`
+        """
+        return index.everything
+
 
 class RSEAttributeEqualCheck(BaseExpressionElement):
     """
@@ -260,6 +467,12 @@ class RSEAttributeEqualCheck(BaseExpressionElement):
             rse_dict[rse['id']] = rse
         return (set([rse['id'] for rse in output]), rse_dict)
 
+    def evaluate(self, index):
+        """
+        Inherited from :py:func:`BaseExpressionElement.evaluate`
+        """
+        return index.equal(self.key, self.value)
+
 
 class RSEAttributeSmallerCheck(BaseExpressionElement):
     """
@@ -295,6 +508,12 @@ class RSEAttributeSmallerCheck(BaseExpressionElement):
                 continue
         return (set(output), rse_dict)
 
+    def evaluate(self, index):
+        """
+        Inherited from :py:func:`BaseExpressionElement.evaluate`
+        """
+        return index.compare(self.key, self.value, smaller=True)
+
 
 class RSEAttributeLargerCheck(BaseExpressionElement):
     """
@@ -330,6 +549,12 @@ class RSEAttributeLargerCheck(BaseExpressionElement):
                 continue
         return (set(output), rse_dict)
 
+    def evaluate(self, index):
+        """
+        Inherited from :py:func:`BaseExpressionElement.evaluate`
+        """
+        return index.compare(self.key, self.value, smaller=False)
+
 
 @add_metaclass(abc.ABCMeta)
 class BaseRSEOperator(BaseExpressionElement):
@@ -385,6 +610,12 @@ class ComplementOperator(BaseRSEOperator):
         right_term_tuple = self.right_term.resolve_elements(session=session)
         return (left_term_tuple[0] - right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
 
+    def evaluate(self, index):
+        """
+        Inherited from :py:func:`BaseExpressionElement.evaluate`
+        """
+        return self.left_term.evaluate(index) & ~self.right_term.evaluate(index)
+
 
 class UnionOperator(BaseRSEOperator):
     """
@@ -419,6 +650,12 @@ class UnionOperator(BaseRSEOperator):
         right_term_tuple = self.right_term.resolve_elements(session=session)
         return (left_term_tuple[0] | right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
 
+    def evaluate(self, index):
+        """
+        Inherited from :py:func:`BaseExpressionElement.evaluate`
+        """
+        return self.left_term.evaluate(index) | self.right_term.evaluate(index)
+
 
 class IntersectOperator(BaseRSEOperator):
     """
@@ -452,3 +689,9 @@ class IntersectOperator(BaseRSEOperator):
         left_term_tuple = self.left_term.resolve_elements(session=session)
         right_term_tuple = self.right_term.resolve_elements(session=session)
         return (left_term_tuple[0] & right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
+
+    def evaluate(self, index):
+        """
+        Inherited from :py:func:`BaseExpressionElement.evaluate`
+        """
+        return self.left_term.evaluate(index) & self.right_term.evaluate(index)
@@ -15,21 +15,91 @@
 
 from random import uniform, shuffle
 
-from rucio.common.exception import InsufficientAccountLimit, InsufficientTargetRSEs, InvalidRuleWeight, RSEOverQuota
-from rucio.core.account import has_account_attribute, get_usage
-from rucio.core.account_limit import get_account_limit
-from rucio.core.rse import list_rse_attributes, has_rse_attribute, get_rse_limits
-from rucio.core.rse_counter import get_counter as get_rse_counter
+from rucio.common.exception import InsufficientAccountLimit, InsufficientTargetRSEs, InvalidRuleWeight, RSEOverQuota, CounterNotFound
+from rucio.core.account import has_account_attribute, get_usages
+from rucio.core.account_limit import get_account_limits
+from rucio.core.rse import list_all_rse_attributes, list_rse_limits
+from rucio.core.rse_counter import get_counters as get_rse_counters
 from rucio.db.sqla.session import read_session
 
 
+class RSESelectorCache():
+    """
+    Bulk loaded RSE attributes, limits, counters and account quotas and usage used by the RSE selector.
+    One cache can be shared by the RSE selectors of all rules created together.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty cache.
+        """
+        self.attributes = {}      # {rse_id: {key: value}}
+        self.space_limits = {}    # {rse_id: MaxSpaceAvailable or None}
+        self.counters = {}        # {rse_id: bytes or None}
+        self.account_limits = {}  # {account: {rse_id: bytes}}
+        self.usages = {}          # {account: {rse_id: bytes}}
+        self.admins = {}          # {account: boolean}
+
+    def load_rses(self, rse_ids, session=None):
+        """
+        Load the attributes of the RSEs not yet in the cache.
+
+        :param rse_ids:  List of RSE ids.
+        :param session:  DB Session in use.
+        """
+        rse_ids = [rse_id for rse_id in set(rse_ids) if rse_id not in self.attributes]
+        if rse_ids:
+            attributes = list_all_rse_attributes(rse_ids=rse_ids, session=session)
+            for rse_id in rse_ids:
+                self.attributes[rse_id] = attributes.get(rse_id, {})
+
+    def load_quotas(self, account, rse_ids, session=None):
+        """
+        Load the space limits and counters of the RSEs, and the quotas and usage of the account, not yet in the cache.
+
+        :param account:  The account.
+        :param rse_ids:  List of RSE ids.
+        :param session:  DB Session in use.
+        """
+        rse_ids = set(rse_ids)
+        missing_rse_ids = [rse_id for rse_id in rse_ids if rse_id not in self.space_limits]
+        if missing_rse_ids:
+            limits = list_rse_limits(rse_ids=missing_rse_ids, name='MaxSpaceAvailable', session=session)
+            counters = get_rse_counters(rse_ids=missing_rse_ids, session=session)
+            for rse_id in missing_rse_ids:
+                self.space_limits[rse_id] = limits.get(rse_id, {}).get('MaxSpaceAvailable')
+                self.counters[rse_id] = counters[rse_id]['bytes'] if rse_id in counters else None
+
+        account_limits = self.account_limits.setdefault(account, {})
+        usages = self.usages.setdefault(account, {})
+        missing_rse_ids = [rse_id for rse_id in rse_ids if rse_id not in usages]
+        if missing_rse_ids:
+            limits = get_account_limits(account=account, rse_ids=missing_rse_ids, session=session)
+            account_usages = get_usages(account=account, rse_ids=missing_rse_ids, session=session)
+            for rse_id in missing_rse_ids:
+                account_limits[rse_id] = limits.get(rse_id)
+                usages[rse_id] = account_usages[rse_id]['bytes']
+
+    def is_admin(self, account, session=None):
+        """
+        Check if the account has the admin attribute.
+
+        :param account:  The account.
+        :param session:  DB Session in use.
+        :returns:        True if the account is an admin.
+        """
+        if account not in self.admins:
+            self.admins[account] = has_account_attribute(account=account, key='admin', session=session)
+        return self.admins[account]
+
+
 class RSESelector():
     """
     Representation of the RSE selector
     """
 
     @read_session
-    def __init__(self, account, rses, weight, copies, ignore_account_limit=False, session=None):
+    def __init__(self, account, rses, weight, copies, ignore_account_limit=False, cache=None, session=None):
         """
         Initialize the RSE Selector.
 
@@ -38,15 +108,19 @@ class RSESelector():
         :param weight:                Weighting to use.
         :param copies:                Number of copies to create.
         :param ignore_account_limit:  Flag if the quota should be ignored.
+        :param cache:                 RSESelectorCache to share between selectors, a new one is used if not given.
         :param session:               DB Session in use.
         :raises:                      InvalidRuleWeight, InsufficientAccountLimit, InsufficientTargetRSEs
         """
         self.account = account
         self.rses = []  # [{'rse_id':, 'weight':, 'staging_area'}]
         self.copies = copies
+        if cache is None:
+            cache = RSESelectorCache()
+        cache.load_rses(rse_ids=[rse['id'] for rse in rses], session=session)
         if weight is not None:
             for rse in rses:
-                attributes = list_rse_attributes(rse_id=rse['id'], session=session)
+                attributes = cache.attributes[rse['id']]
                 availability_write = True if rse.get('availability', 7) & 2 else False
                 if weight not in attributes:
                     continue  # The RSE does not have the required weight set, therefore it is ignored
@@ -60,7 +134,7 @@ class RSESelector():
                     raise InvalidRuleWeight('The RSE \'%s\' has a non-number specified for the weight \'%s\'' % (rse['rse'], weight))
         else:
             for rse in rses:
-                mock_rse = has_rse_attribute(rse['id'], 'mock', session=session)
+                mock_rse = 'mock' in cache.attributes[rse['id']]
                 availability_write = True if rse.get('availability', 7) & 2 else False
                 self.rses.append({'rse_id': rse['id'],
                                   'weight': 1,
@@ -71,27 +145,30 @@ class RSESelector():
         if len(self.rses) < self.copies:
             raise InsufficientTargetRSEs('Target RSE set not sufficient for number of copies. (%s copies requested, RSE set size %s)' % (self.copies, len(self.rses)))
 
-        if has_account_attribute(account=account, key='admin', session=session) or ignore_account_limit:
+        if ignore_account_limit or cache.is_admin(account=account, session=session):
             for rse in self.rses:
                 rse['quota_left'] = float('inf')
                 rse['space_left'] = float('inf')
         else:
+            cache.load_quotas(account=account, rse_ids=[rse['rse_id'] for rse in self.rses if not rse['mock_rse']], session=session)
             for rse in self.rses:
                 if rse['mock_rse']:
                     rse['quota_left'] = float('inf')
                     rse['space_left'] = float('inf')
                 else:
-                    quota_limit = get_account_limit(account=account, rse_id=rse['rse_id'], session=session)
+                    quota_limit = cache.account_limits[account][rse['rse_id']]
                     if quota_limit is None:
                         rse['quota_left'] = 0
                     else:
-                        rse['quota_left'] = quota_limit - get_usage(rse_id=rse['rse_id'], account=account, session=session)['bytes']
+                        rse['quota_left'] = quota_limit - cache.usages[account][rse['rse_id']]
 
-                    space_limit = get_rse_limits(name='MaxSpaceAvailable', rse_id=rse['rse_id'], session=session).get('MaxSpaceAvailable')
+                    space_limit = cache.space_limits[rse['rse_id']]
                     if space_limit is None or space_limit < 0:
                         rse['space_left'] = float('inf')
                     else:
-                        rse['space_left'] = space_limit - get_rse_counter(rse_id=rse['rse_id'], session=session)['bytes']
+                        if cache.counters[rse['rse_id']] is None:
+                            raise CounterNotFound()
+                        rse['space_left'] = space_limit - cache.counters[rse['rse_id']]
 
         self.rses = [rse for rse in self.rses if rse['quota_left'] > 0]
 
@@ -63,7 +63,7 @@ from rucio.common.exception import (InvalidRSEExpression, InvalidReplicationRule
                                     ManualRuleApprovalBlocked, UnsupportedOperation, UndefinedPolicy)
 from rucio.common.schema import validate_schema
 from rucio.common.types import InternalScope
-from rucio.common.utils import str_to_date, sizefmt
+from rucio.common.utils import str_to_date, sizefmt, chunks
 from rucio.core import account_counter, rse_counter, request as request_core
 from rucio.core.account import get_account
 from rucio.core.lifetime_exception import define_eol
@@ -71,7 +71,7 @@ from rucio.core.message import add_message
 from rucio.core.monitor import record_timer_block
 from rucio.core.rse import get_rse_name, list_rse_attributes, get_rse, get_rse_usage
 from rucio.core.rse_expression_parser import parse_expression
-from rucio.core.rse_selector import RSESelector
+from rucio.core.rse_selector import RSESelector, RSESelectorCache
 from rucio.core.rule_grouping import apply_rule_grouping, repair_stuck_locks_and_apply_rule_grouping, create_transfer_dict
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import (LockState, ReplicaState, RuleState, RuleGrouping,
@@ -383,6 +383,9 @@ def add_rules(dids, rules, session=None):
                     all_source_rses.extend(parse_expression(rule.get('source_replica_expression'), session=session))
             all_source_rses = list(set([rse['id'] for rse in all_source_rses]))
 
+        # RSE attributes, limits, counters and quotas are loaded in bulk and shared by the RSE selectors of all rules
+        rse_selector_cache = RSESelectorCache()
+
         for elem in dids:
             # 2. Get the did
             with record_timer_block('rule.add_rules.get_did'):
@@ -473,7 +476,8 @@ def add_rules(dids, rules, session=None):
 
                     # 5. Create the RSE selector
                     with record_timer_block('rule.add_rules.create_rse_selector'):
-                        rseselector = RSESelector(account=rule['account'], rses=rses, weight=rule.get('weight'), copies=rule['copies'], ignore_account_limit=rule.get('ask_approval', False), session=session)
+                        rseselector = RSESelector(account=rule['account'], rses=rses, weight=rule.get('weight'), copies=rule['copies'], ignore_account_limit=rule.get('ask_approval', False),
+                                                  cache=rse_selector_cache, session=session)
 
                     # 4. Create the replication rule
                     with record_timer_block('rule.add_rules.create_rule'):
@@ -1446,13 +1450,14 @@ def move_rule(rule_id, rse_expression, session=None):
 
 
 @transactional_session
-def re_evaluate_did(scope, name, rule_evaluation_action, session=None):
+def re_evaluate_did(scope, name, rule_evaluation_action, detached_since=None, session=None):
     """
     Re-Evaluates a did.
 
     :param scope:                   The scope of the did to be re-evaluated.
     :param name:                    The name of the did to be re-evaluated.
     :param rule_evaluation_action:  The Rule evaluation action.
+    :param detached_since:          For a DETACH, only evaluate the children detached since this date instead of all the locks of the rules.
     :param session:                 The database session in use.
     :raises:                        DataIdentifierNotFound
     """
@@ -1466,7 +1471,7 @@ def re_evaluate_did(scope, name, rule_evaluation_action, session=None):
     if rule_evaluation_action == DIDReEvaluation.ATTACH:
         __evaluate_did_attach(did, session=session)
     else:
-        __evaluate_did_detach(did, session=session)
+        __evaluate_did_detach(did, detached_since=detached_since, session=session)
 
     # Update size and length of did
     if session.bind.dialect.name == 'oracle':
@@ -1501,7 +1506,8 @@ def get_updated_dids(total_workers, worker_number, limit=100, blacklisted_dids=[
     query = session.query(models.UpdatedDID.id,
                           models.UpdatedDID.scope,
                           models.UpdatedDID.name,
-                          models.UpdatedDID.rule_evaluation_action)
+                          models.UpdatedDID.rule_evaluation_action,
+                          models.UpdatedDID.created_at)
 
     if total_workers > 0:
         if session.bind.dialect.name == 'oracle':
@@ -1716,6 +1722,18 @@ def delete_updated_did(id, session=None):
     session.query(models.UpdatedDID).filter(models.UpdatedDID.id == id).delete()
 
 
+@transactional_session
+def delete_updated_dids(ids, session=None):
+    """
+    Delete updated_dids by id.
+
+    :param ids:                     List of ids of the rows to delete.
+    :param session:                 The database session in use.
+    """
+    for chunk in chunks(ids, 100):
+        session.query(models.UpdatedDID).filter(models.UpdatedDID.id.in_(chunk)).delete(synchronize_session=False)
+
+
 @transactional_session
 def update_rules_for_lost_replica(scope, name, rse_id, nowait=False, session=None):
     """
@@ -2360,17 +2378,95 @@ def __find_stuck_locks_and_repair_them(datasetfiles, locks, replicas, source_rep
 
 
 @transactional_session
-def __evaluate_did_detach(eval_did, session=None):
+def __list_detached_dids(eval_did, detached_since, session=None):
+    """
+    List the children detached from a did since a date, resolved to their files and datasets,
+    together with all the parents still covering each of them.
+
+    :param eval_did:        The did object in use.
+    :param detached_since:  Date of the oldest detach to evaluate.
+    :param session:         The database session in use.
+    :returns:               (files, datasets, parents) with files and datasets as sets of (scope, name) and
+                            parents as dictionary (scope, name) -> set of (scope, name), or None if no detached child is archived.
+    """
+    # The detached children are archived in the contents history; the margin covers the time between
+    # the archival and the flush of the updated_did row in the detaching transaction
+    query = session.query(models.DataIdentifierAssociationHistory.child_scope,
+                          models.DataIdentifierAssociationHistory.child_name,
+                          models.DataIdentifierAssociationHistory.child_type).\
+        with_hint(models.DataIdentifierAssociationHistory, "INDEX(CONTENTS_HISTORY CONTENTS_HISTORY_IDX)", 'oracle').\
+        filter(models.DataIdentifierAssociationHistory.scope == eval_did.scope,
+               models.DataIdentifierAssociationHistory.name == eval_did.name,
+               models.DataIdentifierAssociationHistory.deleted_at >= detached_since - timedelta(hours=1))
+
+    files, datasets = set(), set()
+    children = query.all()
+    if not children:
+        return None
+    try:
+        for child_scope, child_name, child_type in children:
+            if child_type == DIDType.FILE:
+                files.add((child_scope, child_name))
+                continue
+            if child_type == DIDType.DATASET:
+                datasets.add((child_scope, child_name))
+            else:
+                for dataset in rucio.core.did.list_child_datasets(scope=child_scope, name=child_name, session=session):
+                    datasets.add((dataset['scope'], dataset['name']))
+            for file in rucio.core.did.list_files(scope=child_scope, name=child_name, session=session):
+                files.add((file['scope'], file['name']))
+    except DataIdentifierNotFound:
+        # A detached child has been deleted since, its files can only be found from the locks of the rules
+        return None
+
+    parents = {}
+    for did, did_parents in rucio.core.did.list_all_parent_dids_bulk(dids=[{'scope': scope, 'name': name} for scope, name in files | datasets], session=session).items():
+        parents[did] = set((parent['scope'], parent['name']) for parent in did_parents)
+    return files, datasets, parents
+
+
+def __list_rule_locks_of_dids(model, rule_id, dids, session):
+    """
+    List the locks of a rule on a set of dids.
+
+    :param model:    The lock model, ReplicaLock or DatasetLock.
+    :param rule_id:  The rule id.
+    :param dids:     Set of (scope, name).
+    :param session:  The database session in use.
+    :returns:        List of lock objects.
+    """
+    names_per_scope = {}
+    for scope, name in dids:
+        names_per_scope.setdefault(scope, []).append(name)
+
+    locks = []
+    for scope, names in names_per_scope.items():
+        for names_chunk in chunks(names, 100):
+            locks.extend(session.query(model).filter(model.rule_id == rule_id,
+                                                     model.scope == scope,
+                                                     model.name.in_(names_chunk)).all())
+    return locks
+
+
+@transactional_session
+def __evaluate_did_detach(eval_did, detached_since=None, session=None):
     """
     Evaluate a parent did which has children removed.
 
-    :param eval_did:  The did object in use.
-    :param session:   The database session in use.
+    :param eval_did:        The did object in use.
+    :param detached_since:  If set, only the locks of the children detached since this date are evaluated,
+                            otherwise all the locks of the rules are compared with their current content.
+    :param session:         The database session in use.
     """
 
     logging.info("Re-Evaluating did %s:%s for DETACH", eval_did.scope, eval_did.name)
 
     with record_timer_block('rule.evaluate_did_detach'):
+        detached = None
+        if detached_since is not None:
+            with record_timer_block('rule.evaluate_did_detach.list_detached_dids'):
+                detached = __list_detached_dids(eval_did=eval_did, detached_since=detached_since, session=session)
+
         # Get all parent DID's
         parent_dids = rucio.core.did.list_all_parent_dids(scope=eval_did.scope, name=eval_did.name, session=session)
 
@@ -2383,13 +2479,21 @@ def __evaluate_did_detach(eval_did, session=None):
         transfers_to_delete = []  # [{'scope': , 'name':, 'rse_id':}]
         account_counter_decreases = {}  # {'rse_id': [file_size, file_size, file_size]}
         for rule in rules:
-            # Get all the files covering this rule
             files = {}
-            for file in rucio.core.did.list_files(scope=rule.scope, name=rule.name, session=session):
-                files[(file['scope'], file['name'])] = True
+            if detached is None:
+                # Get all the files covering this rule
+                for file in rucio.core.did.list_files(scope=rule.scope, name=rule.name, session=session):
+                    files[(file['scope'], file['name'])] = True
+                query = session.query(models.ReplicaLock).filter_by(rule_id=rule.id)
+            else:
+                # Get the detached files still covered by this rule through another parent
+                detached_files, detached_datasets, detached_parents = detached
+                for file in detached_files:
+                    if (rule.scope, rule.name) in detached_parents[file]:
+                        files[file] = True
+                query = __list_rule_locks_of_dids(model=models.ReplicaLock, rule_id=rule.id, dids=detached_files, session=session)
             logging.debug("Removing locks for rule %s [%d/%d/%d]", str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt)
             rule_locks_ok_cnt_before = rule.locks_ok_cnt
-            query = session.query(models.ReplicaLock).filter_by(rule_id=rule.id)
             for lock in query:
                 if (lock.scope, lock.name) not in files:
                     if __delete_lock_and_update_replica(lock=lock, purge_replicas=rule.purge_replicas, nowait=True, session=session):
@@ -2406,12 +2510,19 @@ def __evaluate_did_detach(eval_did, session=None):
             logging.debug("Finished removing locks for rule %s [%d/%d/%d]", str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt)
 
             if eval_did.did_type == DIDType.CONTAINER:
-                # Get all datasets of eval_did
                 child_datasets = {}
-                for ds in rucio.core.did.list_child_datasets(scope=rule.scope, name=rule.name, session=session):
-                    child_datasets[(ds['scope'], ds['name'])] = True
+                if detached is None:
+                    # Get all datasets of eval_did
+                    for ds in rucio.core.did.list_child_datasets(scope=rule.scope, name=rule.name, session=session):
+                        child_datasets[(ds['scope'], ds['name'])] = True
+                    query = session.query(models.DatasetLock).filter_by(rule_id=rule.id)
+                else:
+                    # Get the detached datasets still covered by this rule through another parent
+                    for ds in detached_datasets:
+                        if (rule.scope, rule.name) in detached_parents[ds]:
+                            child_datasets[ds] = True
+                    query = __list_rule_locks_of_dids(model=models.DatasetLock, rule_id=rule.id, dids=detached_datasets, session=session)
                 logging.debug("Removing dataset_locks for rule %s [%d/%d/%d]", str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt)
-                query = session.query(models.DatasetLock).filter_by(rule_id=rule.id)
                 for ds_lock in query:
                     if (ds_lock.scope, ds_lock.name) not in child_datasets:
                         ds_lock.delete(flush=False, session=session)
@@ -22,13 +22,11 @@ import logging
 import traceback
 
 from rucio.common.exception import InvalidRSEExpression
-from rucio.common.rse_attributes import get_rse_attributes
 from rucio.core import request
-from rucio.core.rse import get_rse_name
+from rucio.core.rse_cache import RSE_CACHE
 from rucio.core.rse_expression_parser import parse_expression
 from rucio.db.sqla.constants import RequestType
 from rucio.db.sqla.session import read_session
-from rucio.rse import rsemanager as rsemgr
 
 
 @read_session
@@ -87,9 +85,9 @@ def get_stagein_requests_and_source_replicas(total_workers=0, worker_number=0, f
                         continue
 
                     # Get destination rse information and protocol
-                    dest_rse_name = get_rse_name(rse_id=dest_rse_id, session=session)
+                    dest_rse_name = RSE_CACHE.get_rse_name(dest_rse_id, session=session)
                     if dest_rse_id not in rses_info:
-                        rses_info[dest_rse_id] = rsemgr.get_rse_info(rse=dest_rse_name, session=session)
+                        rses_info[dest_rse_id] = RSE_CACHE.get_rse_info(dest_rse_id, session=session)
 
                     if staging_buffer != dest_rse_id:
                         continue
@@ -113,14 +111,14 @@ def get_stagein_requests_and_source_replicas(total_workers=0, worker_number=0, f
                             if source_rse_id not in allowed_rses:
                                 continue
 
-                    source_rse_name = get_rse_name(rse_id=source_rse_id, session=session)
+                    source_rse_name = RSE_CACHE.get_rse_name(source_rse_id, session=session)
                     if source_rse_id not in rses_info:
-                        rses_info[source_rse_id] = rsemgr.get_rse_info(rse=source_rse_name, session=session)
+                        rses_info[source_rse_id] = RSE_CACHE.get_rse_info(source_rse_id, session=session)
                     if source_rse_id not in rse_attrs:
-                        rse_attrs[source_rse_id] = get_rse_attributes(rse_id=source_rse_id, session=session)
+                        rse_attrs[source_rse_id] = RSE_CACHE.get_rse_attributes(source_rse_id, session=session)
 
                     if source_rse_id not in protocols:
-                        protocols[source_rse_id] = rsemgr.create_protocol(rses_info[source_rse_id], 'write', current_schemes)
+                        protocols[source_rse_id] = RSE_CACHE.get_protocol(source_rse_id, 'write', current_schemes, session=session)
 
                     # we need to set the spacetoken if we use SRM
                     dest_spacetoken = None
@@ -146,14 +144,14 @@ def get_stagein_requests_and_source_replicas(total_workers=0, worker_number=0, f
                             attr = json.loads(str(attributes))
 
                     # to get space token and fts attribute
-                    source_rse_name = get_rse_name(rse_id=source_rse_id, session=session)
+                    source_rse_name = RSE_CACHE.get_rse_name(source_rse_id, session=session)
                     if source_rse_id not in rses_info:
-                        rses_info[source_rse_id] = rsemgr.get_rse_info(rse=source_rse_name, session=session)
+                        rses_info[source_rse_id] = RSE_CACHE.get_rse_info(source_rse_id, session=session)
                     if source_rse_id not in rse_attrs:
-                        rse_attrs[source_rse_id] = get_rse_attributes(rse_id=source_rse_id, session=session)
+                        rse_attrs[source_rse_id] = RSE_CACHE.get_rse_attributes(source_rse_id, session=session)
 
                     if source_rse_id not in protocols:
-                        protocols[source_rse_id] = rsemgr.create_protocol(rses_info[source_rse_id], 'write', current_schemes)
+                        protocols[source_rse_id] = RSE_CACHE.get_protocol(source_rse_id, 'write', current_schemes, session=session)
 
                     # we need to set the spacetoken if we use SRM
                     dest_spacetoken = None
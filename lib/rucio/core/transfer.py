@@ -31,12 +31,12 @@ from sqlalchemy.sql.expression import bindparam, text, false
 
 from rucio.common import constants
 from rucio.common.exception import RucioException, UnsupportedOperation, InvalidRSEExpression, RSEProtocolNotSupported, RequestNotFound
-from rucio.common.rse_attributes import get_rse_attributes
 from rucio.common.utils import construct_surl
 from rucio.common.constants import SUPPORTED_PROTOCOLS
 from rucio.core import did, message as message_core, request as request_core
 from rucio.core.monitor import record_counter, record_timer
 from rucio.core.rse import get_rse_name, list_rses
+from rucio.core.rse_cache import RSE_CACHE
 from rucio.core.rse_expression_parser import parse_expression
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import DIDType, RequestState, FTSState, RSEType, RequestType, ReplicaState
@@ -428,8 +428,8 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
         if source_rse_id is None or rse is None:
             continue
 
-        dest_rse_name = get_rse_name(rse_id=dest_rse_id, session=session)
-        source_rse_name = get_rse_name(rse_id=source_rse_id, session=session)
+        dest_rse_name = RSE_CACHE.get_rse_name(dest_rse_id, session=session)
+        source_rse_name = RSE_CACHE.get_rse_name(source_rse_id, session=session)
 
         if link_ranking is None:
             logging.debug("Request %s: no link from %s to %s" % (req_id, source_rse_name, dest_rse_name))
@@ -461,15 +461,15 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
 
                 # Get destination rse information
                 if dest_rse_id not in rses_info:
-                    rses_info[dest_rse_id] = rsemgr.get_rse_info(rse=dest_rse_name, session=session)
+                    rses_info[dest_rse_id] = RSE_CACHE.get_rse_info(dest_rse_id, session=session)
                 if dest_rse_id not in rse_attrs:
-                    rse_attrs[dest_rse_id] = get_rse_attributes(dest_rse_id, session=session)
+                    rse_attrs[dest_rse_id] = RSE_CACHE.get_rse_attributes(dest_rse_id, session=session)
 
                 # Get the source rse information
                 if source_rse_id not in rses_info:
-                    rses_info[source_rse_id] = rsemgr.get_rse_info(rse=source_rse_name, session=session)
+                    rses_info[source_rse_id] = RSE_CACHE.get_rse_info(source_rse_id, session=session)
                 if source_rse_id not in rse_attrs:
-                    rse_attrs[source_rse_id] = get_rse_attributes(source_rse_id, session=session)
+                    rse_attrs[source_rse_id] = RSE_CACHE.get_rse_attributes(source_rse_id, session=session)
 
                 attr = None
                 if attributes:
@@ -515,7 +515,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 dest_rse_id_key = '%s_%s' % (dest_rse_id, matching_scheme[0])
                 if dest_rse_id_key not in protocols:
                     try:
-                        protocols[dest_rse_id_key] = rsemgr.create_protocol(rses_info[dest_rse_id], 'third_party_copy', matching_scheme[0])
+                        protocols[dest_rse_id_key] = RSE_CACHE.get_protocol(dest_rse_id, 'third_party_copy', matching_scheme[0], session=session)
                     except RSEProtocolNotSupported:
                         logging.error('Operation "third_party_copy" not supported by dest_rse %s with schemes %s' % (dest_rse_name, current_schemes))
                         if req_id in reqs_no_source:
@@ -561,7 +561,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 source_rse_id_key = '%s_%s' % (source_rse_id, '_'.join([matching_scheme[0], matching_scheme[1]]))
                 if source_rse_id_key not in protocols:
                     try:
-                        protocols[source_rse_id_key] = rsemgr.create_protocol(rses_info[source_rse_id], 'third_party_copy', matching_scheme[1])
+                        protocols[source_rse_id_key] = RSE_CACHE.get_protocol(source_rse_id, 'third_party_copy', matching_scheme[1], session=session)
                     except RSEProtocolNotSupported:
                         logging.error('Operation "third_party_copy" not supported by source_rse %s with schemes %s' % (source_rse_name, matching_scheme[1]))
                         if req_id in reqs_no_source:
@@ -674,13 +674,13 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
 
                 # Compute the source rse information
                 if source_rse_id not in rses_info:
-                    rses_info[source_rse_id] = rsemgr.get_rse_info(rse=source_rse_name, session=session)
+                    rses_info[source_rse_id] = RSE_CACHE.get_rse_info(source_rse_id, session=session)
 
                 # Get protocol
                 source_rse_id_key = '%s_%s' % (source_rse_id, '_'.join(current_schemes))
                 if source_rse_id_key not in protocols:
                     try:
-                        protocols[source_rse_id_key] = rsemgr.create_protocol(rses_info[source_rse_id], 'third_party_copy', current_schemes)
+                        protocols[source_rse_id_key] = RSE_CACHE.get_protocol(source_rse_id, 'third_party_copy', current_schemes, session=session)
                     except RSEProtocolNotSupported:
                         logging.error('Operation "third_party_copy" not supported by %s with schemes %s' % (rses_info[source_rse_id]['rse'], current_schemes))
                         continue
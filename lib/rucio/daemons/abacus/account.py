@@ -31,10 +31,13 @@ import threading
 import time
 import traceback
 
+from datetime import datetime
+
 from rucio.common.config import config_get
 from rucio.common.utils import get_thread_with_periodic_running_function
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.account_counter import get_updated_account_counters, update_account_counter, fill_account_counter_history_table
+from rucio.core.account_counter import get_updated_account_counters, update_account_counter, fold_updated_account_counters, fill_account_counter_history_table
+from rucio.core.monitor import record_counter, record_gauge
 
 graceful_stop = threading.Event()
 
@@ -46,9 +49,12 @@ logging.basicConfig(stream=sys.stdout,
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def account_update(once=False):
+def account_update(once=False, fold=False):
     """
     Main loop to check and update the Account Counters.
+
+    :param once: Run only once.
+    :param fold: Fold the updated counters of all the account/RSE pairs of the worker at once.
     """
 
     logging.info('account_update: starting')
@@ -66,6 +72,25 @@ def account_update(once=False):
             # Heartbeat
             heartbeat = live(executable='rucio-abacus-account', hostname=hostname, pid=pid, thread=current_thread)
 
+            if fold:
+                start_time = time.time()
+                try:
+                    folded = fold_updated_account_counters(total_workers=heartbeat['nr_threads'] - 1,
+                                                           worker_number=heartbeat['assign_thread'])
+                except Exception:
+                    logging.warning('account_update[%s/%s]: folding failed, updating the account-rse counters one by one: %s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, traceback.format_exc()))
+                else:
+                    lag = (datetime.utcnow() - folded['oldest']).total_seconds() if folded['oldest'] else 0
+                    record_gauge('abacus.account.lag', lag)
+                    record_counter('abacus.account.folded_rows', delta=folded['rows'])
+                    logging.debug('account_update[%s/%s]: folded %d updates of %d account-rse counters in %f, lag %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, folded['rows'], folded['counters'], time.time() - start_time, lag))
+                    if not folded['rows'] and not once:
+                        logging.info('account_update[%s/%s] did not get any work' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1))
+                        time.sleep(10)
+                    if once:
+                        break
+                    continue
+
             # Select a bunch of rses for to update for this worker
             start = time.time()  # NOQA
             account_rse_ids = get_updated_account_counters(total_workers=heartbeat['nr_threads'] - 1,
@@ -102,7 +127,7 @@ def stop(signum=None, frame=None):
     graceful_stop.set()
 
 
-def run(once=False, threads=1, fill_history_table=False):
+def run(once=False, threads=1, fill_history_table=False, fold=False):
     """
     Starts up the Abacus-Account threads.
     """
@@ -111,10 +136,10 @@ def run(once=False, threads=1, fill_history_table=False):
 
     if once:
         logging.info('main: executing one iteration only')
-        account_update(once)
+        account_update(once=once, fold=fold)
     else:
         logging.info('main: starting threads')
-        threads = [threading.Thread(target=account_update, kwargs={'once': once}) for i in range(0, threads)]
+        threads = [threading.Thread(target=account_update, kwargs={'once': once, 'fold': fold}) for i in range(0, threads)]
         if fill_history_table:
             threads.append(get_thread_with_periodic_running_function(3600, fill_account_counter_history_table, graceful_stop))
         [t.start() for t in threads]
@@ -31,10 +31,13 @@ import threading
 import time
 import traceback
 
+from datetime import datetime
+
 from rucio.common.config import config_get
 from rucio.common.utils import get_thread_with_periodic_running_function
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.rse_counter import get_updated_rse_counters, update_rse_counter, fill_rse_counter_history_table
+from rucio.core.monitor import record_counter, record_gauge
+from rucio.core.rse_counter import get_updated_rse_counters, update_rse_counter, fold_updated_rse_counters, fill_rse_counter_history_table
 
 graceful_stop = threading.Event()
 
@@ -46,9 +49,12 @@ logging.basicConfig(stream=sys.stdout,
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def rse_update(once=False):
+def rse_update(once=False, fold=False):
     """
     Main loop to check and update the RSE Counters.
+
+    :param once: Run only once.
+    :param fold: Fold the updated counters of all the RSEs of the worker at once.
     """
 
     logging.info('rse_update: starting')
@@ -66,6 +72,25 @@ def rse_update(once=False):
             # Heartbeat
             heartbeat = live(executable='rucio-abacus-rse', hostname=hostname, pid=pid, thread=current_thread)
 
+            if fold:
+                start_time = time.time()
+                try:
+                    folded = fold_updated_rse_counters(total_workers=heartbeat['nr_threads'] - 1,
+                                                       worker_number=heartbeat['assign_thread'])
+                except Exception:
+                    logging.warning('rse_update[%s/%s]: folding failed, updating the rses one by one: %s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, traceback.format_exc()))
+                else:
+                    lag = (datetime.utcnow() - folded['oldest']).total_seconds() if folded['oldest'] else 0
+                    record_gauge('abacus.rse.lag', lag)
+                    record_counter('abacus.rse.folded_rows', delta=folded['rows'])
+                    logging.debug('rse_update[%s/%s]: folded %d updates of %d rses in %f, lag %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, folded['rows'], folded['rses'], time.time() - start_time, lag))
+                    if not folded['rows'] and not once:
+                        logging.info('rse_update[%s/%s] did not get any work' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1))
+                        time.sleep(10)
+                    if once:
+                        break
+                    continue
+
             # Select a bunch of rses for to update for this worker
             start = time.time()  # NOQA
             rse_ids = get_updated_rse_counters(total_workers=heartbeat['nr_threads'] - 1,
@@ -101,7 +126,7 @@ def stop(signum=None, frame=None):
     graceful_stop.set()
 
 
-def run(once=False, threads=1, fill_history_table=False):
+def run(once=False, threads=1, fill_history_table=False, fold=False):
     """
     Starts up the Abacus-RSE threads.
     """
@@ -110,10 +135,10 @@ def run(once=False, threads=1, fill_history_table=False):
 
     if once:
         logging.info('main: executing one iteration only')
-        rse_update(once)
+        rse_update(once=once, fold=fold)
     else:
         logging.info('main: starting threads')
-        threads = [threading.Thread(target=rse_update, kwargs={'once': once}) for i in range(0, threads)]
+        threads = [threading.Thread(target=rse_update, kwargs={'once': once, 'fold': fold}) for i in range(0, threads)]
         if fill_history_table:
             threads.append(get_thread_with_periodic_running_function(3600, fill_rse_counter_history_table, graceful_stop))
         [t.start() for t in threads]
@@ -54,10 +54,10 @@ from rucio.common.exception import DatabaseException, ConfigNotFound, Unsupporte
 from rucio.core import request as request_core, heartbeat, replica as replica_core
 from rucio.core.config import items
 from rucio.core.monitor import record_timer, record_counter
-from rucio.core.rse import list_rses, get_rse_name
+from rucio.core.rse import list_rses
+from rucio.core.rse_cache import RSE_CACHE
 from rucio.db.sqla.constants import RequestState, RequestType, ReplicaState, BadFilesStatus
 from rucio.db.sqla.session import transactional_session
-from rucio.rse import rsemanager
 
 
 logging.basicConfig(stream=sys.stdout,
@@ -211,7 +211,8 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
     failed_during_submission = [RequestState.SUBMITTING, RequestState.SUBMISSION_FAILED, RequestState.LOST]
     failed_no_submission_attempts = [RequestState.NO_SOURCES, RequestState.ONLY_TAPE_SOURCES, RequestState.MISMATCH_SCHEME]
     undeterministic_rses = __get_undeterministic_rses()
-    rses_info, protocols = {}, {}
+    undeterministic_replicas = {}
+    failed_requests = []
     replicas = {}
     for req in reqs:
         try:
@@ -230,18 +231,11 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
                 replica['state'] = ReplicaState.AVAILABLE
                 replica['archived'] = False
 
-                # for TAPE, replica path is needed
+                # for TAPE, replica path is needed, the pfns of a protocol are parsed together
                 if req['request_type'] in (RequestType.TRANSFER, RequestType.STAGEIN) and req['dest_rse_id'] in undeterministic_rses:
-                    if req['dest_rse_id'] not in rses_info:
-                        dest_rse = get_rse_name(rse_id=req['dest_rse_id'])
-                        rses_info[req['dest_rse_id']] = rsemanager.get_rse_info(dest_rse)
-                    pfn = req['dest_url']
-                    scheme = urlparse(pfn).scheme
-                    dest_rse_id_scheme = '%s_%s' % (req['dest_rse_id'], scheme)
-                    if dest_rse_id_scheme not in protocols:
-                        protocols[dest_rse_id_scheme] = rsemanager.create_protocol(rses_info[req['dest_rse_id']], 'write', scheme)
-                    path = protocols[dest_rse_id_scheme].parse_pfns([pfn])[pfn]['path']
-                    replica['path'] = os.path.join(path, os.path.basename(pfn))
+                    scheme = urlparse(req['dest_url']).scheme
+                    undeterministic_replicas.setdefault((req['dest_rse_id'], scheme), []).append((req, replica))
+                    continue
 
                 # replica should not be added to replicas until all info are filled
                 replicas[req['request_type']][req['rule_id']].append(replica)
@@ -249,52 +243,14 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
             # Standard failure from the transfer tool
             elif req['state'] == RequestState.FAILED:
                 __check_suspicious_files(req, suspicious_patterns)
-                tss = time.time()
-                try:
-                    new_req = request_core.requeue_and_archive(req, retry_protocol_mismatches)
-                    if new_req:
-                        # should_retry_request and requeue_and_archive are not in one session,
-                        # another process can requeue_and_archive and this one will return None.
-                        record_timer('daemons.conveyor.common.update_request_state.request-requeue_and_archive', (time.time() - tss) * 1000)
-                        logging.warn(prepend_str + 'REQUEUED DID %s:%s REQUEST %s AS %s TRY %s' % (req['scope'],
-                                                                                                   req['name'],
-                                                                                                   req['request_id'],
-                                                                                                   new_req['request_id'],
-                                                                                                   new_req['retry_count']))
-                    else:
-                        # No new_req is return if should_retry_request returns False
-                        logging.warn('%s EXCEEDED SUBMITTING DID %s:%s REQUEST %s in state %s', prepend_str, req['scope'], req['name'], req['request_id'], req['state'])
-                        replica['state'] = ReplicaState.UNAVAILABLE
-                        replica['archived'] = False
-                        replica['error_message'] = req['err_msg'] if req['err_msg'] else request_core.get_transfer_error(req['state'])
-                        replicas[req['request_type']][req['rule_id']].append(replica)
-                except RequestNotFound:
-                    logging.warn('%s Cannot find request %s anymore', prepend_str, req['request_id'])
+                failed_requests.append((req, replica))
 
             # All other failures
             elif req['state'] in failed_during_submission or req['state'] in failed_no_submission_attempts:
                 if req['state'] in failed_during_submission and req['updated_at'] > (datetime.datetime.utcnow() - datetime.timedelta(minutes=120)):
                     # To prevent race conditions
                     continue
-                try:
-                    tss = time.time()
-                    new_req = request_core.requeue_and_archive(req, retry_protocol_mismatches)
-                    if new_req:
-                        record_timer('daemons.conveyor.common.update_request_state.request-requeue_and_archive', (time.time() - tss) * 1000)
-                        logging.warn(prepend_str + 'REQUEUED SUBMITTING DID %s:%s REQUEST %s AS %s TRY %s' % (req['scope'],
-                                                                                                              req['name'],
-                                                                                                              req['request_id'],
-                                                                                                              new_req['request_id'],
-                                                                                                              new_req['retry_count']))
-                    else:
-                        # No new_req is return if should_retry_request returns False
-                        logging.warn('%s EXCEEDED SUBMITTING DID %s:%s REQUEST %s in state %s', prepend_str, req['scope'], req['name'], req['request_id'], req['state'])
-                        replica['state'] = ReplicaState.UNAVAILABLE
-                        replica['archived'] = False
-                        replica['error_message'] = req['err_msg'] if req['err_msg'] else request_core.get_transfer_error(req['state'])
-                        replicas[req['request_type']][req['rule_id']].append(replica)
-                except RequestNotFound:
-                    logging.warn('%s Cannot find request %s anymore', prepend_str, req['request_id'])
+                failed_requests.append((req, replica))
 
         except Exception as error:
             logging.error(prepend_str + "Something unexpected happened when handling request %s(%s:%s) at %s: %s" % (req['request_id'],
@@ -303,9 +259,105 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
                                                                                                                      req['dest_rse_id'],
                                                                                                                      str(error)))
 
+    for (dest_rse_id, scheme), reqs_replicas in undeterministic_replicas.items():
+        __set_replica_paths(dest_rse_id, scheme, reqs_replicas, replicas, prepend_str)
+
+    if failed_requests:
+        __requeue_failed_requests(failed_requests, retry_protocol_mismatches, replicas, prepend_str)
+
     __handle_terminated_replicas(replicas, prepend_str)
 
 
+def __set_replica_paths(dest_rse_id, scheme, reqs_replicas, replicas, prepend_str=''):
+    """
+    Set the paths of the replicas of an undeterministic RSE, parsing all their pfns at once.
+
+    :param dest_rse_id:    The destination RSE id.
+    :param scheme:         The scheme of the pfns.
+    :param reqs_replicas:  List of (request, replica) pairs.
+    :param replicas:       Replicas to update, by request type and rule id.
+    :param prepend_str:    String to prepend to logging.
+    """
+
+    try:
+        protocol = RSE_CACHE.get_protocol(dest_rse_id, 'write', scheme)
+        paths = protocol.parse_pfns([req['dest_url'] for req, _ in reqs_replicas])
+    except Exception as error:
+        logging.warning('%s Cannot parse the pfns of %s requests at %s together, parsing them one by one: %s', prepend_str, len(reqs_replicas), dest_rse_id, str(error))
+        paths = {}
+
+    for req, replica in reqs_replicas:
+        pfn = req['dest_url']
+        try:
+            if pfn not in paths:
+                paths.update(RSE_CACHE.get_protocol(dest_rse_id, 'write', scheme).parse_pfns([pfn]))
+            replica['path'] = os.path.join(paths[pfn]['path'], os.path.basename(pfn))
+            # replica should not be added to replicas until all info are filled
+            replicas[req['request_type']][req['rule_id']].append(replica)
+        except Exception as error:
+            logging.error(prepend_str + "Something unexpected happened when handling request %s(%s:%s) at %s: %s" % (req['request_id'],
+                                                                                                                     req['scope'],
+                                                                                                                     req['name'],
+                                                                                                                     req['dest_rse_id'],
+                                                                                                                     str(error)))
+
+
+def __requeue_failed_requests(failed_requests, retry_protocol_mismatches, replicas, prepend_str=''):
+    """
+    Requeue and archive failed requests in one transaction, or one by one if it fails.
+    The replicas of the requests which are not retried anymore are marked unavailable.
+
+    :param failed_requests:              List of (request, replica) pairs.
+    :param retry_protocol_mismatches:    Boolean to retry the transfer in case of protocol mismatch.
+    :param replicas:                     Replicas to update, by request type and rule id.
+    :param prepend_str:                  String to prepend to logging.
+    """
+
+    tss = time.time()
+    try:
+        new_reqs = request_core.requeue_and_archive_bulk([req for req, _ in failed_requests], retry_protocol_mismatches)
+        record_timer('daemons.conveyor.finisher.requeue_and_archive_bulk', (time.time() - tss) * 1000)
+    except Exception as error:
+        logging.warning('%s Cannot requeue %s requests together, requeuing them one by one: %s', prepend_str, len(failed_requests), str(error))
+        new_reqs = {}
+        for req, _ in failed_requests:
+            tss = time.time()
+            try:
+                new_reqs[req['request_id']] = request_core.requeue_and_archive(req, retry_protocol_mismatches)
+                if new_reqs[req['request_id']]:
+                    record_timer('daemons.conveyor.common.update_request_state.request-requeue_and_archive', (time.time() - tss) * 1000)
+            except RequestNotFound:
+                pass
+            except Exception as error:
+                logging.error(prepend_str + "Something unexpected happened when handling request %s(%s:%s) at %s: %s" % (req['request_id'],
+                                                                                                                         req['scope'],
+                                                                                                                         req['name'],
+                                                                                                                         req['dest_rse_id'],
+                                                                                                                         str(error)))
+                # Neither requeued nor exceeded, the request is handled again in the next cycle
+                new_reqs[req['request_id']] = False
+
+    for req, replica in failed_requests:
+        if req['request_id'] not in new_reqs:
+            logging.warn('%s Cannot find request %s anymore', prepend_str, req['request_id'])
+            continue
+        new_req = new_reqs[req['request_id']]
+        if new_req:
+            logging.warn(prepend_str + 'REQUEUED %sDID %s:%s REQUEST %s AS %s TRY %s' % ('' if req['state'] == RequestState.FAILED else 'SUBMITTING ',
+                                                                                         req['scope'],
+                                                                                         req['name'],
+                                                                                         req['request_id'],
+                                                                                         new_req['request_id'],
+                                                                                         new_req['retry_count']))
+        elif new_req is None:
+            # No new_req is return if should_retry_request returns False
+            logging.warn('%s EXCEEDED SUBMITTING DID %s:%s REQUEST %s in state %s', prepend_str, req['scope'], req['name'], req['request_id'], req['state'])
+            replica['state'] = ReplicaState.UNAVAILABLE
+            replica['archived'] = False
+            replica['error_message'] = req['err_msg'] if req['err_msg'] else request_core.get_transfer_error(req['state'])
+            replicas[req['request_type']][req['rule_id']].append(replica)
+
+
 def __get_undeterministic_rses():
     """
     Get the undeterministic rses from the database
@@ -45,14 +45,16 @@ try:
 except Exception:
     from configparser import NoOptionError  # py3
 from requests.exceptions import RequestException
+from six.moves.urllib.parse import urlparse
 from sqlalchemy.exc import DatabaseError
 
 from rucio.common.config import config_get
 from rucio.common.exception import DatabaseException, TransferToolTimeout, TransferToolWrongAnswer
-from rucio.common.utils import chunks
+from rucio.common.utils import chunks, run_concurrently
 from rucio.core import heartbeat, transfer as transfer_core, request as request_core
-from rucio.core.monitor import record_timer, record_counter
+from rucio.core.monitor import record_timer, record_counter, record_gauge
 from rucio.db.sqla.constants import RequestState, RequestType
+from rucio.db.sqla.session import transactional_session
 
 
 logging.basicConfig(stream=sys.stdout,
@@ -64,13 +66,19 @@ logging.basicConfig(stream=sys.stdout,
 
 graceful_stop = threading.Event()
 
+# Number of transfers per query of each FTS host in the parallel mode, shrunk when a query has to be bisected
+batch_sizes = {}
+
 datetime.datetime.strptime('', '')
 
 
 def poller(once=False, activities=None, sleep_time=60,
-           fts_bulk=100, db_bulk=1000, older_than=60, activity_shares=None):
+           fts_bulk=100, db_bulk=1000, older_than=60, activity_shares=None, max_polling_hosts=1):
     """
     Main loop to check the status of a transfer primitive with a transfertool.
+
+    :param max_polling_hosts:  If greater than 1, poll up to this many FTS queries concurrently, bisect the failing
+                               queries and update the requests of each query in one transaction.
     """
 
     try:
@@ -138,12 +146,15 @@ def poller(once=False, activities=None, sleep_time=60,
                         xfers_ids[transf['external_host']] = []
                     xfers_ids[transf['external_host']].append((transf['external_id'], transf['request_id']))
 
-                for external_host in xfers_ids:
-                    external_ids = list({trf[0] for trf in xfers_ids[external_host]})
-                    request_ids = [trf[1] for trf in xfers_ids[external_host]]
-                    for xfers in chunks(external_ids, fts_bulk):
-                        # poll transfers
-                        poll_transfers(external_host=external_host, xfers=xfers, prepend_str=prepend_str, request_ids=request_ids, timeout=timeout)
+                if max_polling_hosts > 1:
+                    poll_transfers_parallel(xfers_ids=xfers_ids, fts_bulk=fts_bulk, prepend_str=prepend_str, timeout=timeout, max_polling_hosts=max_polling_hosts)
+                else:
+                    for external_host in xfers_ids:
+                        external_ids = list({trf[0] for trf in xfers_ids[external_host]})
+                        request_ids = [trf[1] for trf in xfers_ids[external_host]]
+                        for xfers in chunks(external_ids, fts_bulk):
+                            # poll transfers
+                            poll_transfers(external_host=external_host, xfers=xfers, prepend_str=prepend_str, request_ids=request_ids, timeout=timeout)
 
                 if len(transfs) < fts_bulk / 2:
                     logging.info(prepend_str + "Only %s transfers for activity %s, which is less than half of the bulk %s, will sleep %s seconds" % (len(transfs), activity, fts_bulk, sleep_time))
@@ -171,7 +182,7 @@ def stop(signum=None, frame=None):
 
 
 def run(once=False, sleep_time=60, activities=None,
-        fts_bulk=100, db_bulk=1000, older_than=60, activity_shares=None, total_threads=1):
+        fts_bulk=100, db_bulk=1000, older_than=60, activity_shares=None, total_threads=1, max_polling_hosts=1):
     """
     Starts up the conveyer threads.
     """
@@ -197,7 +208,8 @@ def run(once=False, sleep_time=60, activities=None,
 
     if once:
         logging.info('executing one poller iteration only')
-        poller(once=once, fts_bulk=fts_bulk, db_bulk=db_bulk, older_than=older_than, activities=activities, activity_shares=activity_shares)
+        poller(once=once, fts_bulk=fts_bulk, db_bulk=db_bulk, older_than=older_than, activities=activities, activity_shares=activity_shares,
+               max_polling_hosts=max_polling_hosts)
 
     else:
 
@@ -208,7 +220,8 @@ def run(once=False, sleep_time=60, activities=None,
                                                            'db_bulk': db_bulk,
                                                            'sleep_time': sleep_time,
                                                            'activities': activities,
-                                                           'activity_shares': activity_shares}) for _ in range(0, total_threads)]
+                                                           'activity_shares': activity_shares,
+                                                           'max_polling_hosts': max_polling_hosts}) for _ in range(0, total_threads)]
 
         [thread.start() for thread in threads]
 
@@ -296,3 +309,131 @@ def poll_transfers(external_host, xfers, prepend_str='', request_ids=None, timeo
         logging.debug(prepend_str + 'Finished updating %s transfer requests status (%i requests state changed) in %s seconds' % (len(xfers), cnt, (time.time() - tss)))
     except Exception:
         logging.error(traceback.format_exc())
+
+
+def poll_transfers_parallel(xfers_ids, fts_bulk=100, prepend_str='', timeout=None, max_polling_hosts=5):
+    """
+    Poll the transfers of several FTS servers concurrently, then update the requests of each query in one transaction.
+
+    :param xfers_ids:          Dictionary {external_host: [(external_id, request_id)]}.
+    :param fts_bulk:           Maximum number of transfers per FTS query.
+    :param prepend_str:        String to prepend to the logging.
+    :param timeout:            Timeout.
+    :param max_polling_hosts:  Maximum number of FTS queries in flight.
+    """
+    calls, hosts = [], []
+    for external_host in xfers_ids:
+        external_ids = list({trf[0] for trf in xfers_ids[external_host]})
+        batch_size = min(batch_sizes.get(external_host, fts_bulk), fts_bulk)
+        record_gauge('daemons.conveyor.poller.batch_size.%s' % __extract_host(external_host), batch_size)
+        for xfers in chunks(external_ids, batch_size):
+            calls.append((__query_transfers, {'external_host': external_host, 'xfers': xfers, 'prepend_str': prepend_str, 'timeout': timeout}))
+            hosts.append(external_host)
+
+    results = run_concurrently(calls, max_workers=max_polling_hosts)
+
+    for external_host, (resps, bisected) in zip(hosts, [result if not isinstance(result, Exception) else (result, False) for result in results]):
+        # shrink the queries of the hosts returning wrong answers, grow them back when they succeed
+        if bisected:
+            batch_sizes[external_host] = max(min(batch_sizes.get(external_host, fts_bulk), fts_bulk) // 2, 1)
+        else:
+            batch_sizes[external_host] = min(batch_sizes.get(external_host, fts_bulk) * 2, fts_bulk)
+
+        if isinstance(resps, TransferToolTimeout):
+            logging.error(prepend_str + str(resps))
+            continue
+        elif isinstance(resps, RequestException):
+            logging.error(prepend_str + "Failed to contact FTS server: %s" % (str(resps)))
+            continue
+        elif isinstance(resps, Exception):
+            logging.error(prepend_str + "Failed to query FTS info: %s" % (str(resps)))
+            continue
+
+        tss = time.time()
+        request_ids = set(trf[1] for trf in xfers_ids[external_host])
+        try:
+            cnt = __update_transfers(external_host=external_host, resps=resps, request_ids=request_ids, prepend_str=prepend_str)
+        except (DatabaseException, DatabaseError) as error:
+            # a locked request rolls back the whole query, update its transfers one by one
+            logging.warning(prepend_str + 'Failed to update %i transfers of %s in bulk, will do it one by one: %s' % (len(resps), external_host, str(error)))
+            cnt = 0
+            for transfer_id in resps:
+                try:
+                    cnt += __update_transfers(external_host=external_host, resps={transfer_id: resps[transfer_id]}, request_ids=request_ids, prepend_str=prepend_str)
+                except (DatabaseException, DatabaseError) as error:
+                    if re.match('.*ORA-00054.*', error.args[0]) or re.match('.*ORA-00060.*', error.args[0]) or 'ERROR 1205 (HY000)' in error.args[0]:
+                        logging.warn(prepend_str + "Lock detected when handling transfer %s - skipping" % transfer_id)
+                    else:
+                        logging.error(traceback.format_exc())
+        except Exception:
+            logging.error(prepend_str + 'Failed to update the transfers of %s: %s' % (external_host, traceback.format_exc()))
+        record_timer('daemons.conveyor.poller.update_transfers', (time.time() - tss) * 1000 / max(len(resps), 1))
+        logging.debug(prepend_str + 'Finished updating %s transfers of %s (%i requests state changed) in %s seconds' % (len(resps), external_host, cnt, (time.time() - tss)))
+
+
+def __extract_host(external_host):
+    # graphite does not like the dots in the FQDN
+    return urlparse(external_host).hostname.replace('.', '_')
+
+
+def __query_transfers(external_host, xfers, prepend_str='', timeout=None):
+    """
+    Query a list of transfers from an FTS server, bisecting the list while the server returns a wrong answer.
+
+    :param external_host:  The FTS server to query from.
+    :param xfers:          List of transfers to poll.
+    :param prepend_str:    String to prepend to the logging.
+    :param timeout:        Timeout.
+    :returns:              Tuple (responses by transfer id, True if the list had to be bisected).
+    """
+    tss = time.time()
+    try:
+        logging.info(prepend_str + 'Polling %i transfers against %s with timeout %s' % (len(xfers), external_host, timeout))
+        resps = transfer_core.bulk_query_transfers(external_host, xfers, 'fts3', timeout)
+        record_timer('daemons.conveyor.poller.bulk_query_transfers.%s' % __extract_host(external_host), (time.time() - tss) * 1000)
+        return resps, False
+    except TransferToolWrongAnswer as error:
+        if len(xfers) == 1:
+            logging.error(prepend_str + 'Problem querying %s on %s . Error returned : %s' % (xfers[0], external_host, str(error)))
+            return {xfers[0]: error}, True
+        logging.warning(prepend_str + 'Problem querying %i transfers on %s, bisecting the query: %s' % (len(xfers), external_host, str(error)))
+        record_counter('daemons.conveyor.poller.bisect_query')
+        resps = {}
+        for half in (xfers[:len(xfers) // 2], xfers[len(xfers) // 2:]):
+            resps.update(__query_transfers(external_host, half, prepend_str=prepend_str, timeout=timeout)[0])
+        return resps, True
+
+
+@transactional_session
+def __update_transfers(external_host, resps, request_ids, prepend_str='', session=None):
+    """
+    Update the requests of polled transfers and touch the transfers in one transaction.
+
+    :param external_host:  The FTS server the transfers were queried from.
+    :param resps:          Dictionary {transfer_id: response} as returned by bulk_query_transfers.
+    :param request_ids:    Set of the polled request ids.
+    :param prepend_str:    String to prepend to the logging.
+    :param session:        The database session to use.
+    :returns:              Number of requests whose state changed.
+    """
+    cnt = 0
+    for transfer_id, transf_resp in resps.items():
+        if transf_resp is None:
+            transfer_core.update_transfer_state(external_host, transfer_id, RequestState.LOST, logging_prepend_str=prepend_str, session=session)
+            record_counter('daemons.conveyor.poller.transfer_lost')
+        elif isinstance(transf_resp, Exception):
+            logging.warning(prepend_str + "Failed to poll FTS(%s) job (%s): %s" % (external_host, transfer_id, transf_resp))
+            record_counter('daemons.conveyor.poller.query_transfer_exception')
+        else:
+            for request_id in transf_resp:
+                if request_id in request_ids:
+                    ret = request_core.update_request_state(transf_resp[request_id], logging_prepend_str=prepend_str, session=session)
+                    # if True, really update request content; if False, only touch request
+                    if ret:
+                        cnt += 1
+                    record_counter('daemons.conveyor.poller.update_request_state.%s' % ret)
+
+        # should touch transfers.
+        # Otherwise if one bulk transfer includes many requests and one is not terminated, the transfer will be poll again.
+        transfer_core.touch_transfer(external_host, transfer_id, session=session)
+    return cnt
@@ -49,6 +49,7 @@ from six import iteritems
 
 from rucio.common.config import config_get
 from rucio.common.schema import ACTIVITY
+from rucio.common.utils import run_concurrently
 from rucio.core import heartbeat, request as request_core, transfer as transfer_core
 from rucio.core.monitor import record_counter, record_timer
 from rucio.daemons.conveyor.common import submit_transfer, bulk_group_transfer, get_conveyor_rses, USER_ACTIVITY
@@ -87,6 +88,11 @@ def submitter(once=False, rses=None, mock=False,
     except NoOptionError:
         timeout = None
 
+    try:
+        max_submitting_hosts = int(config_get('conveyor', 'max_submitting_hosts'))
+    except NoOptionError:
+        max_submitting_hosts = 10
+
     try:
         bring_online = config_get('conveyor', 'bring_online')
     except NoOptionError:
@@ -175,18 +181,21 @@ def submitter(once=False, rses=None, mock=False,
 
                 logging.info('%s Starting to submit transfers for %s', prepend_str, activity)
 
+                # the FTS hosts are submitted to concurrently, so a slow host does not delay the others
+                calls = []
                 for external_host in grouped_jobs:
                     if not user_transfer:
-                        for job in grouped_jobs[external_host]:
-                            # submit transfers
-                            submit_transfer(external_host=external_host, job=job, submitter='transfer_submitter',
-                                            logging_prepend_str=prepend_str, timeout=timeout)
+                        jobs = grouped_jobs[external_host]
                     else:
-                        for _, jobs in iteritems(grouped_jobs[external_host]):
-                            # submit transfers
-                            for job in jobs:
-                                submit_transfer(external_host=external_host, job=job, submitter='transfer_submitter',
-                                                logging_prepend_str=prepend_str, timeout=timeout, user_transfer_job=user_transfer)
+                        jobs = [job for _, host_jobs in iteritems(grouped_jobs[external_host]) for job in host_jobs]
+                    calls.append((__submit_jobs, {'external_host': external_host,
+                                                  'jobs': jobs,
+                                                  'prepend_str': prepend_str,
+                                                  'timeout': timeout,
+                                                  'user_transfer': user_transfer}))
+                for error in run_concurrently(calls, max_workers=max_submitting_hosts):
+                    if isinstance(error, Exception):
+                        logging.critical('%s %s', prepend_str, str(error))
 
                 if len(transfers) < group_bulk:
                     logging.info('%s Only %s transfers for %s which is less than group bulk %s, sleep %s seconds', prepend_str, len(transfers), activity, group_bulk, sleep_time)
@@ -206,6 +215,22 @@ def submitter(once=False, rses=None, mock=False,
     return
 
 
+def __submit_jobs(external_host, jobs, prepend_str, timeout, user_transfer):
+    """
+    Submit the jobs of an FTS host one after the other.
+
+    :param external_host:  FTS server to submit to.
+    :param jobs:           List of job dictionaries.
+    :param prepend_str:    String to prepend to the logging.
+    :param timeout:        Timeout.
+    :param user_transfer:  Parameter for transfer with user credentials.
+    """
+    for job in jobs:
+        # submit transfers
+        submit_transfer(external_host=external_host, job=job, submitter='transfer_submitter',
+                        logging_prepend_str=prepend_str, timeout=timeout, user_transfer_job=user_transfer)
+
+
 def stop(signum=None, frame=None):
     """
     Graceful exit.
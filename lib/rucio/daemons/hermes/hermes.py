@@ -37,6 +37,11 @@ import threading
 import time
 import traceback
 
+try:
+    from Queue import Queue, Empty  # py2
+except ImportError:
+    from queue import Queue, Empty  # py3
+
 from email.mime.text import MIMEText
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -44,8 +49,9 @@ import stomp
 
 from rucio.common.config import config_get, config_get_int, config_get_bool
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.message import retrieve_messages, delete_messages
-from rucio.core.monitor import record_counter
+from rucio.common.utils import run_concurrently
+from rucio.core.message import retrieve_messages, delete_messages, archive_messages
+from rucio.core.monitor import record_counter, record_timer
 
 
 logging.getLogger('requests').setLevel(logging.CRITICAL)
@@ -162,10 +168,194 @@ class HermesListener(stomp.ConnectionListener):
         logging.error('[broker] [%s]: %s', self.__broker, body)
 
 
+class HistoryWriter(threading.Thread):
+    '''
+    Archives the delivered messages to the history in batches, outside of the delivery loop.
+    '''
+
+    def __init__(self, bulk=1000, max_queued=100000):
+        '''
+        :param bulk: Maximum number of messages per insert.
+        :param max_queued: Maximum number of messages waiting to be archived, put blocks beyond.
+        '''
+        super(HistoryWriter, self).__init__(name='hermes-history')
+        self.daemon = True
+        self.bulk = bulk
+        self.queue = Queue(maxsize=max_queued)
+        self.stopped = threading.Event()
+
+    def put(self, messages):
+        '''
+        Queue delivered messages for archiving.
+
+        :param messages: List of message history dictionaries.
+        '''
+        for message in messages:
+            self.queue.put(message)
+
+    def run(self):
+        while not (self.stopped.is_set() and self.queue.empty()):
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=1))
+                while len(batch) < self.bulk:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            if not batch:
+                continue
+            try:
+                t_start = time.time()
+                archive_messages(batch)
+                record_timer('daemons.hermes.history.archive', (time.time() - t_start) * 1000)
+                record_counter('daemons.hermes.history.archived', len(batch))
+            except Exception:
+                logging.critical('[history] could not archive %i messages: %s', len(batch), traceback.format_exc())
+                record_counter('daemons.hermes.history.failed', len(batch))
+
+    def stop(self):
+        '''
+        Archive the queued messages and stop.
+        '''
+        self.stopped.set()
+        self.join()
+
+
+def __history_entry(message, payload):
+    '''
+    Build the history dictionary of a delivered message.
+    '''
+    return {'id': message['id'],
+            'created_at': message['created_at'],
+            'updated_at': message['created_at'],
+            'payload': payload,
+            'event_type': message['event_type']}
+
+
+def __connect(conn, use_ssl, username=None, password=None):
+    '''
+    Connect to a broker if the connection is down.
+    '''
+    if not conn.is_connected():
+        host_and_ports = conn.transport._Transport__host_and_ports[0][0]
+        record_counter('daemons.hermes.reconnect.%s' % host_and_ports.split('.')[0])
+        conn.start()
+        if not use_ssl:
+            logging.info('[broker] connecting with USERPASS to %s', host_and_ports)
+            conn.connect(username, password, wait=True)
+        else:
+            logging.info('[broker] connecting with SSL to %s', host_and_ports)
+            conn.connect(wait=True)
+
+
+def __log_message(heartbeat, message):
+    '''
+    Log a delivered message at debug level.
+    '''
+    if str(message['event_type']).lower().startswith('transfer') or str(message['event_type']).lower().startswith('stagein'):
+        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, request-id: %s, transfer-id: %s, created_at: %s',
+                      heartbeat['assign_thread'], heartbeat['nr_threads'],
+                      str(message['event_type']).lower(),
+                      message['payload'].get('scope', None),
+                      message['payload'].get('name', None),
+                      message['payload'].get('dst-rse', None),
+                      message['payload'].get('request-id', None),
+                      message['payload'].get('transfer-id', None),
+                      str(message['created_at']))
+
+    elif str(message['event_type']).lower().startswith('dataset'):
+        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, rule-id: %s, created_at: %s)',
+                      heartbeat['assign_thread'],
+                      heartbeat['nr_threads'],
+                      str(message['event_type']).lower(),
+                      message['payload']['scope'],
+                      message['payload']['name'],
+                      message['payload']['rse'],
+                      message['payload']['rule_id'],
+                      str(message['created_at']))
+
+    elif str(message['event_type']).lower().startswith('deletion'):
+        if 'url' not in message['payload']:
+            message['payload']['url'] = 'unknown'
+        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, url: %s, created_at: %s)',
+                      heartbeat['assign_thread'],
+                      heartbeat['nr_threads'],
+                      str(message['event_type']).lower(),
+                      message['payload']['scope'],
+                      message['payload']['name'],
+                      message['payload']['rse'],
+                      message['payload']['url'],
+                      str(message['created_at']))
+    else:
+        logging.debug('[broker] %i:%i - other message: %s',
+                      heartbeat['assign_thread'], heartbeat['nr_threads'],
+                      message)
+
+
+def __deliver_to_broker(conn, messages, destination, heartbeat):
+    '''
+    Send messages over one broker connection, stopping at the first delivery failure.
+
+    :returns: The history dictionaries of the delivered messages.
+    '''
+    delivered = []
+    for message in messages:
+        try:
+            conn.send(body=json.dumps({'event_type': str(message['event_type']).lower(),
+                                       'payload': message['payload'],
+                                       'created_at': str(message['created_at'])}),
+                      destination=destination,
+                      headers={'persistent': 'true',
+                               'event_type': str(message['event_type']).lower()})
+        except ValueError:
+            logging.warn('Cannot serialize payload to JSON: %s', str(message['payload']))
+            delivered.append(__history_entry(message, str(message['payload'])))
+            continue
+        except Exception as error:
+            logging.warn('Could not deliver %i messages to %s: %s', len(messages) - len(delivered),
+                         conn.transport._Transport__host_and_ports[0][0], str(error))
+            break
+        delivered.append(__history_entry(message, json.dumps(message['payload'])))
+        __log_message(heartbeat, message)
+    return delivered
+
+
+def __fan_out_messages(conns, messages, destination, heartbeat, use_ssl, username=None, password=None):
+    '''
+    Spread the messages over all the connected brokers and send to every broker in its own thread.
+
+    :returns: The history dictionaries of the delivered messages.
+    '''
+    live_conns = []
+    for conn in conns:
+        try:
+            __connect(conn, use_ssl, username, password)
+            live_conns.append(conn)
+        except Exception as error:
+            logging.warn('Could not connect to %s: %s', conn.transport._Transport__host_and_ports[0][0], str(error))
+    if not live_conns:
+        return []
+
+    # spread differently at each cycle, so that the undelivered messages do not stick to a broker
+    random.shuffle(live_conns)
+    calls = [(__deliver_to_broker, {'conn': conn, 'messages': messages[idx::len(live_conns)], 'destination': destination, 'heartbeat': heartbeat})
+             for idx, conn in enumerate(live_conns)]
+    to_delete = []
+    for delivered in run_concurrently(calls, max_workers=len(calls)):
+        if isinstance(delivered, Exception):
+            logging.warn('Could not deliver messages: %s', str(delivered))
+            continue
+        to_delete.extend(delivered)
+    return to_delete
+
+
 def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, delay=10,
-                     broker_timeout=3, broker_retry=3):
+                     broker_timeout=3, broker_retry=3, fan_out=False, history_writer=None):
     '''
     Main loop to deliver messages to a broker.
+
+    With fan_out, the messages are spread over all the brokers and sent in parallel. If a
+    history_writer is given, the delivered messages are archived asynchronously by it.
     '''
     logging.info('[broker] starting - threads (%i) bulk (%i)', thread, bulk)
 
@@ -182,6 +372,7 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
 
     port = config_get_int('messaging-hermes', 'port')
     vhost = config_get('messaging-hermes', 'broker_virtual_host', raise_exception=False)
+    username, password = None, None
     if not use_ssl:
         username = config_get('messaging-hermes', 'username')
         password = config_get('messaging-hermes', 'password')
@@ -241,100 +432,70 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
                               heartbeat['assign_thread'], heartbeat['nr_threads'],
                               len(messages))
                 to_delete = []
-                for message in messages:
-                    try:
-                        conn = random.sample(conns, 1)[0]
-                        if not conn.is_connected():
-                            host_and_ports = conn.transport._Transport__host_and_ports[0][0]
-                            record_counter('daemons.hermes.reconnect.%s' % host_and_ports.split('.')[0])
-                            conn.start()
-                            if not use_ssl:
-                                logging.info('[broker] %i:%i - connecting with USERPASS to %s',
-                                             heartbeat['assign_thread'],
-                                             heartbeat['nr_threads'],
-                                             host_and_ports)
-                                conn.connect(username, password, wait=True)
-                            else:
-                                logging.info('[broker] %i:%i - connecting with SSL to %s',
-                                             heartbeat['assign_thread'],
-                                             heartbeat['nr_threads'],
-                                             host_and_ports)
-                                conn.connect(wait=True)
-
-                        conn.send(body=json.dumps({'event_type': str(message['event_type']).lower(),
-                                                   'payload': message['payload'],
-                                                   'created_at': str(message['created_at'])}),
-                                  destination=destination,
-                                  headers={'persistent': 'true',
-                                           'event_type': str(message['event_type']).lower()})
-
-                        to_delete.append({'id': message['id'],
-                                          'created_at': message['created_at'],
-                                          'updated_at': message['created_at'],
-                                          'payload': json.dumps(message['payload']),
-                                          'event_type': message['event_type']})
-                    except ValueError:
-                        logging.warn('Cannot serialize payload to JSON: %s',
-                                     str(message['payload']))
-                        to_delete.append({'id': message['id'],
-                                          'created_at': message['created_at'],
-                                          'updated_at': message['created_at'],
-                                          'payload': str(message['payload']),
-                                          'event_type': message['event_type']})
-                        continue
-                    except stomp.exception.NotConnectedException as error:
-                        logging.warn('Could not deliver message due to NotConnectedException: %s',
-                                     str(error))
-                        continue
-                    except stomp.exception.ConnectFailedException as error:
-                        logging.warn('Could not deliver message due to ConnectFailedException: %s',
-                                     str(error))
-                        continue
-                    except Exception as error:
-                        logging.warn('Could not deliver message: %s', str(error))
-                        logging.critical(traceback.format_exc())
-                        continue
-
-                    if str(message['event_type']).lower().startswith('transfer') or str(message['event_type']).lower().startswith('stagein'):
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, request-id: %s, transfer-id: %s, created_at: %s',
-                                      heartbeat['assign_thread'], heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload'].get('scope', None),
-                                      message['payload'].get('name', None),
-                                      message['payload'].get('dst-rse', None),
-                                      message['payload'].get('request-id', None),
-                                      message['payload'].get('transfer-id', None),
-                                      str(message['created_at']))
-
-                    elif str(message['event_type']).lower().startswith('dataset'):
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, rule-id: %s, created_at: %s)',
-                                      heartbeat['assign_thread'],
-                                      heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload']['scope'],
-                                      message['payload']['name'],
-                                      message['payload']['rse'],
-                                      message['payload']['rule_id'],
-                                      str(message['created_at']))
-
-                    elif str(message['event_type']).lower().startswith('deletion'):
-                        if 'url' not in message['payload']:
-                            message['payload']['url'] = 'unknown'
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, url: %s, created_at: %s)',
-                                      heartbeat['assign_thread'],
-                                      heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload']['scope'],
-                                      message['payload']['name'],
-                                      message['payload']['rse'],
-                                      message['payload']['url'],
-                                      str(message['created_at']))
-                    else:
-                        logging.debug('[broker] %i:%i - other message: %s',
-                                      heartbeat['assign_thread'], heartbeat['nr_threads'],
-                                      message)
-
-                delete_messages(to_delete)
+                if fan_out:
+                    t_deliver = time.time()
+                    to_delete = __fan_out_messages(conns, messages, destination, heartbeat, use_ssl, username, password)
+                    record_timer('daemons.hermes.fan_out', (time.time() - t_deliver) * 1000)
+                else:
+                    for message in messages:
+                        try:
+                            conn = random.sample(conns, 1)[0]
+                            if not conn.is_connected():
+                                host_and_ports = conn.transport._Transport__host_and_ports[0][0]
+                                record_counter('daemons.hermes.reconnect.%s' % host_and_ports.split('.')[0])
+                                conn.start()
+                                if not use_ssl:
+                                    logging.info('[broker] %i:%i - connecting with USERPASS to %s',
+                                                 heartbeat['assign_thread'],
+                                                 heartbeat['nr_threads'],
+                                                 host_and_ports)
+                                    conn.connect(username, password, wait=True)
+                                else:
+                                    logging.info('[broker] %i:%i - connecting with SSL to %s',
+                                                 heartbeat['assign_thread'],
+                                                 heartbeat['nr_threads'],
+                                                 host_and_ports)
+                                    conn.connect(wait=True)
+
+                            conn.send(body=json.dumps({'event_type': str(message['event_type']).lower(),
+                                                       'payload': message['payload'],
+                                                       'created_at': str(message['created_at'])}),
+                                      destination=destination,
+                                      headers={'persistent': 'true',
+                                               'event_type': str(message['event_type']).lower()})
+
+                            to_delete.append({'id': message['id'],
+                                              'created_at': message['created_at'],
+                                              'updated_at': message['created_at'],
+                                              'payload': json.dumps(message['payload']),
+                                              'event_type': message['event_type']})
+                        except ValueError:
+                            logging.warn('Cannot serialize payload to JSON: %s',
+                                         str(message['payload']))
+                            to_delete.append({'id': message['id'],
+                                              'created_at': message['created_at'],
+                                              'updated_at': message['created_at'],
+                                              'payload': str(message['payload']),
+                                              'event_type': message['event_type']})
+                            continue
+                        except stomp.exception.NotConnectedException as error:
+                            logging.warn('Could not deliver message due to NotConnectedException: %s',
+                                         str(error))
+                            continue
+                        except stomp.exception.ConnectFailedException as error:
+                            logging.warn('Could not deliver message due to ConnectFailedException: %s',
+                                         str(error))
+                            continue
+                        except Exception as error:
+                            logging.warn('Could not deliver message: %s', str(error))
+                            logging.critical(traceback.format_exc())
+                            continue
+
+                        __log_message(heartbeat, message)
+
+                delete_messages(to_delete, archive=history_writer is None)
+                if history_writer:
+                    history_writer.put(to_delete)
                 logging.info('[broker] %i:%i - submitted %i messages',
                              heartbeat['assign_thread'],
                              heartbeat['nr_threads'],
@@ -380,9 +541,12 @@ def stop(signum=None, frame=None):
 
 
 def run(once=False, send_email=True, threads=1, bulk=1000, delay=10, broker_timeout=3,
-        broker_retry=3):
+        broker_retry=3, fan_out=False):
     '''
     Starts up the hermes threads.
+
+    With fan_out, each thread sends in parallel to all the brokers and the delivered messages
+    are archived to the history by a shared background writer.
     '''
 
     logging.info('resolving brokers')
@@ -406,12 +570,18 @@ def run(once=False, send_email=True, threads=1, bulk=1000, delay=10, broker_time
 
     logging.debug('brokers resolved to %s', brokers_resolved)
 
+    history_writer = None
+    if fan_out:
+        history_writer = HistoryWriter(bulk=bulk)
+        history_writer.start()
+
     if once:
         logging.info('executing one hermes iteration only')
         deliver_messages(once=once,
                          brokers_resolved=brokers_resolved,
                          bulk=bulk, delay=delay,
-                         broker_timeout=broker_timeout, broker_retry=broker_retry)
+                         broker_timeout=broker_timeout, broker_retry=broker_retry,
+                         fan_out=fan_out, history_writer=history_writer)
         deliver_emails(once=once,
                        send_email=send_email, bulk=bulk, delay=delay)
 
@@ -422,7 +592,9 @@ def run(once=False, send_email=True, threads=1, bulk=1000, delay=10, broker_time
                                                                          'bulk': bulk,
                                                                          'delay': delay,
                                                                          'broker_timeout': broker_timeout,
-                                                                         'broker_retry': broker_retry}) for i in range(0, threads)]
+                                                                         'broker_retry': broker_retry,
+                                                                         'fan_out': fan_out,
+                                                                         'history_writer': history_writer}) for i in range(0, threads)]
 
         for thrd in range(0, 1):
             thread_list.append(threading.Thread(target=deliver_emails, kwargs={'thread': thrd,
@@ -437,3 +609,6 @@ def run(once=False, send_email=True, threads=1, bulk=1000, delay=10, broker_time
         # Interruptible joins require a timeout.
         while thread_list:
             thread_list = [t.join(timeout=3.14) for t in thread_list if t and t.isAlive()]
+
+    if history_writer:
+        history_writer.stop()
@@ -46,7 +46,7 @@ from rucio.common.config import config_get
 from rucio.common.exception import DatabaseException, DataIdentifierNotFound, ReplicationRuleCreationTemporaryFailed
 from rucio.common.types import InternalScope
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.rule import re_evaluate_did, get_updated_dids, delete_updated_did
+from rucio.core.rule import re_evaluate_did, get_updated_dids, delete_updated_dids
 from rucio.core.monitor import record_counter
 
 graceful_stop = threading.Event()
@@ -59,9 +59,13 @@ logging.basicConfig(stream=sys.stdout,
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def re_evaluator(once=False):
+def re_evaluator(once=False, incremental=False):
     """
     Main loop to check the re-evaluation of dids.
+
+    :param once:         Run only once.
+    :param incremental:  Only evaluate the children detached since the oldest pending event of a did,
+                         instead of comparing all the locks of its rules with their content.
     """
 
     hostname = socket.gethostname()
@@ -96,29 +100,35 @@ def re_evaluator(once=False):
                 logging.debug('re_evaluator[%s/%s] did not get any work (paused_dids=%s)' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, str(len(paused_dids))))
                 graceful_stop.wait(30)
             else:
-                done_dids = {}
+                # Coalesce the events of the same did and action, they are evaluated only once
+                events = []
+                event_ids = {}
                 for did in dids:
+                    did_event = (did.scope.internal, did.name, did.rule_evaluation_action)
+                    if did_event not in event_ids:
+                        event_ids[did_event] = []
+                        events.append(did)
+                    event_ids[did_event].append(did.id)
+                if len(events) < len(dids):
+                    record_counter('rule.judge.evaluator.coalesced_events', len(dids) - len(events))
+
+                for did in events:
                     if graceful_stop.is_set():
                         break
 
-                    # Check if this did has already been operated on
-                    did_tag = '%s:%s' % (did.scope.internal, did.name)
-                    if did_tag in done_dids:
-                        if did.rule_evaluation_action in done_dids[did_tag]:
-                            logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s already done' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
-                            delete_updated_did(id=did.id)
-                            continue
-                    else:
-                        done_dids[did_tag] = []
+                    ids = event_ids[(did.scope.internal, did.name, did.rule_evaluation_action)]
+                    if len(ids) > 1:
+                        logging.debug('re_evaluator[%s/%s]: coalesced %d events of %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, len(ids), did.scope, did.name))
 
                     try:
                         start_time = time.time()
-                        re_evaluate_did(scope=did.scope, name=did.name, rule_evaluation_action=did.rule_evaluation_action)
+                        # The events are ordered by creation, so the first one is the oldest pending detach
+                        re_evaluate_did(scope=did.scope, name=did.name, rule_evaluation_action=did.rule_evaluation_action,
+                                        detached_since=did.created_at if incremental else None)
                         logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name, time.time() - start_time))
-                        delete_updated_did(id=did.id)
-                        done_dids[did_tag].append(did.rule_evaluation_action)
+                        delete_updated_dids(ids=ids)
                     except DataIdentifierNotFound as e:
-                        delete_updated_did(id=did.id)
+                        delete_updated_dids(ids=ids)
                     except (DatabaseException, DatabaseError) as e:
                         if match('.*ORA-00054.*', str(e.args[0])):
                             paused_dids[(did.scope.internal, did.name)] = datetime.utcnow() + timedelta(seconds=randint(60, 600))
@@ -167,7 +177,7 @@ def stop(signum=None, frame=None):
     graceful_stop.set()
 
 
-def run(once=False, threads=1):
+def run(once=False, threads=1, incremental=False):
     """
     Starts up the Judge-Eval threads.
     """
@@ -176,10 +186,10 @@ def run(once=False, threads=1):
     sanity_check(executable='rucio-judge-evaluator', hostname=hostname)
 
     if once:
-        re_evaluator(once)
+        re_evaluator(once=once, incremental=incremental)
     else:
         logging.info('Evaluator starting %s threads' % str(threads))
-        threads = [threading.Thread(target=re_evaluator, kwargs={'once': once}) for i in range(0, threads)]
+        threads = [threading.Thread(target=re_evaluator, kwargs={'once': once, 'incremental': incremental}) for i in range(0, threads)]
         [t.start() for t in threads]
         # Interruptible joins require a timeout.
         while threads[0].is_alive():
@@ -30,6 +30,10 @@ Reaper is a daemon to manage file deletion.
 
 from __future__ import print_function, division
 
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 import logging
 import os
 import socket
@@ -54,7 +58,7 @@ from rucio.common.utils import chunks
 from rucio.core import monitor
 from rucio.core.config import get
 from rucio.core.credential import get_signed_url
-from rucio.core.heartbeat import live, die, sanity_check, list_payload_counts
+from rucio.core.heartbeat import live, die, sanity_check, list_payload_counts, update_payload
 from rucio.core.message import add_message
 from rucio.core.replica import list_and_mark_unlocked_replicas, delete_replicas
 from rucio.core.rse import list_rses, get_rse_limits, get_rse_usage, list_rse_attributes, get_rse_protocols
@@ -269,8 +273,171 @@ def __check_rse_usage(rse, rse_id, prepend_str):
     return result
 
 
+def __resolve_pfns(replicas, rse_info, scheme, prepend_str):
+    """
+    Internal method to set the deletion PFN of a chunk of replicas with one lfns2pfns call.
+
+    :param replicas:     List of replicas of an RSE. The PFN is set in place under the key pfn.
+    :param rse_info:     The RSE settings.
+    :param scheme:       Force a particular protocol, e.g., mock.
+    :param prepend_str:  String to prepend to the log messages.
+    """
+    lfns = [{'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']} for replica in replicas]
+    try:
+        pfns = rsemgr.lfns2pfns(rse_settings=rse_info, lfns=lfns, operation='delete', scheme=scheme)
+    except (ReplicaUnAvailable, ReplicaNotFound):
+        # One of the replicas cannot be resolved, fall back to one call per replica
+        pfns = {}
+        for lfn in lfns:
+            try:
+                pfns.update(rsemgr.lfns2pfns(rse_settings=rse_info, lfns=[lfn], operation='delete', scheme=scheme))
+            except (ReplicaUnAvailable, ReplicaNotFound) as error:
+                logging.warning('%s Failed get pfn UNAVAILABLE replica %s:%s on %s with error %s', prepend_str, lfn['scope'], lfn['name'], rse_info['rse'], str(error))
+
+    for replica in replicas:
+        pfn = pfns.get('%s:%s' % (replica['scope'], replica['name']))
+        replica['pfn'] = str(pfn) if pfn else None
+
+
+class DeletionPipeline(object):
+    """
+    Storage and catalogue deletion stages of the pipelined reaper.
+
+    The replicas listed and marked by the reaper threads are queued per hostname and deleted
+    from the storage by a bounded pool of workers for each hostname. The replicas deleted from
+    the storage are then removed from the catalogue in bulk by a single thread. The queues are
+    bounded, so the database and the storage work overlap while a slow storage only stalls its
+    own workers.
+    """
+
+    def __init__(self, max_workers_by_hostname=5, scheme=None, queue_size=10, bulk_size=1000):
+        """
+        :param max_workers_by_hostname:  Maximum number of storage deletion workers per hostname.
+        :param scheme:                   Force the deletion to use a particular protocol, e.g., mock.
+        :param queue_size:               Maximum number of chunks of replicas waiting for each hostname.
+        :param bulk_size:                Maximum number of replicas deleted from the catalogue at once.
+        """
+        self.max_workers_by_hostname = max_workers_by_hostname
+        self.scheme = scheme
+        self.queue_size = queue_size
+        self.bulk_size = bulk_size
+        self.lock = threading.Lock()
+        self.deletion_queues = {}
+        self.deletion_workers = {}
+        self.catalogue_queue = Queue.Queue(maxsize=queue_size * max_workers_by_hostname)
+        self.catalogue_worker = threading.Thread(target=self._catalogue_deletion)
+        self.catalogue_worker.start()
+
+    def _get_deletion_queue(self, hostname):
+        """
+        Return the queue of a hostname, starting its storage deletion workers if needed.
+
+        :param hostname: The hostname of the storage.
+        """
+        with self.lock:
+            if hostname not in self.deletion_queues:
+                self.deletion_queues[hostname] = Queue.Queue(maxsize=self.queue_size)
+                self.deletion_workers[hostname] = [threading.Thread(target=self._storage_deletion, args=(hostname, )) for _ in range(self.max_workers_by_hostname)]
+                for worker in self.deletion_workers[hostname]:
+                    worker.start()
+            return self.deletion_queues[hostname]
+
+    def is_full(self, hostname):
+        """
+        Check if the queue of a hostname is full, i.e. if its storage is not keeping up.
+
+        :param hostname: The hostname of the storage.
+
+        :returns: True if no more replicas can be queued for the hostname.
+        """
+        return self._get_deletion_queue(hostname).full()
+
+    def submit(self, hostname, rse_id, rse_info, replicas, staging_areas, prepend_str):
+        """
+        Queue a chunk of replicas for deletion. Blocks while the queue of the hostname is full.
+
+        :param hostname:       The hostname of the storage.
+        :param rse_id:         The RSE id.
+        :param rse_info:       The RSE settings.
+        :param replicas:       List of replicas with their PFN.
+        :param staging_areas:  List of the staging areas.
+        :param prepend_str:    String to prepend to the log messages.
+        """
+        self._get_deletion_queue(hostname).put((rse_id, rse_info, replicas, staging_areas, prepend_str))
+
+    def _storage_deletion(self, hostname):
+        """
+        Storage deletion worker of a hostname.
+
+        :param hostname: The hostname of the storage.
+        """
+        deletion_queue = self.deletion_queues[hostname]
+        while True:
+            item = deletion_queue.get()
+            if item is None:
+                break
+            rse_id, rse_info, replicas, staging_areas, prepend_str = item
+            try:
+                del_start_time = time.time()
+                prot = rsemgr.create_protocol(rse_info, 'delete', scheme=self.scheme)
+                deleted_files = delete_from_storage(replicas, prot, rse_info, staging_areas, prepend_str)
+                logging.info('%s %i files processed on %s in %s seconds', prepend_str, len(replicas), hostname, time.time() - del_start_time)
+                self.catalogue_queue.put((rse_id, rse_info['rse'], deleted_files, prepend_str))
+            except Exception:
+                logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+
+    def _catalogue_deletion(self):
+        """
+        Catalogue deletion worker. Accumulates the replicas deleted from the storages and
+        removes them from the catalogue once bulk_size replicas are pending or the queue is idle.
+        """
+        pending, nb_pending, stopping = {}, 0, False
+        while not stopping:
+            try:
+                item = self.catalogue_queue.get(timeout=1)
+                if item is None:
+                    stopping = True
+                else:
+                    rse_id, rse_name, deleted_files, prepend_str = item
+                    pending.setdefault((rse_id, rse_name, prepend_str), []).extend(deleted_files)
+                    nb_pending += len(deleted_files)
+                    if nb_pending < self.bulk_size and not self.catalogue_queue.empty():
+                        continue
+            except Queue.Empty:
+                pass
+
+            for (rse_id, rse_name, prepend_str), deleted_files in pending.items():
+                for files in chunks(deleted_files, self.bulk_size):
+                    del_start = time.time()
+                    try:
+                        with monitor.record_timer_block('reaper.delete_replicas'):
+                            delete_replicas(rse_id=rse_id, files=files)
+                        logging.debug('%s delete_replicas successed on %s : %s replicas in %s seconds', prepend_str, rse_name, len(files), time.time() - del_start)
+                        monitor.record_counter(counters='reaper.deletion.done', delta=len(files))
+                    except (DatabaseException, IntegrityError, DatabaseError) as error:
+                        logging.error('%s %s', prepend_str, str(error))
+                    except Exception:
+                        logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+            pending, nb_pending = {}, 0
+
+    def stop(self):
+        """
+        Drain the queues and stop all the workers.
+        """
+        with self.lock:
+            hostnames = list(self.deletion_queues)
+        for hostname in hostnames:
+            for _ in self.deletion_workers[hostname]:
+                self.deletion_queues[hostname].put(None)
+        for hostname in hostnames:
+            for worker in self.deletion_workers[hostname]:
+                worker.join()
+        self.catalogue_queue.put(None)
+        self.catalogue_worker.join()
+
+
 def reaper(rses, chunk_size=100, once=False, greedy=False,
-           scheme=None, delay_seconds=0, sleep_time=60):
+           scheme=None, delay_seconds=0, sleep_time=60, deletion_pipeline=None):
     """
     Main loop to select and delete files.
 
@@ -281,12 +448,17 @@ def reaper(rses, chunk_size=100, once=False, greedy=False,
     :param scheme:         Force the reaper to use a particular protocol, e.g., mock.
     :param delay_seconds:  The delay to query replicas in BEING_DELETED state.
     :param sleep_time:     Time between two cycles.
+    :param deletion_pipeline: If set, the DeletionPipeline which deletes the listed replicas from the storage and the catalogue.
     """
 
     try:
-        max_deletion_thread = get('reaper', 'nb_workers_by_hostname')
+        max_deletion_thread = int(get('reaper', 'nb_workers_by_hostname'))
     except ConfigNotFound as error:
         max_deletion_thread = 5
+    try:
+        payload_count_ttl = int(get('reaper', 'payload_count_ttl'))
+    except ConfigNotFound:
+        payload_count_ttl = 60
     hostname = socket.getfqdn()
     executable = sys.argv[0]
     pid = os.getpid()
@@ -350,13 +522,18 @@ def reaper(rses, chunk_size=100, once=False, greedy=False,
             random.shuffle(list_rses_mult)
 
             skip_until_next_run = []
+            # Snapshot of the payload counts, refreshed every payload_count_ttl seconds and updated locally with the claims of this thread
+            # The payload of the thread was reset by the heartbeat at the beginning of the cycle
+            payload_cnt, payload_cnt_time, current_payload = None, 0, None
             for rse_name, rse_id, needed_free_space, max_being_deleted_files in list_rses_mult:
                 if rse_id in skip_until_next_run:
                     continue
                 logging.debug('%s Working on %s. Percentage of the total space needed %.2f', prepend_str, rse_name, needed_free_space / tot_needed_free_space * 100)
                 rse_hostname, rse_info = rses_hostname_mapping[rse_id]
                 rse_hostname_key = '%s,%s' % (rse_id, rse_hostname)
-                payload_cnt = list_payload_counts(executable, older_than=600, hash_executable=None, session=None)
+                if payload_cnt is None or time.time() - payload_cnt_time > payload_count_ttl:
+                    payload_cnt = list_payload_counts(executable, older_than=600, hash_executable=None, session=None)
+                    payload_cnt_time = time.time()
                 # logging.debug('%s Payload count : %s', prepend_str, str(payload_cnt))
                 tot_threads_for_hostname = 0
                 tot_threads_for_rse = 0
@@ -372,8 +549,17 @@ def reaper(rses, chunk_size=100, once=False, greedy=False,
                     # Might need to reschedule a try on this RSE later in the same cycle
                     continue
 
+                if deletion_pipeline and deletion_pipeline.is_full(rse_hostname):
+                    logging.debug('%s Deletion queue for %s is full. Back off on RSE %s', prepend_str, rse_hostname, rse_name)
+                    continue
+
                 logging.info('%s Nb workers on %s smaller than the limit (current %i vs max %i). Starting new worker on RSE %s', prepend_str, rse_hostname, tot_threads_for_hostname, max_deletion_thread, rse_name)
-                live(executable, hostname, pid, hb_thread, older_than=600, hash_executable=None, payload=rse_hostname_key, session=None)
+                # Claim the payload with a single heartbeat update and account for it in the snapshot
+                update_payload(executable, hostname, pid, hb_thread, payload=rse_hostname_key, session=None)
+                if current_payload and payload_cnt.get(current_payload):
+                    payload_cnt[current_payload] -= 1
+                payload_cnt[rse_hostname_key] = payload_cnt.get(rse_hostname_key, 0) + 1
+                current_payload = rse_hostname_key
                 logging.debug('%s Total deletion workers for %s : %i', prepend_str, rse_hostname, tot_threads_for_hostname + 1)
                 # List and mark BEING_DELETED the files to delete
                 del_start_time = time.time()
@@ -395,25 +581,24 @@ def reaper(rses, chunk_size=100, once=False, greedy=False,
                 except Exception:
                     logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
 
+                if deletion_pipeline:
+                    # Physical and catalogue deletion take place in the pipeline
+                    try:
+                        for file_replicas in chunks(replicas, 100):
+                            __resolve_pfns(file_replicas, rse_info, scheme, prepend_str)
+                            deletion_pipeline.submit(rse_hostname, rse_id, rse_info, file_replicas, staging_areas, prepend_str)
+                    except Exception:
+                        logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+                    continue
+
                 # Physical  deletion will take place there
                 try:
                     prot = rsemgr.create_protocol(rse_info, 'delete', scheme=scheme)
                     for file_replicas in chunks(replicas, 100):
                         # Refresh heartbeat
-                        live(executable, hostname, pid, hb_thread, older_than=600, hash_executable=None, payload=rse_hostname_key, session=None)
+                        update_payload(executable, hostname, pid, hb_thread, payload=rse_hostname_key, session=None)
                         del_start_time = time.time()
-                        for replica in file_replicas:
-                            try:
-                                replica['pfn'] = str(rsemgr.lfns2pfns(rse_settings=rse_info,
-                                                                      lfns=[{'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']}],
-                                                                      operation='delete', scheme=scheme).values()[0])
-                                time.sleep(random.uniform(0, 0.01))
-                            except (ReplicaUnAvailable, ReplicaNotFound) as error:
-                                logging.warning('%s Failed get pfn UNAVAILABLE replica %s:%s on %s with error %s', prepend_str, replica['scope'], replica['name'], rse_name, str(error))
-                                replica['pfn'] = None
-
-                            except Exception:
-                                logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+                        __resolve_pfns(file_replicas, rse_info, scheme, prepend_str)
 
                         deleted_files = delete_from_storage(file_replicas, prot, rse_info, staging_areas, prepend_str)
                         logging.info('%s %i files processed in %s seconds', prepend_str, len(file_replicas), time.time() - del_start_time)
@@ -457,7 +642,7 @@ def stop(signum=None, frame=None):
     GRACEFUL_STOP.set()
 
 
-def run(threads=1, chunk_size=100, once=False, greedy=False, rses=None, scheme=None, exclude_rses=None, include_rses=None, delay_seconds=0, sleep_time=60):
+def run(threads=1, chunk_size=100, once=False, greedy=False, rses=None, scheme=None, exclude_rses=None, include_rses=None, delay_seconds=0, sleep_time=60, pipeline=False):
     """
     Starts up the reaper threads.
 
@@ -472,6 +657,7 @@ def run(threads=1, chunk_size=100, once=False, greedy=False, rses=None, scheme=N
     :param include_rses:       RSE expression to include RSEs.
     :param delay_seconds:      The delay to query replicas in BEING_DELETED state.
     :param sleep_time:         Time between two cycles.
+    :param pipeline:           If True, the storage and catalogue deletions are done by a pipeline shared by the threads.
     """
     logging.info('main: starting processes')
 
@@ -501,6 +687,15 @@ def run(threads=1, chunk_size=100, once=False, greedy=False, rses=None, scheme=N
 
     logging.info('Reaper: This instance will work on RSEs: %s', ', '.join([rse['rse'] for rse in rses]))
 
+    deletion_pipeline = None
+    if pipeline:
+        try:
+            max_deletion_thread = int(get('reaper', 'nb_workers_by_hostname'))
+        except ConfigNotFound:
+            max_deletion_thread = 5
+        logging.info('starting deletion pipeline with %i workers by hostname', max_deletion_thread)
+        deletion_pipeline = DeletionPipeline(max_workers_by_hostname=max_deletion_thread, scheme=scheme)
+
     logging.info('starting reaper threads')
     threads_list = [threading.Thread(target=reaper, kwargs={'once': once,
                                                             'rses': rses,
@@ -508,7 +703,8 @@ def run(threads=1, chunk_size=100, once=False, greedy=False, rses=None, scheme=N
                                                             'greedy': greedy,
                                                             'sleep_time': sleep_time,
                                                             'delay_seconds': delay_seconds,
-                                                            'scheme': scheme}) for _ in range(0, threads)]
+                                                            'scheme': scheme,
+                                                            'deletion_pipeline': deletion_pipeline}) for _ in range(0, threads)]
 
     for thread in threads_list:
         thread.start()
@@ -521,3 +717,7 @@ def run(threads=1, chunk_size=100, once=False, greedy=False, rses=None, scheme=N
     # Interruptible joins require a timeout.
     while threads_list:
         threads_list = [thread.join(timeout=3.14) for thread in threads_list if thread and thread.isAlive()]
+
+    if deletion_pipeline:
+        logging.info('draining deletion pipeline')
+        deletion_pipeline.stop()
@@ -33,28 +33,29 @@ import re
 import socket
 
 from datetime import datetime
-from json import loads as jloads, dumps as jdumps
+from json import loads as jloads
 from os import getpid
 try:
     from Queue import Queue  # py2
 except ImportError:
     from queue import Queue  # py3
 from sys import stdout
-from threading import Event, Thread, current_thread
+from threading import Event, Lock, Thread, current_thread
 from time import sleep, time
 from traceback import format_exc
 
+from six import string_types
 from stomp import Connection
 
 from rucio.common.config import config_get, config_get_bool, config_get_int
-from rucio.common.exception import ConfigNotFound
+from rucio.common.exception import ConfigNotFound, RSENotFound
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.core.monitor import record_counter, record_timer
 from rucio.core.config import get
-from rucio.core.did import touch_dids, list_parent_dids
+from rucio.core.did import touch_dids, list_parent_dids_bulk
 from rucio.core.heartbeat import live, die, sanity_check
 from rucio.core.lock import touch_dataset_locks
-from rucio.core.replica import touch_replica, touch_collection_replicas, declare_bad_file_replicas
+from rucio.core.replica import touch_replicas, touch_collection_replicas, declare_bad_file_replicas
 from rucio.core.rse import get_rse_id
 from rucio.db.sqla.constants import DIDType, BadFilesStatus
 
@@ -70,8 +71,101 @@ logging.basicConfig(stream=stdout,
 graceful_stop = Event()
 
 
+class AtimeAggregator(object):
+    """
+    Aggregates the access times of the file replicas by (scope, name, rse_id), keeping the latest one,
+    and applies them in bulk. Replicas hitting a locked row are kept for the next flush.
+    """
+    def __init__(self, flush_interval=10, max_size=10000, chunk_size=100, max_retries=5):
+        self.__flush_interval = flush_interval
+        self.__max_size = max_size
+        self.__chunk_size = chunk_size
+        self.__max_retries = max_retries
+        self.__replicas = {}
+        self.__lock = Lock()
+        self.__last_flush = time()
+
+    def add(self, replica):
+        """
+        Add the access of a replica, the latest access of a replica wins.
+
+        :param replica: Dictionary with scope, name, rse_id and accessed_at.
+        """
+        key = (replica['scope'], replica['name'], replica['rse_id'])
+        with self.__lock:
+            previous = self.__replicas.get(key)
+            if previous is None:
+                self.__replicas[key] = {'scope': replica['scope'], 'name': replica['name'], 'rse_id': replica['rse_id'],
+                                        'accessed_at': replica['accessed_at'], 'retries': replica.get('retries', 0)}
+            elif replica['accessed_at'] > previous['accessed_at']:
+                previous['accessed_at'] = replica['accessed_at']
+
+    def __len__(self):
+        return len(self.__replicas)
+
+    def is_due(self):
+        """
+        Check if the aggregated replicas have to be flushed.
+        """
+        return len(self.__replicas) >= self.__max_size or (self.__replicas and time() - self.__last_flush >= self.__flush_interval)
+
+    def flush(self):
+        """
+        Update the access times of the aggregated replicas.
+
+        :returns: Number of updated replicas.
+        """
+        with self.__lock:
+            replicas = list(self.__replicas.values())
+            self.__replicas = {}
+            self.__last_flush = time()
+        if not replicas:
+            return 0
+
+        start_time = time()
+        locked = []
+        for chunk in [replicas[i:i + self.__chunk_size] for i in range(0, len(replicas), self.__chunk_size)]:
+            locked.extend(self.__touch(chunk))
+
+        # the replicas hitting a locked row are retried at the next flush instead of being resubmitted to the broker
+        dropped = 0
+        for replica in locked:
+            replica['retries'] += 1
+            if replica['retries'] > self.__max_retries:
+                dropped += 1
+                continue
+            self.add(replica)
+
+        record_timer('daemons.tracer.kronos.update_atime', (time() - start_time) * 1000)
+        record_counter('daemons.tracer.kronos.updated_atime', len(replicas) - len(locked))
+        if locked:
+            record_counter('daemons.tracer.kronos.locked_atime', len(locked))
+            logging.warning('(kronos_file) hit %d locked rows, %d will be retried' % (len(locked), len(locked) - dropped))
+        if dropped:
+            record_counter('daemons.tracer.kronos.dropped_atime', dropped)
+        logging.info('(kronos_file) updated %d replicas in %d chunks (%fs)' % (len(replicas) - len(locked), (len(replicas) - 1) // self.__chunk_size + 1, time() - start_time))
+        return len(replicas) - len(locked)
+
+    def __touch(self, replicas):
+        """
+        Update the access times of a chunk of replicas, bisecting it to isolate the locked rows.
+
+        :param replicas: List of replicas.
+        :returns:        List of the replicas which could not be updated.
+        """
+        try:
+            if touch_replicas(replicas):
+                return []
+        except Exception:
+            logging.error(format_exc())
+            record_counter('daemons.tracer.kronos.update_error')
+        if len(replicas) == 1:
+            return replicas
+        return self.__touch(replicas[:len(replicas) // 2]) + self.__touch(replicas[len(replicas) // 2:])
+
+
 class AMQConsumer(object):
-    def __init__(self, broker, conn, queue, chunksize, subscription_id, excluded_usrdns, dataset_queue, bad_files_patterns):
+    def __init__(self, broker, conn, queue, chunksize, subscription_id, excluded_usrdns, dataset_queue, bad_files_patterns, atime_aggregator=None):
         self.__broker = broker
         self.__conn = conn
         self.__queue = queue
@@ -85,6 +179,7 @@ class AMQConsumer(object):
         self.__excluded_usrdns = excluded_usrdns
         self.__dataset_queue = dataset_queue
         self.__bad_files_patterns = bad_files_patterns
+        self.__atime_aggregator = atime_aggregator or AtimeAggregator()
 
     def on_error(self, headers, message):
         record_counter('daemons.tracer.kronos.error')
@@ -132,13 +227,18 @@ class AMQConsumer(object):
             self.__reports = []
             self.__ids = []
 
+            if self.__atime_aggregator.is_due():
+                self.__atime_aggregator.flush()
+
     def __update_atime(self):
         """
         Bulk update atime.
         """
         replicas = []
-        rses = []
+        files = []  # [(scope, name, rse_ids, accessed_at)]
+        rse_ids = {}  # rse -> rse_id, resolved once per chunk
         for report in self.__reports:
+            report_rse_ids = []
             try:
                 # Identify suspicious files
                 try:
@@ -217,7 +317,10 @@ class AMQConsumer(object):
 
                     rses = report['remoteSite'].strip().split(',')
                     for rse in rses:
-                        rse_id = get_rse_id(rse=rse)
+                        if rse not in rse_ids:
+                            rse_ids[rse] = get_rse_id(rse=rse)
+                        rse_id = rse_ids[rse]
+                        report_rse_ids.append(rse_id)
                         replicas.append({'name': report['filename'], 'scope': report['scope'], 'rse': rse, 'rse_id': rse_id, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix']),
                                          'traceTimeentryUnix': report['traceTimeentryUnix'], 'eventVersion': report['eventVersion']})
                 else:
@@ -228,7 +331,10 @@ class AMQConsumer(object):
                     rse = None
                     if 'remoteSite' in report:
                         rse = report['remoteSite']
-                        rse_id = get_rse_id(rse=rse)
+                        if rse not in rse_ids:
+                            rse_ids[rse] = get_rse_id(rse=rse)
+                        rse_id = rse_ids[rse]
+                        report_rse_ids.append(rse_id)
                     if 'datasetScope' in report:
                         self.__dataset_queue.put({'scope': report['datasetScope'], 'name': report['dataset'], 'rse_id': rse_id, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
                         continue
@@ -237,39 +343,34 @@ class AMQConsumer(object):
                             continue
                         replicas.append({'name': report['filename'], 'scope': report['scope'], 'rse': rse, 'rse_id': rse_id, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
 
-            except (KeyError, AttributeError):
+                files.append((report['scope'], report['filename'], report_rse_ids, datetime.utcfromtimestamp(report['traceTimeentryUnix'])))
+
+            except (KeyError, AttributeError, RSENotFound):
                 logging.error(format_exc())
                 record_counter('daemons.tracer.kronos.report_error')
                 continue
 
-            for did in list_parent_dids(report['scope'], report['filename']):
+        # the direct parent datasets of all the files of the chunk are resolved together
+        try:
+            parents = list_parent_dids_bulk([{'scope': scope, 'name': name} for scope, name, _, _ in files])
+        except Exception:
+            logging.error(format_exc())
+            record_counter('daemons.tracer.kronos.update_error')
+            parents = {}
+        for scope, name, rse_ids, accessed_at in files:
+            for did in parents.get((scope, name), []):
                 if did['type'] != DIDType.DATASET:
                     continue
                 # do not update _dis datasets
                 if did['scope'].external == 'panda' and '_dis' in did['name']:
                     continue
-                for rse in rses:
-                    rse_id = get_rse_id(rse=rse)
-                    self.__dataset_queue.put({'scope': did['scope'], 'name': did['name'], 'did_type': did['type'], 'rse_id': rse_id, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
+                for rse_id in rse_ids:
+                    self.__dataset_queue.put({'scope': did['scope'], 'name': did['name'], 'did_type': did['type'], 'rse_id': rse_id, 'accessed_at': accessed_at})
 
         logging.debug(replicas)
 
-        try:
-            start_time = time()
-            for replica in replicas:
-                # if touch replica hits a locked row put the trace back into queue for later retry
-                if not touch_replica(replica):
-                    resubmit = {'filename': replica['name'], 'scope': replica['scope'].external, 'remoteSite': replica['rse'], 'traceTimeentryUnix': replica['traceTimeentryUnix'],
-                                'eventType': 'get', 'usrdn': 'someuser', 'clientState': 'DONE', 'eventVersion': replica['eventVersion']}
-                    self.__conn.send(body=jdumps(resubmit), destination=self.__queue, headers={'appversion': 'rucio', 'resubmitted': '1'})
-                    record_counter('daemons.tracer.kronos.sent_resubmitted')
-                    logging.warning('(kronos_file) hit locked row, resubmitted to queue')
-            record_timer('daemons.tracer.kronos.update_atime', (time() - start_time) * 1000)
-        except Exception:
-            logging.error(format_exc())
-            record_counter('daemons.tracer.kronos.update_error')
-
-        logging.info('(kronos_file) updated %d replicas' % len(replicas))
+        for replica in replicas:
+            self.__atime_aggregator.add(replica)
 
 
 def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None, sleep_time=60):
@@ -310,6 +411,10 @@ def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None,
         password = config_get('tracer-kronos', 'password')
 
     excluded_usrdns = set(config_get('tracer-kronos', 'excluded_usrdns').split(','))
+    atime_aggregator = AtimeAggregator(flush_interval=int(config_get('tracer-kronos', 'atime_flush_interval', raise_exception=False, default=10)),
+                                       max_size=int(config_get('tracer-kronos', 'atime_max_size', raise_exception=False, default=10000)),
+                                       chunk_size=int(config_get('tracer-kronos', 'atime_chunk_size', raise_exception=False, default=100)),
+                                       max_retries=int(config_get('tracer-kronos', 'atime_max_retries', raise_exception=False, default=5)))
     vhost = config_get('tracer-kronos', 'broker_virtual_host', raise_exception=False)
 
     conns = []
@@ -344,17 +449,19 @@ def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None,
                                                                      subscription_id=subscription_id,
                                                                      excluded_usrdns=excluded_usrdns,
                                                                      dataset_queue=dataset_queue,
-                                                                     bad_files_patterns=bad_files_patterns))
+                                                                     bad_files_patterns=bad_files_patterns,
+                                                                     atime_aggregator=atime_aggregator))
                 conn.start()
                 if not use_ssl:
                     conn.connect(username, password)
                 else:
                     conn.connect()
                 conn.subscribe(destination=config_get('tracer-kronos', 'queue'), ack='client-individual', id=subscription_id, headers={'activemq.prefetchSize': prefetch_size})
-        tottime = time() - start_time
-        if tottime < sleep_time:
-            logging.info('(kronos_file) Will sleep for %s seconds' % (sleep_time - tottime))
-            sleep(sleep_time - tottime)
+        # flush the access times aggregated in quiet periods, the busy periods are flushed by the consumers
+        while time() - start_time < sleep_time and not graceful_stop.is_set():
+            if atime_aggregator.is_due():
+                atime_aggregator.flush()
+            graceful_stop.wait(1)
 
     logging.info('(kronos_file) graceful stop requested')
 
@@ -364,6 +471,9 @@ def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None,
         except Exception:
             pass
 
+    logging.info('(kronos_file) flushing %d aggregated replicas before shutdown...' % len(atime_aggregator))
+    atime_aggregator.flush()
+
     die(executable='kronos-file', hostname=hostname, pid=pid, thread=thread)
     logging.info('(kronos_file) graceful stop done')
 
@@ -376,13 +486,16 @@ def kronos_dataset(once=False, thread=0, dataset_queue=None, sleep_time=60):
     thread = current_thread()
 
     dataset_wait = config_get_int('tracer-kronos', 'dataset_wait')
+    chunk_size = int(config_get('tracer-kronos', 'dataset_chunk_size', raise_exception=False, default=100))
+    max_retry_size = int(config_get('tracer-kronos', 'dataset_max_retry_size', raise_exception=False, default=10000))
+    retry = {}
     start = datetime.now()
     sanity_check(executable='kronos-dataset', hostname=hostname)
     while not graceful_stop.is_set():
         start_time = time()
         live(executable='kronos-dataset', hostname=hostname, pid=pid, thread=thread)
         if (datetime.now() - start).seconds > dataset_wait:
-            __update_datasets(dataset_queue)
+            __update_datasets(dataset_queue, retry=retry, chunk_size=chunk_size, max_retry_size=max_retry_size)
             start = datetime.now()
         tottime = time() - start_time
         if tottime < sleep_time:
@@ -391,71 +504,88 @@ def kronos_dataset(once=False, thread=0, dataset_queue=None, sleep_time=60):
     # once again for the backlog
     die(executable='kronos-dataset', hostname=hostname, pid=pid, thread=thread)
     logging.info('(kronos_dataset) cleaning dataset backlog before shutdown...')
-    __update_datasets(dataset_queue)
+    __update_datasets(dataset_queue, retry=retry, chunk_size=chunk_size, max_retry_size=max_retry_size)
 
 
-def __update_datasets(dataset_queue):
+def __update_datasets(dataset_queue, retry=None, chunk_size=100, max_retry_size=10000):
+    """
+    Aggregate the dataset accesses of the queue, keeping the latest access, and update
+    the dids, dataset locks and collection replicas in chunks of multi-row statements.
+
+    :param dataset_queue:   Queue of the dataset accesses.
+    :param retry:           Dictionary table -> {(scope, name, rse_id): accessed_at} of the failed updates. They are merged
+                            into this flush and it is refilled with the updates failing again.
+    :param chunk_size:      Number of rows per statement.
+    :param max_retry_size:  Maximum number of failed updates kept per table, the next ones are dropped.
+    """
+    retry = {} if retry is None else retry
     len_ds = dataset_queue.qsize()
-    datasets = {}
-    dslocks = {}
+    updates = {'dids': retry.pop('dids', {}),
+               'dataset_locks': retry.pop('dataset_locks', {}),
+               'collection_replicas': retry.pop('collection_replicas', {})}
     now = time()
     for _ in range(0, len_ds):
         dataset = dataset_queue.get()
-        did = '%s:%s' % (dataset['scope'].internal, dataset['name'])
-        rse = dataset['rse_id']
-        if did not in datasets:
-            datasets[did] = dataset['accessed_at']
-        else:
-            datasets[did] = max(datasets[did], dataset['accessed_at'])
-
-        if rse is None:
-            continue
-        if did not in dslocks:
-            dslocks[did] = {}
-        if rse not in dslocks[did]:
-            dslocks[did][rse] = dataset['accessed_at']
-        else:
-            dslocks[did][rse] = max(dataset['accessed_at'], dslocks[did][rse])
+        scope = dataset['scope']
+        if isinstance(scope, string_types):
+            scope = InternalScope(scope)
+        accessed_at = dataset['accessed_at']
+        keys = [('dids', (scope, dataset['name'], None))]
+        if dataset['rse_id'] is not None:
+            keys.extend([('dataset_locks', (scope, dataset['name'], dataset['rse_id'])),
+                         ('collection_replicas', (scope, dataset['name'], dataset['rse_id']))])
+        for table, key in keys:
+            if key not in updates[table] or updates[table][key] < accessed_at:
+                updates[table][key] = accessed_at
     logging.debug('(kronos_dataset) fetched %d datasets from queue (%ds)' % (len_ds, time() - now))
 
-    total, failed, start = 0, 0, time()
-    for did, accessed_at in datasets.items():
-        scope, name = did.split(':')
-        scope = InternalScope(scope, fromExternal=False)
-        update_did = {'scope': scope, 'name': name, 'type': DIDType.DATASET, 'accessed_at': accessed_at}
-        # if update fails, put back in queue and retry next time
-        if not touch_dids((update_did,)):
-            update_did['rse_id'] = None
-            dataset_queue.put(update_did)
-            failed += 1
-        total += 1
-    logging.debug('(kronos_dataset) did update for %d datasets, %d failed (%ds)' % (total, failed, time() - start))
-
-    total, failed, start = 0, 0, time()
-    for did, rses in dslocks.items():
-        scope, name = did.split(':')
-        scope = InternalScope(scope, fromExternal=False)
-        for rse, accessed_at in rses.items():
-            update_dslock = {'scope': scope, 'name': name, 'rse_id': rse, 'accessed_at': accessed_at}
-            # if update fails, put back in queue and retry next time
-            if not touch_dataset_locks((update_dslock,)):
-                dataset_queue.put(update_dslock)
-                failed += 1
-            total += 1
-    logging.debug('(kronos_dataset) did update for %d locks, %d failed (%ds)' % (total, failed, time() - start))
-
-    total, failed, start = 0, 0, time()
-    for did, rses in dslocks.items():
-        scope, name = did.split(':')
-        scope = InternalScope(scope, fromExternal=False)
-        for rse, accessed_at in rses.items():
-            update_dslock = {'scope': scope, 'name': name, 'rse_id': rse, 'accessed_at': accessed_at}
-            # if update fails, put back in queue and retry next time
-            if not touch_collection_replicas((update_dslock,)):
-                dataset_queue.put(update_dslock)
-                failed += 1
-            total += 1
-    logging.debug('(kronos_dataset) did update for %d collection replicas, %d failed (%ds)' % (total, failed, time() - start))
+    for table, touch in [('dids', touch_dids), ('dataset_locks', touch_dataset_locks), ('collection_replicas', touch_collection_replicas)]:
+        failed = __flush_updates(table, updates[table], touch, chunk_size)
+        dropped = max(len(failed) - max_retry_size, 0)
+        if dropped:
+            record_counter('daemons.tracer.kronos.dataset.%s.dropped' % table, dropped)
+            logging.warning('(kronos_dataset) retry queue of %s is full, dropped %d updates' % (table, dropped))
+        retry[table] = dict(list(failed.items())[:max_retry_size])
+
+
+def __flush_updates(table, updates, touch, chunk_size):
+    """
+    Apply the aggregated access times of a table in chunks.
+
+    :param table:       Name of the table, for the logs and metrics.
+    :param updates:     Dictionary {(scope, name, rse_id): accessed_at}.
+    :param touch:       Function updating a list of rows, returning False on failure.
+    :param chunk_size:  Number of rows per call.
+    :returns:           Dictionary of the updates which failed.
+    """
+    failed = {}
+    keys = list(updates)
+    start = time()
+    for chunk in [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]:
+        rows = []
+        for scope, name, rse_id in chunk:
+            row = {'scope': scope, 'name': name, 'accessed_at': updates[(scope, name, rse_id)]}
+            if rse_id is None:
+                row['type'] = DIDType.DATASET
+            else:
+                row['rse_id'] = rse_id
+            rows.append(row)
+        try:
+            success = touch(rows)
+        except Exception:
+            logging.error(format_exc())
+            success = False
+        if not success:
+            # if update fails, keep it and retry next time
+            for key in chunk:
+                failed[key] = updates[key]
+    duration = time() - start
+    record_timer('daemons.tracer.kronos.dataset.%s.flush' % table, duration * 1000)
+    record_counter('daemons.tracer.kronos.dataset.%s.updated' % table, len(keys) - len(failed))
+    if failed:
+        record_counter('daemons.tracer.kronos.dataset.%s.failed' % table, len(failed))
+    logging.debug('(kronos_dataset) update for %d %s, %d failed (%ds)' % (len(keys), table, len(failed), duration))
+    return failed
 
 
 def stop(signum=None, frame=None):
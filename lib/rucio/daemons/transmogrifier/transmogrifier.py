@@ -46,12 +46,13 @@ from rucio.common.config import config_get
 from rucio.common.schema import validate_schema
 from rucio.common.utils import chunks
 from rucio.core import monitor, heartbeat
-from rucio.core.did import list_new_dids, set_new_dids, get_metadata
+from rucio.core.did import list_new_dids, set_new_dids, get_metadata_bulk
 from rucio.core.rse import list_rses
 from rucio.core.rse_expression_parser import parse_expression
 from rucio.core.rse_selector import RSESelector
-from rucio.core.rule import add_rule, list_rules
+from rucio.core.rule import add_rule, add_rules, list_rules
 from rucio.core.subscription import list_subscriptions, update_subscription
+from rucio.db.sqla.session import transactional_session
 
 
 logging.basicConfig(stream=stdout,
@@ -91,6 +92,92 @@ def _retrial(func, *args, **kwargs):
             raise
 
 
+# Regular expressions without special characters, which match the strings starting with them
+LITERAL_REGEXP = re.compile(r'^[^.^$*+?{}\[\]\\|()]*$')
+
+
+def __compile_filter(filter_string):
+    """
+    Compile the regular expressions of a parsed subscription filter.
+
+    param filter_string: The filter dictionnary of a subscription.
+    return: Dictionnary {pattern, excluded_pattern, scope, metadata, literals, split_rule}
+    """
+    subscription_filter = {'pattern': None,
+                           'excluded_pattern': None,
+                           'scope': None,
+                           'metadata': [],
+                           'literals': {},
+                           'split_rule': False}
+    for key in filter_string:
+        values = filter_string[key]
+        if key == 'pattern':
+            subscription_filter['pattern'] = re.compile(values).match
+        elif key == 'excluded_pattern':
+            subscription_filter['excluded_pattern'] = re.compile(values).match
+        elif key == 'split_rule':
+            if values == 'true':
+                values = True
+            elif values == 'false':
+                values = False
+            subscription_filter['split_rule'] = values
+        elif key == 'scope':
+            subscription_filter['scope'] = [re.compile(scope).match for scope in values]
+            if all(LITERAL_REGEXP.match(scope) for scope in values):
+                subscription_filter['literals']['scope'] = values
+        else:
+            if not isinstance(values, list):
+                values = [values, ]
+            subscription_filter['metadata'].append((str(key), [re.compile(str(value)).match for value in values]))
+            if all(LITERAL_REGEXP.match(str(value)) for value in values):
+                subscription_filter['literals'][str(key)] = [str(value) for value in values]
+    return subscription_filter
+
+
+def compile_subscription_filter(subscription):
+    """
+    Parse the filter and the replication rules of a subscription and compile its regular expressions.
+    The daemon skips the subscriptions whose filter or replication rules are invalid.
+
+    param subscription: The subscription dictionnary.
+    return: Dictionnary {pattern, excluded_pattern, scope, metadata, literals, split_rule, replication_rules},
+            None if the subscription is invalid
+    """
+    try:
+        subscription_filter = __compile_filter(loads(subscription['filter']))
+        subscription_filter['replication_rules'] = loads(subscription['replication_rules'])
+        return subscription_filter
+    except (ValueError, TypeError, re.error) as error:
+        logging.error('%s : Subscription will be skipped' % error)
+        return None
+
+
+def match_subscription_filter(subscription_filter, did, metadata):
+    """
+    Method to identify if a DID matches a compiled subscription filter.
+
+    param subscription_filter: The subscription filter, as returned by compile_subscription_filter.
+    param did: The DID dictionnary
+    param metadata: The metadata dictionnary for the DID
+    return: True/False
+    """
+    if metadata['hidden']:
+        return False
+    if subscription_filter['pattern'] and not subscription_filter['pattern'](did['name']):
+        return False
+    if subscription_filter['excluded_pattern'] and subscription_filter['excluded_pattern'](did['name']):
+        return False
+    if subscription_filter['scope'] is not None and not any(match(did['scope'].external) for match in subscription_filter['scope']):
+        return False
+    for key, matches in subscription_filter['metadata']:
+        if key not in metadata:
+            return False
+        value = str(metadata[key])
+        if not any(match(value) for match in matches):
+            return False
+    return True
+
+
 def is_matching_subscription(subscription, did, metadata):
     """
     Method to identify if a DID matches a subscription.
@@ -107,45 +194,257 @@ def is_matching_subscription(subscription, did, metadata):
     except ValueError as error:
         logging.error('%s : Subscription will be skipped' % error)
         return False
-    # Loop over the keys of filter_string for subscription
-    for key in filter_string:
-        values = filter_string[key]
-        if key == 'pattern':
-            if not re.match(values, did['name']):
-                return False
-        elif key == 'excluded_pattern':
-            if re.match(values, did['name']):
-                return False
-        elif key == 'split_rule':
-            pass
-        elif key == 'scope':
-            match_scope = False
-            for scope in values:
-                if re.match(scope, did['scope'].external):
-                    match_scope = True
-                    break
-            if not match_scope:
-                return False
-        else:
-            if not isinstance(values, list):
-                values = [values, ]
-            has_metadata = False
-            for meta in metadata:
-                if str(meta) == str(key):
-                    has_metadata = True
-                    match_meta = False
-                    for value in values:
-                        if re.match(str(value), str(metadata[meta])):
-                            match_meta = True
-                            break
-                    if not match_meta:
-                        return False
-            if not has_metadata:
-                return False
-    return True
+    return match_subscription_filter(__compile_filter(filter_string), did, metadata)
+
+
+class SubscriptionIndex(object):
+    """
+    Compiled subscriptions, indexed by the literal values of their scope or of one of their metadata,
+    so that a DID is only tested against the subscriptions it can match. The filters are compiled
+    once per version of the subscription.
+    """
+
+    def __init__(self):
+        self.subscriptions = []
+        self.filters = {}
+        self.index = {}
+        self.unindexed = []
+
+    def update(self, subscriptions):
+        """
+        Replace the indexed subscriptions, reusing the compiled filters of the unchanged ones.
+
+        param subscriptions: The list of subscription dictionnaries, ordered by priority.
+        """
+        filters = {}
+        self.subscriptions, self.index, self.unindexed = [], {}, []
+        for subscription in subscriptions:
+            version = (subscription['id'], subscription['filter'], subscription['replication_rules'])
+            subscription_filter = self.filters[version] if version in self.filters else compile_subscription_filter(subscription)
+            filters[version] = subscription_filter
+            if subscription_filter is None:
+                continue
+            position = len(self.subscriptions)
+            self.subscriptions.append((subscription, subscription_filter))
+            # index on the scope, or else on the metadata with the fewest literal values
+            literals = subscription_filter['literals']
+            if 'scope' in literals:
+                key = 'scope'
+            elif literals:
+                key = min(sorted(literals), key=lambda key: len(literals[key]))
+            else:
+                self.unindexed.append(position)
+                continue
+            for literal in literals[key]:
+                self.index.setdefault(key, {}).setdefault(literal, []).append(position)
+        self.filters = filters
+
+    def match(self, did, metadata):
+        """
+        Return the subscriptions matched by a DID, ordered by priority.
+
+        param did: The DID dictionnary
+        param metadata: The metadata dictionnary for the DID
+        return: List of tuples (subscription, compiled filter)
+        """
+        if metadata['hidden']:
+            return []
+        candidates = set(self.unindexed)
+        for key, literals in self.index.items():
+            value = did['scope'].external if key == 'scope' else metadata.get(key)
+            if value is None:
+                continue
+            # re.match only anchors the beginning, so every prefix of the value is a candidate literal
+            value = str(value)
+            for length in range(len(value) + 1):
+                candidates.update(literals.get(value[:length], []))
+        return [self.subscriptions[position] for position in sorted(candidates)
+                if match_subscription_filter(self.subscriptions[position][1], did, metadata)]
+
+
+def get_rule_specs(did, subscription, subscription_filter, blacklisted_rse_id, prepend_str=''):
+    """
+    Build the replication rules to create for a DID matching a subscription.
 
+    param did: The DID dictionnary
+    param subscription: The subscription dictionnary.
+    param subscription_filter: The compiled subscription filter, as returned by compile_subscription_filter.
+    param blacklisted_rse_id: The list of the RSE ids not available for writing.
+    param prepend_str: The prefix of the log messages.
+    return: List of dictionnaries {did, subscription, rule}, rule holding the parameters of add_rule
+    """
+    rule_specs = []
+    for rule_string in subscription_filter['replication_rules']:
+        # Get all the rule and subscription parameters
+        lifetime = rule_string.get('lifetime', None)
+        if lifetime:
+            lifetime = int(lifetime)
+        activity = rule_string.get('activity', 'User Subscriptions')
+        try:
+            validate_schema(name='activity', obj=activity)
+        except InputValidationError as error:
+            logging.error(prepend_str + 'Error validating the activity %s' % (str(error)))
+            activity = 'User Subscriptions'
+        rule = {'account': subscription['account'],
+                'copies': int(rule_string['copies']),
+                'rse_expression': str(rule_string['rse_expression']),
+                'grouping': rule_string.get('grouping', 'DATASET'),
+                'weight': rule_string.get('weight', None),
+                'lifetime': lifetime,
+                'locked': rule_string.get('locked', None) == 'True',
+                'subscription_id': subscription['id'],
+                'source_replica_expression': rule_string.get('source_replica_expression', None),
+                'activity': activity,
+                'purge_replicas': rule_string.get('purge_replicas', False) == 'True',
+                'ignore_availability': rule_string.get('ignore_availability', None),
+                'comment': str(subscription['comments'])}
+
+        # An invalid RSE expression would make the whole transaction of the rule fail
+        try:
+            rses = parse_expression(rule['rse_expression'])
+        except InvalidRSEExpression as error:
+            logging.error(prepend_str + '%s' % (str(error)))
+            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
+            continue
 
-def transmogrifier(bulk=5, once=False, sleep_time=60):
+        if not subscription_filter['split_rule']:
+            rule_specs.append({'did': {'scope': did['scope'], 'name': did['name']}, 'subscription': subscription, 'rule': rule})
+            continue
+
+        copies = rule['copies']
+        list_of_rses = [rse['id'] for rse in rses]
+        # Check that some rule doesn't already exist for this DID and subscription
+        preferred_rse_ids = []
+        for existing_rule in list_rules(filters={'subscription_id': str(subscription['id']), 'scope': did['scope'], 'name': did['name']}):
+            already_existing_rses = [(rse['rse'], rse['id']) for rse in parse_expression(existing_rule['rse_expression'])]
+            for rse, rse_id in already_existing_rses:
+                if (rse_id in list_of_rses) and (rse_id not in preferred_rse_ids):
+                    preferred_rse_ids.append(rse_id)
+        if len(preferred_rse_ids) >= copies:
+            continue
+
+        rse_id_dict = {}
+        for rse in rses:
+            rse_id_dict[rse['id']] = rse['rse']
+        try:
+            rseselector = RSESelector(account=rule['account'], rses=rses, weight=rule['weight'], copies=copies - len(preferred_rse_ids))
+            selected_rse_ids = [rse_id for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=blacklisted_rse_id)]
+        except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
+            logging.warning(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Try including blacklisted sites' %
+                            (subscription['name'], rule['account'], str(error)))
+            # Now including the blacklisted sites
+            try:
+                rseselector = RSESelector(account=rule['account'], rses=rses, weight=rule['weight'], copies=copies - len(preferred_rse_ids))
+                selected_rse_ids = [rse_id for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=[])]
+                rule['ignore_availability'] = True
+            except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
+                logging.error(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Skipping rule creation.' %
+                              (subscription['name'], rule['account'], str(error)))
+                monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
+                # The DID won't be reevaluated at the next cycle
+                continue
+
+        # One rule per selected RSE, the RSEs of the existing rules count as copies
+        selected_rse_ids = [rse_id for rse_id in selected_rse_ids if rse_id not in preferred_rse_ids]
+        for rse_id in selected_rse_ids[:copies - len(preferred_rse_ids)]:
+            logging.info(prepend_str + 'Will insert one rule for %s:%s on %s' % (did['scope'], did['name'], rse_id_dict[rse_id]))
+            rule_specs.append({'did': {'scope': did['scope'], 'name': did['name']},
+                               'subscription': subscription,
+                               'rule': dict(rule, copies=1, rse_expression=rse_id_dict[rse_id])})
+    return rule_specs
+
+
+def __record_rules(rule_specs):
+    """
+    Record the counters of the created rules.
+    """
+    monitor.record_counter(counters='transmogrifier.addnewrule.done', delta=len(rule_specs))
+    for rule_spec in rule_specs:
+        monitor.record_counter(counters='transmogrifier.addnewrule.activity.%s' % ''.join(rule_spec['rule']['activity'].split()), delta=1)
+
+
+def __group_rule_specs(rule_specs, rule_bulk):
+    """
+    Group the rule specifications by DID, up to rule_bulk rules per group, without splitting
+    the rules of a DID across groups. A DID with more than rule_bulk rules gets its own group.
+
+    param rule_specs: List of dictionnaries {did, subscription, rule}, as returned by get_rule_specs.
+    param rule_bulk: The maximum number of rules per group.
+    return: Generator of lists of rule specifications.
+    """
+    dids, rule_specs_per_did = [], {}
+    for rule_spec in rule_specs:
+        key = (rule_spec['did']['scope'], rule_spec['did']['name'])
+        if key not in rule_specs_per_did:
+            dids.append(key)
+            rule_specs_per_did[key] = []
+        rule_specs_per_did[key].append(rule_spec)
+
+    rule_group = []
+    for key in dids:
+        if rule_group and len(rule_group) + len(rule_specs_per_did[key]) > rule_bulk:
+            yield rule_group
+            rule_group = []
+        rule_group.extend(rule_specs_per_did[key])
+    if rule_group:
+        yield rule_group
+
+
+@transactional_session
+def __add_rules(rule_specs, session=None):
+    """
+    Create a group of replication rules in one transaction, with one add_rules per DID.
+
+    param rule_specs: List of dictionnaries {did, subscription, rule}, as returned by get_rule_specs.
+    param session: The database session in use.
+    """
+    dids, rules = [], {}
+    for rule_spec in rule_specs:
+        key = (rule_spec['did']['scope'], rule_spec['did']['name'])
+        if key not in rules:
+            dids.append(rule_spec['did'])
+            rules[key] = []
+        # add_rules updates the rule dictionnaries
+        rules[key].append(dict(rule_spec['rule']))
+    for did in dids:
+        add_rules(dids=[{'scope': did['scope'], 'name': did['name']}], rules=rules[(did['scope'], did['name'])], session=session)
+
+
+def __add_rule(rule_spec, prepend_str=''):
+    """
+    Create one replication rule in its own transaction, retrying the temporary failures.
+
+    param rule_spec: Dictionnary {did, subscription, rule}, as returned by get_rule_specs.
+    param prepend_str: The prefix of the log messages.
+    return: False if the rule cannot be inserted after all the attempts, True otherwise
+    """
+    did, rule = rule_spec['did'], rule_spec['rule']
+    nattempt = 5
+    for attempt in range(0, nattempt):
+        #  Try to create the rule
+        try:
+            add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], **rule)
+            __record_rules([rule_spec])
+            return True
+        except (InvalidReplicationRule, InvalidRuleWeight, InvalidRSEExpression, StagingAreaRuleRequiresLifetime, DuplicateRule) as error:
+            # Errors that won't be retried
+            logging.error(prepend_str + '%s' % (str(error)))
+            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
+            return True
+        except (ReplicationRuleCreationTemporaryFailed, InsufficientTargetRSEs, InsufficientAccountLimit, DatabaseException, RSEBlacklisted) as error:
+            # Errors to be retried
+            logging.error(prepend_str + '%s Will perform an other attempt %i/%i' % (str(error), attempt + 1, nattempt))
+            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
+        except Exception:
+            # Unexpected errors
+            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.unknown', delta=1)
+            exc_type, exc_value, exc_traceback = exc_info()
+            logging.critical(prepend_str + ''.join(format_exception(exc_type, exc_value, exc_traceback)).strip())
+    logging.error(prepend_str + 'Rule for %s:%s on %s cannot be inserted' % (did['scope'], did['name'], rule['rse_expression']))
+    return False
+
+
+def transmogrifier(bulk=5, once=False, sleep_time=60, rule_bulk=100):
     """
     Creates a Transmogrifier Worker that gets a list of new DIDs for a given hash,
     identifies the subscriptions matching the DIDs and
@@ -155,6 +454,7 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
     :param bulk: The number of requests to process.
     :param once: Run only once.
     :param sleep_time: Time between two cycles.
+    :param rule_bulk: The number of rules to create per transaction.
     """
 
     executable = ' '.join(argv)
@@ -162,6 +462,7 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
     pid = os.getpid()
     hb_thread = threading.current_thread()
     heartbeat.sanity_check(executable=executable, hostname=hostname)
+    subscription_index = SubscriptionIndex()
 
     while not graceful_stop.is_set():
 
@@ -195,6 +496,7 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
             #  Order the subscriptions according to their priority
             for priority in priorities:
                 subscriptions.extend(sub_dict[priority])
+            subscription_index.update(subscriptions)
         except SubscriptionNotFound as error:
             logging.warning(prepend_str + 'No subscriptions defined: %s' % (str(error)))
             time.sleep(10)
@@ -207,166 +509,64 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
             start_time = time.time()
             blacklisted_rse_id = [rse['id'] for rse in list_rses({'availability_write': False})]
             logging.debug(prepend_str + 'In transmogrifier worker')
+
+            #  Load the metadata of all the new datasets and containers at once
+            collections = [did for did in dids if did['did_type'] == str(DIDType.DATASET) or did['did_type'] == str(DIDType.CONTAINER)]
+            metadata_dict = {}
+            for metadata in get_metadata_bulk(collections):
+                metadata_dict[(metadata['scope'], metadata['name'])] = metadata
+            logging.debug(prepend_str + 'Time to get the metadata of %i DIDs : %f' % (len(collections), time.time() - start_time))
+
+            #  Build the rules of all the new DIDs matching a subscription
+            rule_specs = []
+            for did in collections:
+                did_tag = '%s:%s' % (did['scope'].internal, did['name'])
+                results[did_tag] = []
+                metadata = metadata_dict.get((did['scope'], did['name']))
+                if metadata is None:
+                    logging.warning(prepend_str + 'Data identifier %s:%s not found' % (did['scope'], did['name']))
+                    continue
+                # Loop over the subscriptions the DID can match
+                for subscription, subscription_filter in subscription_index.match(did, metadata):
+                    results[did_tag].append(subscription['id'])
+                    logging.info(prepend_str + '%s:%s matches subscription %s' % (did['scope'], did['name'], subscription['name']))
+                    rule_specs.extend(get_rule_specs(did, subscription, subscription_filter, blacklisted_rse_id, prepend_str))
+
+            #  Create the rules, up to rule_bulk per transaction and all the rules of a DID in the same transaction.
+            #  If a transaction fails, its rules are created one by one
+            failed_dids = set()
+            for rule_group in __group_rule_specs(rule_specs, rule_bulk):
+                stime = time.time()
+                try:
+                    __add_rules(rule_group)
+                    __record_rules(rule_group)
+                    logging.info(prepend_str + '%i rule(s) inserted in %f seconds' % (len(rule_group), time.time() - stime))
+                except Exception as error:
+                    logging.warning(prepend_str + 'Cannot insert %i rule(s) in one transaction, inserting them one by one : %s' % (len(rule_group), str(error)))
+                    monitor.record_counter(counters='transmogrifier.addnewrule.bulkerror', delta=1)
+                    for rule_spec in rule_group:
+                        if not __add_rule(rule_spec, prepend_str):
+                            failed_dids.add((rule_spec['did']['scope'], rule_spec['did']['name']))
+
             identifiers = []
-            #  Loop over all the new dids
             for did in dids:
-                did_success = True
-                if did['did_type'] == str(DIDType.DATASET) or did['did_type'] == str(DIDType.CONTAINER):
-                    did_tag = '%s:%s' % (did['scope'].internal, did['name'])
-                    results[did_tag] = []
-                    try:
-                        metadata = get_metadata(did['scope'], did['name'])
-                        # Loop over all the subscriptions
-                        for subscription in subscriptions:
-                            #  Check if the DID match the subscription
-                            if is_matching_subscription(subscription, did, metadata) is True:
-                                filter_string = loads(subscription['filter'])
-                                split_rule = filter_string.get('split_rule', False)
-                                if split_rule == 'true':
-                                    split_rule = True
-                                elif split_rule == 'false':
-                                    split_rule = False
-                                stime = time.time()
-                                results[did_tag].append(subscription['id'])
-                                logging.info(prepend_str + '%s:%s matches subscription %s' % (did['scope'], did['name'], subscription['name']))
-                                for rule_string in loads(subscription['replication_rules']):
-                                    # Get all the rule and subscription parameters
-                                    grouping = rule_string.get('grouping', 'DATASET')
-                                    lifetime = rule_string.get('lifetime', None)
-                                    ignore_availability = rule_string.get('ignore_availability', None)
-                                    weight = rule_string.get('weight', None)
-                                    source_replica_expression = rule_string.get('source_replica_expression', None)
-                                    locked = rule_string.get('locked', None)
-                                    if locked == 'True':
-                                        locked = True
-                                    else:
-                                        locked = False
-                                    purge_replicas = rule_string.get('purge_replicas', False)
-                                    if purge_replicas == 'True':
-                                        purge_replicas = True
-                                    else:
-                                        purge_replicas = False
-                                    rse_expression = str(rule_string['rse_expression'])
-                                    comment = str(subscription['comments'])
-                                    subscription_id = str(subscription['id'])
-                                    account = subscription['account']
-                                    copies = int(rule_string['copies'])
-                                    activity = rule_string.get('activity', 'User Subscriptions')
-                                    try:
-                                        validate_schema(name='activity', obj=activity)
-                                    except InputValidationError as error:
-                                        logging.error(prepend_str + 'Error validating the activity %s' % (str(error)))
-                                        activity = 'User Subscriptions'
-                                    if lifetime:
-                                        lifetime = int(lifetime)
-
-                                    str_activity = "".join(activity.split())
-                                    success = False
-                                    nattempt = 5
-                                    attemptnr = 0
-                                    skip_rule_creation = False
-
-                                    if split_rule:
-                                        rses = parse_expression(rse_expression)
-                                        list_of_rses = [rse['id'] for rse in rses]
-                                        # Check that some rule doesn't already exist for this DID and subscription
-                                        preferred_rse_ids = []
-                                        for rule in list_rules(filters={'subscription_id': subscription_id, 'scope': did['scope'], 'name': did['name']}):
-                                            already_existing_rses = [(rse['rse'], rse['id']) for rse in parse_expression(rule['rse_expression'])]
-                                            for rse, rse_id in already_existing_rses:
-                                                if (rse_id in list_of_rses) and (rse_id not in preferred_rse_ids):
-                                                    preferred_rse_ids.append(rse_id)
-                                        if len(preferred_rse_ids) >= copies:
-                                            skip_rule_creation = True
-
-                                        rse_id_dict = {}
-                                        for rse in rses:
-                                            rse_id_dict[rse['id']] = rse['rse']
-                                        try:
-                                            rseselector = RSESelector(account=account, rses=rses, weight=weight, copies=copies - len(preferred_rse_ids))
-                                            selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=blacklisted_rse_id)]
-                                        except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
-                                            logging.warning(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Try including blacklisted sites' %
-                                                            (subscription['name'], account, str(error)))
-                                            # Now including the blacklisted sites
-                                            try:
-                                                rseselector = RSESelector(account=account, rses=rses, weight=weight, copies=copies - len(preferred_rse_ids))
-                                                selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=[])]
-                                                ignore_availability = True
-                                            except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
-                                                logging.error(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Skipping rule creation.' %
-                                                              (subscription['name'], account, str(error)))
-                                                monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                                # The DID won't be reevaluated at the next cycle
-                                                did_success = did_success and True
-                                                continue
-
-                                    for attempt in range(0, nattempt):
-                                        attemptnr = attempt
-                                        nb_rule = 0
-                                        #  Try to create the rule
-                                        try:
-                                            if split_rule:
-                                                if not skip_rule_creation:
-                                                    for rse in selected_rses:
-                                                        logging.info(prepend_str + 'Will insert one rule for %s:%s on %s' % (did['scope'], did['name'], rse))
-                                                        add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=1,
-                                                                 rse_expression=rse, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
-                                                                 subscription_id=subscription_id, source_replica_expression=source_replica_expression, activity=activity,
-                                                                 purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
-
-                                                        nb_rule += 1
-                                                        if nb_rule == copies:
-                                                            success = True
-                                                            break
-                                            else:
-                                                add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=copies,
-                                                         rse_expression=rse_expression, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
-                                                         subscription_id=subscription['id'], source_replica_expression=source_replica_expression, activity=activity,
-                                                         purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
-                                                nb_rule += 1
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.done', delta=nb_rule)
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.activity.%s' % str_activity, delta=nb_rule)
-                                            success = True
-                                            break
-                                        except (InvalidReplicationRule, InvalidRuleWeight, InvalidRSEExpression, StagingAreaRuleRequiresLifetime, DuplicateRule) as error:
-                                            # Errors that won't be retried
-                                            success = True
-                                            logging.error(prepend_str + '%s' % (str(error)))
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                            break
-                                        except (ReplicationRuleCreationTemporaryFailed, InsufficientTargetRSEs, InsufficientAccountLimit, DatabaseException, RSEBlacklisted) as error:
-                                            # Errors to be retried
-                                            logging.error(prepend_str + '%s Will perform an other attempt %i/%i' % (str(error), attempt + 1, nattempt))
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                        except Exception as error:
-                                            # Unexpected errors
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.unknown', delta=1)
-                                            exc_type, exc_value, exc_traceback = exc_info()
-                                            logging.critical(prepend_str + ''.join(format_exception(exc_type, exc_value, exc_traceback)).strip())
-
-                                    did_success = (did_success and success)
-                                    if (attemptnr + 1) == nattempt and not success:
-                                        logging.error(prepend_str + 'Rule for %s:%s on %s cannot be inserted' % (did['scope'], did['name'], rse_expression))
-                                    else:
-                                        logging.info(prepend_str + '%s rule(s) inserted in %f seconds' % (str(nb_rule), time.time() - stime))
-                    except DataIdentifierNotFound as error:
-                        logging.warning(prepend_str + error)
-
-                if did_success:
-                    if did['did_type'] == str(DIDType.FILE):
-                        monitor.record_counter(counters='transmogrifier.did.file.processed', delta=1)
-                    elif did['did_type'] == str(DIDType.DATASET):
-                        monitor.record_counter(counters='transmogrifier.did.dataset.processed', delta=1)
-                    elif did['did_type'] == str(DIDType.CONTAINER):
-                        monitor.record_counter(counters='transmogrifier.did.container.processed', delta=1)
-                    monitor.record_counter(counters='transmogrifier.did.processed', delta=1)
-                    identifiers.append({'scope': did['scope'], 'name': did['name'], 'did_type': DIDType.from_sym(did['did_type'])})
+                if (did['scope'], did['name']) in failed_dids:
+                    continue
+                if did in collections and (did['scope'], did['name']) not in metadata_dict:
+                    continue
+                if did['did_type'] == str(DIDType.FILE):
+                    monitor.record_counter(counters='transmogrifier.did.file.processed', delta=1)
+                elif did['did_type'] == str(DIDType.DATASET):
+                    monitor.record_counter(counters='transmogrifier.did.dataset.processed', delta=1)
+                elif did['did_type'] == str(DIDType.CONTAINER):
+                    monitor.record_counter(counters='transmogrifier.did.container.processed', delta=1)
+                monitor.record_counter(counters='transmogrifier.did.processed', delta=1)
+                identifiers.append({'scope': did['scope'], 'name': did['name'], 'did_type': DIDType.from_sym(did['did_type'])})
 
             time1 = time.time()
 
             #  Mark the DIDs as processed
-            for identifier in chunks(identifiers, 100):
+            for identifier in chunks(identifiers, 1000):
                 _retrial(set_new_dids, identifier, None)
 
             logging.info(prepend_str + 'Time to set the new flag : %f' % (time.time() - time1))
@@ -392,19 +592,20 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
     logging.info(prepend_str + 'Graceful stop done')
 
 
-def run(threads=1, bulk=100, once=False, sleep_time=60):
+def run(threads=1, bulk=100, once=False, sleep_time=60, rule_bulk=100):
     """
     Starts up the transmogrifier threads.
     """
 
     if once:
         logging.info('Will run only one iteration in a single threaded mode')
-        transmogrifier(bulk=bulk, once=once)
+        transmogrifier(bulk=bulk, once=once, rule_bulk=rule_bulk)
     else:
         logging.info('starting transmogrifier threads')
         thread_list = [threading.Thread(target=transmogrifier, kwargs={'once': once,
                                                                        'sleep_time': sleep_time,
-                                                                       'bulk': bulk}) for _ in range(0, threads)]
+                                                                       'bulk': bulk,
+                                                                       'rule_bulk': rule_bulk}) for _ in range(0, threads)]
         [thread.start() for thread in thread_list]
         logging.info('waiting for interrupts')
         # Interruptible joins require a timeout.
@@ -38,14 +38,14 @@ from datetime import datetime, timedelta
 from re import match
 from random import randint
 
-from sqlalchemy.exc import DatabaseError
+from sqlalchemy.exc import DatabaseError, IntegrityError
 
 from rucio.common.config import config_get
-from rucio.common.exception import DatabaseException, UnsupportedOperation, RuleNotFound
+from rucio.common.exception import DatabaseException, RucioException
 from rucio.common.types import InternalAccount
 from rucio.common.utils import chunks
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.monitor import record_counter
+from rucio.core.monitor import record_counter, record_gauge, record_timer
 from rucio.core.did import list_expired_dids, delete_dids
 
 logging.getLogger("requests").setLevel(logging.CRITICAL)
@@ -60,6 +60,57 @@ logging.basicConfig(stream=sys.stdout,
 GRACEFUL_STOP = threading.Event()
 
 
+def __did_error(error):
+    """
+    Tell whether a database error of delete_dids can come from a single did of the chunk, i.e. a
+    lock conflict or an integrity error, rather than from the database or its connection.
+
+    :param error:  The DatabaseException or DatabaseError.
+    :returns:      'lock', 'integrity' or None.
+    """
+    if match('.*(ORA-00054|55P03|3572).*', str(error.args[0])):
+        return 'lock'
+    if isinstance(error, IntegrityError) or match('.*(IntegrityError|ForeignKeyViolation|UniqueViolation|ORA-00001|ORA-02292).*', str(error.args[0])):
+        return 'integrity'
+    return None
+
+
+def __delete_dids(dids, paused_dids, worker_number):
+    """
+    Delete a chunk of dids in one transaction. If the transaction fails with an error which a
+    single did can cause, the chunk is split in two halves which are retried, down to the single
+    dids, so that it only holds back the dids concerned. The dids with a lock conflict are paused.
+    The other errors, e.g. a lost database connection, are raised without retrying.
+
+    :param dids:           The list of dids to delete.
+    :param paused_dids:    Dictionary {(scope, name): datetime} of the paused dids.
+    :param worker_number:  The number of the worker.
+    :returns:              The number of deleted dids.
+    """
+    try:
+        delete_dids(dids=dids, account=InternalAccount('root'), expire_rules=True)
+        record_counter(counters='undertaker.delete_dids', delta=len(dids))
+        return len(dids)
+    except (DatabaseException, DatabaseError) as e:
+        did_error = __did_error(e)
+        if not did_error:
+            raise
+        if len(dids) == 1:
+            if did_error == 'lock':
+                paused_dids[(dids[0]['scope'], dids[0]['name'])] = datetime.utcnow() + timedelta(seconds=randint(600, 2400))
+                record_counter('undertaker.delete_dids.exceptions.LocksDetected')
+                logging.warning('Undertaker(%s): Locks detected for %s:%s', worker_number, dids[0]['scope'], dids[0]['name'])
+            else:
+                logging.error('Undertaker(%s): Got database error %s.', worker_number, str(e))
+    except RucioException as error:
+        if len(dids) == 1:
+            logging.error(error)
+    if len(dids) == 1:
+        return 0
+    record_counter('undertaker.delete_dids.splits')
+    return __delete_dids(dids[:len(dids) // 2], paused_dids, worker_number) + __delete_dids(dids[len(dids) // 2:], paused_dids, worker_number)
+
+
 def undertaker(worker_number=1, total_workers=1, chunk_size=5, once=False):
     """
     Main loop to select and delete dids.
@@ -93,22 +144,24 @@ def undertaker(worker_number=1, total_workers=1, chunk_size=5, once=False):
                 time.sleep(60)
                 continue
 
+            start_time = time.time()
+            nb_deleted = 0
             for chunk in chunks(dids, chunk_size):
-                try:
-                    logging.info('Undertaker(%s): Receive %s dids to delete', worker_number, len(chunk))
-                    delete_dids(dids=chunk, account=InternalAccount('root'), expire_rules=True)
-                    logging.info('Undertaker(%s): Delete %s dids', worker_number, len(chunk))
-                    record_counter(counters='undertaker.delete_dids', delta=len(chunk))
-                except RuleNotFound as error:
-                    logging.error(error)
-                except (DatabaseException, DatabaseError, UnsupportedOperation) as e:
-                    if match('.*ORA-00054.*', str(e.args[0])) or match('.*55P03.*', str(e.args[0])) or match('.*3572.*', str(e.args[0])):
-                        for did in chunk:
-                            paused_dids[(did['scope'], did['name'])] = datetime.utcnow() + timedelta(seconds=randint(600, 2400))
-                        record_counter('undertaker.delete_dids.exceptions.LocksDetected')
-                        logging.warning('undertaker[%s/%s]: Locks detected for chunk', heartbeat['assign_thread'], heartbeat['nr_threads'])
-                    else:
-                        logging.error('Undertaker(%s): Got database error %s.', worker_number, str(e))
+                logging.info('Undertaker(%s): Receive %s dids to delete', worker_number, len(chunk))
+                deleted = __delete_dids(chunk, paused_dids=paused_dids, worker_number=worker_number)
+                logging.info('Undertaker(%s): Delete %s dids', worker_number, deleted)
+                nb_deleted += deleted
+                if GRACEFUL_STOP.is_set():
+                    break
+
+            # Drain rate of the expired dids
+            duration = time.time() - start_time
+            record_timer('undertaker.delete_dids.duration', duration * 1000)
+            record_gauge('undertaker.expired_dids', len(dids))
+            record_gauge('undertaker.paused_dids', len(paused_dids))
+            if duration > 0:
+                record_gauge('undertaker.delete_dids.rate', nb_deleted / duration)
+            logging.info('Undertaker(%s): Deleted %s of %s dids in %.2f seconds', worker_number, nb_deleted, len(dids), duration)
         except:
             logging.critical(traceback.format_exc())
             time.sleep(1)
@@ -273,6 +273,29 @@ class Default(protocol.RSEProtocol):
         except Exception as error:
             raise exception.ServiceUnavailable(error)
 
+    def bulk_delete(self, pfns):
+        """
+        Deletes several files from the connected RSE with a single gfal2 bulk unlink.
+
+        :param pfns: list of physical file names
+
+        :returns: a dict with the PFN as key and True or the exception as value
+        """
+        ret = {}
+        try:
+            errors = self.__ctx.unlink([str(pfn) for pfn in pfns])
+        except Exception as error:
+            return dict((pfn, exception.ServiceUnavailable(error)) for pfn in pfns)
+
+        for pfn, error in zip(pfns, errors):
+            if not error:
+                ret[pfn] = True
+            elif error.code == errno.ENOENT or 'No such file' in str(error):
+                ret[pfn] = exception.SourceNotFound(error)
+            else:
+                ret[pfn] = exception.ServiceUnavailable(error)
+        return ret
+
     def rename(self, path, new_path):
         """
         Allows to rename a file stored inside the connected RSE.
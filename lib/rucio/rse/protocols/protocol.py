@@ -434,6 +434,24 @@ class RSEProtocol(object):
         """
         raise NotImplementedError
 
+    def bulk_delete(self, pfns):
+        """
+            Deletes several files from the connected RSE. Protocols supporting a native
+            bulk deletion overwrite this method, the default deletes the files one by one.
+
+            :param pfns: list of physical file names
+
+            :returns: a dict with the PFN as key and True or the exception as value
+        """
+        ret = {}
+        for pfn in pfns:
+            try:
+                self.delete(pfn)
+                ret[pfn] = True
+            except Exception as error:
+                ret[pfn] = error
+        return ret
+
     def rename(self, path, new_path):
         """ Allows to rename a file stored inside the connected RSE.
 
@@ -279,6 +279,39 @@ class Default(protocol.RSEProtocol):
         except Exception as e:
             raise exception.ServiceUnavailable(e)
 
+    def bulk_delete(self, pfns):
+        """
+            Deletes several files from the connected RSE with one S3 multi-object delete per bucket.
+
+            :param pfns: list of physical file names
+
+            :returns: a dict with the PFN as key and True or the exception as value
+        """
+        ret = {}
+        keys_by_bucket = {}
+        for pfn in pfns:
+            try:
+                bucket_name, key_name = self.get_bucket_key_name(pfn)
+                keys_by_bucket.setdefault(bucket_name, {})[key_name] = pfn
+            except Exception as e:
+                ret[pfn] = e
+
+        for bucket_name, keys in keys_by_bucket.items():
+            try:
+                bucket = self.__conn.get_bucket(bucket_name, validate=False)
+                result = bucket.delete_keys(list(keys), quiet=False)
+                for deleted in result.deleted:
+                    ret[keys[deleted.key]] = True
+                for error in result.errors:
+                    if error.code == 'NoSuchKey':
+                        ret[keys[error.key]] = exception.SourceNotFound(error.message)
+                    else:
+                        ret[keys[error.key]] = exception.ServiceUnavailable(error.message)
+            except Exception as e:
+                for pfn in keys.values():
+                    ret[pfn] = exception.ServiceUnavailable(e)
+        return ret
+
     def rename(self, pfn, new_pfn):
         """ Allows to rename a file stored inside the connected RSE.
 
@@ -34,8 +34,14 @@ from __future__ import print_function
 import copy
 import os
 import random
+import threading
 from time import sleep
 
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
 try:
     from urlparse import urlparse
 except ImportError:
@@ -559,6 +565,78 @@ def delete(rse_settings, lfns):
     return [gs, ret]
 
 
+def bulk_delete(rse_settings, lfns, scheme=None, domain='wan', nb_workers=4, chunk_size=100):
+    """
+        Delete files from the connected storage with several protocol instances working concurrently.
+        The PFNs are resolved with a single lfns2pfns call and split in chunks. Each worker deletes
+        its chunks through its own connected protocol, using the native bulk deletion of the protocol
+        if it has one, so a slow file only delays the chunk it belongs to.
+
+        :param lfns:        a list with dicts containing 'scope' and 'name', and optionally 'path'.
+        :param scheme:      optional filter to select which protocol to be used.
+        :param domain:      the network domain for the deletion, either 'wan' or 'lan'.
+        :param nb_workers:  the maximum number of protocol instances deleting concurrently.
+        :param chunk_size:  the number of files handed at once to a protocol instance.
+
+        :returns: a dict with 'scope:name' as keys and True or the exception as value for each file
+    """
+    ret = {}
+    lfns = [lfns] if not type(lfns) is list else lfns
+
+    keys_by_pfn = {}
+    pfns = create_protocol(rse_settings, 'delete', scheme=scheme, domain=domain).lfns2pfns(lfns)
+    for lfn in lfns:
+        key = '%s:%s' % (lfn['scope'], lfn['name'])
+        pfn = pfns.get(key)
+        if isinstance(pfn, Exception):
+            ret[key] = pfn
+        else:
+            keys_by_pfn.setdefault(pfn, []).append(key)
+
+    pending = Queue()
+    for chunk in utils.chunks(list(keys_by_pfn), chunk_size):
+        pending.put(chunk)
+    lock = threading.Lock()
+
+    def set_status(result):
+        with lock:
+            for pfn, status in result.items():
+                for key in keys_by_pfn[pfn]:
+                    ret[key] = status
+
+    def worker():
+        protocol = create_protocol(rse_settings, 'delete', scheme=scheme, domain=domain)
+        try:
+            protocol.connect()
+        except Exception:
+            # Leave the chunks to the other workers, the remaining ones are reported after the join
+            return
+        try:
+            while True:
+                try:
+                    chunk = pending.get_nowait()
+                except Empty:
+                    break
+                try:
+                    set_status(protocol.bulk_delete(chunk))
+                except Exception as error:
+                    set_status(dict((pfn, error) for pfn in chunk))
+        finally:
+            protocol.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(min(nb_workers, pending.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Chunks left over if no worker could connect
+    while not pending.empty():
+        chunk = pending.get_nowait()
+        set_status(dict((pfn, exception.ServiceUnavailable('Cannot connect to the storage to delete %s' % pfn)) for pfn in chunk))
+    return ret
+
+
 def rename(rse_settings, files):
     """
         Rename files stored on the connected storage.
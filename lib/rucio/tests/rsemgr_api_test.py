@@ -37,7 +37,7 @@ from rucio.rse import rsemanager as mgr
 class MgrTestCases():
     files_local = ["1_rse_local_put.raw", "2_rse_local_put.raw", "3_rse_local_put.raw", "4_rse_local_put.raw"]
     files_remote = ['1_rse_remote_get.raw', '2_rse_remote_get.raw', '3_rse_remote_get.raw', '4_rse_remote_get.raw',
-                    '1_rse_remote_delete.raw', '2_rse_remote_delete.raw', '3_rse_remote_delete.raw', '4_rse_remote_delete.raw',
+                    '1_rse_remote_delete.raw', '2_rse_remote_delete.raw', '3_rse_remote_delete.raw', '4_rse_remote_delete.raw', '5_rse_remote_delete.raw', '6_rse_remote_delete.raw',
                     '1_rse_remote_exists.raw', '2_rse_remote_exists.raw',
                     '1_rse_remote_rename.raw', '2_rse_remote_rename.raw', '3_rse_remote_rename.raw', '4_rse_remote_rename.raw', '5_rse_remote_rename.raw', '6_rse_remote_rename.raw',
                     '7_rse_remote_rename.raw', '8_rse_remote_rename.raw', '9_rse_remote_rename.raw', '10_rse_remote_rename.raw', '11_rse_remote_rename.raw', '12_rse_remote_rename.raw',
@@ -188,6 +188,16 @@ class MgrTestCases():
         """(RSE/PROTOCOLS): Delete a single file from storage (SourceNotFound)"""
         mgr.delete(self.rse_settings, {'name': 'not_existing_data.raw', 'scope': 'user.%s' % self.user})
 
+    def test_bulk_delete_mgr(self):
+        """(RSE/PROTOCOLS): Delete multiple files from storage with concurrent protocols"""
+        details = mgr.bulk_delete(self.rse_settings, [{'name': '5_rse_remote_delete.raw', 'scope': 'user.%s' % self.user},
+                                                      {'name': '6_rse_remote_delete.raw', 'scope': 'user.%s' % self.user},
+                                                      {'name': 'not_existing_data.raw', 'scope': 'user.%s' % self.user}],
+                                  nb_workers=2, chunk_size=1)
+        if not (details['user.%s:5_rse_remote_delete.raw' % self.user] is True and details['user.%s:6_rse_remote_delete.raw' % self.user] is True):
+            raise Exception('Return not as expected: %s' % details)
+        raise details['user.%s:not_existing_data.raw' % self.user]
+
     # MGR-Tests: EXISTS
     def test_exists_mgr_ok_multi(self):
         """(RSE/PROTOCOLS): Check multiple files on storage (Success)"""
@@ -16,13 +16,15 @@
 from __future__ import print_function
 
 from os import remove
+from shutil import rmtree
+from tempfile import mkdtemp
 
-from nose.tools import raises
+from nose.tools import assert_equal, assert_true, raises
 
 from rucio.client.baseclient import BaseClient
 from rucio.client.client import Client
 from rucio.common.config import config_get
-from rucio.common.utils import get_tmp_dir
+from rucio.common.utils import generate_uuid, get_tmp_dir
 from rucio.common.exception import CannotAuthenticate, ClientProtocolNotSupported
 
 
@@ -93,3 +95,26 @@ class TestRucioClients(object):
         client = Client(account='root', ca_cert=self.cacert, auth_type='userpass', creds=creds)
 
         print(client.ping())
+
+    def test_http_cache(self):
+        """ CLIENTS (BASECLIENT): Cache the idempotent GET requests """
+        creds = {'username': 'ddmlab', 'password': 'secret'}
+        cache_dir = mkdtemp()
+        try:
+            client = Client(account='root', ca_cert=self.cacert, auth_type='userpass', creds=creds)
+            client.enable_http_cache(cache_dir=cache_dir)
+
+            assert_equal(client.whoami(), client.whoami())
+            assert_equal(len(client.http_cache_keys), 1)
+            attributes = client.list_rse_attributes('MOCK')
+            assert_equal(client.list_rse_attributes('MOCK'), attributes)
+            assert_equal(len(client.http_cache_keys), 2)
+
+            # a modification drops the cached responses
+            key = 'cached_%s' % generate_uuid()[:8]
+            client.add_rse_attribute('MOCK', key, True)
+            assert_equal(len(client.http_cache_keys), 0)
+            assert_true(key in client.list_rse_attributes('MOCK'))
+            client.delete_rse_attribute('MOCK', key)
+        finally:
+            rmtree(cache_dir)
@@ -10,10 +10,16 @@
   - Wen Guan, <wen.guan@cern.ch>, 2015
 '''
 
+import json
+import threading
 import time
 
+from nose.tools import assert_equal
+
+from rucio.common.utils import generate_uuid
 from rucio.daemons.mock.conveyorinjector import request_transfer
 from rucio.daemons.conveyor import submitter, poller, finisher, throttler
+from rucio.tests.test_transfertool_fts3 import FTSStubHandler, FTSStubServer
 
 
 class TestConveyorSubmitter:
@@ -31,3 +37,44 @@ class TestConveyorSubmitter:
         time.sleep(5)
         poller.run(once=True)
         finisher.run(once=True)
+
+
+class WrongAnswerFTSStubHandler(FTSStubHandler):
+    """ FTS stub failing the known transfers and answering garbage to the queries of a broken transfer. """
+
+    def do_GET(self):
+        if 'broken' in self.path:
+            body = b'garbage'
+        else:
+            transfer_ids = self.path.split('?')[0].split('/')[-1].split(',')
+            body = json.dumps([{'job_id': transfer_id, 'http_status': '500 Internal Server Error'} for transfer_id in transfer_ids]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestConveyorPoller:
+    """ Test the parallel polling of the conveyor poller."""
+
+    def setup(self):
+        self.server = FTSStubServer(('localhost', 0), WrongAnswerFTSStubHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = 'http://localhost:%s' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_poll_transfers_parallel_bisect(self):
+        """ CONVEYOR (DAEMON): Test the bisection of the failing queries of the parallel poller."""
+        xfers_ids = {self.host: [(generate_uuid(), generate_uuid()) for _ in range(7)] + [('broken', generate_uuid())]}
+        poller.poll_transfers_parallel(xfers_ids=xfers_ids, fts_bulk=8, max_polling_hosts=2)
+        assert_equal(poller.batch_sizes[self.host], 4)
+
+        del xfers_ids[self.host][-1]
+        poller.poll_transfers_parallel(xfers_ids=xfers_ids, fts_bulk=8, max_polling_hosts=2)
+        assert_equal(poller.batch_sizes[self.host], 8)
@@ -72,6 +72,32 @@ class TestCoreRSECounter():
             del cnt['updated_at']
             assert_equal(cnt, {'files': count, 'bytes': sum})
 
+    def test_fold_counters(self):
+        """ RSE COUNTER (CORE): Fold the updated counters of several RSEs at once """
+        rse_ids = [get_rse_id(rse='MOCK'), get_rse_id(rse='MOCK2')]
+        rse_update(once=True)
+        rse_counter.del_counter(rse_id=rse_ids[0])
+        rse_counter.add_counter(rse_id=rse_ids[0])
+        rse_counter.del_counter(rse_id=rse_ids[1])
+
+        for i in range(6):
+            rse_counter.increase(rse_id=rse_ids[0], files=1, bytes=100)
+            rse_counter.increase(rse_id=rse_ids[1], files=2, bytes=300)
+        rse_counter.decrease(rse_id=rse_ids[0], files=2, bytes=200)
+        folded = rse_counter.fold_updated_rse_counters(total_workers=0, worker_number=0)
+        assert_equal((folded['rses'], folded['rows']), (2, 13))
+
+        cnt = rse_counter.get_counter(rse_id=rse_ids[0])
+        assert_equal((cnt['files'], cnt['bytes']), (4, 400))
+        cnt = rse_counter.get_counter(rse_id=rse_ids[1])
+        assert_equal((cnt['files'], cnt['bytes']), (12, 1800))
+        assert_equal(rse_counter.get_updated_rse_counters(total_workers=0, worker_number=0), [])
+
+        rse_counter.increase(rse_id=rse_ids[1], files=1, bytes=1)
+        rse_update(once=True, fold=True)
+        cnt = rse_counter.get_counter(rse_id=rse_ids[1])
+        assert_equal((cnt['files'], cnt['bytes']), (13, 1801))
+
     def test_fill_counter_history(self):
         """RSE COUNTER (CORE): Fill the usage history with the current value."""
         db_session = session.get_session()
@@ -134,6 +160,36 @@ class TestCoreAccountCounter():
             del cnt['updated_at']
             assert_equal(cnt, {'files': count, 'bytes': sum})
 
+    def test_fold_counters(self):
+        """ACCOUNT COUNTER (CORE): Fold the updated counters of several accounts and RSEs at once """
+        account_update(once=True)
+        rse_ids = [get_rse_id(rse='MOCK'), get_rse_id(rse='MOCK2')]
+        accounts = [InternalAccount('jdoe'), InternalAccount('root')]
+        for account in accounts:
+            for rse_id in rse_ids:
+                account_counter.del_counter(rse_id=rse_id, account=account)
+        account_counter.add_counter(rse_id=rse_ids[0], account=accounts[0])
+
+        for i in range(3):
+            account_counter.increase(rse_id=rse_ids[0], account=accounts[0], files=1, bytes=100)
+            account_counter.increase(rse_id=rse_ids[1], account=accounts[0], files=2, bytes=300)
+            account_counter.increase(rse_id=rse_ids[0], account=accounts[1], files=3, bytes=500)
+        account_counter.decrease(rse_id=rse_ids[0], account=accounts[0], files=1, bytes=100)
+        folded = account_counter.fold_updated_account_counters(total_workers=0, worker_number=0)
+        assert_equal((folded['counters'], folded['rows']), (3, 10))
+
+        for account, rse_id, usage in ((accounts[0], rse_ids[0], (2, 200)),
+                                       (accounts[0], rse_ids[1], (6, 900)),
+                                       (accounts[1], rse_ids[0], (9, 1500))):
+            cnt = get_usage(rse_id=rse_id, account=account)
+            assert_equal((cnt['files'], cnt['bytes']), usage)
+        assert_equal(account_counter.get_updated_account_counters(total_workers=0, worker_number=0), [])
+
+        account_counter.increase(rse_id=rse_ids[1], account=accounts[1], files=1, bytes=1)
+        account_update(once=True, fold=True)
+        cnt = get_usage(rse_id=rse_ids[1], account=accounts[1])
+        assert_equal((cnt['files'], cnt['bytes']), (1, 1))
+
     def test_fill_counter_history(self):
         """ACCOUNT COUNTER (CORE): Fill the usage history with the current value."""
         db_session = session.get_session()
@@ -45,7 +45,8 @@ from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid
 from rucio.core.account_limit import set_account_limit
 from rucio.core.did import (list_dids, add_did, delete_dids, get_did_atime, touch_dids, attach_dids, detach_dids,
-                            get_metadata, set_metadata, get_did, get_did_access_cnt)
+                            get_metadata, get_metadata_bulk, set_metadata, get_did, get_did_access_cnt, list_all_parent_dids,
+                            list_all_parent_dids_bulk, list_parent_dids, list_parent_dids_bulk)
 from rucio.core.rse import get_rse_id
 from rucio.core.replica import add_replica
 from rucio.db.sqla.constants import DIDType
@@ -109,6 +110,25 @@ class TestDIDCore:
         assert_equal(100, get_did_access_cnt(scope=tmp_scope, name=tmp_dsn1))
         assert_equal(None, get_did_access_cnt(scope=tmp_scope, name=tmp_dsn2))
 
+    def test_touch_dids_bulk(self):
+        """ DATA IDENTIFIERS (CORE): Touch many dids at once"""
+        tmp_scope = InternalScope('mock')
+        root = InternalAccount('root')
+        dsns = ['dsn_%s' % generate_uuid() for _ in range(3)]
+        for dsn in dsns:
+            add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        now = datetime.utcnow()
+        now -= timedelta(microseconds=now.microsecond)
+
+        assert_equal(True, touch_dids(dids=[{'scope': tmp_scope, 'name': dsn, 'type': DIDType.DATASET, 'accessed_at': now - timedelta(days=i)} for i, dsn in enumerate(dsns[:2])] +
+                                      [{'scope': tmp_scope, 'name': dsns[0], 'type': DIDType.DATASET, 'accessed_at': now}]))
+        assert_equal(now, get_did_atime(scope=tmp_scope, name=dsns[0]))
+        assert_equal(now - timedelta(days=1), get_did_atime(scope=tmp_scope, name=dsns[1]))
+        assert_equal(None, get_did_atime(scope=tmp_scope, name=dsns[2]))
+        assert_equal(2, get_did_access_cnt(scope=tmp_scope, name=dsns[0]))
+        assert_equal(1, get_did_access_cnt(scope=tmp_scope, name=dsns[1]))
+        assert_equal(True, touch_dids(dids=[]))
+
     def test_update_dids(self):
         """ DATA IDENTIFIERS (CORE): Update file size and checksum"""
         tmp_scope = InternalScope('mock')
@@ -173,6 +193,68 @@ class TestDIDCore:
 
         detach_dids(scope=tmp_scope, name=parent_name, dids=files)
 
+    def test_list_all_parent_dids_bulk(self):
+        """ DATA IDENTIFIERS (CORE): List all parents of many DIDs at once """
+        tmp_scope = InternalScope('mock')
+        root = InternalAccount('root')
+        rse_id = get_rse_id('MOCK')
+        dsn1, dsn2 = 'dsn_%s' % generate_uuid(), 'dsn_%s' % generate_uuid()
+        cnt1, cnt2 = 'cnt_%s' % generate_uuid(), 'cnt_%s' % generate_uuid()
+        for dsn in (dsn1, dsn2):
+            add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        for cnt in (cnt1, cnt2):
+            add_did(scope=tmp_scope, name=cnt, type=DIDType.CONTAINER, account=root)
+
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 1, 'adler32': '0cc737eb'} for _ in range(4)]
+        attach_dids(scope=tmp_scope, name=dsn1, rse_id=rse_id, dids=files, account=root)
+        attach_dids(scope=tmp_scope, name=dsn2, rse_id=rse_id, dids=files[:1], account=root)
+        attach_dids(scope=tmp_scope, name=cnt1, dids=[{'scope': tmp_scope, 'name': dsn1}], account=root)
+        attach_dids(scope=tmp_scope, name=cnt2, dids=[{'scope': tmp_scope, 'name': cnt1}], account=root)
+
+        cache = {}
+        parents = list_all_parent_dids_bulk(dids=files, cache=cache)
+        for file in files:
+            expected = [(p['scope'], p['name']) for p in list_all_parent_dids(scope=file['scope'], name=file['name'])]
+            assert_equal(sorted((p['scope'], p['name']) for p in parents[(file['scope'], file['name'])]), sorted(expected))
+        assert_equal(len(parents[(tmp_scope, files[0]['name'])]), 4)
+        assert_equal(len(parents[(tmp_scope, files[1]['name'])]), 3)
+        assert_in((tmp_scope, cnt1), cache['parents'])
+
+    def test_list_parent_dids_bulk(self):
+        """ DATA IDENTIFIERS (CORE): List the direct parents of many DIDs at once """
+        tmp_scope = InternalScope('mock')
+        root = InternalAccount('root')
+        rse_id = get_rse_id('MOCK')
+        dsn1, dsn2, cnt1 = 'dsn_%s' % generate_uuid(), 'dsn_%s' % generate_uuid(), 'cnt_%s' % generate_uuid()
+        for dsn in (dsn1, dsn2):
+            add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        add_did(scope=tmp_scope, name=cnt1, type=DIDType.CONTAINER, account=root)
+
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 1, 'adler32': '0cc737eb'} for _ in range(3)]
+        attach_dids(scope=tmp_scope, name=dsn1, rse_id=rse_id, dids=files, account=root)
+        attach_dids(scope=tmp_scope, name=dsn2, rse_id=rse_id, dids=files[:1], account=root)
+        attach_dids(scope=tmp_scope, name=cnt1, dids=[{'scope': tmp_scope, 'name': dsn1}], account=root)
+
+        parents = list_parent_dids_bulk(dids=files + [{'scope': tmp_scope, 'name': dsn1}])
+        for tmp_did in files + [{'scope': tmp_scope, 'name': dsn1}]:
+            expected = [(p['scope'], p['name']) for p in list_parent_dids(scope=tmp_did['scope'], name=tmp_did['name'])]
+            assert_equal(sorted((p['scope'], p['name']) for p in parents[(tmp_did['scope'], tmp_did['name'])]), sorted(expected))
+        assert_equal(sorted(p['name'] for p in parents[(tmp_scope, files[0]['name'])]), sorted([dsn1, dsn2]))
+        assert_equal([p['name'] for p in parents[(tmp_scope, dsn1)]], [cnt1])
+
+    def test_get_metadata_bulk(self):
+        """ DATA IDENTIFIERS (CORE): Get the metadata of many DIDs at once """
+        tmp_scope = InternalScope('mock')
+        root = InternalAccount('root')
+        dsns = ['dsn_%s' % generate_uuid() for _ in range(3)]
+        for dsn in dsns:
+            add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        dids = [{'scope': tmp_scope, 'name': dsn} for dsn in dsns] + [{'scope': tmp_scope, 'name': 'Nimportnawak'}]
+        metadata = dict(((meta['scope'], meta['name']), meta) for meta in get_metadata_bulk(dids))
+        assert_equal(len(metadata), 3)
+        for dsn in dsns:
+            assert_equal(metadata[(tmp_scope, dsn)], get_metadata(scope=tmp_scope, name=dsn))
+
 
 class TestDIDApi:
 
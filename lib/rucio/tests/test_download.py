@@ -22,10 +22,11 @@ import logging
 import nose.tools
 import os.path
 
+from rucio.client import downloadclient
 from rucio.client.client import Client
 from rucio.client.downloadclient import DownloadClient
 from rucio.client.uploadclient import UploadClient
-from rucio.common.utils import generate_uuid
+from rucio.common.utils import adler32, generate_uuid
 from rucio.tests.common import file_generator
 
 
@@ -71,3 +72,41 @@ class TestDownloadClient(object):
         # Download with wildcard and name
         result = self.download_client.download_dids([{'did': '%s:%s' % (scope, '*'), 'filters': {'guid': uuid}}])
         nose.tools.assert_true(result)
+
+    def test_download_multiple_items_pooled(self):
+        """ DOWNLOAD (CLIENT): download several DIDs reusing the protocol connections and streaming the checksums. """
+        items = [self.create_and_upload_tmp_file('MOCK4') for _ in range(6)]
+
+        pools, checksums = [], []
+        original_pool, original_checksum = downloadclient.ProtocolPool, downloadclient.StreamingChecksum
+
+        class RecordingProtocolPool(original_pool):
+            def __init__(self, logger):
+                original_pool.__init__(self, logger)
+                pools.append(self)
+
+        class RecordingStreamingChecksum(original_checksum):
+            def finish(self):
+                checksum = original_checksum.finish(self)
+                checksums.append(checksum)
+                return checksum
+
+        downloadclient.ProtocolPool, downloadclient.StreamingChecksum = RecordingProtocolPool, RecordingStreamingChecksum
+        try:
+            # fewer threads than files, so that every thread downloads several files
+            download_client = DownloadClient(client=self.client, max_threads=2)
+            result = download_client.download_dids([{'did': '%s:%s' % (item['did_scope'], item['did_name'])} for item in items], num_threads=2)
+        finally:
+            downloadclient.ProtocolPool, downloadclient.StreamingChecksum = original_pool, original_checksum
+
+        nose.tools.assert_equal(len(result), 6)
+        for output_item in result:
+            nose.tools.assert_equal(output_item['clientState'], 'DONE')
+            stats = output_item['source_stats'][-1]
+            nose.tools.assert_equal(stats['rse'], 'MOCK4')
+            nose.tools.assert_true(stats['bytes'] > 0)
+
+        nose.tools.assert_equal(len(pools), 1)
+        nose.tools.assert_true(pools[0].reused > 0)
+        nose.tools.assert_equal(pools[0].created + pools[0].reused, 6)
+        nose.tools.assert_equal(sorted(checksums), sorted(adler32(item['path']) for item in items))
@@ -11,10 +11,14 @@
 
 import random
 import threading
+import time
 
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_false, assert_true
 
-from rucio.core.heartbeat import live, die, cardiac_arrest, list_payload_counts
+from rucio.core import heartbeat
+from rucio.core.heartbeat import live, die, cardiac_arrest, list_heartbeats, list_payload_counts, update_payload, calc_hash
+from rucio.db.sqla.models import Heartbeats
+from rucio.db.sqla.session import get_session
 
 
 class TestHeartbeat:
@@ -95,5 +99,81 @@ class TestHeartbeat:
 
         assert_equal(list_payload_counts('test5'), {})
 
+    def test_heartbeat_update_payload(self):
+        """ HEARTBEAT (CORE): Test payload update without thread assignment"""
+
+        pids = [self.__pid() for _ in range(2)]
+        threads = [self.__thread() for _ in range(2)]
+
+        live('test6', 'host0', pids[0], threads[0], payload='payload1')
+        update_payload('test6', 'host0', pids[0], threads[0], payload='payload2')
+        assert_equal(list_payload_counts('test6'), {'payload2': 1})
+
+        # An unknown heartbeat is registered
+        update_payload('test6', 'host1', pids[1], threads[1], payload='payload2')
+        assert_equal(list_payload_counts('test6'), {'payload2': 2})
+        assert_equal(live('test6', 'host1', pids[1], threads[1], payload='payload2'), {'assign_thread': 1, 'nr_threads': 2})
+
+    def test_heartbeat_assignment_lease(self):
+        """ HEARTBEAT (CORE): Reuse the thread assignment until the membership changes"""
+
+        pid = self.__pid()
+        thread = self.__thread()
+        assert_equal(live('test7', 'host1', pid, thread), {'assign_thread': 0, 'nr_threads': 1})
+
+        # a thread of another process joins
+        session = get_session()
+        Heartbeats(executable=calc_hash('test7'), readable='test7', hostname='host0', pid=self.__pid(),
+                   thread_id=1, thread_name='other').save(session=session)
+        session.commit()
+        assert_equal(live('test7', 'host1', pid, thread), {'assign_thread': 0, 'nr_threads': 1})
+
+        lease, heartbeat.ASSIGNMENT_LEASE = heartbeat.ASSIGNMENT_LEASE, 0
+        try:
+            assert_equal(live('test7', 'host1', pid, thread), {'assign_thread': 1, 'nr_threads': 2})
+        finally:
+            heartbeat.ASSIGNMENT_LEASE = lease
+
+    def test_heartbeat_batched_beats(self):
+        """ HEARTBEAT (CORE): Refresh the heartbeats of all the threads of a process together"""
+
+        pid = self.__pid()
+        event = threading.Event()
+        threads = [threading.Thread(target=event.wait) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads[:3]:
+                live('test8', 'host0', pid, thread)
+            # the last thread is alive but stuck, it does not call live within its older_than anymore
+            live('test8', 'host0', pid, threads[3], older_than=1)
+            before = dict((beat[3], beat[4]) for beat in list_heartbeats() if beat[0] == 'test8')
+            time.sleep(1.1)
+
+            interval, heartbeat.BEAT_INTERVAL = heartbeat.BEAT_INTERVAL, 0
+            try:
+                assert_equal(live('test8', 'host0', pid, threads[0])['nr_threads'], 4)
+            finally:
+                heartbeat.BEAT_INTERVAL = interval
+            after = dict((beat[3], beat[4]) for beat in list_heartbeats() if beat[0] == 'test8')
+            for thread in threads[:3]:
+                assert_true(after[thread.name] > before[thread.name])
+            assert_equal(after[threads[3].name], before[threads[3].name])
+        finally:
+            event.set()
+
+    def test_heartbeat_rollback(self):
+        """ HEARTBEAT (CORE): Do not cache the heartbeats of a rolled back transaction"""
+
+        pid = self.__pid()
+        thread = self.__thread()
+        session = get_session()
+        assert_equal(live('test9', 'host0', pid, thread, payload='payload1', session=session), {'assign_thread': 0, 'nr_threads': 1})
+        session.rollback()
+        session.remove()
+        assert_false((calc_hash('test9'), 'host0', pid, thread.ident) in getattr(heartbeat, '__HEARTBEATS'))
+        assert_equal(live('test9', 'host0', pid, thread, payload='payload1'), {'assign_thread': 0, 'nr_threads': 1})
+        assert_equal(list_payload_counts('test9'), {'payload1': 1})
+
     def tearDown(self):
         cardiac_arrest()
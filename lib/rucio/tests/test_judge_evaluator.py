@@ -246,6 +246,43 @@ class TestJudgeEvaluator():
 
         assert(8 == get_rule(rule_id)['locks_ok_cnt'])
 
+    def test_judge_evaluate_detach_incremental(self):
+        """ JUDGE EVALUATOR: Test the incremental evaluation of detached files and datasets"""
+        re_evaluator(once=True, incremental=True)
+
+        scope = InternalScope('mock')
+        container = 'container_' + str(uuid())
+        add_did(scope, container, DIDType.from_sym('CONTAINER'), self.jdoe)
+
+        files = create_files(3, scope, self.rse1_id, bytes=100)
+        dataset1 = 'dataset_' + str(uuid())
+        add_did(scope, dataset1, DIDType.from_sym('DATASET'), self.jdoe)
+        attach_dids(scope, dataset1, files, self.jdoe)
+        attach_dids(scope, container, [{'scope': scope, 'name': dataset1}], self.jdoe)
+
+        # The first file is also in a second dataset of the container
+        dataset2 = 'dataset_' + str(uuid())
+        add_did(scope, dataset2, DIDType.from_sym('DATASET'), self.jdoe)
+        attach_dids(scope, dataset2, files[:1] + create_files(2, scope, self.rse1_id, bytes=100), self.jdoe)
+        attach_dids(scope, container, [{'scope': scope, 'name': dataset2}], self.jdoe)
+
+        rule_id = add_rule(dids=[{'scope': scope, 'name': container}], account=self.jdoe, copies=1, rse_expression=self.rse1, grouping='DATASET', weight=None, lifetime=None, locked=False, subscription_id=None)[0]
+        re_evaluator(once=True, incremental=True)
+        assert(5 == get_rule(rule_id)['locks_ok_cnt'])
+
+        # The first file is still covered by the second dataset, the second one is not covered anymore
+        detach_dids(scope, dataset1, files[:2])
+        re_evaluator(once=True, incremental=True)
+        assert(4 == get_rule(rule_id)['locks_ok_cnt'])
+        assert(len(get_replica_locks(scope=files[0]['scope'], name=files[0]['name'])) == 1)
+        assert(len(get_replica_locks(scope=files[1]['scope'], name=files[1]['name'])) == 0)
+
+        detach_dids(scope, container, [{'scope': scope, 'name': dataset1}])
+        re_evaluator(once=True, incremental=True)
+        assert(3 == get_rule(rule_id)['locks_ok_cnt'])
+        assert(len([ds_lock for ds_lock in get_dataset_locks(scope=scope, name=dataset1)]) == 0)
+        assert(len([ds_lock for ds_lock in get_dataset_locks(scope=scope, name=dataset2)]) > 0)
+
     def test_judge_add_files_to_dataset_with_2_rules(self):
         """ JUDGE EVALUATOR: Test the judge when adding files to dataset with 2 rules"""
         scope = InternalScope('mock')
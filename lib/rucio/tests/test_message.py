@@ -62,3 +62,24 @@ class TestMessagesCore():
         delete_messages(to_delete)
 
         assert_equal(retrieve_messages(), [])
+
+    def test_pop_messages_bulk(self):
+        """ MESSAGE (CORE): Test retrieve large messages and delete them without archiving """
+
+        truncate_messages()
+        for i in range(10):
+            add_message(event_type='TEST', payload={'number': i,
+                                                    'padding': 'x' * (5000 if i % 2 else 10)})
+
+        tmp = retrieve_messages(10)
+        assert_equal(sorted(i['payload']['number'] for i in tmp), list(range(10)))
+        for i in tmp:
+            assert_equal(len(i['payload']['padding']), 5000 if i['payload']['number'] % 2 else 10)
+
+        delete_messages([{'id': i['id'],
+                          'created_at': i['created_at'],
+                          'updated_at': i['created_at'],
+                          'payload': str(i['payload']),
+                          'event_type': i['event_type']} for i in tmp], archive=False)
+
+        assert_equal(retrieve_messages(), [])
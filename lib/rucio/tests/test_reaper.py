@@ -18,6 +18,8 @@
 # - Joaquin Bogado <jbogado@linti.unlp.edu.ar>, 2018
 # - Andrew Lister <andrew.lister@stfc.ac.uk>, 2019
 
+from datetime import datetime
+
 import nose.tools
 
 from rucio.common.utils import execute, generate_uuid
@@ -26,6 +28,7 @@ from rucio.core import rse as rse_core
 from rucio.core import replica as replica_core
 
 from rucio.clis.daemons.reaper.reaper import main
+from rucio.daemons.reaper import reaper2
 
 
 def test_reaper():
@@ -50,3 +53,24 @@ def test_reaper():
     exitcode, out, err = execute(cmd)
     print(cmd, out, err)
     nose.tools.assert_equal(exitcode, 0)
+
+
+def test_reaper2_pipeline():
+    """ REAPER2 (DAEMON): Test the pipelined deletion of the reaper2 daemon."""
+    nb_files = 30
+    file_size = 2147483648  # 2G
+    rse_id = rse_core.get_rse_id(rse='MOCK')
+    scope = InternalScope('data13_hip')
+
+    names = ['lfn' + generate_uuid() for _ in range(nb_files)]
+    for name in names:
+        replica_core.add_replica(rse_id=rse_id, scope=scope, name=name, bytes=file_size,
+                                 account=InternalAccount('root'), adler32=None, md5=None, tombstone=datetime(year=1970, month=1, day=1))
+
+    rse_core.set_rse_usage(rse_id=rse_id, source='storage', used=nb_files * file_size, free=800)
+    rse_core.set_rse_limits(rse_id=rse_id, name='MinFreeSpace', value=10737418240)
+
+    reaper2.run(once=True, rses=['MOCK'], scheme='MOCK', chunk_size=nb_files, greedy=True, pipeline=True)
+
+    remaining = [replica for replica in replica_core.list_replicas(dids=[{'scope': scope, 'name': name} for name in names], rse_expression='MOCK')]
+    nose.tools.assert_equal(remaining, [])
@@ -47,7 +47,7 @@ from rucio.core.replica import (add_replica, add_replicas, delete_replicas, get_
                                 update_replica_lock_counter, get_replica, list_replicas,
                                 declare_bad_file_replicas, list_bad_replicas,
                                 update_replicas_paths, update_replica_state,
-                                get_replica_atime, touch_replica, get_bad_pfns, set_tombstone)
+                                get_replica_atime, touch_replica, touch_replicas, get_bad_pfns, set_tombstone)
 from rucio.core.rse import add_rse, add_protocol, add_rse_attribute, del_rse_attribute, get_rse_id
 from rucio.client.ruleclient import RuleClient
 from rucio.daemons.badreplicas.necromancer import run as necromancer_run
@@ -259,6 +259,36 @@ class TestReplicaCore:
         for i in range(0, nbfiles - 1):
             assert_equal(None, get_replica_atime({'scope': files2[i]['scope'], 'name': files2[i]['name'], 'rse_id': rse_id}))
 
+    def test_touch_replicas_bulk(self):
+        """ REPLICA (CORE): Touch many replicas accessed_at timestamp in bulk"""
+        tmp_scope = InternalScope('mock')
+        root = InternalAccount('root')
+        nbfiles = 5
+        files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 1, 'adler32': '0cc737eb', 'meta': {'events': 10}} for _ in range(nbfiles)]
+        rse_ids = [get_rse_id(rse='MOCK'), get_rse_id(rse='MOCK3')]
+        for rse_id in rse_ids:
+            add_replicas(rse_id=rse_id, files=files, account=root, ignore_availability=True)
+
+        now = datetime.utcnow()
+        now -= timedelta(microseconds=now.microsecond)
+        before = now - timedelta(days=1)
+
+        # The first file is accessed on both RSEs, its did gets the latest access
+        replicas = [{'scope': tmp_scope, 'name': files[0]['name'], 'rse_id': rse_ids[0], 'accessed_at': before},
+                    {'scope': tmp_scope, 'name': files[0]['name'], 'rse_id': rse_ids[1], 'accessed_at': now}]
+        replicas.extend({'scope': tmp_scope, 'name': f['name'], 'rse_id': rse_ids[0], 'accessed_at': now} for f in files[1:-1])
+        assert_equal(touch_replicas(replicas), True)
+
+        assert_equal(before, get_replica_atime({'scope': tmp_scope, 'name': files[0]['name'], 'rse_id': rse_ids[0]}))
+        assert_equal(now, get_replica_atime({'scope': tmp_scope, 'name': files[0]['name'], 'rse_id': rse_ids[1]}))
+        assert_equal(now, get_did_atime(scope=tmp_scope, name=files[0]['name']))
+        for f in files[1:-1]:
+            assert_equal(now, get_replica_atime({'scope': tmp_scope, 'name': f['name'], 'rse_id': rse_ids[0]}))
+            assert_equal(None, get_replica_atime({'scope': tmp_scope, 'name': f['name'], 'rse_id': rse_ids[1]}))
+            assert_equal(now, get_did_atime(scope=tmp_scope, name=f['name']))
+        assert_equal(None, get_replica_atime({'scope': tmp_scope, 'name': files[-1]['name'], 'rse_id': rse_ids[0]}))
+        assert_equal(None, get_did_atime(scope=tmp_scope, name=files[-1]['name']))
+
     def test_list_replicas_all_states(self):
         """ REPLICA (CORE): list file replicas with all_states"""
         tmp_scope = InternalScope('mock')
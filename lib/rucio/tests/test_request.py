@@ -18,13 +18,14 @@
 # PY3K COMPATIBLE
 
 from datetime import datetime
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_false, assert_in, assert_not_in
 
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid
 from rucio.core.did import attach_dids, add_did
 from rucio.core.replica import add_replica
-from rucio.core.request import release_all_waiting_requests, queue_requests, get_request_by_did, release_waiting_requests_per_free_volume, release_waiting_requests_grouped_fifo, release_waiting_requests_fifo
+from rucio.core.request import (release_all_waiting_requests, queue_requests, get_request, get_request_by_did, get_sources, release_waiting_requests_per_free_volume,
+                                release_waiting_requests_grouped_fifo, release_waiting_requests_fifo, requeue_and_archive_bulk)
 from rucio.core.rse import get_rse_id, set_rse_transfer_limits
 from rucio.db.sqla import session, models, constants
 
@@ -812,3 +813,36 @@ class TestRequestCore(object):
         assert_equal(request['state'], constants.RequestState.QUEUED)
         request = get_request_by_did(self.scope, name2, self.dest_rse_id, session=self.db_session)
         assert_equal(request['state'], constants.RequestState.QUEUED)
+
+    def test_requeue_and_archive_bulk(self):
+        """ REQUEST (CORE): requeue and archive failed requests together."""
+        requests = []
+        for retry_count in (0, 3):
+            name = generate_uuid()
+            add_replica(self.source_rse_id, self.scope, name, 1, self.account, session=self.db_session)
+            requests.append({'dest_rse_id': self.dest_rse_id,
+                             'request_type': constants.RequestType.TRANSFER,
+                             'name': name,
+                             'scope': self.scope,
+                             'rule_id': generate_uuid(),
+                             'retry_count': retry_count,
+                             'attributes': {'activity': self.user_activity, 'bytes': 1, 'md5': '', 'adler32': ''},
+                             'sources': [{'rse_id': self.source_rse_id, 'ranking': 0, 'bytes': 1, 'url': 'mock://%s' % name, 'is_using': True}]})
+        queue_requests(requests, session=self.db_session)
+        self.db_session.query(models.Request).update({'state': constants.RequestState.FAILED}, synchronize_session=False)
+        missing_request = {'request_id': generate_uuid()}
+
+        new_reqs = requeue_and_archive_bulk(requests + [missing_request], session=self.db_session)
+        assert_not_in(missing_request['request_id'], new_reqs)
+        assert_equal(new_reqs[requests[1]['request_id']], None)
+        new_req = new_reqs[requests[0]['request_id']]
+        assert_equal((new_req['previous_attempt_id'], new_req['retry_count']), (requests[0]['request_id'], 1))
+
+        for request in requests:
+            assert_equal(get_request(request['request_id'], session=self.db_session), None)
+            assert_in(request['request_id'], [hist_request.id for hist_request in self.db_session.query(models.Request.__history_mapper__.class_)])
+        request = get_request(new_req['request_id'], session=self.db_session)
+        assert_equal((request['name'], request['retry_count']), (requests[0]['name'], 1))
+        source = get_sources(new_req['request_id'], session=self.db_session)[0]
+        assert_equal(source['ranking'], -1)
+        assert_false(source['is_using'])
@@ -0,0 +1,57 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from rucio.common.exception import RSEProtocolNotSupported
+from rucio.core.rse import add_rse, add_protocol, add_rse_attribute, del_protocols
+from rucio.core.rse_cache import RSEMetadataCache
+from rucio.tests.common import rse_name_generator
+
+
+class TestRSEMetadataCache(object):
+
+    def setup(self):
+        self.rse = rse_name_generator()
+        self.rse_id = add_rse(self.rse)
+        add_protocol(self.rse_id, {'scheme': 'MOCK',
+                                   'hostname': 'localhost',
+                                   'port': 17,
+                                   'prefix': '/the/one/with/all/the/files',
+                                   'impl': 'rucio.rse.protocols.mock.Default',
+                                   'domains': {
+                                       'lan': {'read': 1, 'write': 1, 'delete': 1},
+                                       'wan': {'read': 1, 'write': 1, 'delete': 1, 'third_party_copy': 1}}})
+        self.cache = RSEMetadataCache(ttl=300)
+
+    def test_rse_metadata_cache(self):
+        """ RSE CACHE (CORE): Share the RSE metadata and protocols until they expire """
+        assert_equal(self.cache.get_rse_name(self.rse_id), self.rse)
+        info = self.cache.get_rse_info(self.rse_id)
+        assert_equal(info['rse'], self.rse)
+        assert_true(self.cache.get_rse_info(self.rse_id) is info)
+        protocol = self.cache.get_protocol(self.rse_id, 'third_party_copy', 'MOCK')
+        assert_true(self.cache.get_protocol(self.rse_id, 'third_party_copy', ['MOCK']) is protocol)
+
+        expired = RSEMetadataCache(ttl=0)
+        info = expired.get_rse_info(self.rse_id)
+        assert_true(expired.get_rse_info(self.rse_id) is not info)
+
+    def test_rse_metadata_cache_invalidation(self):
+        """ RSE CACHE (CORE): Drop the cached RSE metadata when the attributes or protocols change """
+        assert_true('cached' not in self.cache.get_rse_attributes(self.rse_id))
+        add_rse_attribute(self.rse_id, 'cached', True)
+        assert_true('cached' in self.cache.get_rse_attributes(self.rse_id))
+
+        protocol = self.cache.get_protocol(self.rse_id, 'write', 'MOCK')
+        self.cache.invalidate(self.rse_id)
+        assert_true(self.cache.get_protocol(self.rse_id, 'write', 'MOCK') is not protocol)
+
+        del_protocols(self.rse_id, 'MOCK')
+        with assert_raises(RSEProtocolNotSupported):
+            self.cache.get_protocol(self.rse_id, 'write', 'MOCK')
@@ -176,6 +176,62 @@ class TestRSEExpressionParserCore(object):
         assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression("%s>30" % self.attribute_numeric)]), sorted([self.rse4_id, self.rse5_id]))
 
 
+class TestRSEExpressionIndexCore(object):
+
+    def __init__(self):
+        self.rse1 = rse_name_generator()
+        self.rse2 = rse_name_generator()
+        self.rse3 = rse_name_generator()
+
+        self.rse1_id = rse.add_rse(self.rse1)
+        self.rse2_id = rse.add_rse(self.rse2)
+        self.rse3_id = rse.add_rse(self.rse3)
+
+        self.attribute = attribute_name_generator()
+        rse.add_rse_attribute(self.rse1_id, self.attribute, "at")
+        rse.add_rse_attribute(self.rse2_id, self.attribute, "de")
+        rse.add_rse_attribute(self.rse3_id, self.attribute, "de")
+
+        self.attribute_numeric = attribute_name_generator()
+        rse.add_rse_attribute(self.rse1_id, self.attribute_numeric, 10)
+        rse.add_rse_attribute(self.rse2_id, self.attribute_numeric, 20)
+        rse.add_rse_attribute(self.rse3_id, self.attribute_numeric, 30)
+
+        self.tag = tag_generator()
+        rse.add_rse_attribute(self.rse1_id, self.tag, True)
+        rse.add_rse_attribute(self.rse2_id, self.tag, True)
+
+    def evaluate(self, expression):
+        index = rse_expression_parser.get_rse_expression_index()
+        return sorted([t_rse['id'] for t_rse in index.rses_from_bitset(rse_expression_parser.compile_expression(expression).evaluate(index))])
+
+    def test_index_matches_database_evaluation(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that the index evaluation matches the database evaluation """
+        for expression in [self.rse1,
+                           self.tag,
+                           "%s=de" % self.attribute,
+                           "%s\\%s" % (self.tag, self.rse1),
+                           "%s&%s=de" % (self.tag, self.attribute),
+                           "(%s|%s)&%s<25" % (self.rse1, self.rse3, self.attribute_numeric),
+                           "%s>15" % self.attribute_numeric]:
+            expected = rse_expression_parser.compile_expression(expression).resolve_elements(session=None)[0]
+            assert_equal(self.evaluate(expression), sorted(expected))
+
+    def test_index_invalidation(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that the index is invalidated by attribute changes """
+        assert_equal(self.evaluate("%s=de" % self.attribute), sorted([self.rse2_id, self.rse3_id]))
+        rse.del_rse_attribute(self.rse3_id, self.attribute)
+        assert_equal(self.evaluate("%s=de" % self.attribute), [self.rse2_id])
+        rse.add_rse_attribute(self.rse1_id, self.tag + 'X', True)
+        assert_equal(self.evaluate(self.tag + 'X'), [self.rse1_id])
+
+    def test_compiled_expression_cache(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that compiled expressions are reused """
+        expression = "%s|%s" % (self.rse1, self.rse2)
+        assert_equal(rse_expression_parser.compile_expression(expression) is rse_expression_parser.compile_expression(expression), True)
+        assert_raises(InvalidRSEExpression, rse_expression_parser.compile_expression, "%s|" % self.rse1)
+
+
 class TestRSEExpressionParserClient(object):
 
     def __init__(self):
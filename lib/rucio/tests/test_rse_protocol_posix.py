@@ -168,6 +168,11 @@ class TestRsePOSIX(object):
         """POSIX (RSE/PROTOCOLS): Delete a single file from storage (SourceNotFound)"""
         self.mtc.test_delete_mgr_SourceNotFound_single()
 
+    @raises(exception.SourceNotFound)
+    def test_bulk_delete_mgr(self):
+        """POSIX (RSE/PROTOCOLS): Delete multiple files from storage with concurrent protocols"""
+        self.mtc.test_bulk_delete_mgr()
+
     # MGR-Tests: EXISTS
     def test_exists_mgr_ok_multi(self):
         """POSIX (RSE/PROTOCOLS): Check multiple files on storage (Success)"""
@@ -42,6 +42,8 @@ from rucio.core.account_limit import set_account_limit
 from rucio.core.request import get_request_by_did
 from rucio.core.replica import add_replica, get_replica
 from rucio.core.rse import add_rse_attribute, add_rse, update_rse, get_rse_id, del_rse_attribute, set_rse_limits
+from rucio.core.rse_expression_parser import parse_expression
+from rucio.core.rse_selector import RSESelector, RSESelectorCache
 from rucio.core.rse_counter import get_counter as get_rse_counter
 from rucio.core.rule import add_rule, get_rule, delete_rule, add_rules, update_rule, reduce_rule, move_rule, list_rules
 from rucio.daemons.abacus.account import account_update
@@ -593,6 +595,24 @@ class TestReplicationRuleCore():
         finally:
             set_rse_limits(self.rse3_id, 'MaxSpaceAvailable', -1)
 
+    def test_rse_selector_cache(self):
+        """ REPLICATION RULE (CORE): Test that RSE selectors sharing a cache see the same quotas and limits"""
+        rses = parse_expression(self.T1)
+        cache = RSESelectorCache()
+        set_rse_limits(self.rse3_id, 'MaxSpaceAvailable', 250)
+        try:
+            selector1 = RSESelector(account=self.jdoe, rses=rses, weight=None, copies=1, cache=cache)
+            selector2 = RSESelector(account=self.jdoe, rses=rses, weight='fakeweight', copies=1, cache=cache)
+            uncached = RSESelector(account=self.jdoe, rses=rses, weight=None, copies=1)
+        finally:
+            set_rse_limits(self.rse3_id, 'MaxSpaceAvailable', -1)
+
+        assert_equal(sorted(cache.attributes.keys()), sorted([rse['id'] for rse in rses]))
+        assert_equal(cache.space_limits[self.rse3_id], 250)
+        assert_equal(selector1.get_rse_dictionary()[self.rse3_id]['space_left'], 250 - get_rse_counter(self.rse3_id)['bytes'])
+        assert_equal(selector1.get_rse_dictionary(), uncached.get_rse_dictionary())
+        assert_equal(selector2.get_rse_dictionary()[self.rse1_id]['weight'], 10.0)
+
     def test_dataset_callback(self):
         """ REPLICATION RULE (CORE): Test dataset callback"""
 
@@ -23,6 +23,8 @@
 
 from __future__ import print_function
 
+import re
+
 from json import dumps, loads
 
 from nose.tools import assert_equal, assert_true, raises, assert_raises
@@ -35,11 +37,12 @@ from rucio.common.exception import InvalidObject, SubscriptionNotFound, Subscrip
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid as uuid
 from rucio.core.account_limit import set_account_limit
-from rucio.core.did import add_did, set_new_dids
+from rucio.core.did import add_did, list_new_dids, set_new_dids
 from rucio.core.rse import add_rse
 from rucio.core.rule import add_rule
 from rucio.core.scope import add_scope
-from rucio.daemons.transmogrifier.transmogrifier import run
+from rucio.daemons.transmogrifier import transmogrifier as transmogrifier_module
+from rucio.daemons.transmogrifier.transmogrifier import run, is_matching_subscription, SubscriptionIndex
 from rucio.db.sqla.constants import DIDType
 from rucio.web.rest.authentication import APP as auth_app
 from rucio.web.rest.subscription import APP as subs_app
@@ -133,6 +136,51 @@ class TestSubscriptionCoreApi():
         for rule in list_subscription_rule_states(account='root', name=subscription_name):
             assert_equal(rule[3], 2)
 
+    def test_subscription_index(self):
+        """ SUBSCRIPTION (DAEMON): Test that the subscription index matches the same subscriptions as the filters """
+        filters = [{'scope': ['data18_13TeV', 'mc16_13TeV'], 'datatype': ['AOD']},
+                   {'scope': ['data1[5-8]_13TeV'], 'datatype': ['AOD', 'DAOD_.*']},
+                   {'project': 'data18', 'pattern': '.*physics_Main.*'},
+                   {'datatype': ['DAOD_EXOT'], 'excluded_pattern': '.*_tid.*'},
+                   {'account': ['root', ], 'split_rule': 'true'},
+                   {'datatype': ['AOD'], 'scope': ['mc16_13TeV']},
+                   {'scope': '[invalid'}]
+        subscriptions = [{'id': uuid(), 'filter': dumps(filter_string), 'replication_rules': dumps([{'copies': 1, 'rse_expression': 'MOCK'}])} for filter_string in filters]
+        dids = [({'scope': InternalScope('data18_13TeV'), 'name': 'data18_13TeV.00350000.physics_Main.AOD.f100'}, {'hidden': False, 'datatype': 'AOD', 'project': 'data18_13TeV'}),
+                ({'scope': InternalScope('mc16_13TeV'), 'name': 'mc16_13TeV.361000.DAOD_EXOT1.e100_tid01'}, {'hidden': False, 'datatype': 'DAOD_EXOT1', 'account': 'root'}),
+                ({'scope': InternalScope('data17_13TeV'), 'name': 'data17_13TeV.00340000.physics_Main.DAOD_EXOT2.p100'}, {'hidden': False, 'datatype': 'DAOD_EXOT2', 'account': 'rootless'}),
+                ({'scope': InternalScope('mc16_13TeV'), 'name': 'mc16_13TeV.361000.AOD.e100'}, {'hidden': True, 'datatype': 'AOD', 'account': 'root'})]
+
+        # the index skips the subscriptions with invalid replication rules or an invalid filter
+        subscriptions.append({'id': uuid(), 'filter': dumps(filters[0]), 'replication_rules': '[invalid'})
+        index = SubscriptionIndex()
+        index.update(subscriptions)
+        index.update(subscriptions)
+        assert_equal(len(index.subscriptions), 6)
+        for did, metadata in dids:
+            expected = [subscription['id'] for subscription in subscriptions[:6] if is_matching_subscription(subscription, did, metadata)]
+            assert_equal([subscription['id'] for subscription, _ in index.match(did, metadata)], expected)
+        assert_equal([subscription['id'] for subscription, _ in index.match(*dids[0])], [subscriptions[0]['id'], subscriptions[1]['id'], subscriptions[2]['id']])
+        assert_equal([subscription['id'] for subscription, _ in index.match(*dids[2])], [subscriptions[1]['id'], subscriptions[3]['id'], subscriptions[4]['id']])
+        assert_equal([subscription['id'] for subscription, _ in index.match(*dids[1])], [subscriptions[4]['id']])
+        assert_true(index.match(*dids[1])[0][1]['split_rule'])
+        assert_equal(index.match(*dids[3]), [])
+
+        # is_matching_subscription only looks at the filter and raises on an invalid regular expression
+        assert_true(is_matching_subscription(subscriptions[7], *dids[0]))
+        assert_raises(re.error, is_matching_subscription, subscriptions[6], *dids[0])
+        assert_equal(is_matching_subscription({'filter': '{invalid', 'replication_rules': '[]'}, *dids[0]), False)
+
+    def test_group_rule_specs(self):
+        """ SUBSCRIPTION (DAEMON): Test that the rules of a DID are never split across transactions """
+        tmp_scope = InternalScope('mock')
+        rules_per_did = [2, 1, 3, 1, 5, 1]
+        rule_specs = [{'did': {'scope': tmp_scope, 'name': 'dataset_%i' % i}, 'rule': {'copies': 1}}
+                      for i, nb_rules in enumerate(rules_per_did) for _ in range(nb_rules)]
+        rule_groups = list(getattr(transmogrifier_module, '__group_rule_specs')(rule_specs, 3))
+        assert_equal([[rule_spec['did']['name'] for rule_spec in rule_group] for rule_group in rule_groups],
+                     [['dataset_0', 'dataset_0', 'dataset_1'], ['dataset_2'] * 3, ['dataset_3'], ['dataset_4'] * 5, ['dataset_5']])
+
 
 class TestSubscriptionRestApi():
 
@@ -351,3 +399,25 @@ class TestSubscriptionClient():
         run(threads=1, bulk=1000000, once=True)
         rules = [rule for rule in self.did_client.list_did_rules(scope=tmp_scope.external, name=dsn) if str(rule['subscription_id']) == str(subid)]
         assert_equal(len(rules), 2)
+
+    def test_run_transmogrifier_rule_bulk(self):
+        """ SUBSCRIPTION (DAEMON): Test the transmogrifier with several rules per transaction and a failing rule """
+        tmp_scope = InternalScope('mock_' + uuid()[:8])
+        root = InternalAccount('root')
+        add_scope(tmp_scope, root)
+        dsns = ['dataset-%s' % uuid() for _ in range(5)]
+        for dsn in dsns:
+            add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account=root)
+        add_rule(dids=[{'scope': tmp_scope, 'name': dsns[0]}], account=root, copies=1, rse_expression='MOCK', grouping='NONE', weight=None, lifetime=None, locked=False, subscription_id=None)
+
+        subid = self.sub_client.add_subscription(name=uuid(), account='root', filter={'scope': [tmp_scope.external, ], 'pattern': 'dataset-.*'},
+                                                 replication_rules=[{'rse_expression': 'MOCK', 'copies': 1, 'activity': 'Data Brokering'}],
+                                                 lifetime=None, retroactive=0, dry_run=0, comments='Ni ! Ni!')
+        run(threads=1, bulk=1000000, once=True, rule_bulk=3)
+        # The duplicate rule of the first dataset doesn't prevent the creation of the others
+        for dsn in dsns[1:]:
+            rules = [rule for rule in self.did_client.list_did_rules(scope=tmp_scope.external, name=dsn) if str(rule['subscription_id']) == str(subid)]
+            assert_equal(len(rules), 1)
+        new_dids = [(did['scope'], did['name']) for did in list_new_dids(did_type=None, chunk_size=100000)]
+        for dsn in dsns:
+            assert_true((tmp_scope, dsn) not in new_dids)
@@ -0,0 +1,91 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+import json
+import threading
+
+try:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from nose.tools import assert_equal, assert_true
+
+from rucio.common.utils import generate_uuid
+from rucio.transfertool.fts3 import bulk_query_hosts, bulk_submit, get_session
+
+
+class FTSStubServer(ThreadingMixIn, HTTPServer):
+    """ Threaded server, the keep-alive connections of the pooled sessions stay open. """
+
+    daemon_threads = True
+
+
+class FTSStubHandler(BaseHTTPRequestHandler):
+    """ Minimal FTS REST interface answering the job submissions and the bulk queries. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def __reply(self, body):
+        body = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.__reply({'job_id': generate_uuid()})
+
+    def do_GET(self):
+        transfer_ids = self.path.split('?')[0].split('/')[-1].split(',')
+        self.__reply([{'job_id': transfer_id, 'http_status': '404 Not Found'} for transfer_id in transfer_ids])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFTS3Transfertool:
+
+    def setup(self):
+        self.servers = []
+        for _ in range(2):
+            server = FTSStubServer(('localhost', 0), FTSStubHandler)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self.servers.append(server)
+        self.hosts = ['http://localhost:%s' % server.server_address[1] for server in self.servers]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def test_bulk_submit_and_query(self):
+        """ FTS3 (TRANSFERTOOL): Submit and query jobs on several hosts concurrently """
+        files = [{'sources': ['root://source/file'], 'destinations': ['root://destination/file'], 'metadata': {'request_id': generate_uuid()}}]
+        jobs = [{'external_host': host, 'files': files, 'job_params': {}} for host in self.hosts for _ in range(3)]
+        transfer_ids = bulk_submit(jobs)
+        assert_equal(len(transfer_ids), 6)
+        assert_true(all(not isinstance(transfer_id, Exception) for transfer_id in transfer_ids))
+
+        responses = bulk_query_hosts({self.hosts[0]: transfer_ids[:3], self.hosts[1]: transfer_ids[3:]})
+        assert_equal(sorted(responses), sorted(self.hosts))
+        assert_equal(responses[self.hosts[0]], dict((transfer_id, None) for transfer_id in transfer_ids[:3]))
+        assert_equal(responses[self.hosts[1]], dict((transfer_id, None) for transfer_id in transfer_ids[3:]))
+
+    def test_session_reuse(self):
+        """ FTS3 (TRANSFERTOOL): The session of a host is shared """
+        assert_true(get_session(self.hosts[0])[0] is get_session(self.hosts[0])[0])
+        assert_true(get_session(self.hosts[0])[0] is not get_session(self.hosts[1])[0])
@@ -21,8 +21,9 @@
 
 from datetime import datetime, timedelta
 
-from nose.tools import assert_not_equal
+from nose.tools import assert_equal, assert_not_equal, assert_raises
 
+from rucio.common.exception import DatabaseException, DataIdentifierNotFound
 from rucio.common.types import InternalAccount, InternalScope
 from rucio.common.utils import generate_uuid
 from rucio.core.account_limit import set_account_limit
@@ -30,6 +31,7 @@ from rucio.core.did import add_dids, attach_dids, list_expired_dids, get_did
 from rucio.core.replica import get_replica
 from rucio.core.rule import add_rules, list_rules
 from rucio.core.rse import get_rse_id, add_rse
+from rucio.daemons.undertaker import undertaker as undertaker_module
 from rucio.daemons.undertaker.undertaker import undertaker
 from rucio.tests.common import rse_name_generator
 
@@ -80,6 +82,67 @@ class TestUndertaker:
         for replica in replicas:
             assert_not_equal(get_replica(scope=replica['scope'], name=replica['name'], rse_id=rse_id)['tombstone'], None)
 
+    def test_undertaker_bulk(self):
+        """ UNDERTAKER (CORE): Test the deletion of many dids per transaction. """
+        tmp_scope = InternalScope('mock')
+        jdoe = InternalAccount('jdoe')
+        root = InternalAccount('root')
+        rse_id = get_rse_id('MOCK')
+
+        set_account_limit(jdoe, rse_id, -1)
+
+        dsns = [{'name': 'dsn_%s' % generate_uuid(),
+                 'scope': tmp_scope,
+                 'type': 'DATASET',
+                 'lifetime': -1,
+                 'rules': [{'account': jdoe, 'copies': 1,
+                            'rse_expression': 'MOCK',
+                            'grouping': 'DATASET'}]} for i in range(20)]
+        cnt = {'name': 'cnt_%s' % generate_uuid(), 'scope': tmp_scope, 'type': 'CONTAINER'}
+        add_dids(dids=dsns + [cnt], account=root)
+        for dsn in dsns:
+            files = [{'scope': tmp_scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 1, 'adler32': '0cc737eb'} for i in range(2)]
+            attach_dids(scope=tmp_scope, name=dsn['name'], rse_id=rse_id, dids=files, account=root)
+        attach_dids(scope=tmp_scope, name=cnt['name'], dids=[{'scope': tmp_scope, 'name': dsns[0]['name']}], account=root)
+
+        # The dataset detached from its container is left for the next pass, the others are deleted
+        undertaker(worker_number=1, total_workers=1, chunk_size=1000, once=True)
+        get_did(scope=tmp_scope, name=dsns[0]['name'])
+        for dsn in dsns[1:]:
+            assert_raises(DataIdentifierNotFound, get_did, scope=tmp_scope, name=dsn['name'])
+            assert_equal(list(list_rules(filters={'scope': tmp_scope, 'name': dsn['name']})), [])
+
+        undertaker(worker_number=1, total_workers=1, chunk_size=1000, once=True)
+        assert_raises(DataIdentifierNotFound, get_did, scope=tmp_scope, name=dsns[0]['name'])
+        get_did(scope=tmp_scope, name=cnt['name'])
+
+    def test_undertaker_errors(self):
+        """ UNDERTAKER (CORE): Test that only the errors of single dids are narrowed down and the others are raised. """
+        dids = [{'scope': InternalScope('mock'), 'name': 'dsn_%s' % generate_uuid()} for i in range(4)]
+        locked = dids[1]
+
+        def delete_dids(dids, account, expire_rules=False):
+            if locked in dids:
+                raise DatabaseException('ORA-00054: resource busy and acquire with NOWAIT specified')
+
+        delete_dids_chunk = getattr(undertaker_module, '__delete_dids')
+        original = undertaker_module.delete_dids
+        try:
+            undertaker_module.delete_dids = delete_dids
+            paused_dids = {}
+            assert_equal(delete_dids_chunk(dids, paused_dids, 1), 3)
+            assert_equal(list(paused_dids), [(locked['scope'], locked['name'])])
+
+            def delete_dids(dids, account, expire_rules=False):
+                raise DatabaseException('ORA-03113: end-of-file on communication channel')
+
+            undertaker_module.delete_dids = delete_dids
+            paused_dids = {}
+            assert_raises(DatabaseException, delete_dids_chunk, dids, paused_dids, 1)
+            assert_equal(paused_dids, {})
+        finally:
+            undertaker_module.delete_dids = original
+
     def test_list_expired_dids_with_locked_rules(self):
         """ UNDERTAKER (CORE): Test that the undertaker does not list expired dids with locked rules"""
         tmp_scope = InternalScope('mock')
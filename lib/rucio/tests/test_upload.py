@@ -0,0 +1,62 @@
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+import logging
+
+import nose.tools
+import os.path
+
+from rucio.client.client import Client
+from rucio.client.uploadclient import UploadClient
+from rucio.common.utils import generate_uuid
+from rucio.tests.common import file_generator
+
+
+class TestUploadClient(object):
+
+    def setup(self):
+        logger = logging.getLogger('dlul_client')
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.DEBUG)
+        self.client = Client()
+        self.upload_client = UploadClient(_client=self.client, logger=logger)
+
+    def test_bulk_upload(self):
+        """ UPLOAD (CLIENT): upload files concurrently and register them in bulk. """
+        scope = 'mock'
+        dataset = 'dataset_%s' % generate_uuid()
+        items = []
+        for _ in range(5):
+            file_path = file_generator()
+            items.append({'path': file_path,
+                          'rse': 'MOCK4',
+                          'did_scope': scope,
+                          'did_name': os.path.basename(file_path),
+                          'dataset_scope': scope,
+                          'dataset_name': dataset})
+        file_path = file_generator()
+        items.append({'path': file_path, 'rse': 'MOCK4', 'did_scope': scope, 'did_name': os.path.basename(file_path)})
+
+        files = self.upload_client.bulk_upload(items, num_threads=3)
+        nose.tools.assert_equal(len(files), 6)
+        for file in files:
+            nose.tools.assert_equal(file['clientState'], 'DONE')
+
+        content = [did['name'] for did in self.client.list_content(scope, dataset)]
+        nose.tools.assert_equal(sorted(content), sorted(item['did_name'] for item in items[:5]))
+        replicas = list(self.client.list_replicas([{'scope': scope, 'name': item['did_name']} for item in items], all_states=True))
+        nose.tools.assert_equal(len(replicas), 6)
+        for replica in replicas:
+            nose.tools.assert_equal(replica['states'], {'MOCK4': 'AVAILABLE'})
+        rules = list(self.client.list_did_rules(scope, items[5]['did_name']))
+        nose.tools.assert_equal(len(rules), 1)
+
+        # the files already registered are skipped
+        files = self.upload_client.bulk_upload(items)
+        for file in files:
+            nose.tools.assert_equal(file['clientState'], 'ALREADY_DONE')
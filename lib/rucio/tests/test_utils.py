@@ -12,13 +12,15 @@
  PY3K COMPATIBLE
 '''
 
+import hashlib
 import unittest
 import tempfile
+import zlib
 
 from nose.tools import assert_raises, assert_equal, assert_is_instance, assert_is_not_none
 from re import match
 from rucio.common.exception import InvalidType
-from rucio.common.utils import md5, adler32, parse_did_filter_from_string
+from rucio.common.utils import md5, adler32, bulk_file_checksums, file_checksums, parse_did_filter_from_string
 
 
 class TestUtils(unittest.TestCase):
@@ -57,6 +59,25 @@ class TestUtils(unittest.TestCase):
             adler32('no_file')
         assert_equal('FATAL - could not get Adler32 checksum of file no_file - [Errno 2] No such file or directory: \'no_file\'', e.exception.message)
 
+    def test_utils_file_checksums(self):
+        """(COMMON/UTILS): test calculating Adler32 and MD5 of files in a single pass"""
+        assert_equal(file_checksums(self.temp_file_1.name), {'adler32': '198d03ff', 'md5': '31d50dd6285b9ff9f8611d0762265d04'})
+
+        temp_files = []
+        for size in (0, 1, 5 * 1024 * 1024 + 3):
+            data = b'\x00\xff\n' * size
+            temp_file = tempfile.NamedTemporaryFile()
+            temp_file.write(data)
+            temp_file.flush()
+            temp_files.append((temp_file, data))
+        checksums = bulk_file_checksums([temp_file.name for temp_file, _ in temp_files])
+        for temp_file, data in temp_files:
+            assert_equal(checksums[temp_file.name], {'adler32': '%08x' % (zlib.adler32(data) & 0xffffffff), 'md5': hashlib.md5(data).hexdigest()})
+            temp_file.close()
+
+        with assert_raises(Exception):
+            bulk_file_checksums(['no_file'])
+
     def test_parse_did_filter_string(self):
         """(COMMON/UTILS): test parsing of did filter string"""
         test_cases = [{
@@ -27,6 +27,7 @@ except ImportError:
     JSONDecodeError = ValueError
 import logging
 import sys
+import threading
 import time
 import traceback
 try:
@@ -36,7 +37,7 @@ except ImportError:
 import uuid
 
 import requests
-from requests.adapters import ReadTimeout
+from requests.adapters import HTTPAdapter, ReadTimeout
 from requests.packages.urllib3 import disable_warnings  # pylint: disable=import-error
 
 from dogpile.cache import make_region
@@ -49,7 +50,7 @@ except ImportError:
     pass
 from rucio.common.config import config_get, config_get_bool
 from rucio.common.exception import TransferToolTimeout, TransferToolWrongAnswer
-from rucio.common.utils import APIEncoder
+from rucio.common.utils import APIEncoder, run_concurrently
 from rucio.core.monitor import record_counter, record_timer
 from rucio.db.sqla.constants import FTSState
 from rucio.transfertool.transfertool import Transfertool
@@ -67,6 +68,62 @@ logging.basicConfig(stream=sys.stdout,
 REGION_SHORT = make_region().configure('dogpile.cache.memory',
                                        expiration_time=1800)
 
+# Keep-alive sessions and in-flight request limits, shared by all the transfertools of a process for a given FTS host
+SESSIONS = {}
+IN_FLIGHT = {}
+SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(external_host):
+    """
+    Return the pooled keep-alive session and the in-flight requests semaphore of an FTS host.
+    The size of the connection pool and the number of requests in flight for a host are set
+    by the conveyor options fts_pool_size and fts_max_in_flight.
+
+    :param external_host: The FTS host.
+    :returns:             Tuple (requests.Session, threading.BoundedSemaphore).
+    """
+    with SESSIONS_LOCK:
+        if external_host not in SESSIONS:
+            pool_size = int(config_get('conveyor', 'fts_pool_size', False, 10))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            SESSIONS[external_host] = session
+            IN_FLIGHT[external_host] = threading.BoundedSemaphore(int(config_get('conveyor', 'fts_max_in_flight', False, 10)))
+        return SESSIONS[external_host], IN_FLIGHT[external_host]
+
+
+def bulk_submit(jobs, timeout=None, max_workers=10):
+    """
+    Submit jobs to their FTS hosts concurrently.
+
+    :param jobs:         List of dictionaries with keys external_host, files and job_params.
+    :param timeout:      Timeout in seconds.
+    :param max_workers:  Maximum number of submissions in flight.
+    :returns:            List of the FTS transfer identifiers, or of the exceptions, in the order of the jobs.
+    """
+    return run_concurrently([(FTS3Transfertool(external_host=job['external_host']).submit,
+                              {'files': job['files'], 'job_params': job['job_params'], 'timeout': timeout}) for job in jobs],
+                            max_workers=max_workers)
+
+
+def bulk_query_hosts(transfer_ids, timeout=None, max_workers=10):
+    """
+    Query the status of transfers on several FTS hosts concurrently.
+
+    :param transfer_ids: Dictionary {external_host: list of FTS transfer identifiers}.
+    :param timeout:      Timeout in seconds.
+    :param max_workers:  Maximum number of hosts queried at once.
+    :returns:            Dictionary {external_host: bulk_query response or exception}.
+    """
+    hosts = list(transfer_ids)
+    results = run_concurrently([(FTS3Transfertool(external_host=host).bulk_query,
+                                 {'transfer_ids': transfer_ids[host], 'timeout': timeout}) for host in hosts],
+                               max_workers=max_workers)
+    return dict(zip(hosts, results))
+
 
 class FTS3Transfertool(Transfertool):
     """
@@ -89,6 +146,7 @@ class FTS3Transfertool(Transfertool):
         else:
             self.cert = None
             self.verify = True  # True is the default setting of a requests.* method
+        self.session, self.in_flight = get_session(self.external_host)
 
     # Public methods part of the common interface
 
@@ -189,12 +247,13 @@ class FTS3Transfertool(Transfertool):
         post_result = None
         try:
             start_time = time.time()
-            post_result = requests.post('%s/jobs' % self.external_host,
-                                        verify=self.verify,
-                                        cert=self.cert,
-                                        data=params_str,
-                                        headers={'Content-Type': 'application/json'},
-                                        timeout=timeout)
+            with self.in_flight:
+                post_result = self.session.post('%s/jobs' % self.external_host,
+                                                verify=self.verify,
+                                                cert=self.cert,
+                                                data=params_str,
+                                                headers={'Content-Type': 'application/json'},
+                                                timeout=timeout)
             record_timer('transfertool.fts3.submit_transfer.%s' % self.__extract_host(self.external_host), (time.time() - start_time) * 1000 / len(files))
         except ReadTimeout as error:
             raise TransferToolTimeout(error)
@@ -236,11 +295,11 @@ class FTS3Transfertool(Transfertool):
 
         job = None
 
-        job = requests.delete('%s/jobs/%s' % (self.external_host, transfer_id),
-                              verify=self.verify,
-                              cert=self.cert,
-                              headers={'Content-Type': 'application/json'},
-                              timeout=timeout)
+        job = self.session.delete('%s/jobs/%s' % (self.external_host, transfer_id),
+                                  verify=self.verify,
+                                  cert=self.cert,
+                                  headers={'Content-Type': 'application/json'},
+                                  timeout=timeout)
 
         if job and job.status_code == 200:
             record_counter('transfertool.fts3.%s.cancel.success' % self.__extract_host(self.external_host))
@@ -263,12 +322,12 @@ class FTS3Transfertool(Transfertool):
         params_dict = {"params": {"priority": priority}}
         params_str = json.dumps(params_dict, cls=APIEncoder)
 
-        job = requests.post('%s/jobs/%s' % (self.external_host, transfer_id),
-                            verify=self.verify,
-                            data=params_str,
-                            cert=self.cert,
-                            headers={'Content-Type': 'application/json'},
-                            timeout=timeout)  # TODO set to 3 in conveyor
+        job = self.session.post('%s/jobs/%s' % (self.external_host, transfer_id),
+                                verify=self.verify,
+                                data=params_str,
+                                cert=self.cert,
+                                headers={'Content-Type': 'application/json'},
+                                timeout=timeout)  # TODO set to 3 in conveyor
 
         if job and job.status_code == 200:
             record_counter('transfertool.fts3.%s.update_priority.success' % self.__extract_host(self.external_host))
@@ -296,11 +355,12 @@ class FTS3Transfertool(Transfertool):
 
         job = None
 
-        job = requests.get('%s/jobs/%s' % (self.external_host, transfer_id),
-                           verify=self.verify,
-                           cert=self.cert,
-                           headers={'Content-Type': 'application/json'},
-                           timeout=timeout)  # TODO Set to 5 in conveyor
+        with self.in_flight:
+            job = self.session.get('%s/jobs/%s' % (self.external_host, transfer_id),
+                                   verify=self.verify,
+                                   cert=self.cert,
+                                   headers={'Content-Type': 'application/json'},
+                                   timeout=timeout)  # TODO Set to 5 in conveyor
         if job and job.status_code == 200:
             record_counter('transfertool.fts3.%s.query.success' % self.__extract_host(self.external_host))
             return [job.json()]
@@ -319,10 +379,10 @@ class FTS3Transfertool(Transfertool):
 
         get_result = None
 
-        get_result = requests.get('%s/whoami' % self.external_host,
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'})
+        get_result = self.session.get('%s/whoami' % self.external_host,
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'})
 
         if get_result and get_result.status_code == 200:
             record_counter('transfertool.fts3.%s.whoami.success' % self.__extract_host(self.external_host))
@@ -340,10 +400,10 @@ class FTS3Transfertool(Transfertool):
 
         get_result = None
 
-        get_result = requests.get('%s/' % self.external_host,
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'})
+        get_result = self.session.get('%s/' % self.external_host,
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'})
 
         if get_result and get_result.status_code == 200:
             record_counter('transfertool.fts3.%s.version.success' % self.__extract_host(self.external_host))
@@ -363,22 +423,22 @@ class FTS3Transfertool(Transfertool):
         jobs = None
 
         try:
-            whoami = requests.get('%s/whoami' % (self.external_host),
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'})
+            whoami = self.session.get('%s/whoami' % (self.external_host),
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'})
             if whoami and whoami.status_code == 200:
                 delegation_id = whoami.json()['delegation_id']
             else:
                 raise Exception('Could not retrieve delegation id: %s', whoami.content)
             state_string = ','.join(state)
-            jobs = requests.get('%s/jobs?dlg_id=%s&state_in=%s&time_window=%s' % (self.external_host,
-                                                                                  delegation_id,
-                                                                                  state_string,
-                                                                                  last_nhours),
-                                verify=self.verify,
-                                cert=self.cert,
-                                headers={'Content-Type': 'application/json'})
+            jobs = self.session.get('%s/jobs?dlg_id=%s&state_in=%s&time_window=%s' % (self.external_host,
+                                                                                      delegation_id,
+                                                                                      state_string,
+                                                                                      last_nhours),
+                                    verify=self.verify,
+                                    cert=self.cert,
+                                    headers={'Content-Type': 'application/json'})
         except ReadTimeout as error:
             raise TransferToolTimeout(error)
         except JSONDecodeError as error:
@@ -414,13 +474,13 @@ class FTS3Transfertool(Transfertool):
             transfer_ids = [transfer_ids]
 
         responses = {}
-        fts_session = requests.Session()
         xfer_ids = ','.join(transfer_ids)
-        jobs = fts_session.get('%s/jobs/%s?files=file_state,dest_surl,finish_time,start_time,reason,source_surl,file_metadata' % (self.external_host, xfer_ids),
-                               verify=self.verify,
-                               cert=self.cert,
-                               headers={'Content-Type': 'application/json'},
-                               timeout=timeout)
+        with self.in_flight:
+            jobs = self.session.get('%s/jobs/%s?files=file_state,dest_surl,finish_time,start_time,reason,source_surl,file_metadata' % (self.external_host, xfer_ids),
+                                    verify=self.verify,
+                                    cert=self.cert,
+                                    headers={'Content-Type': 'application/json'},
+                                    timeout=timeout)
 
         if jobs is None:
             record_counter('transfertool.fts3.%s.bulk_query.failure' % self.__extract_host(self.external_host))
@@ -452,11 +512,11 @@ class FTS3Transfertool(Transfertool):
         """
 
         try:
-            result = requests.get('%s/ban/se' % self.external_host,
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'},
-                                  timeout=None)
+            result = self.session.get('%s/ban/se' % self.external_host,
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'},
+                                      timeout=None)
         except Exception as error:
             raise Exception('Could not retrieve transfer information: %s', error)
         if result and result.status_code == 200:
@@ -471,11 +531,11 @@ class FTS3Transfertool(Transfertool):
         """
 
         try:
-            result = requests.get('%s/config/se' % (self.external_host),
-                                  verify=self.verify,
-                                  cert=self.cert,
-                                  headers={'Content-Type': 'application/json'},
-                                  timeout=None)
+            result = self.session.get('%s/config/se' % (self.external_host),
+                                      verify=self.verify,
+                                      cert=self.cert,
+                                      headers={'Content-Type': 'application/json'},
+                                      timeout=None)
         except Exception:
             logging.warn('Could not get config of %s on %s - %s', storage_element, self.external_host, str(traceback.format_exc()))
         if result and result.status_code == 200:
@@ -529,12 +589,12 @@ class FTS3Transfertool(Transfertool):
         params_str = json.dumps(params_dict, cls=APIEncoder)
 
         try:
-            result = requests.post('%s/config/se' % (self.external_host),
-                                   verify=self.verify,
-                                   cert=self.cert,
-                                   data=params_str,
-                                   headers={'Content-Type': 'application/json'},
-                                   timeout=None)
+            result = self.session.post('%s/config/se' % (self.external_host),
+                                       verify=self.verify,
+                                       cert=self.cert,
+                                       data=params_str,
+                                       headers={'Content-Type': 'application/json'},
+                                       timeout=None)
 
         except Exception:
             logging.warn('Could not set the config of %s on %s - %s', storage_element, self.external_host, str(traceback.format_exc()))
@@ -568,12 +628,12 @@ class FTS3Transfertool(Transfertool):
         result = None
         if ban:
             try:
-                result = requests.post('%s/ban/se' % self.external_host,
-                                       verify=self.verify,
-                                       cert=self.cert,
-                                       data=params_str,
-                                       headers={'Content-Type': 'application/json'},
-                                       timeout=None)
+                result = self.session.post('%s/ban/se' % self.external_host,
+                                           verify=self.verify,
+                                           cert=self.cert,
+                                           data=params_str,
+                                           headers={'Content-Type': 'application/json'},
+                                           timeout=None)
             except Exception:
                 logging.warn('Could not ban %s on %s - %s', storage_element, self.external_host, str(traceback.format_exc()))
             if result and result.status_code == 200:
@@ -582,12 +642,12 @@ class FTS3Transfertool(Transfertool):
         else:
 
             try:
-                result = requests.delete('%s/ban/se?storage=%s' % (self.external_host, storage_element),
-                                         verify=self.verify,
-                                         cert=self.cert,
-                                         data=params_str,
-                                         headers={'Content-Type': 'application/json'},
-                                         timeout=None)
+                result = self.session.delete('%s/ban/se?storage=%s' % (self.external_host, storage_element),
+                                             verify=self.verify,
+                                             cert=self.cert,
+                                             data=params_str,
+                                             headers={'Content-Type': 'application/json'},
+                                             timeout=None)
             except Exception:
                 logging.warn('Could not unban %s on %s - %s', storage_element, self.external_host, str(traceback.format_exc()))
             if result and result.status_code == 204:
@@ -616,11 +676,11 @@ class FTS3Transfertool(Transfertool):
 
                 get_result = None
                 try:
-                    get_result = requests.get('%s/whoami' % self.external_host,
-                                              verify=self.verify,
-                                              cert=self.cert,
-                                              headers={'Content-Type': 'application/json'},
-                                              timeout=5)
+                    get_result = self.session.get('%s/whoami' % self.external_host,
+                                                  verify=self.verify,
+                                                  cert=self.cert,
+                                                  headers={'Content-Type': 'application/json'},
+                                                  timeout=5)
                 except ReadTimeout as error:
                     raise TransferToolTimeout(error)
                 except JSONDecodeError as error:
@@ -821,11 +881,11 @@ class FTS3Transfertool(Transfertool):
 
         files = None
 
-        files = requests.get('%s/jobs/%s/files' % (self.external_host, transfer_id),
-                             verify=self.verify,
-                             cert=self.cert,
-                             headers={'Content-Type': 'application/json'},
-                             timeout=5)
+        files = self.session.get('%s/jobs/%s/files' % (self.external_host, transfer_id),
+                                 verify=self.verify,
+                                 cert=self.cert,
+                                 headers={'Content-Type': 'application/json'},
+                                 timeout=5)
         if files and (files.status_code == 200 or files.status_code == 207):
             record_counter('transfertool.fts3.%s.query_details.success' % self.__extract_host(self.external_host))
             return files.json()
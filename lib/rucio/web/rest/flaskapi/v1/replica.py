@@ -24,11 +24,12 @@
 
 from __future__ import print_function
 from datetime import datetime
+from itertools import chain
 from json import dumps
 from six import string_types
 from traceback import format_exc
 
-from flask import Flask, Blueprint, Response, request
+from flask import Flask, Blueprint, Response, request, stream_with_context
 from flask.views import MethodView
 from geoip2.errors import AddressNotFoundError
 from xml.sax.saxutils import escape
@@ -93,20 +94,34 @@ class Replicas(MethodView):
         if limit:
             limit = int(limit)
 
-        data = ""
         content_type = 'application/x-json-stream'
+        if metalink:
+            content_type = 'application/metalink4+xml'
+
+        client_ip = request.environ.get('HTTP_X_FORWARDED_FOR')
+        if client_ip is None:
+            client_ip = request.remote_addr
+
         try:
-            # first, set the appropriate content type, and stream the header
-            if metalink:
-                content_type = 'application/metalink4+xml'
-                data += '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
+            # we need to call list_replicas before starting to reply
+            # otherwise the exceptions won't be propagated correctly
+            rfiles = iter(list_replicas(dids=dids, schemes=schemes))
+            first = next(rfiles, None)
+        except DataIdentifierNotFound as error:
+            return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
+        except RucioException as error:
+            return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
+        except Exception as error:
+            print(format_exc())
+            return error, 500
 
-            # then, stream the replica information
-            for rfile in list_replicas(dids=dids, schemes=schemes):
-                client_ip = request.environ.get('HTTP_X_FORWARDED_FOR')
-                if client_ip is None:
-                    client_ip = request.remote_addr
+        def generate():
+            # first, stream the header
+            if metalink:
+                yield '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
 
+            # then, stream the replica information, one chunk per file
+            for rfile in (chain([first], rfiles) if first is not None else []):
                 replicas = []
                 dictreplica = {}
                 for rse in rfile['rses']:
@@ -121,41 +136,35 @@ class Replicas(MethodView):
                 else:
                     replicas = sort_random(dictreplica)
                 if not metalink:
-                    data += dumps(rfile) + '\n'
+                    yield dumps(rfile) + '\n'
                 else:
-                    data += ' <file name="' + rfile['name'] + '">\n'
-                    data += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
+                    metalink_file = [' <file name="' + rfile['name'] + '">\n',
+                                     '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n']
 
                     if rfile['adler32'] is not None:
-                        data += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
+                        metalink_file.append('  <hash type="adler32">' + rfile['adler32'] + '</hash>\n')
                     if rfile['md5'] is not None:
-                        data += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
+                        metalink_file.append('  <hash type="md5">' + rfile['md5'] + '</hash>\n')
 
-                    data += '  <size>' + str(rfile['bytes']) + '</size>\n'
+                    metalink_file.append('  <size>' + str(rfile['bytes']) + '</size>\n')
 
-                    data += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    data += '</glfn>\n'
+                    metalink_file.append('  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name']))
+                    metalink_file.append('</glfn>\n')
 
                     idx = 0
                     for replica in replicas:
-                        data += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
+                        metalink_file.append('   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n')
                         idx += 1
                         if limit and limit == idx:
                             break
-                    data += ' </file>\n'
+                    metalink_file.append(' </file>\n')
+                    yield ''.join(metalink_file)
 
             # don't forget to send the metalink footer
             if metalink:
-                data += '</metalink>\n'
+                yield '</metalink>\n'
 
-            return Response(data, content_type=content_type)
-        except DataIdentifierNotFound as error:
-            return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
-        except RucioException as error:
-            return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
-        except Exception as error:
-            print(format_exc())
-            return error, 500
+        return Response(stream_with_context(generate()), content_type=content_type)
 
     def post(self):
         """
@@ -316,7 +325,7 @@ class ListReplicas(MethodView):
             client_ip = request.remote_addr
 
         dids, schemes, select, unavailable, limit = [], None, None, False, None
-        ignore_availability, rse_expression, all_states = False, None, False
+        ignore_availability, rse_expression, all_states, domain = False, None, False, None
         client_location = {}
 
         json_data = request.data
@@ -347,23 +356,37 @@ class ListReplicas(MethodView):
         select = request.args.get('select', None)
         select = request.args.get('sort', None)
 
-        data = ""
         content_type = 'application/x-json-stream'
+        if metalink:
+            content_type = 'application/metalink4+xml'
+
         try:
-            # first, set the appropriate content type, and stream the header
+            # we need to call list_replicas before starting to reply
+            # otherwise the exceptions won't be propagated correctly
+            rfiles = iter(list_replicas(dids=dids, schemes=schemes,
+                                        unavailable=unavailable,
+                                        request_id=request.environ.get('request_id'),
+                                        ignore_availability=ignore_availability,
+                                        all_states=all_states,
+                                        rse_expression=rse_expression,
+                                        client_location=client_location,
+                                        domain=domain))
+            first = next(rfiles, None)
+        except DataIdentifierNotFound as error:
+            return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
+        except RucioException as error:
+            return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
+        except Exception as error:
+            print(format_exc())
+            return error, 500
+
+        def generate():
+            # first, stream the header
             if metalink:
-                content_type = 'application/metalink4+xml'
-                data += '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
-
-            # then, stream the replica information
-            for rfile in list_replicas(dids=dids, schemes=schemes,
-                                       unavailable=unavailable,
-                                       request_id=request.environ.get('request_id'),
-                                       ignore_availability=ignore_availability,
-                                       all_states=all_states,
-                                       rse_expression=rse_expression,
-                                       client_location=client_location,
-                                       domain=domain):
+                yield '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
+
+            # then, stream the replica information, one chunk per file
+            for rfile in (chain([first], rfiles) if first is not None else []):
                 replicas = []
                 dictreplica = {}
                 for rse in rfile['rses']:
@@ -372,18 +395,18 @@ class ListReplicas(MethodView):
                         dictreplica[replica] = rse
 
                 if not metalink:
-                    data += dumps(rfile, cls=APIEncoder) + '\n'
+                    yield dumps(rfile, cls=APIEncoder) + '\n'
                 else:
-                    data += ' <file name="' + rfile['name'] + '">\n'
-                    data += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
+                    metalink_file = [' <file name="' + rfile['name'] + '">\n',
+                                     '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n']
                     if rfile['adler32'] is not None:
-                        data += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
+                        metalink_file.append('  <hash type="adler32">' + rfile['adler32'] + '</hash>\n')
                     if rfile['md5'] is not None:
-                        data += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
-                    data += '  <size>' + str(rfile['bytes']) + '</size>\n'
+                        metalink_file.append('  <hash type="md5">' + rfile['md5'] + '</hash>\n')
+                    metalink_file.append('  <size>' + str(rfile['bytes']) + '</size>\n')
 
-                    data += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    data += '</glfn>\n'
+                    metalink_file.append('  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name']))
+                    metalink_file.append('</glfn>\n')
 
                     if select == 'geoip':
                         replicas = sort_geoip(dictreplica, client_location['ip'])
@@ -398,24 +421,18 @@ class ListReplicas(MethodView):
 
                     idx = 0
                     for replica in replicas:
-                        data += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
+                        metalink_file.append('   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n')
                         idx += 1
                         if limit and limit == idx:
                             break
-                    data += ' </file>\n'
+                    metalink_file.append(' </file>\n')
+                    yield ''.join(metalink_file)
 
             # don't forget to send the metalink footer
             if metalink:
-                data += '</metalink>\n'
+                yield '</metalink>\n'
 
-            return Response(data, content_type=content_type)
-        except DataIdentifierNotFound as error:
-            return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
-        except RucioException as error:
-            return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
-        except Exception as error:
-            print(format_exc())
-            return error, 500
+        return Response(stream_with_context(generate()), content_type=content_type)
 
 
 class ReplicasDIDs(MethodView):
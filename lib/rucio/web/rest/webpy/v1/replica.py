@@ -151,26 +151,27 @@ class Replicas(RucioController):
                 if not metalink:
                     yield dumps(rfile) + '\n'
                 else:
-                    yield ' <file name="' + rfile['name'] + '">\n'
-                    yield '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
+                    metalink_file = [' <file name="' + rfile['name'] + '">\n']
+                    metalink_file.append('  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n')
 
                     if rfile['adler32'] is not None:
-                        yield '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
+                        metalink_file.append('  <hash type="adler32">' + rfile['adler32'] + '</hash>\n')
                     if rfile['md5'] is not None:
-                        yield '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
+                        metalink_file.append('  <hash type="md5">' + rfile['md5'] + '</hash>\n')
 
-                    yield '  <size>' + str(rfile['bytes']) + '</size>\n'
+                    metalink_file.append('  <size>' + str(rfile['bytes']) + '</size>\n')
 
-                    yield '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    yield '</glfn>\n'
+                    metalink_file.append('  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name']))
+                    metalink_file.append('</glfn>\n')
 
                     idx = 0
                     for replica in replicas:
-                        yield '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
+                        metalink_file.append('   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n')
                         idx += 1
                         if limit and limit == idx:
                             break
-                    yield ' </file>\n'
+                    metalink_file.append(' </file>\n')
+                    yield ''.join(metalink_file)
 
             # ensure complete metalink
             if __first and metalink:
@@ -411,26 +412,26 @@ class ListReplicas(RucioController):
                                                 rfile['pfns'][replica]['rse'],
                                                 rfile['pfns'][replica]['client_extract'])
 
-                    yield ' <file name="' + rfile['name'] + '">\n'
+                    metalink_file = [' <file name="' + rfile['name'] + '">\n']
 
                     if 'parents' in rfile and rfile['parents']:
-                        yield '  <parents>\n'
+                        metalink_file.append('  <parents>\n')
                         for parent in rfile['parents']:
-                            yield '   <did>' + parent + '</did>\n'
-                        yield '  </parents>\n'
+                            metalink_file.append('   <did>' + parent + '</did>\n')
+                        metalink_file.append('  </parents>\n')
 
-                    yield '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
+                    metalink_file.append('  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n')
                     if rfile['adler32'] is not None:
-                        yield '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
+                        metalink_file.append('  <hash type="adler32">' + rfile['adler32'] + '</hash>\n')
                     if rfile['md5'] is not None:
-                        yield '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
-                    yield '  <size>' + str(rfile['bytes']) + '</size>\n'
+                        metalink_file.append('  <hash type="md5">' + rfile['md5'] + '</hash>\n')
+                    metalink_file.append('  <size>' + str(rfile['bytes']) + '</size>\n')
 
-                    yield '  <glfn name="/%s/rucio/%s:%s"></glfn>\n' % (config_get('policy', 'schema',
-                                                                                   raise_exception=False,
-                                                                                   default='generic'),
-                                                                        rfile['scope'],
-                                                                        rfile['name'])
+                    metalink_file.append('  <glfn name="/%s/rucio/%s:%s"></glfn>\n' % (config_get('policy', 'schema',
+                                                                                                  raise_exception=False,
+                                                                                                  default='generic'),
+                                                                                       rfile['scope'],
+                                                                                       rfile['name']))
 
                     # TODO: deprecate this
                     if select == 'geoip':
@@ -448,15 +449,16 @@ class ListReplicas(RucioController):
 
                     idx = 0
                     for replica in replicas:
-                        yield '  <url location="' + str(dictreplica[replica][2]) \
-                            + '" domain="' + str(dictreplica[replica][0]) \
-                            + '" priority="' + str(dictreplica[replica][1]) \
-                            + '" client_extract="' + str(dictreplica[replica][3]).lower() \
-                            + '">' + escape(replica) + '</url>\n'
+                        metalink_file.append('  <url location="' + str(dictreplica[replica][2])
+                                             + '" domain="' + str(dictreplica[replica][0])
+                                             + '" priority="' + str(dictreplica[replica][1])
+                                             + '" client_extract="' + str(dictreplica[replica][3]).lower()
+                                             + '">' + escape(replica) + '</url>\n')
                         idx += 1
                         if limit and limit == idx:
                             break
-                    yield ' </file>\n'
+                    metalink_file.append(' </file>\n')
+                    yield ''.join(metalink_file)
 
             # ensure complete metalink
             if __first and metalink:
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of the file checksums.
+
+Generates a set of files of various sizes and computes their adler32 and md5
+three times: with the former two passes (adler32 by line, md5 by 4 KiB blocks),
+with the single-pass file_checksums, and with bulk_file_checksums on a pool of
+threads. Prints the MB/s of each.
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import zlib
+
+from rucio.common.utils import bulk_file_checksums, file_checksums
+
+
+def two_passes(file):
+    """
+    Former computation: adler32 over the lines of the file, then md5 over 4 KiB blocks.
+    """
+    adler = 1
+    with open(file, 'rb') as openFile:
+        for line in openFile:
+            adler = zlib.adler32(line, adler)
+    hash_md5 = hashlib.md5()
+    with open(file, 'rb') as f:
+        list(map(hash_md5.update, iter(lambda: f.read(4096), b"")))
+    return {'adler32': str('%08x' % (adler & 0xffffffff)), 'md5': hash_md5.hexdigest()}
+
+
+def run(function, files):
+    """
+    Hash the files with a function and return the MB/s.
+    """
+    start = time.time()
+    function(files)
+    return sum(os.path.getsize(file) for file in files) / (time.time() - start) / 1e6
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the adler32 and md5 computation of files')
+    parser.add_argument('--sizes', default='1024,1048576,16777216,134217728', help='Comma separated file sizes in bytes')
+    parser.add_argument('--files', type=int, default=4, help='Number of files per size')
+    parser.add_argument('--threads', type=int, default=4, help='Number of threads of the bulk computation')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='benchmark_checksums_')
+    try:
+        files = []
+        for size in [int(size) for size in args.sizes.split(',')]:
+            for i in range(args.files):
+                file = os.path.join(directory, '%d_%d' % (size, i))
+                with open(file, 'wb') as openFile:
+                    openFile.write(os.urandom(size))
+                files.append(file)
+
+        for file in files:
+            assert two_passes(file) == file_checksums(file)
+
+        before = run(lambda files: [two_passes(file) for file in files], files)
+        single = run(lambda files: [file_checksums(file) for file in files], files)
+        threaded = run(lambda files: bulk_file_checksums(files, max_workers=args.threads), files)
+        print('%d files, %.1f MB' % (len(files), sum(os.path.getsize(file) for file in files) / 1e6))
+        print('two passes:             %8.1f MB/s' % before)
+        print('single pass:            %8.1f MB/s (x%.1f)' % (single, single / before))
+        print('single pass, %2d threads: %7.1f MB/s (x%.1f)' % (args.threads, threaded, threaded / before))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of the requeuing of failed requests by the conveyor-finisher.
+
+Registers N synthetic files on a temporary source RSE, queues a transfer request
+for each of them to a temporary destination RSE and marks the requests failed.
+They are requeued and archived once one by one with a copy of the former finisher
+code and once per finisher chunk with requeue_and_archive_bulk, and the
+requests/second of both are printed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from rucio.common.exception import RequestNotFound
+from rucio.common.types import InternalAccount, InternalScope
+from rucio.common.utils import chunks, generate_uuid
+from rucio.core.monitor import record_counter, record_timer
+from rucio.core.replica import add_replicas
+from rucio.core.request import (archive_request, get_request, get_sources, queue_requests,
+                                requeue_and_archive_bulk, should_retry_request)
+from rucio.core.rse import add_rse, del_rse
+from rucio.db.sqla import models
+from rucio.db.sqla.constants import RequestState, RequestType
+from rucio.db.sqla.session import get_session, transactional_session
+
+
+@transactional_session
+def former_requeue_and_archive(request, retry_protocol_mismatches=False, session=None):
+    """
+    Former requeue_and_archive of rucio.core.request, one transaction per request.
+    """
+    record_counter('core.request.requeue_request')
+    request_id = request['request_id']
+    new_req = get_request(request_id, session=session)
+
+    if new_req:
+        new_req['sources'] = get_sources(request_id, session=session)
+        archive_request(request_id, session=session)
+
+        if should_retry_request(new_req, retry_protocol_mismatches):
+            new_req['request_id'] = generate_uuid()
+            new_req['previous_attempt_id'] = request_id
+            if new_req['retry_count'] is None:
+                new_req['retry_count'] = 1
+            elif new_req['state'] != RequestState.SUBMITTING:
+                new_req['retry_count'] += 1
+
+            if new_req['sources']:
+                for i in range(len(new_req['sources'])):
+                    if new_req['sources'][i]['is_using']:
+                        if new_req['sources'][i]['ranking'] is None:
+                            new_req['sources'][i]['ranking'] = -1
+                        else:
+                            new_req['sources'][i]['ranking'] -= 1
+                        new_req['sources'][i]['is_using'] = False
+            queue_requests([new_req], session=session)
+            return new_req
+    else:
+        raise RequestNotFound
+    return None
+
+
+def former_requeue_failed_requests(requests):
+    """
+    Former handling of the failed requests by the finisher, one request at a time.
+    """
+    for req in requests:
+        tss = time.time()
+        try:
+            new_req = former_requeue_and_archive(req)
+            if new_req:
+                record_timer('daemons.conveyor.common.update_request_state.request-requeue_and_archive', (time.time() - tss) * 1000)
+        except RequestNotFound:
+            pass
+
+
+def requeue_failed_requests(requests, bulk):
+    """
+    Handling of the failed requests by the finisher, one transaction per chunk.
+    """
+    for requests_chunk in chunks(requests, bulk):
+        tss = time.time()
+        requeue_and_archive_bulk(requests_chunk)
+        record_timer('daemons.conveyor.finisher.requeue_and_archive_bulk', (time.time() - tss) * 1000)
+
+
+def queue_failed_requests(number, dest_rse_id, source_rse_id):
+    """
+    Register synthetic files, queue their requests and mark them failed.
+    """
+    scope = InternalScope('mock')
+    requests = []
+    for _ in range(number):
+        name = 'benchmark_%s' % generate_uuid()
+        requests.append({'dest_rse_id': dest_rse_id,
+                         'request_type': RequestType.TRANSFER,
+                         'scope': scope,
+                         'name': name,
+                         'rule_id': generate_uuid(),
+                         'retry_count': 0,
+                         'attributes': {'activity': 'Benchmark', 'bytes': 1, 'md5': None, 'adler32': '0cc737eb'},
+                         'sources': [{'rse_id': source_rse_id, 'ranking': 0, 'bytes': 1, 'url': 'mock://localhost/%s' % name, 'is_using': True}]})
+    for requests_chunk in chunks(requests, 100):
+        add_replicas(source_rse_id, [{'scope': scope, 'name': request['name'], 'bytes': 1, 'adler32': '0cc737eb'} for request in requests_chunk], InternalAccount('root'))
+        queue_requests(requests_chunk)
+    session = get_session()
+    session.query(models.Request).filter_by(dest_rse_id=dest_rse_id).update({'state': RequestState.FAILED}, synchronize_session=False)
+    session.commit()
+    return requests
+
+
+def delete_requests(dest_rse_id, session):
+    """
+    Delete the requests to the destination RSE, their sources and their history.
+    """
+    for model in (models.Source, models.Request, models.Request.__history_mapper__.class_):
+        session.query(model).filter_by(dest_rse_id=dest_rse_id).delete(synchronize_session=False)
+    session.commit()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the requests/second of the requeuing of failed requests')
+    parser.add_argument('--requests', type=int, default=2000, help='Number of synthetic failed requests')
+    parser.add_argument('--bulk', type=int, default=100, help='Number of requests per finisher chunk')
+    args = parser.parse_args()
+
+    source_rse_id = add_rse('MOCK_BENCHMARK_%s' % generate_uuid()[:8].upper())
+    dest_rse_id = add_rse('MOCK_BENCHMARK_%s' % generate_uuid()[:8].upper())
+    session = get_session()
+    try:
+        requests = queue_failed_requests(args.requests, dest_rse_id, source_rse_id)
+        start = time.time()
+        former_requeue_failed_requests(requests)
+        before = len(requests) / (time.time() - start)
+        delete_requests(dest_rse_id, session)
+
+        requests = queue_failed_requests(args.requests, dest_rse_id, source_rse_id)
+        start = time.time()
+        requeue_failed_requests(requests, args.bulk)
+        after = len(requests) / (time.time() - start)
+
+        print('%d failed requests, %d requests per chunk' % (len(requests), args.bulk))
+        print('one by one: %10.1f requests/s' % before)
+        print('bulk:       %10.1f requests/s (x%.1f)' % (after, after / before))
+    finally:
+        session.rollback()
+        delete_requests(dest_rse_id, session)
+        names = [name for name, in session.query(models.RSEFileAssociation.name).filter_by(rse_id=source_rse_id)]
+        session.query(models.RSEFileAssociation).filter_by(rse_id=source_rse_id).delete(synchronize_session=False)
+        for names_chunk in chunks(names, 500):
+            session.query(models.DataIdentifier).filter(models.DataIdentifier.scope == InternalScope('mock'),
+                                                        models.DataIdentifier.name.in_(names_chunk)).delete(synchronize_session=False)
+        session.commit()
+        del_rse(source_rse_id)
+        del_rse(dest_rse_id)
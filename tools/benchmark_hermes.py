@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of the hermes message delivery.
+
+Starts a local stub STOMP broker, queues N messages and delivers them with one
+hermes cycle, once sending every message to a random broker connection and once
+fanning the messages out over all the connections with the asynchronous history
+writer, and prints the messages/second of both.
+"""
+
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+
+try:
+    from SocketServer import ThreadingMixIn, TCPServer, BaseRequestHandler  # py2
+except ImportError:
+    from socketserver import ThreadingMixIn, TCPServer, BaseRequestHandler  # py3
+
+from rucio.common.config import config_add_section, config_has_section, config_set
+from rucio.core.message import add_message, truncate_messages
+from rucio.daemons.hermes import hermes
+
+
+class StubBroker(ThreadingMixIn, TCPServer):
+    """
+    STOMP broker accepting the connections and counting the sent frames.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    latency = 0
+    received = 0
+    lock = threading.Lock()
+
+
+class StubBrokerHandler(BaseRequestHandler):
+    """
+    Minimal STOMP 1.2 session: CONNECT, SEND and DISCONNECT, with receipts when requested.
+    """
+
+    def handle(self):
+        buffer = b''
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            buffer += data
+            while b'\x00' in buffer:
+                frame, buffer = buffer.split(b'\x00', 1)
+                frame = frame.lstrip(b'\r\n')
+                if not frame:
+                    continue
+                lines = frame.split(b'\n\n', 1)[0].split(b'\n')
+                command, headers = lines[0], dict(line.split(b':', 1) for line in lines[1:] if b':' in line)
+                if command in (b'CONNECT', b'STOMP'):
+                    self.request.sendall(b'CONNECTED\nversion:1.2\nheart-beat:0,0\n\n\x00')
+                elif command == b'SEND':
+                    if self.server.latency:
+                        time.sleep(self.server.latency)
+                    with self.server.lock:
+                        self.server.received += 1
+                if b'receipt' in headers:
+                    self.request.sendall(b'RECEIPT\nreceipt-id:' + headers[b'receipt'] + b'\n\n\x00')
+                if command == b'DISCONNECT':
+                    return
+
+
+def run(server, brokers, messages, fan_out):
+    """
+    Deliver and archive the queued messages with one hermes cycle and return the messages/second.
+    """
+    truncate_messages()
+    for i in range(messages):
+        add_message(event_type='BENCHMARK', payload={'number': i, 'scope': 'mock', 'name': 'file_%06d' % i})
+    server.received = 0
+
+    history_writer = hermes.HistoryWriter(bulk=messages) if fan_out else None
+    if history_writer:
+        history_writer.start()
+    start = time.time()
+    hermes.deliver_messages(once=True, brokers_resolved=['127.0.0.1'] * brokers, bulk=messages, delay=0,
+                            fan_out=fan_out, history_writer=history_writer)
+    if history_writer:
+        # the messages are only done once they are archived
+        history_writer.stop()
+    # hermes waits one second after its first heartbeat
+    elapsed = time.time() - start - 1
+    if server.received != messages:
+        print('warning: the broker received %d of %d messages' % (server.received, messages))
+    return messages / elapsed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the hermes message delivery against a stub STOMP broker')
+    parser.add_argument('--messages', type=int, default=5000, help='Number of queued messages')
+    parser.add_argument('--brokers', type=int, default=4, help='Number of broker connections')
+    parser.add_argument('--latency', type=float, default=0.0002, help='Seconds the stub broker takes per message')
+    args = parser.parse_args()
+
+    server = StubBroker(('127.0.0.1', 0), StubBrokerHandler)
+    server.latency = args.latency
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    if not config_has_section('messaging-hermes'):
+        config_add_section('messaging-hermes')
+    config_set('messaging-hermes', 'use_ssl', 'False')
+    config_set('messaging-hermes', 'port', str(server.server_address[1]))
+    config_set('messaging-hermes', 'nonssl_port', str(server.server_address[1]))
+    config_set('messaging-hermes', 'username', 'benchmark')
+    config_set('messaging-hermes', 'password', 'benchmark')
+    config_set('messaging-hermes', 'destination', '/topic/benchmark')
+
+    try:
+        before = run(server, args.brokers, args.messages, fan_out=False)
+        after = run(server, args.brokers, args.messages, fan_out=True)
+        print('%d messages, %d brokers' % (args.messages, args.brokers))
+        print('random broker: %10.1f messages/s' % before)
+        print('fan-out:       %10.1f messages/s (x%.1f)' % (after, after / before))
+    finally:
+        truncate_messages()
+        server.shutdown()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of the PFN resolution stage of list_replicas.
+
+Lists N synthetic replicas of a root RSE for a client of another site, once with
+the former row-by-row resolution and once with the batched resolution, and prints
+the rows/second of both. Both go through the internal root proxy of the client site.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from copy import deepcopy
+
+from rucio.common.exception import RSEProtocolNotSupported
+from rucio.common.types import InternalScope
+from rucio.common.utils import generate_uuid
+from rucio.core.config import get as config_get, remove_option as config_remove_option, set as config_set
+from rucio.core.replica import _iter_replicas_with_pfns
+from rucio.core.rse import add_rse, add_protocol, add_rse_attribute, del_rse, get_rse_attribute, get_rse_name
+from rucio.db.sqla.constants import ReplicaState, RSEType
+from rucio.rse import rsemanager as rsemgr
+
+
+def rowwise_pfns(rows, client_location):
+    """
+    Former resolution of _list_replicas in the wan domain, copied without the archive and
+    URL signing branches: protocols resolved once per RSE, then one lfns2pfns call per row
+    and, for root PFNs of a located client, one site attribute and config lookup per row.
+    """
+    original_domain = 'wan'
+    tmp_protocols, rse_info, pfns_cache = {}, {}, {}
+    for scope, name, bytes, md5, adler32, path, state, rse_id, rse, rse_type, volatile in rows:
+        pfns = []
+        domain = deepcopy(original_domain)
+
+        if rse_id not in rse_info:
+            rse_info[rse_id] = rsemgr.get_rse_info(rse=get_rse_name(rse_id=rse_id))
+        rse_info[rse_id]['priority_wan'] = {p['scheme']: p['domains']['wan']['read'] for p in rse_info[rse_id]['protocols'] if p['domains']['wan']['read'] > 0}
+        rse_info[rse_id]['priority_lan'] = {p['scheme']: p['domains']['lan']['read'] for p in rse_info[rse_id]['protocols'] if p['domains']['lan']['read'] > 0}
+
+        if rse_id not in tmp_protocols:
+            rse_schemes = []
+            try:
+                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info[rse_id], operation='read', domain=domain)['scheme'])
+            except RSEProtocolNotSupported:
+                pass
+            tmp_protocols[rse_id] = [(domain, rsemgr.create_protocol(rse_settings=rse_info[rse_id], operation='read', scheme=s, domain=domain),
+                                      rse_info[rse_id]['priority_%s' % domain][s]) for s in rse_schemes]
+
+        for tmp_protocol in tmp_protocols[rse_id]:
+            protocol = tmp_protocol[1]
+            if 'determinism_type' in protocol.attributes:
+                try:
+                    path = pfns_cache['%s:%s:%s' % (protocol.attributes['determinism_type'], scope.internal, name)]
+                except KeyError:
+                    path = protocol._get_path(scope, name)
+                    pfns_cache['%s:%s:%s' % (protocol.attributes['determinism_type'], scope.internal, name)] = path
+
+            pfn = list(protocol.lfns2pfns(lfns={'scope': scope, 'name': name, 'path': path}).values())[0]
+            if domain == 'wan' and protocol.attributes['scheme'] == 'root' and client_location:
+                if 'site' in client_location and client_location['site']:
+                    rse_site_attr = get_rse_attribute('site', rse_id)
+                    replica_site = ['']
+                    if isinstance(rse_site_attr, list) and rse_site_attr:
+                        replica_site = rse_site_attr[0]
+                    if client_location['site'] != replica_site:
+                        root_proxy_internal = config_get('root-proxy-internal', client_location['site'], default='')
+                        if root_proxy_internal:
+                            pfn = 'root://' + root_proxy_internal + '//' + pfn
+            pfns.append((pfn, tmp_protocol[0], tmp_protocol[2], False))
+        yield pfns
+
+
+def batched_pfns(rows, client_location):
+    """
+    Batched resolution as used by list_replicas.
+    """
+    for replica in _iter_replicas_with_pfns(replicas=rows, show_pfns=True, pfn_context={'rses': {}, 'paths': {}},
+                                            schemes=None, domain='wan', local_rses=[], client_location=client_location,
+                                            sign_urls=False, signature_lifetime=None, session=None):
+        yield replica[-2]
+
+
+def run(function, rows, client_location):
+    """
+    Consume all the PFNs of a resolution function and return the rows/second.
+    """
+    start = time.time()
+    count = 0
+    for _ in function(rows, client_location):
+        count += 1
+    return count / (time.time() - start)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the PFN resolution of list_replicas')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of synthetic replicas')
+    args = parser.parse_args()
+
+    rse = 'MOCK_BENCHMARK_%s' % generate_uuid()[:8].upper()
+    rse_id = add_rse(rse)
+    try:
+        add_protocol(rse_id, {'scheme': 'root',
+                              'hostname': 'localhost',
+                              'port': 1094,
+                              'prefix': '/benchmark/',
+                              'impl': 'rucio.rse.protocols.xrootd.Default',
+                              'domains': {'lan': {'read': 1, 'write': 1, 'delete': 1},
+                                          'wan': {'read': 1, 'write': 1, 'delete': 1}}})
+        add_rse_attribute(rse_id, 'site', 'BENCHMARK_SITE')
+
+        scope = InternalScope('mock')
+        rows = [(scope, 'file_%s' % generate_uuid(), 1, None, '0cc737eb', '/benchmark/path/%06d' % i,
+                 ReplicaState.AVAILABLE, rse_id, rse, RSEType.DISK, False) for i in range(args.rows)]
+        # the client is at another site, so every PFN goes through its internal root proxy
+        client_location = {'site': 'CLIENT_SITE'}
+        config_set('root-proxy-internal', 'CLIENT_SITE', 'proxy.client.site:1094')
+
+        before = run(rowwise_pfns, rows, client_location)
+        after = run(batched_pfns, rows, client_location)
+        print('%d rows' % args.rows)
+        print('row-by-row: %10.1f rows/s' % before)
+        print('batched:    %10.1f rows/s (x%.1f)' % (after, after / before))
+    finally:
+        config_remove_option('root-proxy-internal', 'CLIENT_SITE')
+        del_rse(rse_id)
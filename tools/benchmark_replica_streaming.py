@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of the streaming of the replica REST endpoints.
+
+Serves N synthetic files through the list_replicas endpoints of the flask and
+web.py applications, in NDJSON and metalink, and prints for each the time to
+the first byte, the files/second and the peak of the allocated memory while
+the response is consumed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from io import BytesIO
+from json import dumps
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from rucio.common.utils import generate_uuid
+
+
+def synthetic_replicas(nb_files, nb_replicas):
+    """
+    Replacement of rucio.api.replica.list_replicas yielding synthetic files.
+    """
+    def list_replicas(*args, **kwargs):
+        for i in range(nb_files):
+            name = 'file_%s' % generate_uuid()
+            pfns = {}
+            rses = {}
+            for j in range(nb_replicas):
+                pfn = 'root://storage%02d.benchmark.org:1094//benchmark/%06d/%s' % (j, i, name)
+                pfns[pfn] = {'domain': 'wan', 'priority': j + 1, 'rse': 'RSE_%02d' % j, 'client_extract': False, 'type': 'DISK', 'volatile': False}
+                rses['RSE_%02d' % j] = [pfn]
+            yield {'scope': 'benchmark', 'name': name, 'bytes': 1048576, 'md5': None, 'adler32': '0cc737eb',
+                   'pfns': pfns, 'rses': rses, 'states': {}}
+    return list_replicas
+
+
+def consume(wsgi, environ):
+    """
+    Consume a WSGI response and return its status, the time to the first byte, the total time and the number of bytes.
+    """
+    start = time.time()
+    first_byte, size = None, 0
+    statuses = []
+    result = wsgi(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    for chunk in result:
+        if chunk and first_byte is None:
+            first_byte = time.time() - start
+        size += len(chunk)
+    if hasattr(result, 'close'):
+        result.close()
+    return statuses[-1] if statuses else None, first_byte, time.time() - start, size
+
+
+def run(wsgi, path, metalink, nb_files):
+    """
+    Serve a list_replicas call and print its figures.
+    """
+    body = dumps({'dids': [{'scope': 'benchmark', 'name': 'benchmark'}]}).encode()
+    environ = {'REQUEST_METHOD': 'POST',
+               'PATH_INFO': path,
+               'SCRIPT_NAME': '',
+               'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80',
+               'SERVER_PROTOCOL': 'HTTP/1.1',
+               'REMOTE_ADDR': '127.0.0.1',
+               'CONTENT_LENGTH': str(len(body)),
+               'HTTP_X_RUCIO_AUTH_TOKEN': 'benchmark',
+               'HTTP_ACCEPT': 'application/metalink4+xml' if metalink else 'application/x-json-stream',
+               'wsgi.input': BytesIO(body),
+               'wsgi.url_scheme': 'http',
+               'wsgi.errors': BytesIO(),
+               'wsgi.multithread': False,
+               'wsgi.multiprocess': False,
+               'wsgi.run_once': False,
+               'wsgi.version': (1, 0)}
+    if tracemalloc:
+        tracemalloc.start()
+    status, first_byte, duration, size = consume(wsgi, environ)
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc else None
+    if tracemalloc:
+        tracemalloc.stop()
+    assert status and status.startswith('200'), 'the endpoint %s answered %s' % (path, status)
+    assert size > 0, 'the endpoint %s answered an empty body' % path
+    return first_byte, nb_files / duration, size, peak
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the streaming of the replica REST endpoints')
+    parser.add_argument('--files', type=int, default=100000, help='Number of synthetic files')
+    parser.add_argument('--replicas', type=int, default=3, help='Number of replicas per file')
+    args = parser.parse_args()
+
+    auth = lambda token: {'account': 'root', 'identity': 'benchmark'}  # noqa: E731
+    applications = []
+    try:
+        from rucio.web.rest.flaskapi.v1 import common as flask_common, replica as flask_replica
+        flask_common.validate_auth_token = auth
+        flask_replica.list_replicas = synthetic_replicas(args.files, args.replicas)
+        applications.append(('flask', flask_replica.application, '/list'))
+    except ImportError as error:
+        print('flask: skipped (%s)' % error)
+    try:
+        from rucio.web.rest import common as webpy_common
+        from rucio.web.rest.webpy.v1 import replica as webpy_replica
+        # the load hook of the web.py applications authenticates through rucio.web.rest.common
+        webpy_common.validate_auth_token = auth
+        webpy_replica.list_replicas = synthetic_replicas(args.files, args.replicas)
+        applications.append(('web.py', webpy_replica.application, '/list/'))
+    except ImportError as error:
+        print('web.py: skipped (%s)' % error)
+
+    print('%d files, %d replicas per file' % (args.files, args.replicas))
+    for framework, wsgi, path in applications:
+        for metalink in (False, True):
+            first_byte, rate, size, peak = run(wsgi, path, metalink, args.files)
+            row = (framework, 'metalink' if metalink else 'ndjson', first_byte or 0, rate, size / 1048576., '%.1f MB' % (peak / 1048576.) if peak is not None else 'n/a')
+            print('%-6s %-8s first byte: %8.4fs  %10.1f files/s  body: %8.1f MB  peak memory: %s' % row)
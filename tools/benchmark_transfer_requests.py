@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of get_transfer_requests_and_source_replicas.
+
+Feeds N synthetic (request, source) rows between two RSEs using the mock protocol
+through the function, once with the former RSE metadata lookups and once with the
+cache shared across the submitter cycles, and prints the rows/second of both.
+The former lookups go through the dogpile memcached regions at 127.0.0.1:11211,
+which miss every time if no memcached server runs there.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from rucio.common.rse_attributes import get_rse_attributes
+from rucio.common.types import InternalScope
+from rucio.common.utils import generate_uuid
+from rucio.core import transfer as transfer_core
+from rucio.core.rse import add_rse, add_protocol, add_rse_attribute, del_rse, get_rse_name
+from rucio.core.rse_cache import RSE_CACHE
+from rucio.rse import rsemanager as rsemgr
+
+
+class FormerRSEMetadata(object):
+    """
+    Former lookups of get_transfer_requests_and_source_replicas, for one submitter cycle: the RSE
+    names for every row, then per cycle the settings with rsemanager.get_rse_info, the attributes
+    with rucio.common.rse_attributes.get_rse_attributes and new protocol instances.
+    """
+
+    def __init__(self):
+        self.rse_names = {}
+        self.rses_info = {}
+
+    def get_rse_name(self, rse_id, session=None):
+        self.rse_names[rse_id] = get_rse_name(rse_id=rse_id, session=session)
+        return self.rse_names[rse_id]
+
+    def get_rse_info(self, rse_id, session=None):
+        self.rses_info[rse_id] = rsemgr.get_rse_info(rse=self.rse_names[rse_id], session=session)
+        return self.rses_info[rse_id]
+
+    def get_rse_attributes(self, rse_id, session=None):
+        return get_rse_attributes(rse_id, session=session)
+
+    def get_protocol(self, rse_id, operation, scheme=None, domain='wan', session=None):
+        return rsemgr.create_protocol(self.rses_info[rse_id], operation, scheme)
+
+
+def run(rows, cycles, bulk, shared):
+    """
+    Run the submitter cycles over the rows and return the rows/second.
+    """
+    start = time.time()
+    try:
+        for _ in range(cycles):
+            for offset in range(0, len(rows), bulk):
+                # the function keeps its per-cycle dictionaries, the former lookups only live for one cycle
+                transfer_core.RSE_CACHE = RSE_CACHE if shared else FormerRSEMetadata()
+                # the database query is replaced by the synthetic rows
+                setattr(transfer_core, '__list_transfer_requests_and_source_replicas', lambda **kwargs: rows[offset:offset + bulk])
+                transfer_core.get_transfer_requests_and_source_replicas(schemes=['MOCK'])
+    finally:
+        transfer_core.RSE_CACHE = RSE_CACHE
+    return cycles * len(rows) / (time.time() - start)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the rows/second of get_transfer_requests_and_source_replicas')
+    parser.add_argument('--rows', type=int, default=50000, help='Number of synthetic (request, source) rows')
+    parser.add_argument('--bulk', type=int, default=1000, help='Number of rows per submitter cycle')
+    parser.add_argument('--cycles', type=int, default=3, help='Number of passes over the rows')
+    args = parser.parse_args()
+
+    list_requests = getattr(transfer_core, '__list_transfer_requests_and_source_replicas')
+    rse_ids = []
+    try:
+        for _ in range(2):
+            rse_id = add_rse('MOCK_BENCHMARK_%s' % generate_uuid()[:8].upper())
+            add_protocol(rse_id, {'scheme': 'MOCK',
+                                  'hostname': 'localhost',
+                                  'port': 17,
+                                  'prefix': '/benchmark/',
+                                  'impl': 'rucio.rse.protocols.mock.Default',
+                                  'domains': {'lan': {'read': 1, 'write': 1, 'delete': 1},
+                                              'wan': {'read': 1, 'write': 1, 'delete': 1, 'third_party_copy': 1}}})
+            add_rse_attribute(rse_id, 'fts', 'https://fts.benchmark:8446')
+            rse_ids.append(rse_id)
+        source_rse_id, dest_rse_id = rse_ids
+
+        scope = InternalScope('mock')
+        rows = [(generate_uuid(), generate_uuid(), scope, 'file_%06d' % i, None, '0cc737eb', 1, 'Benchmark', '{"lifetime": -1}', None,
+                 dest_rse_id, source_rse_id, 'MOCK_BENCHMARK', True, 'DISK', '/benchmark/path/%06d' % i, 0, None, 0, 1)
+                for i in range(args.rows)]
+
+        before = run(rows, args.cycles, args.bulk, shared=False)
+        after = run(rows, args.cycles, args.bulk, shared=True)
+        print('%d rows, %d rows per cycle' % (args.rows, args.bulk))
+        print('former lookups: %10.1f rows/s' % before)
+        print('shared cache:   %10.1f rows/s (x%.1f)' % (after, after / before))
+    finally:
+        setattr(transfer_core, '__list_transfer_requests_and_source_replicas', list_requests)
+        for rse_id in rse_ids:
+            del_rse(rse_id)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of the transmogrifier subscription matching.
+
+Generates N synthetic subscriptions, with literal or regular expression scopes,
+name patterns and metadata filters, and M synthetic DIDs with their metadata.
+The DIDs are matched once against every subscription with is_matching_subscription
+and once through the compiled SubscriptionIndex, and the DIDs/second of both are
+printed. The matched subscriptions of both are checked to be identical.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import random
+import time
+
+from rucio.common.types import InternalScope
+from rucio.common.utils import generate_uuid
+from rucio.daemons.transmogrifier.transmogrifier import SubscriptionIndex, is_matching_subscription
+
+
+PROJECTS = ['data15_13TeV', 'data16_13TeV', 'data17_13TeV', 'data18_13TeV', 'mc16_13TeV', 'mc16_valid', 'valid1', 'user']
+DATATYPES = ['RAW', 'AOD', 'ESD', 'HITS', 'EVNT', 'DAOD_EXOT%d', 'DAOD_SUSY%d', 'DAOD_HIGG%d', 'NTUP_PILEUP', 'HIST']
+STEPS = ['merge', 'recon', 'deriv', 'simul', 'evgen']
+
+
+def generate_subscriptions(number):
+    """
+    Return synthetic subscriptions, a mix of indexable and regular expression filters.
+    """
+    subscriptions = []
+    for i in range(number):
+        filter_string = {}
+        kind = i % 4
+        if kind == 0:
+            filter_string['scope'] = random.sample(PROJECTS[:-1], 2)
+        elif kind == 1:
+            filter_string['scope'] = ['data1[5-8]_13TeV', 'mc16_.*']
+        if kind != 3:
+            filter_string['datatype'] = [random.choice(DATATYPES).replace('%d', str(random.randint(1, 30)))]
+        else:
+            filter_string['datatype'] = ['DAOD_.*']
+            filter_string['prod_step'] = random.choice(STEPS)
+        if random.random() < 0.5:
+            filter_string['project'] = random.choice(PROJECTS)
+        if random.random() < 0.3:
+            filter_string['pattern'] = '.*\\.r%d.*' % random.randint(9000, 9999)
+        if random.random() < 0.2:
+            filter_string['excluded_pattern'] = '.*_tid.*'
+        subscriptions.append({'id': generate_uuid(),
+                              'name': 'subscription_%d' % i,
+                              'filter': json.dumps(filter_string),
+                              'replication_rules': json.dumps([{'copies': 1, 'rse_expression': 'tier=1'}])})
+    return subscriptions
+
+
+def generate_dids(number):
+    """
+    Return synthetic (did, metadata) pairs.
+    """
+    dids = []
+    for i in range(number):
+        project = random.choice(PROJECTS)
+        datatype = random.choice(DATATYPES).replace('%d', str(random.randint(1, 30)))
+        name = '%s.%08d.physics_Main.%s.r%d_p%d_%06d' % (project, random.randint(0, 99999999), datatype, random.randint(9000, 9999), random.randint(1000, 9999), i)
+        dids.append(({'scope': InternalScope(project), 'name': name},
+                     {'hidden': False, 'project': project, 'datatype': datatype, 'prod_step': random.choice(STEPS), 'stream_name': 'physics_Main'}))
+    return dids
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the transmogrifier subscription matching')
+    parser.add_argument('--subscriptions', type=int, default=300, help='Number of synthetic subscriptions')
+    parser.add_argument('--dids', type=int, default=5000, help='Number of synthetic DIDs')
+    args = parser.parse_args()
+
+    random.seed(42)
+    subscriptions = generate_subscriptions(args.subscriptions)
+    dids = generate_dids(args.dids)
+
+    start = time.time()
+    before = [[subscription['id'] for subscription in subscriptions if is_matching_subscription(subscription, did, metadata)] for did, metadata in dids]
+    before_rate = len(dids) / (time.time() - start)
+
+    start = time.time()
+    index = SubscriptionIndex()
+    index.update(subscriptions)
+    after = [[subscription['id'] for subscription, _ in index.match(did, metadata)] for did, metadata in dids]
+    after_rate = len(dids) / (time.time() - start)
+
+    assert before == after, 'the index does not match the same subscriptions'
+    print('%d subscriptions, %d DIDs, %d matches' % (len(subscriptions), len(dids), sum(len(matches) for matches in after)))
+    print('every subscription: %10.1f DIDs/s' % before_rate)
+    print('subscription index: %10.1f DIDs/s (x%.1f)' % (after_rate, after_rate / before_rate))